@@ -11,7 +11,7 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import logging
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
 import math
 import re
 
@@ -24,11 +24,15 @@ class AdvancedDataCoPipeline:
     Advanced ETL Pipeline với full transaction processing
     """
     
-    def __init__(self, csv_file: str):
+    def __init__(self, csv_file: str, sort_by_key: bool = False):
         self.csv_file = csv_file
         self.df = None
         self.batch_size = 1000
         
+        # Emit rows theo thứ tự clustered key (external_id / FK cha) thay vì thứ tự CSV
+        # để InnoDB insert append-only vào PRIMARY và FK indexes
+        self.sort_by_key = sort_by_key
+        
         # Mapping configurations theo DataCo_Database_Mapping.md
         self.shipping_mode_mapping = {
             'Standard Class': 'STANDARD',
@@ -88,6 +92,12 @@ class AdvancedDataCoPipeline:
             logger.error(f"❌ Error loading data: {e}")
             return False
 
+    def order_rows(self, frame: pd.DataFrame, key_columns: List[str]) -> pd.DataFrame:
+        """Sắp xếp rows theo clustered key nếu bật sort_by_key (stable sort)"""
+        if not self.sort_by_key:
+            return frame
+        return frame.sort_values(key_columns, kind='mergesort')
+
     def clean_string(self, value: str, max_length: int = None) -> str:
         """Clean string values cho SQL"""
         if pd.isna(value) or value == '':
@@ -116,7 +126,18 @@ class AdvancedDataCoPipeline:
         
         return f"'{dt_value.strftime('%Y-%m-%d %H:%M:%S')}'"
 
-    def generate_users_sql(self) -> str:
+    def _insert_batches(self, header: str, values: Iterable[str]) -> Iterator[str]:
+        """Multi-row INSERTs tối đa self.batch_size rows mỗi statement, format lazily"""
+        batch = []
+        for value in values:
+            batch.append(value)
+            if len(batch) >= self.batch_size:
+                yield f"\n{header}\n{', '.join(batch)};\n"
+                batch = []
+        if batch:
+            yield f"\n{header}\n{', '.join(batch)};\n"
+
+    def iter_users_sql(self) -> Iterator[str]:
         """Generate users SQL từ customer data với AUTO_INCREMENT"""
         logger.info("👥 Generating users SQL...")
         
@@ -124,37 +145,36 @@ class AdvancedDataCoPipeline:
         customers = self.df[[
             'Customer Id', 'Customer Fname', 'Customer Lname', 'Customer Email'
         ]].drop_duplicates(subset=['Customer Id'])
+        customers = self.order_rows(customers, ['Customer Id'])
         
-        user_values = []
-        # System user không có external_id
-        user_values.append("(0, 'system', 'system@dataco.com', 'System User', 'hashed_password', (SELECT id FROM roles WHERE role_name = 'ADMIN' LIMIT 1), (SELECT id FROM status WHERE name = 'Active' AND type = 'USER' LIMIT 1), NOW())")
-        
-        for _, row in customers.iterrows():
-            external_id = int(row['Customer Id'])
-            username = f"customer_{external_id}"
-            email = self.clean_string(row['Customer Email'], 255)
-            if email == 'XXXXXXXXX' or email == '':
-                email = f"customer_{external_id}@dataco.com"
-            
-            fname = self.clean_string(row['Customer Fname'], 100)
-            lname = self.clean_string(row['Customer Lname'], 100)
-            full_name = f"{fname} {lname}".strip()
-            if not full_name:
-                full_name = f"Customer {external_id}"
-            
-            user_values.append(
-                f"({external_id}, '{username}', '{email}', '{self.clean_string(full_name, 255)}', "
-                f"'hashed_password', (SELECT id FROM roles WHERE role_name = 'CUSTOMER' LIMIT 1), (SELECT id FROM status WHERE name = 'Active' AND type = 'USER' LIMIT 1), NOW())"
-            )
+        def user_values():
+            # System user không có external_id
+            yield "(0, 'system', 'system@dataco.com', 'System User', 'hashed_password', (SELECT id FROM roles WHERE role_name = 'ADMIN' LIMIT 1), (SELECT id FROM status WHERE name = 'Active' AND type = 'USER' LIMIT 1), NOW())"
+            
+            for _, row in customers.iterrows():
+                external_id = int(row['Customer Id'])
+                username = f"customer_{external_id}"
+                email = self.clean_string(row['Customer Email'], 255)
+                if email == 'XXXXXXXXX' or email == '':
+                    email = f"customer_{external_id}@dataco.com"
+                
+                fname = self.clean_string(row['Customer Fname'], 100)
+                lname = self.clean_string(row['Customer Lname'], 100)
+                full_name = f"{fname} {lname}".strip()
+                if not full_name:
+                    full_name = f"Customer {external_id}"
+                
+                yield (
+                    f"({external_id}, '{username}', '{email}', '{self.clean_string(full_name, 255)}', "
+                    f"'hashed_password', (SELECT id FROM roles WHERE role_name = 'CUSTOMER' LIMIT 1), (SELECT id FROM status WHERE name = 'Active' AND type = 'USER' LIMIT 1), NOW())"
+                )
         
-        if user_values:
-            return f"""
-INSERT IGNORE INTO users (external_id, username, email, full_name, password, role_id, status_id, created_at) VALUES
-{', '.join(user_values)};
-"""
-        return ""
+        yield from self._insert_batches(
+            "INSERT IGNORE INTO users (external_id, username, email, full_name, password, role_id, status_id, created_at) VALUES",
+            user_values()
+        )
 
-    def generate_orders_sql(self) -> str:
+    def iter_orders_sql(self) -> Iterator[str]:
         """Generate orders SQL theo mapping guide"""
         logger.info("📦 Generating orders SQL...")
         
@@ -163,41 +183,40 @@ INSERT IGNORE INTO users (external_id, username, email, full_name, password, rol
             'Order Id', 'Benefit per order', 'Order Profit Per Order', 'Sales',
             'order_date_clean', 'Order Status', 'Customer Id', 'Department Id', 'Customer Segment'
         ]].drop_duplicates(subset=['Order Id'])
+        orders = self.order_rows(orders, ['Order Id'])
         
-        order_values = []
-        for _, row in orders.iterrows():
-            external_id = int(row['Order Id'])
-            # Mapping theo guide: Benefit per order → benefit_per_order
-            benefit_per_order = float(row['Benefit per order']) if pd.notna(row['Benefit per order']) else 0.0
-            # Mapping theo guide: Order Profit Per Order → order_profit_per_order  
-            order_profit_per_order = float(row['Order Profit Per Order']) if pd.notna(row['Order Profit Per Order']) else 0.0
-            # Mapping theo guide: Sales → total_amount
-            total_amount = float(row['Sales']) if pd.notna(row['Sales']) else 0.0
-            # Mapping theo guide: order date (DateOrders) → created_at
-            created_at = self.format_datetime(row['order_date_clean'])
-            
-            status_id = self.order_status_mapping.get(str(row['Order Status']), 1)
-            customer_external_id = int(row['Customer Id'])
-            store_external_id = int(row['Department Id'])
-            
-            # Customer Segment → notes (theo mapping guide)
-            notes = self.clean_string(row['Customer Segment'], 500) if pd.notna(row['Customer Segment']) else ''
-            
-            # Chỉ insert các trường được chỉ định trong mapping guide
-            order_values.append(
-                f"({external_id}, {benefit_per_order}, {order_profit_per_order}, {total_amount}, "
-                f"{created_at}, (SELECT id FROM users WHERE external_id = {customer_external_id} LIMIT 1), "
-                f"(SELECT id FROM stores WHERE external_id = {store_external_id} LIMIT 1), '{notes}', NOW())"
-            )
+        def order_values():
+            for _, row in orders.iterrows():
+                external_id = int(row['Order Id'])
+                # Mapping theo guide: Benefit per order → benefit_per_order
+                benefit_per_order = float(row['Benefit per order']) if pd.notna(row['Benefit per order']) else 0.0
+                # Mapping theo guide: Order Profit Per Order → order_profit_per_order  
+                order_profit_per_order = float(row['Order Profit Per Order']) if pd.notna(row['Order Profit Per Order']) else 0.0
+                # Mapping theo guide: Sales → total_amount
+                total_amount = float(row['Sales']) if pd.notna(row['Sales']) else 0.0
+                # Mapping theo guide: order date (DateOrders) → created_at
+                created_at = self.format_datetime(row['order_date_clean'])
+                
+                status_id = self.order_status_mapping.get(str(row['Order Status']), 1)
+                customer_external_id = int(row['Customer Id'])
+                store_external_id = int(row['Department Id'])
+                
+                # Customer Segment → notes (theo mapping guide)
+                notes = self.clean_string(row['Customer Segment'], 500) if pd.notna(row['Customer Segment']) else ''
+                
+                # Chỉ insert các trường được chỉ định trong mapping guide
+                yield (
+                    f"({external_id}, {benefit_per_order}, {order_profit_per_order}, {total_amount}, "
+                    f"{created_at}, (SELECT id FROM users WHERE external_id = {customer_external_id} LIMIT 1), "
+                    f"(SELECT id FROM stores WHERE external_id = {store_external_id} LIMIT 1), '{notes}', NOW())"
+                )
         
-        if order_values:
-            return f"""
-INSERT IGNORE INTO orders (external_id, benefit_per_order, order_profit_per_order, total_amount, created_at, created_by, store_id, notes, updated_at) VALUES
-{', '.join(order_values)};
-"""
-        return ""
+        yield from self._insert_batches(
+            "INSERT IGNORE INTO orders (external_id, benefit_per_order, order_profit_per_order, total_amount, created_at, created_by, store_id, notes, updated_at) VALUES",
+            order_values()
+        )
 
-    def generate_addresses_sql(self) -> str:
+    def iter_addresses_sql(self) -> Iterator[str]:
         """Generate addresses SQL theo mapping guide"""
         logger.info("📍 Generating addresses SQL...")
         
@@ -208,57 +227,56 @@ INSERT IGNORE INTO orders (external_id, benefit_per_order, order_profit_per_orde
             'Customer Street', 'Order Zipcode', 'Customer City', 'Customer Country', 
             'Customer State', 'Customer Zipcode'
         ]].drop_duplicates(subset=['Order Id'])
+        addresses = self.order_rows(addresses, ['Order Id'])
         
-        address_values = []
-        for _, row in addresses.iterrows():
-            order_external_id = int(row['Order Id'])
-            
-            # Mapping theo guide: Latitude → latitude, Longitude → longitude
-            latitude = float(row['Latitude']) if pd.notna(row['Latitude']) else 'NULL'
-            longitude = float(row['Longitude']) if pd.notna(row['Longitude']) else 'NULL'
-            
-            # Mapping theo guide: Order City → city (ưu tiên Order City trước Customer City)
-            city = self.clean_string(row['Order City'], 100) if pd.notna(row['Order City']) else self.clean_string(row['Customer City'], 100)
-            # Mapping theo guide: Order Country → country  
-            country = self.clean_string(row['Order Country'], 100) if pd.notna(row['Order Country']) else self.clean_string(row['Customer Country'], 100)
-            # Mapping theo guide: Order State → state
-            state = self.clean_string(row['Order State'], 100) if pd.notna(row['Order State']) else self.clean_string(row['Customer State'], 100)
-            # Mapping theo guide: Order Region → region
-            region = self.clean_string(row['Order Region'], 100)
-            
-            # Mapping theo guide: Customer Fname → contact_name
-            contact_name = self.clean_string(row['Customer Fname'], 255)
-            # Mapping theo guide: Customer Email → contact_email
-            contact_email = self.clean_string(row['Customer Email'], 255)
-            if contact_email == 'XXXXXXXXX' or not contact_email:
-                contact_email = 'noemail@dataco.com'
-            
-            # Mapping theo guide: Customer Street → address
-            address = self.clean_string(row['Customer Street'], 500)
-            if not address:
-                address = f"Address for Order {order_external_id}"
-            
-            # Mapping theo guide: Order Zipcode → postal_code (ưu tiên Order Zipcode)
-            postal_code = str(row['Order Zipcode']) if pd.notna(row['Order Zipcode']) else str(row['Customer Zipcode']) if pd.notna(row['Customer Zipcode']) else '00000'
-            
-            lat_val = f"{latitude}" if latitude != 'NULL' else 'NULL'
-            lng_val = f"{longitude}" if longitude != 'NULL' else 'NULL'
-            
-            # Chỉ insert các trường được chỉ định trong mapping guide
-            address_values.append(
-                f"({lat_val}, {lng_val}, NOW(), (SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), "
-                f"'{postal_code}', '{city}', '{country}', '{region}', '{state}', '{address}', "
-                f"'{contact_email}', '{contact_name}', 'DELIVERY', NOW())"
-            )
+        def address_values():
+            for _, row in addresses.iterrows():
+                order_external_id = int(row['Order Id'])
+                
+                # Mapping theo guide: Latitude → latitude, Longitude → longitude
+                latitude = float(row['Latitude']) if pd.notna(row['Latitude']) else 'NULL'
+                longitude = float(row['Longitude']) if pd.notna(row['Longitude']) else 'NULL'
+                
+                # Mapping theo guide: Order City → city (ưu tiên Order City trước Customer City)
+                city = self.clean_string(row['Order City'], 100) if pd.notna(row['Order City']) else self.clean_string(row['Customer City'], 100)
+                # Mapping theo guide: Order Country → country  
+                country = self.clean_string(row['Order Country'], 100) if pd.notna(row['Order Country']) else self.clean_string(row['Customer Country'], 100)
+                # Mapping theo guide: Order State → state
+                state = self.clean_string(row['Order State'], 100) if pd.notna(row['Order State']) else self.clean_string(row['Customer State'], 100)
+                # Mapping theo guide: Order Region → region
+                region = self.clean_string(row['Order Region'], 100)
+                
+                # Mapping theo guide: Customer Fname → contact_name
+                contact_name = self.clean_string(row['Customer Fname'], 255)
+                # Mapping theo guide: Customer Email → contact_email
+                contact_email = self.clean_string(row['Customer Email'], 255)
+                if contact_email == 'XXXXXXXXX' or not contact_email:
+                    contact_email = 'noemail@dataco.com'
+                
+                # Mapping theo guide: Customer Street → address
+                address = self.clean_string(row['Customer Street'], 500)
+                if not address:
+                    address = f"Address for Order {order_external_id}"
+                
+                # Mapping theo guide: Order Zipcode → postal_code (ưu tiên Order Zipcode)
+                postal_code = str(row['Order Zipcode']) if pd.notna(row['Order Zipcode']) else str(row['Customer Zipcode']) if pd.notna(row['Customer Zipcode']) else '00000'
+                
+                lat_val = f"{latitude}" if latitude != 'NULL' else 'NULL'
+                lng_val = f"{longitude}" if longitude != 'NULL' else 'NULL'
+                
+                # Chỉ insert các trường được chỉ định trong mapping guide
+                yield (
+                    f"({lat_val}, {lng_val}, NOW(), (SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), "
+                    f"'{postal_code}', '{city}', '{country}', '{region}', '{state}', '{address}', "
+                    f"'{contact_email}', '{contact_name}', 'DELIVERY', NOW())"
+                )
         
-        if address_values:
-            return f"""
-INSERT IGNORE INTO addresses (latitude, longitude, created_at, order_id, postal_code, city, country, region, state, address, contact_email, contact_name, address_type, updated_at) VALUES
-{', '.join(address_values)};
-"""
-        return ""
+        yield from self._insert_batches(
+            "INSERT IGNORE INTO addresses (latitude, longitude, created_at, order_id, postal_code, city, country, region, state, address, contact_email, contact_name, address_type, updated_at) VALUES",
+            address_values()
+        )
 
-    def generate_order_items_sql(self) -> str:
+    def iter_order_items_sql(self) -> Iterator[str]:
         """Generate order_items SQL theo mapping guide"""
         logger.info("📋 Generating order_items SQL...")
         
@@ -266,71 +284,65 @@ INSERT IGNORE INTO addresses (latitude, longitude, created_at, order_id, postal_
             'Order Item Id', 'Order Item Quantity', 'Order Item Product Price',
             'Order Id', 'Product Card Id'
         ]]
+        # Theo order cha trước để FK index order_id cũng được insert tuần tự
+        order_items = self.order_rows(order_items, ['Order Id', 'Order Item Id'])
         
         # Process in batches for memory efficiency
-        item_values = []
-        for _, row in order_items.iterrows():
-            item_external_id = int(row['Order Item Id'])
-            # Mapping theo guide: Order Item Quantity → quantity
-            quantity = int(row['Order Item Quantity'])
-            # Mapping theo guide: Order Item Product Price → unit_price
-            unit_price = float(row['Order Item Product Price'])
-            order_external_id = int(row['Order Id'])
-            product_external_id = int(row['Product Card Id'])
-            
-            # Chỉ insert các trường được chỉ định trong mapping guide
-            item_values.append(
-                f"({item_external_id}, {quantity}, {unit_price}, NOW(), "
-                f"(SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), "
-                f"(SELECT id FROM products WHERE external_id = {product_external_id} LIMIT 1), NOW())"
-            )
+        def item_values():
+            for _, row in order_items.iterrows():
+                item_external_id = int(row['Order Item Id'])
+                # Mapping theo guide: Order Item Quantity → quantity
+                quantity = int(row['Order Item Quantity'])
+                # Mapping theo guide: Order Item Product Price → unit_price
+                unit_price = float(row['Order Item Product Price'])
+                order_external_id = int(row['Order Id'])
+                product_external_id = int(row['Product Card Id'])
+                
+                # Chỉ insert các trường được chỉ định trong mapping guide
+                yield (
+                    f"({item_external_id}, {quantity}, {unit_price}, NOW(), "
+                    f"(SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), "
+                    f"(SELECT id FROM products WHERE external_id = {product_external_id} LIMIT 1), NOW())"
+                )
         
-        if item_values:
-            # Split into batches
-            batch_sql = []
-            for i in range(0, len(item_values), self.batch_size):
-                batch = item_values[i:i+self.batch_size]
-                batch_sql.append(f"""
-INSERT IGNORE INTO order_items (external_id, quantity, unit_price, created_at, order_id, product_id, updated_at) VALUES
-{', '.join(batch)};
-""")
-            return '\n'.join(batch_sql)
-        return ""
+        yield from self._insert_batches(
+            "INSERT IGNORE INTO order_items (external_id, quantity, unit_price, created_at, order_id, product_id, updated_at) VALUES",
+            item_values()
+        )
 
-    def generate_payments_sql(self) -> str:
+    def iter_payments_sql(self) -> Iterator[str]:
         """Generate payments SQL theo mapping guide"""
         logger.info("💳 Generating payments SQL...")
         
         payments = self.df[[
             'Order Id', 'Type', 'Sales', 'Customer Id'
         ]].drop_duplicates(subset=['Order Id'])
+        payments = self.order_rows(payments, ['Order Id'])
         
-        payment_values = []
-        payment_counter = 1
-        
-        for _, row in payments.iterrows():
-            amount = float(row['Sales'])
-            # Mapping theo guide: Type → payment_method với ánh xạ giá trị chính xác
-            payment_method = self.payment_type_mapping.get(str(row['Type']), 'CASH')
-            order_external_id = int(row['Order Id'])
-            customer_external_id = int(row['Customer Id'])
-            
-            # Chỉ insert trường payment_method được chỉ định trong mapping guide
-            payment_values.append(
-                f"({amount}, 4, NOW(), (SELECT id FROM users WHERE external_id = {customer_external_id} LIMIT 1), "
-                f"(SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), NOW(), "
-                f"'Transaction for Order {order_external_id}', 'TXN_{payment_counter:08d}', '{payment_method}')"
-            )
-            payment_counter += 1
+        def payment_values():
+            payment_counter = 1
+            
+            for _, row in payments.iterrows():
+                amount = float(row['Sales'])
+                # Mapping theo guide: Type → payment_method với ánh xạ giá trị chính xác
+                payment_method = self.payment_type_mapping.get(str(row['Type']), 'CASH')
+                order_external_id = int(row['Order Id'])
+                customer_external_id = int(row['Customer Id'])
+                
+                # Chỉ insert trường payment_method được chỉ định trong mapping guide
+                yield (
+                    f"({amount}, 4, NOW(), (SELECT id FROM users WHERE external_id = {customer_external_id} LIMIT 1), "
+                    f"(SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), NOW(), "
+                    f"'Transaction for Order {order_external_id}', 'TXN_{payment_counter:08d}', '{payment_method}')"
+                )
+                payment_counter += 1
         
-        if payment_values:
-            return f"""
-INSERT IGNORE INTO payments (amount, status_id, created_at, created_by, order_id, updated_at, notes, transaction_id, payment_method) VALUES
-{', '.join(payment_values)};
-"""
-        return ""
+        yield from self._insert_batches(
+            "INSERT IGNORE INTO payments (amount, status_id, created_at, created_by, order_id, updated_at, notes, transaction_id, payment_method) VALUES",
+            payment_values()
+        )
 
-    def generate_deliveries_sql(self) -> str:
+    def iter_deliveries_sql(self) -> Iterator[str]:
         """Generate deliveries SQL theo mapping guide"""
         logger.info("🚚 Generating deliveries SQL...")
         
@@ -338,152 +350,156 @@ INSERT IGNORE INTO payments (amount, status_id, created_at, created_by, order_id
             'Order Id', 'Late_delivery_risk', 'shipping_date_clean', 'Shipping Mode',
             'order_date_clean', 'Days for shipping (real)'
         ]].drop_duplicates(subset=['Order Id'])
+        deliveries = self.order_rows(deliveries, ['Order Id'])
         
-        delivery_values = []
-        
-        for _, row in deliveries.iterrows():
-            order_external_id = int(row['Order Id'])
-            # Mapping theo guide: Late_delivery_risk → late_delivery_risk
-            late_delivery_risk = int(row['Late_delivery_risk']) if pd.notna(row['Late_delivery_risk']) else 0
-            
-            # Mapping theo guide: shipping date (DateOrders) → actual_delivery_time
-            actual_delivery_time = self.format_datetime(row['shipping_date_clean'])
-            order_date = self.format_datetime(row['order_date_clean'])
-            
-            # Mapping theo guide: Shipping Mode → service_type với ánh xạ giá trị chính xác
-            service_type = self.shipping_mode_mapping.get(str(row['Shipping Mode']), 'STANDARD')
+        def delivery_values():
             
-            # Calculate pickup date (order_date + 1 day)
-            try:
-                if pd.notna(row['order_date_clean']):
-                    pickup_dt = row['order_date_clean'] + timedelta(days=1)
-                    pickup_date = f"'{pickup_dt.strftime('%Y-%m-%d %H:%M:%S')}'"
-                else:
+            for _, row in deliveries.iterrows():
+                order_external_id = int(row['Order Id'])
+                # Mapping theo guide: Late_delivery_risk → late_delivery_risk
+                late_delivery_risk = int(row['Late_delivery_risk']) if pd.notna(row['Late_delivery_risk']) else 0
+                
+                # Mapping theo guide: shipping date (DateOrders) → actual_delivery_time
+                actual_delivery_time = self.format_datetime(row['shipping_date_clean'])
+                order_date = self.format_datetime(row['order_date_clean'])
+                
+                # Mapping theo guide: Shipping Mode → service_type với ánh xạ giá trị chính xác
+                service_type = self.shipping_mode_mapping.get(str(row['Shipping Mode']), 'STANDARD')
+                
+                # Calculate pickup date (order_date + 1 day)
+                try:
+                    if pd.notna(row['order_date_clean']):
+                        pickup_dt = row['order_date_clean'] + timedelta(days=1)
+                        pickup_date = f"'{pickup_dt.strftime('%Y-%m-%d %H:%M:%S')}'"
+                    else:
+                        pickup_date = 'NOW()'
+                except:
                     pickup_date = 'NOW()'
-            except:
-                pickup_date = 'NOW()'
-            
-            # Chỉ insert các trường được chỉ định trong mapping guide
-            delivery_values.append(
-                f"({late_delivery_risk}, {actual_delivery_time}, NOW(), "
-                f"{order_date}, (SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), {pickup_date}, NOW(), 1, "
-                f"'Delivery for Order {order_external_id}', '{service_type}', 'ROAD')"
-            )
+                
+                # Chỉ insert các trường được chỉ định trong mapping guide
+                yield (
+                    f"({late_delivery_risk}, {actual_delivery_time}, NOW(), "
+                    f"{order_date}, (SELECT id FROM orders WHERE external_id = {order_external_id} LIMIT 1), {pickup_date}, NOW(), 1, "
+                    f"'Delivery for Order {order_external_id}', '{service_type}', 'ROAD')"
+                )
         
-        if delivery_values:
-            return f"""
-INSERT IGNORE INTO deliveries (late_delivery_risk, actual_delivery_time, created_at, order_date, order_id, pickup_date, updated_at, vehicle_id, delivery_notes, service_type, transport_mode) VALUES
-{', '.join(delivery_values)};
-"""
-        return ""
+        yield from self._insert_batches(
+            "INSERT IGNORE INTO deliveries (late_delivery_risk, actual_delivery_time, created_at, order_date, order_id, pickup_date, updated_at, vehicle_id, delivery_notes, service_type, transport_mode) VALUES",
+            delivery_values()
+        )
 
-    def generate_complete_sql(self) -> bool:
-        """Generate complete SQL file"""
-        try:
-            logger.info("🏗️  Generating complete SQL file...")
-            
-            # Generate all SQL sections
-            sql_sections = []
-            
-            # 1. Master data (from previous pipeline)
-            sql_sections.append("-- ===== MASTER DATA =====")
-            
-            # Status and Roles master data already imported via production_master_data.sql
-            # Skipping to avoid duplicates
-            
-            # Warehouses - loại bỏ ID vì có AUTO_INCREMENT
-            sql_sections.append("""
+    def iter_sql_sections(self) -> Iterator[str]:
+        """
+        Yield SQL theo thứ tự dependency, format lazily; bảng transaction được
+        chia thành các INSERT tối đa self.batch_size rows
+        """
+        # 1. Master data (from previous pipeline)
+        yield "-- ===== MASTER DATA ====="
+        
+        # Status and Roles master data already imported via production_master_data.sql
+        # Skipping to avoid duplicates
+        
+        # Warehouses - loại bỏ ID vì có AUTO_INCREMENT
+        yield """
 INSERT IGNORE INTO warehouses (warehouse_code, name, address, capacity_m3, is_active, created_at, created_by) VALUES
 ('WH001', 'Main Warehouse', 'Default Warehouse Address', 10000.00, 1, NOW(), (SELECT id FROM users WHERE external_id = 0 LIMIT 1));
-""")
-            
-            # Vehicles - loại bỏ ID vì có AUTO_INCREMENT, và sử dụng status name thay vì hardcode ID
-            sql_sections.append("""
+"""
+        
+        # Vehicles - loại bỏ ID vì có AUTO_INCREMENT, và sử dụng status name thay vì hardcode ID
+        yield """
 INSERT IGNORE INTO vehicles (license_plate, vehicle_type, capacity_weight_kg, capacity_volume_m3, status_id, created_at) VALUES
 ('DEFAULT-001', 'TRUCK', 5000.00, 50.00, (SELECT id FROM status WHERE name = 'AVAILABLE' LIMIT 1), NOW());
-""")
-            
-            # 2. Categories - chỉ insert field được chỉ định trong mapping guide  
-            categories = self.df[['Category Id', 'Category Name']].drop_duplicates()
-            cat_values = []
-            for _, row in categories.iterrows():
-                external_id = int(row['Category Id'])
-                # Mapping theo guide: Category Name → name
-                name = self.clean_string(row['Category Name'], 255)
-                cat_values.append(f"({external_id}, 'CAT_{external_id}', '{name}', NOW())")
-            
-            if cat_values:
-                sql_sections.append(f"""
+"""
+        
+        # 2. Categories - chỉ insert field được chỉ định trong mapping guide  
+        categories = self.df[['Category Id', 'Category Name']].drop_duplicates()
+        categories = self.order_rows(categories, ['Category Id'])
+        cat_values = []
+        for _, row in categories.iterrows():
+            external_id = int(row['Category Id'])
+            # Mapping theo guide: Category Name → name
+            name = self.clean_string(row['Category Name'], 255)
+            cat_values.append(f"({external_id}, 'CAT_{external_id}', '{name}', NOW())")
+        
+        if cat_values:
+            yield f"""
 INSERT IGNORE INTO categories (external_id, category_id, name, created_at) VALUES
 {', '.join(cat_values)};
-""")
-            
-            # 3. Stores - chỉ insert field được chỉ định trong mapping guide
-            stores = self.df[['Department Id', 'Department Name']].drop_duplicates()
-            store_values = []
-            for _, row in stores.iterrows():
-                external_id = int(row['Department Id'])
-                # Mapping theo guide: Department Name → store_name
-                store_name = self.clean_string(row['Department Name'], 255)
-                store_values.append(f"({external_id}, '{store_name}', '000-000-0000', 'Default Store Address', NOW())")
-            
-            if store_values:
-                sql_sections.append(f"""
+"""
+        
+        # 3. Stores - chỉ insert field được chỉ định trong mapping guide
+        stores = self.df[['Department Id', 'Department Name']].drop_duplicates()
+        stores = self.order_rows(stores, ['Department Id'])
+        store_values = []
+        for _, row in stores.iterrows():
+            external_id = int(row['Department Id'])
+            # Mapping theo guide: Department Name → store_name
+            store_name = self.clean_string(row['Department Name'], 255)
+            store_values.append(f"({external_id}, '{store_name}', '000-000-0000', 'Default Store Address', NOW())")
+        
+        if store_values:
+            yield f"""
 INSERT IGNORE INTO stores (external_id, store_name, phone, address, created_at) VALUES
 {', '.join(store_values)};
-""")
-            
-            # 4. Products - chỉ insert các trường trong mapping guide
-            products = self.df[[
-                'Product Card Id', 'Product Name', 'Product Description', 
-                'Product Price', 'Product Status', 'Product Image', 'Product Category Id'
-            ]].drop_duplicates(subset=['Product Card Id'])
-            
-            product_values = []
-            for _, row in products.iterrows():
-                external_id = int(row['Product Card Id'])
-                name = self.clean_string(row['Product Name'], 255)
-                description = self.clean_string(row['Product Description'], 1000)
-                unit_price = float(row['Product Price'])  # Product Price → unit_price
-                # Product Status mapping: 0 → ACTIVE, 1 → INACTIVE
-                product_status = self.product_status_mapping.get(int(row['Product Status']), 'ACTIVE')
-                product_image = self.clean_string(row['Product Image'], 500)
-                category_external_id = int(row['Product Category Id'])
-                
-                # Chỉ insert các trường được chỉ định trong mapping guide
-                product_values.append(
-                    f"({external_id}, '{name}', '{description}', {unit_price}, '{product_status}', "
-                    f"'{product_image}', (SELECT id FROM categories WHERE external_id = {category_external_id} LIMIT 1), NOW())"
-                )
+"""
+        
+        # 4. Products - chỉ insert các trường trong mapping guide
+        products = self.df[[
+            'Product Card Id', 'Product Name', 'Product Description', 
+            'Product Price', 'Product Status', 'Product Image', 'Product Category Id'
+        ]].drop_duplicates(subset=['Product Card Id'])
+        products = self.order_rows(products, ['Product Card Id'])
+        
+        product_values = []
+        for _, row in products.iterrows():
+            external_id = int(row['Product Card Id'])
+            name = self.clean_string(row['Product Name'], 255)
+            description = self.clean_string(row['Product Description'], 1000)
+            unit_price = float(row['Product Price'])  # Product Price → unit_price
+            # Product Status mapping: 0 → ACTIVE, 1 → INACTIVE
+            product_status = self.product_status_mapping.get(int(row['Product Status']), 'ACTIVE')
+            product_image = self.clean_string(row['Product Image'], 500)
+            category_external_id = int(row['Product Category Id'])
             
-            if product_values:
-                sql_sections.append(f"""
+            # Chỉ insert các trường được chỉ định trong mapping guide
+            product_values.append(
+                f"({external_id}, '{name}', '{description}', {unit_price}, '{product_status}', "
+                f"'{product_image}', (SELECT id FROM categories WHERE external_id = {category_external_id} LIMIT 1), NOW())"
+            )
+        
+        if product_values:
+            yield f"""
 INSERT IGNORE INTO products 
 (external_id, name, description, unit_price, product_status, product_image, category_id, created_at) VALUES
 {', '.join(product_values)};
-""")
-            
-            # 5. Transaction data
-            sql_sections.append("\n-- ===== TRANSACTION DATA =====")
-            
-            sql_sections.append(self.generate_users_sql())
-            sql_sections.append(self.generate_orders_sql())
-            sql_sections.append(self.generate_addresses_sql())
-            sql_sections.append(self.generate_order_items_sql())
-            sql_sections.append(self.generate_payments_sql())
-            sql_sections.append(self.generate_deliveries_sql())
+"""
+        
+        # 5. Transaction data
+        yield "\n-- ===== TRANSACTION DATA ====="
+        
+        yield from self.iter_users_sql()
+        yield from self.iter_orders_sql()
+        yield from self.iter_addresses_sql()
+        yield from self.iter_order_items_sql()
+        yield from self.iter_payments_sql()
+        yield from self.iter_deliveries_sql()
+
+    def generate_complete_sql(self, output_file: str = 'dataco_complete_import.sql') -> bool:
+        """Generate complete SQL file"""
+        try:
+            logger.info("🏗️  Generating complete SQL file...")
             
             # Write to file
-            output_file = 'dataco_complete_import.sql'
             with open(output_file, 'w', encoding='utf-8') as f:
                 f.write("-- DataCo Supply Chain Complete Import SQL\n")
                 f.write("-- Generated by Advanced ETL Pipeline\n")
                 f.write(f"-- Created: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"-- Total Records: {len(self.df):,}\n\n")
+                f.write(f"-- Total Records: {len(self.df):,}\n")
+                f.write(f"-- Row order: {'clustered key' if self.sort_by_key else 'CSV'}\n\n")
                 f.write("SET FOREIGN_KEY_CHECKS = 0;\n")
                 f.write("SET SQL_MODE = 'NO_AUTO_VALUE_ON_ZERO';\n\n")
                 
-                for section in sql_sections:
+                for section in self.iter_sql_sections():
                     f.write(section)
                     f.write("\n")
                 
@@ -520,7 +536,11 @@ INSERT IGNORE INTO products
             return False
 
 if __name__ == "__main__":
-    pipeline = AdvancedDataCoPipeline('DataCoSupplyChainDataset.csv')
+    import sys
+    
+    # --sort-by-key: emit rows theo clustered key để tối ưu InnoDB page locality
+    pipeline = AdvancedDataCoPipeline('DataCoSupplyChainDataset.csv',
+                                      sort_by_key='--sort-by-key' in sys.argv)
     
     success = pipeline.run_complete_pipeline()
     
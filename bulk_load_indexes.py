@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Bulk Load Secondary Index Manager
+=================================
+Drop và rebuild secondary indexes quanh các đợt bulk load lớn.
+
+Khi load order_items, orders, addresses, delivery_tracking... vào các bảng có
+nhiều FK index, InnoDB phải cập nhật từng index theo từng row. Module này:
+
+1. Capture định nghĩa secondary indexes + foreign keys từ information_schema
+2. Drop các index không thiết yếu (non-unique, không phải PRIMARY) và các FK
+   đang phụ thuộc vào chúng
+3. Sau bulk insert, rebuild indexes trong MỘT ALTER TABLE (ALGORITHM=INPLACE)
+   cho mỗi bảng, rồi add FKs trong ALTER riêng với foreign_key_checks=0 - gộp
+   ADD FOREIGN KEY chung với checks bật buộc MySQL dùng ALGORITHM=COPY
+4. Validate schema sau rebuild giống hệt schema ban đầu
+
+UNIQUE indexes (external_id, username, ...) luôn được giữ lại vì INSERT IGNORE
+và các subquery lookup theo external_id cần chúng trong lúc load.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Các bảng lớn được load nhiều nhất - xem dump-fastroute-202508070955.sql
+BULK_LOAD_TABLES = [
+    'orders', 'order_items', 'addresses', 'payments',
+    'deliveries', 'delivery_tracking'
+]
+
+INDEX_QUERY = """
+SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME,
+       SUB_PART, COLLATION, INDEX_TYPE, EXPRESSION
+FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders})
+ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+"""
+
+FOREIGN_KEY_QUERY = """
+SELECT k.TABLE_NAME, k.CONSTRAINT_NAME, k.COLUMN_NAME, k.ORDINAL_POSITION,
+       k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME,
+       r.UPDATE_RULE, r.DELETE_RULE
+FROM information_schema.KEY_COLUMN_USAGE k
+JOIN information_schema.REFERENTIAL_CONSTRAINTS r
+  ON r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA
+ AND r.CONSTRAINT_NAME = k.CONSTRAINT_NAME
+ AND r.TABLE_NAME = k.TABLE_NAME
+WHERE k.TABLE_SCHEMA = DATABASE() AND k.TABLE_NAME IN ({placeholders})
+  AND k.REFERENCED_TABLE_NAME IS NOT NULL
+ORDER BY k.TABLE_NAME, k.CONSTRAINT_NAME, k.ORDINAL_POSITION
+"""
+
+
+class SecondaryIndexManager:
+    """Capture, drop và rebuild secondary indexes cho bulk load."""
+
+    def __init__(self, cursor, tables: Optional[List[str]] = None,
+                 logger: Optional[logging.Logger] = None, log_dir: str = 'production_logs'):
+        self.cursor = cursor
+        self.tables = list(tables or BULK_LOAD_TABLES)
+        self.logger = logger or logging.getLogger(__name__)
+        self.log_dir = log_dir
+        self.captured = None   # Schema snapshot trước khi drop
+        self.dropped = {}      # table -> {'indexes': [...], 'foreign_keys': [...]}
+
+    def capture_schema(self) -> Dict[str, Any]:
+        """Đọc định nghĩa indexes và foreign keys từ information_schema."""
+        placeholders = ', '.join(['%s'] * len(self.tables))
+
+        self.cursor.execute(INDEX_QUERY.format(placeholders=placeholders), tuple(self.tables))
+        indexes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for row in self.cursor.fetchall():
+            (table, index_name, non_unique, _seq, column, sub_part,
+             collation, index_type, expression) = row
+            table_indexes = indexes.setdefault(table, {})
+            index = table_indexes.setdefault(index_name, {
+                'name': index_name,
+                'unique': not int(non_unique),
+                'index_type': index_type,
+                'functional': False,
+                'columns': []
+            })
+            if expression is not None:
+                index['functional'] = True
+            index['columns'].append({
+                'column': column,
+                'sub_part': int(sub_part) if sub_part is not None else None,
+                'descending': collation == 'D'
+            })
+
+        self.cursor.execute(FOREIGN_KEY_QUERY.format(placeholders=placeholders), tuple(self.tables))
+        foreign_keys: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for row in self.cursor.fetchall():
+            (table, constraint, column, _position, ref_table,
+             ref_column, update_rule, delete_rule) = row
+            fk = foreign_keys.setdefault(table, {}).setdefault(constraint, {
+                'name': constraint,
+                'columns': [],
+                'referenced_table': ref_table,
+                'referenced_columns': [],
+                'update_rule': update_rule,
+                'delete_rule': delete_rule
+            })
+            fk['columns'].append(column)
+            fk['referenced_columns'].append(ref_column)
+
+        return {
+            table: {
+                'indexes': indexes.get(table, {}),
+                'foreign_keys': foreign_keys.get(table, {})
+            }
+            for table in self.tables if table in indexes
+        }
+
+    @staticmethod
+    def _is_droppable(index: Dict[str, Any]) -> bool:
+        """Index không thiết yếu: non-unique BTREE thường, không phải PRIMARY."""
+        return (index['name'] != 'PRIMARY'
+                and not index['unique']
+                and not index['functional']
+                and index['index_type'] == 'BTREE')
+
+    @staticmethod
+    def _leading_columns(index: Dict[str, Any], count: int) -> List[str]:
+        return [col['column'] for col in index['columns'][:count]]
+
+    def _plan_table(self, table_schema: Dict[str, Any]) -> Tuple[List[Dict], List[Dict]]:
+        """Chọn indexes sẽ drop và các FK phải drop theo (vì cần index đó)."""
+        indexes = table_schema['indexes']
+        drop_indexes = [idx for idx in indexes.values() if self._is_droppable(idx)]
+        kept_indexes = [idx for idx in indexes.values() if not self._is_droppable(idx)]
+
+        drop_fks = []
+        for fk in table_schema['foreign_keys'].values():
+            fk_columns = fk['columns']
+            covered = any(
+                self._leading_columns(idx, len(fk_columns)) == fk_columns
+                for idx in kept_indexes
+            )
+            if not covered:
+                drop_fks.append(fk)
+
+        return drop_indexes, drop_fks
+
+    def save_definitions(self, log_dir: Optional[str] = None) -> str:
+        """Lưu định nghĩa đã capture ra file để có thể restore thủ công nếu crash."""
+        log_dir = log_dir or self.log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(log_dir, f"index_definitions_{timestamp}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.captured, f, indent=2)
+        return path
+
+    def drop_secondary_indexes(self) -> bool:
+        """
+        Capture schema rồi drop các secondary indexes không thiết yếu.
+        Mỗi định nghĩa được ghi vào self.dropped TRƯỚC khi DROP, nên khi lỗi giữa
+        chừng mọi thứ đã drop (kể cả FKs) đều được rebuild lại trước khi return.
+        """
+        completed = False
+        try:
+            self.captured = self.capture_schema()
+            definitions_file = self.save_definitions()
+            self.logger.info(f"📋 Index definitions saved: {definitions_file}")
+
+            for table, table_schema in self.captured.items():
+                drop_indexes, drop_fks = self._plan_table(table_schema)
+                if not drop_indexes:
+                    continue
+
+                dropped = self.dropped.setdefault(table, {'indexes': [], 'foreign_keys': []})
+
+                # FK phải drop trước index mà nó phụ thuộc
+                if drop_fks:
+                    dropped['foreign_keys'] = drop_fks
+                    clauses = [f"DROP FOREIGN KEY `{fk['name']}`" for fk in drop_fks]
+                    self.cursor.execute(f"ALTER TABLE `{table}` {', '.join(clauses)}")
+
+                dropped['indexes'] = drop_indexes
+                clauses = [f"DROP INDEX `{idx['name']}`" for idx in drop_indexes]
+                self.cursor.execute(f"ALTER TABLE `{table}` {', '.join(clauses)}")
+
+                self.logger.info(f"🗑️  {table}: dropped {len(drop_indexes)} indexes, "
+                                 f"{len(drop_fks)} foreign keys")
+
+            completed = True
+            return True
+
+        except Exception as e:
+            self.logger.error(f"❌ Dropping secondary indexes failed: {e}")
+            return False
+
+        finally:
+            if not completed and self.dropped:
+                # Restore whatever was dropped before the failure
+                self.rebuild_secondary_indexes()
+
+    @staticmethod
+    def _index_clause(index: Dict[str, Any]) -> str:
+        columns = []
+        for col in index['columns']:
+            part = f"`{col['column']}`"
+            if col['sub_part']:
+                part += f"({col['sub_part']})"
+            if col['descending']:
+                part += " DESC"
+            columns.append(part)
+        return f"ADD INDEX `{index['name']}` ({', '.join(columns)})"
+
+    @staticmethod
+    def _foreign_key_clause(fk: Dict[str, Any]) -> str:
+        columns = ', '.join(f"`{c}`" for c in fk['columns'])
+        ref_columns = ', '.join(f"`{c}`" for c in fk['referenced_columns'])
+        return (f"ADD CONSTRAINT `{fk['name']}` FOREIGN KEY ({columns}) "
+                f"REFERENCES `{fk['referenced_table']}` ({ref_columns}) "
+                f"ON DELETE {fk['delete_rule']} ON UPDATE {fk['update_rule']}")
+
+    def rebuild_secondary_indexes(self) -> bool:
+        """
+        Rebuild tất cả indexes + FKs đã drop. Mỗi bảng: một ALTER ADD INDEX
+        (INPLACE), sau đó một ALTER ADD CONSTRAINT với foreign_key_checks=0 để
+        cũng chạy INPLACE - data vừa load không được FK check lại, giống lúc import.
+        Định nghĩa còn tồn tại (DROP đã ghi nhận nhưng thất bại, hoặc index đã
+        rebuild trước khi FK lỗi) được bỏ qua; bảng rebuild lỗi vẫn giữ trong
+        self.dropped để gọi lại.
+        """
+        try:
+            current = self.capture_schema()
+        except Exception as e:
+            self.logger.warning(f"⚠️  Cannot read current schema, rebuilding everything recorded: {e}")
+            current = {}
+
+        success = True
+        fk_checks_disabled = False
+        try:
+            for table, dropped in list(self.dropped.items()):
+                existing = current.get(table, {'indexes': {}, 'foreign_keys': {}})
+                indexes = [idx for idx in dropped['indexes'] if idx['name'] not in existing['indexes']]
+                foreign_keys = [fk for fk in dropped['foreign_keys'] if fk['name'] not in existing['foreign_keys']]
+                try:
+                    if indexes:
+                        clauses = [self._index_clause(idx) for idx in indexes]
+                        self.cursor.execute(f"ALTER TABLE `{table}` {', '.join(clauses)}, ALGORITHM=INPLACE")
+                    if foreign_keys:
+                        if not fk_checks_disabled:
+                            # Giữ giá trị của session (import có thể đang tắt sẵn) để restore
+                            self.cursor.execute("SET @bulk_load_fk_checks = @@foreign_key_checks")
+                            self.cursor.execute("SET foreign_key_checks = 0")
+                            fk_checks_disabled = True
+                        clauses = [self._foreign_key_clause(fk) for fk in foreign_keys]
+                        self.cursor.execute(f"ALTER TABLE `{table}` {', '.join(clauses)}, ALGORITHM=INPLACE")
+                    del self.dropped[table]
+                    self.logger.info(f"🔧 {table}: rebuilt {len(indexes)} indexes, "
+                                     f"{len(foreign_keys)} foreign keys")
+                except Exception as e:
+                    self.logger.error(f"❌ Rebuilding indexes on {table} failed: {e}")
+                    success = False
+        finally:
+            if fk_checks_disabled:
+                self.cursor.execute("SET foreign_key_checks = @bulk_load_fk_checks")
+
+        return success
+
+    def verify_schema(self) -> bool:
+        """So sánh schema hiện tại với snapshot trước khi drop."""
+        if self.captured is None:
+            return True
+
+        current = self.capture_schema()
+        if current == self.captured:
+            self.logger.info("✅ Index schema identical to pre-load snapshot")
+            return True
+
+        for table in sorted(set(self.captured) | set(current)):
+            before = self.captured.get(table, {})
+            after = current.get(table, {})
+            for kind in ('indexes', 'foreign_keys'):
+                missing = set(before.get(kind, {})) - set(after.get(kind, {}))
+                extra = set(after.get(kind, {})) - set(before.get(kind, {}))
+                changed = [name for name in set(before.get(kind, {})) & set(after.get(kind, {}))
+                           if before[kind][name] != after[kind][name]]
+                if missing or extra or changed:
+                    self.logger.error(f"❌ {table} {kind} mismatch - missing: {sorted(missing)}, "
+                                      f"extra: {sorted(extra)}, changed: {sorted(changed)}")
+        return False
@@ -9,10 +9,12 @@ Ngày tạo: 2025-01-11
 import mysql.connector
 import logging
 from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import sys
 import os
 
+from shipping_fee_engine import get_row_fee_engine
+
 # Cấu hình logging
 def setup_logging(log_file_name):
     """Thiết lập logging với file riêng biệt"""
@@ -57,12 +59,20 @@ FRAGILE_MULTIPLIER = Decimal('1.3')   # Hệ số hàng dễ vỡ
 NORMAL_MULTIPLIER = Decimal('1.0')    # Hệ số hàng bình thường
 VOLUME_TO_WEIGHT_FACTOR = Decimal('200')  # Volume (m³) × 200 = kg
 
+PRICING_CONSTANTS = {
+    'BASE_PRICE_PER_KG': BASE_PRICE_PER_KG,
+    'FRAGILE_MULTIPLIER': FRAGILE_MULTIPLIER,
+    'NORMAL_MULTIPLIER': NORMAL_MULTIPLIER,
+    'VOLUME_TO_WEIGHT_FACTOR': VOLUME_TO_WEIGHT_FACTOR
+}
+
 class ShippingFeeCalculator:
     def __init__(self, test_mode=True):
         self.test_mode = test_mode
         self.connection = None
         self.cursor = None
         self.log_file = setup_logging("shipping_fee_calculation")
+        self.fee_engine = get_row_fee_engine(constants=PRICING_CONSTANTS, service_multipliers=SERVICE_TYPE_MULTIPLIERS)
         logging.info("=== BẮT ĐẦU TÍNH TOÁN PHÍ GIAO HÀNG ===")
         logging.info(f"Chế độ: {'TEST' if test_mode else 'PRODUCTION'}")
         
@@ -85,53 +95,13 @@ class ShippingFeeCalculator:
             self.connection.close()
         logging.info("Đã đóng kết nối database")
     
-    def calculate_shipping_weight(self, actual_weight, volume):
-        """Tính trọng lượng tính phí = MAX(trọng lượng thực tế, trọng lượng quy đổi)"""
-        actual_weight = Decimal(str(actual_weight)) if actual_weight else Decimal('0')
-        volume = Decimal(str(volume)) if volume else Decimal('0')
-        
-        # Trọng lượng quy đổi = Volume (m³) × 200
-        volume_weight = volume * VOLUME_TO_WEIGHT_FACTOR
-        
-        shipping_weight = max(actual_weight, volume_weight)
-        return shipping_weight
-    
-    def calculate_base_fee(self, shipping_weight):
-        """Tính phí cơ bản = Trọng lượng tính phí × 15,000 VNĐ/kg"""
-        return shipping_weight * BASE_PRICE_PER_KG
-    
-    def get_fragile_multiplier(self, is_fragile):
-        """Lấy hệ số rủi ro dựa trên is_fragile"""
-        return FRAGILE_MULTIPLIER if is_fragile else NORMAL_MULTIPLIER
-    
-    def get_service_type_multiplier(self, service_type):
-        """Lấy hệ số service type"""
-        return SERVICE_TYPE_MULTIPLIERS.get(service_type, Decimal('1.0'))
-    
     def calculate_shipping_fee(self, weight, volume, is_fragile, service_type):
         """
         Tính phí logistics cho một order_item
         TỔNG PHÍ LOGISTICS = PHÍ CƠ BẢN × HỆ SỐ RỦI RO × HỆ SỐ SERVICE_TYPE
+        Trả về (total_fee, shipping_weight, base_fee), công thức nằm trong fee engine
         """
-        # 1. Tính trọng lượng tính phí
-        shipping_weight = self.calculate_shipping_weight(weight, volume)
-        
-        # 2. Tính phí cơ bản
-        base_fee = self.calculate_base_fee(shipping_weight)
-        
-        # 3. Áp dụng hệ số rủi ro
-        fragile_multiplier = self.get_fragile_multiplier(is_fragile)
-        
-        # 4. Áp dụng hệ số service type
-        service_multiplier = self.get_service_type_multiplier(service_type)
-        
-        # 5. Tính tổng phí
-        total_fee = base_fee * fragile_multiplier * service_multiplier
-        
-        # Làm tròn đến 2 chữ số thập phân
-        total_fee = total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        
-        return total_fee, shipping_weight, base_fee
+        return self.fee_engine.breakdown(weight, volume, is_fragile, service_type)
     
     def get_order_items_data(self):
         """Lấy dữ liệu order_items cần tính shipping_fee"""
@@ -173,7 +143,7 @@ class ShippingFeeCalculator:
         try:
             update_query = """
             UPDATE order_items 
-            SET shipping_fee = %s, updated_at = NOW()
+            SET shipping_fee = %s
             WHERE id = %s
             """
             self.cursor.execute(update_query, (shipping_fee, order_item_id))
@@ -216,7 +186,7 @@ class ShippingFeeCalculator:
         try:
             update_query = """
             UPDATE deliveries 
-            SET delivery_fee = %s, updated_at = NOW()
+            SET delivery_fee = %s
             WHERE id = %s
             """
             self.cursor.execute(update_query, (delivery_fee, delivery_id))
@@ -9,30 +9,65 @@ Version: Ultra-Stable 3.0
 import mysql.connector
 import logging
 from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import sys
 import os
-import json
 import time
+import multiprocessing
+import sqlite3
 from typing import List, Tuple, Optional, Dict, Any
 
 # Import ultra-conservative configuration
 from shipping_fee_config import (
-    get_database_config, SHIPPING_CONSTANTS, SERVICE_TYPE_MULTIPLIERS,
-    PROCESSING_CONFIG, LOGGING_CONFIG, VALIDATION_CONFIG, SECURITY_CONFIG
+    get_database_config, PROCESSING_CONFIG, LOGGING_CONFIG, VALIDATION_CONFIG, SECURITY_CONFIG
 )
+from shipping_fee_db import (
+    build_order_item_delivery_query, DeliveryFeeAccumulator, fee_changed, fetch_order_items_after,
+    iter_delivery_fee_totals, latest_fee_updates, make_fee_writer, ProductAttributeCache
+)
+from shipping_fee_engine import get_row_fee_engine
+from fee_memo import DEFAULT_PRICING_CONFIG, FeeMemo, pricing_config_hash
+from pricing_rules import resolve_pricing_config
+from fee_watermark import FeeWatermark, changed_deliveries_where, changed_order_items_where
+from fee_journal import FeeChangeJournal, JOURNAL_MODES, new_run_id
+from fee_throttle import AdaptiveThrottle
+from fee_connection import ConnectionManager
+from fee_checkpoint import CheckpointStore, SERIAL
+
+ORDER_ITEMS_QUERY = build_order_item_delivery_query()
+CHECKPOINT_JOB = 'ultra_stable'
+
+# Partial stats lưu cùng cursor: resume cộng tiếp thay vì đếm lại
+CHECKPOINT_STATS = ('order_items_processed', 'order_items_updated', 'order_items_unchanged',
+                    'order_items_errors', 'transactions_committed')
+
+def checkpoint_job(db_config: Dict[str, Any]) -> str:
+    """Checkpoint của test và production database không bao giờ lẫn nhau"""
+    return f"{CHECKPOINT_JOB}:{db_config['database']}"
 
 class UltraStableShippingCalculator:
     """
     Ultra-stable calculator with connection recovery and fault tolerance
     """
     
-    def __init__(self, is_test: bool = False):
+    def __init__(self, is_test: bool = False, shard: Optional[Dict[str, int]] = None,
+                 changed_since: Optional[datetime] = None, pricing_version: Optional[int] = None,
+                 run_id: Optional[str] = None):
         self.is_test = is_test
-        self.connection = None
-        self.cursor = None
+        # shard: {'index', 'start_after', 'end_id'} khi chạy như worker của parallel mode
+        self.shard = shard
+        # Incremental mode: chỉ order_items thay đổi từ watermark (None = toàn bộ)
+        self.changed_since = changed_since
+        self.watermark = FeeWatermark(PROCESSING_CONFIG['watermark_file'])
+        self.order_items_query = self._build_order_items_query()
         self.db_config = get_database_config(is_test)
         
+        # Checkpoint store (SQLite): cursor + partial stats theo shard, chung một file cho mọi workers
+        self.checkpoints = CheckpointStore()
+        self.checkpoint_job = checkpoint_job(self.db_config)
+        self.checkpoint_shard = shard['index'] if shard else SERIAL
+        self.checkpoint_run = None
+        
         # Add connection recovery settings
         self.db_config.update({
             'connect_timeout': 30,
@@ -43,16 +78,27 @@ class UltraStableShippingCalculator:
         })
         
         self.log_file, self.error_log_file = self._setup_logging()
-        self.last_connection_check = datetime.now()
-        self.records_since_check = 0
+        
+        # Delay giữa các chunks theo tải server (Threads_running, row lock waits, replica lag)
+        self.throttle = AdaptiveThrottle(PROCESSING_CONFIG, self.db_config)
+        
+        # Pooled connection, reconnect khi câu lệnh lỗi thay vì ping SELECT 1 định kỳ
+        self.db = ConnectionManager(self.db_config,
+                                    max_retries=PROCESSING_CONFIG['max_retries'],
+                                    retry_delay=PROCESSING_CONFIG['retry_delay'],
+                                    check_interval=PROCESSING_CONFIG['connection_check_interval'],
+                                    max_idle=PROCESSING_CONFIG['max_connection_idle'])
+        self.db.on_reconnect = self._on_reconnect
         
         # Statistics
         self.stats = {
             'order_items_processed': 0,
             'order_items_updated': 0,
             'order_items_errors': 0,
+            'order_items_unchanged': 0,
             'deliveries_processed': 0,
             'deliveries_updated': 0,
+            'deliveries_unchanged': 0,
             'deliveries_errors': 0,
             'transactions_committed': 0,
             'connection_recoveries': 0,
@@ -61,25 +107,79 @@ class UltraStableShippingCalculator:
             'last_processed_id': 0
         }
         
+        # Product attributes cache thay cho JOIN products trong mỗi batch
+        self.product_cache = ProductAttributeCache(PROCESSING_CONFIG['product_cache_refresh_seconds'])
+        
+        # BACKUP_MODE journal/file: chỉ ghi (id, old_fee, new_fee) của rows bị đổi, rollback theo run_id
+        self.run_id = run_id or new_run_id()
+        self.journal = (FeeChangeJournal(PROCESSING_CONFIG['backup_mode'], self.run_id,
+                                         shard_index=shard['index'] if shard else None)
+                        if PROCESSING_CONFIG['backup_mode'] in JOURNAL_MODES else None)
+        
+        # Write-back: staging temp table + UPDATE JOIN (2 round trips / chunk) hoặc executemany
+        self.item_writer = make_fee_writer(PROCESSING_CONFIG['fee_write_strategy'], 'order_items', 'shipping_fee',
+                                           journal=self.journal)
+        self.delivery_writer = make_fee_writer(PROCESSING_CONFIG['fee_write_strategy'], 'deliveries', 'delivery_fee',
+                                               journal=self.journal)
+        
+        # Tổng shipping_fee theo delivery cộng dồn trong item pass (thay cho aggregation scan);
+        # order đầu của shard có thể bắt đầu ở shard trước nên giữ lại cho process cha
+        self.delivery_totals = DeliveryFeeAccumulator(hold_first_order=bool(shard and shard['start_after']))
+        self.delivery_totals_complete = False
+        
+        # Pricing (PRICING_SOURCE): SHIPPING_CONSTANTS hoặc pricing_rules version, nạp lại sau khi connect
+        self.pricing_version = pricing_version
+        self.pricing_config = DEFAULT_PRICING_CONFIG
+        
+        # Fee engine (FEE_ENGINE): python | sql (batch -> python, xem get_row_fee_engine)
+        self.fee_engine = get_row_fee_engine()
+        
+        # Memo (product_id, service_type) -> fee
+        self.fee_memo = FeeMemo(self._calculate_shipping_fee, 'breakdown',
+                                persist_file=PROCESSING_CONFIG['fee_memo_file'] or None)
+        
         logging.info("🛡️  === ULTRA-STABLE SHIPPING FEE CALCULATOR v3.0 ===")
         logging.info(f"Mode: {'TEST' if is_test else 'PRODUCTION'}")
         logging.info(f"Ultra-conservative settings:")
         logging.info(f"  - Batch size: {PROCESSING_CONFIG['batch_size']}")
         logging.info(f"  - Chunk size: {PROCESSING_CONFIG['transaction_chunk_size']}")
-        logging.info(f"  - Connection check: every {PROCESSING_CONFIG['connection_check_interval']} records")
+        logging.info(f"  - Connection: pooled, reconnect on failure (no periodic pings)")
+        logging.info(f"  - Fee engine: {self.fee_engine.name}")
         
+    @property
+    def connection(self):
+        return self.db.connection
+    
+    @property
+    def cursor(self):
+        return self.db.cursor
+    
+    def _build_order_items_query(self) -> str:
+        """Query order_items theo shard range và/hoặc watermark"""
+        conditions = []
+        if self.shard:
+            conditions.append(f"oi.id <= {int(self.shard['end_id'])}")
+        if self.changed_since:
+            conditions.append(changed_order_items_where(self.changed_since))
+        if not conditions:
+            return ORDER_ITEMS_QUERY
+        return build_order_item_delivery_query(where=" AND ".join(conditions))
+    
     def _setup_logging(self):
         """Setup logging"""
         log_dir = "production_logs"
         os.makedirs(log_dir, exist_ok=True)
         
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        log_file = os.path.join(log_dir, f"ultra_stable_{timestamp}.log")
-        error_log_file = os.path.join(log_dir, f"ultra_stable_errors_{timestamp}.log")
+        suffix = f"_shard_{self.shard['index']}" if self.shard else ""
+        log_file = os.path.join(log_dir, f"ultra_stable_{timestamp}{suffix}.log")
+        error_log_file = os.path.join(log_dir, f"ultra_stable_errors_{timestamp}{suffix}.log")
         
+        log_format = (f"%(asctime)s - %(levelname)s - [shard {self.shard['index']}] %(message)s"
+                      if self.shard else '%(asctime)s - %(levelname)s - %(message)s')
         logging.basicConfig(
             level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
+            format=log_format,
             handlers=[
                 logging.FileHandler(log_file, encoding='utf-8'),
                 logging.StreamHandler(sys.stdout)
@@ -88,77 +188,14 @@ class UltraStableShippingCalculator:
         
         return log_file, error_log_file
     
-    def _check_connection_health(self) -> bool:
-        """Check if connection is still alive"""
-        try:
-            if not self.connection or not self.connection.is_connected():
-                return False
-            
-            # Ping test
-            self.cursor.execute("SELECT 1")
-            self.cursor.fetchone()
-            return True
-            
-        except Exception:
-            return False
+    def _on_reconnect(self):
+        """Connection mới sau lỗi: đếm recovery và giãn nhịp chunks"""
+        self.stats['connection_recoveries'] += 1
+        self.throttle.penalize()
     
     def _reconnect_database(self) -> bool:
-        """Reconnect to database with retry"""
-        logging.warning("🔄 Attempting database reconnection...")
-        
-        # Close existing connections
-        try:
-            if self.cursor:
-                self.cursor.close()
-            if self.connection:
-                self.connection.close()
-        except:
-            pass
-        
-        # Reconnect with retry
-        max_retries = PROCESSING_CONFIG['max_retries']
-        base_delay = PROCESSING_CONFIG['retry_delay']
-        
-        for attempt in range(max_retries):
-            try:
-                time.sleep(base_delay * (attempt + 1))  # Progressive delay
-                
-                self.connection = mysql.connector.connect(**self.db_config)
-                self.cursor = self.connection.cursor(dictionary=True, buffered=True)
-                
-                # Test connection
-                self.cursor.execute("SELECT 1")
-                self.cursor.fetchone()
-                
-                self.stats['connection_recoveries'] += 1
-                self.last_connection_check = datetime.now()
-                
-                logging.info(f"✅ Database reconnected successfully (attempt {attempt + 1})")
-                return True
-                
-            except mysql.connector.Error as e:
-                logging.error(f"❌ Reconnection attempt {attempt + 1} failed: {e}")
-                
-        logging.error("💥 All reconnection attempts failed!")
-        return False
-    
-    def _ensure_connection(self) -> bool:
-        """Ensure database connection is healthy"""
-        self.records_since_check += 1
-        
-        # Check connection periodically
-        if (self.records_since_check >= PROCESSING_CONFIG['connection_check_interval'] or
-            (datetime.now() - self.last_connection_check).total_seconds() > PROCESSING_CONFIG['max_connection_idle']):
-            
-            if not self._check_connection_health():
-                logging.warning("⚠️  Connection health check failed, reconnecting...")
-                if not self._reconnect_database():
-                    return False
-            
-            self.records_since_check = 0
-            self.last_connection_check = datetime.now()
-        
-        return True
+        """Reconnect to database with retry (connection mới từ pool)"""
+        return self.db.reconnect()
     
     def _connect_initial(self) -> bool:
         """Initial database connection"""
@@ -167,17 +204,12 @@ class UltraStableShippingCalculator:
         
         for attempt in range(max_retries):
             try:
-                self.connection = mysql.connector.connect(**self.db_config)
-                self.cursor = self.connection.cursor(dictionary=True, buffered=True)
-                
-                # Test connection
-                self.cursor.execute("SELECT 1")
-                self.cursor.fetchone()
-                
+                self.db.connect()
                 logging.info(f"✅ Initial database connection successful")
                 return True
                 
             except mysql.connector.Error as e:
+                self.db.discard()
                 delay = base_delay * (2 ** attempt)
                 logging.error(f"❌ Connection attempt {attempt + 1} failed: {e}")
                 
@@ -187,113 +219,47 @@ class UltraStableShippingCalculator:
                     
         return False
     
+    def _load_pricing(self) -> bool:
+        """Compile pricing rules (PRICING_SOURCE=table) và dựng lại engine/memo/watermark theo config đó"""
+        try:
+            self.pricing_version, self.pricing_config = resolve_pricing_config(self.cursor, self.pricing_version)
+            self.connection.rollback()
+        except (mysql.connector.Error, ValueError) as e:
+            logging.error(f"❌ Cannot load pricing rules: {e}")
+            return False
+        
+        if self.pricing_version is None:
+            return True
+        constants = self.pricing_config['constants']
+        service_multipliers = self.pricing_config['service_multipliers']
+        self.fee_engine = get_row_fee_engine(constants=constants, service_multipliers=service_multipliers)
+        self.fee_memo = FeeMemo(self._calculate_shipping_fee, 'breakdown', config=self.pricing_config,
+                                persist_file=PROCESSING_CONFIG['fee_memo_file'] or None)
+        self.watermark = FeeWatermark(PROCESSING_CONFIG['watermark_file'], config=self.pricing_config)
+        return True
+    
     def _calculate_shipping_fee(self, weight, volume, is_fragile, service_type):
-        """Calculate shipping fee with validation"""
+        """Calculate shipping fee with validation (công thức nằm trong fee engine)"""
         try:
-            # Convert to Decimal
-            actual_weight = Decimal(str(weight)) if weight else Decimal('0')
-            volume_val = Decimal(str(volume)) if volume else Decimal('0')
-            
-            # Calculate shipping weight
-            volume_weight = volume_val * SHIPPING_CONSTANTS['VOLUME_TO_WEIGHT_FACTOR']
-            shipping_weight = max(actual_weight, volume_weight)
-            
-            # Calculate base fee
-            base_fee = shipping_weight * SHIPPING_CONSTANTS['BASE_PRICE_PER_KG']
-            
-            # Apply multipliers
-            fragile_multiplier = (SHIPPING_CONSTANTS['FRAGILE_MULTIPLIER'] 
-                                if is_fragile else SHIPPING_CONSTANTS['NORMAL_MULTIPLIER'])
-            service_multiplier = SERVICE_TYPE_MULTIPLIERS.get(service_type, Decimal('1.0'))
-            
-            # Calculate total
-            total_fee = base_fee * fragile_multiplier * service_multiplier
-            total_fee = total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            
-            return total_fee, shipping_weight, base_fee
-            
+            return self.fee_engine.breakdown(weight, volume, is_fragile, service_type)
         except Exception as e:
             logging.error(f"❌ Calculation error: {e}")
             raise
     
     def _get_order_items_batch_safe(self, limit: int, last_id: int) -> List[Dict]:
-        """Get order items with connection recovery"""
-        query = """
-        SELECT 
-            oi.id as order_item_id,
-            oi.order_id,
-            oi.product_id,
-            oi.quantity,
-            oi.shipping_fee as current_shipping_fee,
-            p.weight,
-            p.volume,
-            p.is_fragile,
-            p.name as product_name,
-            d.service_type,
-            o.external_id as order_external_id
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        JOIN orders o ON oi.order_id = o.id  
-        JOIN deliveries d ON o.id = d.order_id
-        WHERE oi.id > %s
-        ORDER BY oi.id
-        LIMIT %s
-        """
-        
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Ensure connection is healthy
-                if not self._ensure_connection():
-                    return []
-                
-                self.cursor.execute(query, (last_id, limit))
-                results = self.cursor.fetchall()
-                return results
-                
-            except mysql.connector.Error as e:
-                logging.error(f"❌ Query attempt {attempt + 1} failed: {e}")
-                
-                if attempt < max_retries - 1:
-                    if not self._reconnect_database():
-                        return []
-                    time.sleep(1)
-                else:
-                    return []
+        """Get order items (mất connection trước write đầu tiên của chunk: đọc lại trên connection mới)"""
+        def fetch(cursor):
+            self.product_cache.maybe_refresh(cursor)
+            return self.product_cache.attach(fetch_order_items_after(cursor, last_id, limit, self.order_items_query))
         
-        return []
+        return self.db.execute(fetch)
     
     def _update_batch_safe(self, updates: List[Tuple]) -> int:
-        """Update batch with connection recovery"""
+        """Update batch (mất connection sau write đầu tiên: lỗi lên chunk, làm lại từ checkpoint)"""
         if not updates:
             return 0
         
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Ensure connection
-                if not self._ensure_connection():
-                    return 0
-                
-                update_query = """
-                UPDATE order_items 
-                SET shipping_fee = %s, updated_at = NOW()
-                WHERE id = %s
-                """
-                self.cursor.executemany(update_query, updates)
-                return len(updates)
-                
-            except mysql.connector.Error as e:
-                logging.error(f"❌ Update attempt {attempt + 1} failed: {e}")
-                
-                if attempt < max_retries - 1:
-                    if not self._reconnect_database():
-                        return 0
-                    time.sleep(1)
-                else:
-                    return 0
-        
-        return 0
+        return self.db.execute(lambda cursor: self.item_writer.write(cursor, updates), write=True)
     
     def _process_with_recovery(self) -> bool:
         """Process with full connection recovery"""
@@ -302,22 +268,32 @@ class UltraStableShippingCalculator:
         batch_size = PROCESSING_CONFIG['batch_size']
         chunk_size = PROCESSING_CONFIG['transaction_chunk_size']
         
-        total_processed = 0
-        total_updated = 0
-        total_errors = 0
+        # Resume: cộng tiếp partial stats của checkpoint
+        total_processed = self.stats['order_items_processed']
+        total_updated = self.stats['order_items_updated']
+        total_errors = self.stats['order_items_errors']
+        total_unchanged = self.stats['order_items_unchanged']
         last_id = self.stats['last_processed_id']  # Resume from last position
+        committed_last_id = last_id
+        completed = False
+        failed_attempts = 0
+        
+        # Delivery totals chỉ đầy đủ khi pass này thấy mọi order_item (không resume, không incremental)
+        self.delivery_totals_complete = (self.changed_since is None and
+                                         last_id == (self.shard['start_after'] if self.shard else 0))
+        if not self.delivery_totals_complete:
+            self.delivery_totals.discard()
         
         while True:
             try:
                 # Start transaction chunk
-                if not self._ensure_connection():
-                    logging.error("💥 Cannot establish connection")
-                    break
-                
-                self.connection.start_transaction()
+                self.db.begin()
                 chunk_start = datetime.now()
+                chunk_recoveries = self.stats['connection_recoveries']
                 chunk_processed = 0
                 chunk_updated = 0
+                chunk_unchanged = 0
+                chunk_errors = 0
                 
                 # Process in small batches within chunk
                 while chunk_processed < chunk_size:
@@ -329,14 +305,25 @@ class UltraStableShippingCalculator:
                     batch_updates = []
                     
                     for item in batch_items:
+                        if item['product_missing']:
+                            # Product không tồn tại (JOIN products trước đây loại bỏ row này)
+                            self.delivery_totals.add(item, item['current_shipping_fee'])
+                            continue
                         try:
                             # Calculate fee
-                            shipping_fee, weight, base_fee = self._calculate_shipping_fee(
-                                weight=item['weight'],
-                                volume=item['volume'],
-                                is_fragile=bool(item['is_fragile']),
-                                service_type=item['service_type']
+                            shipping_fee, weight, base_fee = self.fee_memo.lookup(
+                                item['product_id'],
+                                item['weight'],
+                                item['volume'],
+                                bool(item['is_fragile']),
+                                item['service_type']
                             )
+                            self.delivery_totals.add(item, shipping_fee)
+                            
+                            # Không ghi lại row có fee không đổi
+                            if not fee_changed(shipping_fee, item['current_shipping_fee']):
+                                chunk_unchanged += 1
+                                continue
                             
                             batch_updates.append((shipping_fee, item['order_item_id']))
                             
@@ -346,15 +333,17 @@ class UltraStableShippingCalculator:
                             
                         except Exception as e:
                             logging.error(f"❌ Error processing item {item['order_item_id']}: {e}")
-                            total_errors += 1
+                            self.delivery_totals.add(item, item['current_shipping_fee'])
+                            chunk_errors += 1
                     
                     # Update with recovery
                     if batch_updates:
                         updated_count = self._update_batch_safe(batch_updates)
                         chunk_updated += updated_count
                         
-                        if updated_count != len(batch_updates):
-                            logging.warning(f"⚠️  Partial update: {updated_count}/{len(batch_updates)}")
+                        expected = len(latest_fee_updates(batch_updates))
+                        if updated_count != expected:
+                            logging.warning(f"⚠️  Partial update: {updated_count}/{expected}")
                     
                     chunk_processed += len(batch_items)
                     last_id = batch_items[-1]['order_item_id']
@@ -367,37 +356,54 @@ class UltraStableShippingCalculator:
                 
                 # Commit chunk
                 if chunk_processed > 0:
-                    if not self._ensure_connection():
-                        logging.error("💥 Lost connection before commit")
-                        break
-                    
-                    self.connection.commit()
+                    self.db.commit()
                     self.stats['transactions_committed'] += 1
+                    committed_last_id = last_id
+                    failed_attempts = 0
+                    
+                    # Reconnect giữa chunk làm mất các batch trước đó của transaction:
+                    # totals không còn tin được, delivery fees sẽ dùng aggregation query
+                    if self.stats['connection_recoveries'] != chunk_recoveries:
+                        self.delivery_totals_complete = False
+                    self.delivery_totals.commit()
+                    self._flush_completed_deliveries()
                     
                     chunk_time = (datetime.now() - chunk_start).total_seconds()
                     logging.info(f"✅ Chunk committed: {chunk_processed:,} processed, "
                                f"{chunk_updated:,} updated in {chunk_time:.1f}s")
                     
-                    # Save progress checkpoint
-                    self._save_checkpoint()
-                
-                total_processed += chunk_processed
-                total_updated += chunk_updated
+                    total_processed += chunk_processed
+                    total_updated += chunk_updated
+                    total_unchanged += chunk_unchanged
+                    total_errors += chunk_errors
+                    
+                    # Save progress checkpoint (cursor + totals đã commit)
+                    self._save_checkpoint({'order_items_processed': total_processed,
+                                           'order_items_updated': total_updated,
+                                           'order_items_unchanged': total_unchanged,
+                                           'order_items_errors': total_errors})
                 
                 # Break if no more data
                 if chunk_processed == 0:
+                    completed = True
                     break
                     
-                # Brief pause between chunks to reduce server load
-                time.sleep(0.5)
+                # Pause giữa chunks theo tải server (0 khi server rảnh)
+                self.throttle.pause(self.connection)
                 
             except Exception as e:
                 logging.error(f"💥 Chunk processing error: {e}")
-                try:
-                    if self.connection:
-                        self.connection.rollback()
-                except:
-                    pass
+                self.db.rollback()
+                
+                # Chunk đã rollback: làm lại từ vị trí commit cuối cùng
+                self.delivery_totals.rollback()
+                last_id = committed_last_id
+                self.stats['last_processed_id'] = committed_last_id
+                
+                failed_attempts += 1
+                if failed_attempts > PROCESSING_CONFIG['max_retries']:
+                    logging.error("💥 Chunk keeps failing, stopping")
+                    break
                 
                 # Try to recover and continue
                 if self._reconnect_database():
@@ -411,107 +417,343 @@ class UltraStableShippingCalculator:
         self.stats['order_items_processed'] = total_processed
         self.stats['order_items_updated'] = total_updated
         self.stats['order_items_errors'] = total_errors
+        self.stats['order_items_unchanged'] = total_unchanged
         
         logging.info(f"📊 Final shipping fee stats:")
         logging.info(f"   Processed: {total_processed:,}")
         logging.info(f"   Updated: {total_updated:,}")
+        logging.info(f"   Unchanged (write skipped): {total_unchanged:,}")
         logging.info(f"   Errors: {total_errors:,}")
         logging.info(f"   Recoveries: {self.stats['connection_recoveries']:,}")
+        self.fee_memo.log_summary()
+        self.product_cache.log_summary()
+        self.item_writer.log_summary()
+        self.throttle.log_summary()
+        self.db.log_summary()
+        self.fee_memo.save()
+        
+        if self.shard or self.changed_since:
+            # Shard / incremental run có thể không có row nào; phải scan hết mới tính là xong
+            return total_errors == 0 and completed
+        return total_errors == 0 and (total_updated > 0 or total_unchanged > 0)
+    
+    def _flush_completed_deliveries(self):
+        """Ghi delivery fees của orders đã scan xong ngay sau chunk (memory chỉ giữ orders ở biên)"""
+        if self.delivery_totals_complete and not self.delivery_totals.contiguous:
+            logging.warning("⚠️  Order items not contiguous by id, delivery fees will use aggregation query")
+            self.delivery_totals_complete = False
+        if not self.delivery_totals_complete:
+            self.delivery_totals.discard()
+            return
         
-        return total_errors == 0 and total_updated > 0
+        deliveries = self.delivery_totals.pop_completed()
+        if not deliveries:
+            return
+        try:
+            self.db.begin()
+            updates, unchanged = self._delivery_updates(deliveries)
+            if updates and self._update_deliveries_safe(updates) != len(updates):
+                raise RuntimeError("partial delivery fee update")
+            self.db.commit()
+        except Exception as e:
+            # Deliveries đã pop: để aggregation query tính lại toàn bộ
+            logging.warning(f"⚠️  Delivery fee flush failed ({e}), falling back to aggregation query")
+            self.db.rollback()
+            self.delivery_totals_complete = False
+            self.delivery_totals.discard()
+            return
+        self.stats['deliveries_processed'] += len(deliveries)
+        self.stats['deliveries_updated'] += len(updates)
+        self.stats['deliveries_unchanged'] += unchanged
     
-    def _save_checkpoint(self):
-        """Save progress checkpoint"""
-        checkpoint = {
+    def _process_with_sql_pushdown(self) -> bool:
+        """
+        Set-based mode: một UPDATE ... JOIN cho mỗi id range, tính phí ngay trong MySQL.
+        Incremental: cùng điều kiện watermark như batch query; shard worker: chỉ range của shard.
+        """
+        logging.info(f"🔄 Starting set-based (SQL pushdown) processing ({self._run_mode_description()})...")
+        
+        engine = self.fee_engine
+        range_size = PROCESSING_CONFIG['sql_range_size']
+        where = changed_order_items_where(self.changed_since) if self.changed_since else None
+        
+        # Safety: biểu thức SQL phải khớp Python engine trước khi ghi gì
+        mismatches = engine.verify_sample(self.cursor, limit=PROCESSING_CONFIG['batch_size'] * 10,
+                                          start_after=self.stats['last_processed_id'])
+        self.connection.rollback()
+        if mismatches:
+            logging.error(f"💥 SQL fee expression differs from Python engine: {mismatches[:5]}")
+            return False
+        
+        if self.shard:
+            max_id = self.shard['end_id']
+        else:
+            self.cursor.execute("SELECT MAX(id) AS max_id FROM order_items")
+            max_id = self.cursor.fetchone()['max_id'] or 0
+            self.connection.rollback()
+        
+        last_id = self.stats['last_processed_id']
+        total_updated = self.stats['order_items_updated']
+        failed_attempts = 0
+        
+        while last_id < max_id:
+            end_id = min(last_id + range_size, max_id)
+            try:
+                self.db.begin()
+                range_start = datetime.now()
+                updated = self.db.execute(
+                    lambda cursor: engine.update_range(cursor, last_id, end_id, journal=self.journal, where=where),
+                    write=True)
+                self.db.commit()
+                
+                range_time = (datetime.now() - range_start).total_seconds()
+                logging.info(f"✅ Range ({last_id:,}, {end_id:,}]: "
+                             f"{updated:,} rows changed in {range_time:.2f}s")
+                
+                self.stats['transactions_committed'] += 1
+                total_updated += updated
+                last_id = end_id
+                failed_attempts = 0
+                self.stats['last_processed_id'] = last_id
+                self.stats['order_items_updated'] = total_updated
+                self._save_checkpoint()
+                self.throttle.pause(self.connection)
+                
+            except Exception as e:
+                logging.error(f"💥 Range update error: {e}")
+                self.db.rollback()
+                
+                failed_attempts += 1
+                if failed_attempts > PROCESSING_CONFIG['max_retries'] or not self._reconnect_database():
+                    logging.error("💥 Cannot recover, stopping")
+                    return False
+                logging.info("🔄 Recovered, retrying range...")
+        
+        # UPDATE rowcount chỉ đếm rows thực sự thay đổi giá trị
+        self.stats['order_items_processed'] = total_updated
+        
+        logging.info(f"📊 Final shipping fee stats (set-based):")
+        logging.info(f"   Rows changed: {total_updated:,}")
+        logging.info(f"   Ranges committed: {self.stats['transactions_committed']:,}")
+        
+        return True
+    
+    def _process_shard_range(self) -> bool:
+        """Toàn bộ order_items (serial) hoặc range của shard: set-based nếu engine hỗ trợ pushdown"""
+        if self.fee_engine.supports_pushdown:
+            return self._process_with_sql_pushdown()
+        return self._process_with_recovery()
+    
+    def _plan_shards(self, shard_count: int) -> List[Dict[str, int]]:
+        """Chia (last_processed_id, MAX(id)] thành shard_count id ranges; dùng lại plan của run đang resume"""
+        shards = self.checkpoint_run['shard_plan'] if self.checkpoint_run else None
+        if shards and len(shards) == shard_count:
+            logging.info(f"📋 Resuming parallel run with saved shard plan ({shard_count} shards)")
+            return shards
+        
+        self.cursor.execute("SELECT MAX(id) AS max_id FROM order_items")
+        max_id = self.cursor.fetchone()['max_id'] or 0
+        self.connection.rollback()
+        
+        start = self.stats['last_processed_id']
+        bounds = [start + (max_id - start) * i // shard_count for i in range(shard_count + 1)]
+        shards = [{'index': i, 'start_after': bounds[i], 'end_id': bounds[i + 1]}
+                  for i in range(shard_count) if bounds[i + 1] > bounds[i]]
+        
+        self.checkpoints.save_plan(self.checkpoint_job, shards)
+        return shards
+    
+    def _process_parallel(self) -> bool:
+        """Parallel mode: mỗi id range một worker process với connection/checkpoint/retry riêng"""
+        shards = self._plan_shards(PROCESSING_CONFIG['parallel_shards'])
+        if not shards:
+            logging.info("ℹ️  No order_items to process")
+            return True
+        
+        workers = max(1, min(len(shards), PROCESSING_CONFIG['max_workers']))
+        logging.info(f"🔀 Starting parallel processing: {len(shards)} shards, {workers} worker processes")
+        for shard in shards:
+            logging.info(f"   Shard {shard['index']}: ids ({shard['start_after']:,}, {shard['end_id']:,}]")
+        
+        # spawn: worker không kế thừa connection (socket) của process cha
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes=workers) as pool:
+            # Shards dùng đúng pricing version của run cha (không đổi giữa chừng nếu có version mới)
+            results = pool.map(_run_shard_worker,
+                               [(self.is_test, shard, self.changed_since, self.pricing_version, self.run_id)
+                                for shard in shards],
+                               chunksize=1)
+        
+        # Merge stats của các shards
+        for result in results:
+            for key in ('order_items_processed', 'order_items_updated', 'order_items_errors',
+                        'order_items_unchanged', 'transactions_committed', 'connection_recoveries',
+                        'deliveries_processed', 'deliveries_updated', 'deliveries_unchanged'):
+                self.stats[key] += result['stats'][key]
+            for key in ('hits', 'misses', 'invalidations'):
+                self.fee_memo.stats[key] += result['fee_memo'][key]
+        self.stats['shards'] = results
+        
+        for result in results:
+            self.delivery_totals.merge(result.pop('delivery_totals'))
+        self.delivery_totals_complete = (shards[0]['start_after'] == 0 and
+                                         all(result['delivery_totals_complete'] for result in results))
+        
+        failed = [result['shard']['index'] for result in results if not result['success']]
+        
+        logging.info(f"📊 Final shipping fee stats ({len(shards)} shards):")
+        logging.info(f"   Processed: {self.stats['order_items_processed']:,}")
+        logging.info(f"   Updated: {self.stats['order_items_updated']:,}")
+        logging.info(f"   Unchanged (write skipped): {self.stats['order_items_unchanged']:,}")
+        logging.info(f"   Errors: {self.stats['order_items_errors']:,}")
+        logging.info(f"   Recoveries: {self.stats['connection_recoveries']:,}")
+        self.fee_memo.log_summary()
+        
+        if failed:
+            logging.error(f"💥 Shards failed: {failed} (checkpoints kept, rerun to resume)")
+            return False
+        return True
+    
+    def run_shard(self) -> Dict[str, Any]:
+        """Entry point của worker process: xử lý một id range, trả về stats (picklable)"""
+        success = False
+        try:
+            self.stats['last_processed_id'] = self._load_checkpoint()
+            if (self._connect_initial() and self._load_pricing()
+                    and (self.journal is None or self._prepare_journal())):
+                success = self._process_shard_range()
+        except Exception as e:
+            logging.error(f"💥 Shard {self.shard['index']} failed: {e}")
+        finally:
+            if self.journal:
+                self.journal.close()
+            self.throttle.close()
+            self.checkpoints.close()
+            self.db.close()
+        
+        return {
+            'shard': self.shard,
+            'success': success,
             'last_processed_id': self.stats['last_processed_id'],
-            'timestamp': datetime.now().isoformat(),
-            'processed': self.stats['order_items_processed'],
-            'updated': self.stats['order_items_updated']
+            'stats': {key: self.stats[key] for key in (
+                'order_items_processed', 'order_items_updated', 'order_items_errors',
+                'order_items_unchanged', 'transactions_committed', 'connection_recoveries',
+                'deliveries_processed', 'deliveries_updated', 'deliveries_unchanged')},
+            'fee_memo': self.fee_memo.summary(),
+            'write_back': self.item_writer.summary(),
+            'journal': self.journal.summary() if self.journal else None,
+            'throttle': self.throttle.summary(),
+            'connection': self.db.summary(),
+            # Chỉ deliveries của orders ở biên shard; phần còn lại worker đã ghi
+            'delivery_totals': self.delivery_totals.totals,
+            'delivery_totals_complete': success and self.delivery_totals_complete
         }
-        
-        with open('shipping_fee_checkpoint.json', 'w') as f:
-            json.dump(checkpoint, f, indent=2)
+    
+    def _save_checkpoint(self, totals: Optional[Dict[str, int]] = None):
+        """Save progress checkpoint: cursor + partial stats trong một SQLite transaction"""
+        stats = {key: self.stats[key] for key in CHECKPOINT_STATS}
+        stats.update(totals or {})
+        self.checkpoints.save_cursor(self.checkpoint_job, self.checkpoint_shard,
+                                     self.shard['start_after'] if self.shard else 0,
+                                     self.shard['end_id'] if self.shard else None,
+                                     self.stats['last_processed_id'], stats)
     
     def _load_checkpoint(self) -> int:
-        """Load last checkpoint"""
+        """Load cursor + partial stats của run đang resume"""
+        start_after = self.shard['start_after'] if self.shard else 0
         try:
-            if os.path.exists('shipping_fee_checkpoint.json'):
-                with open('shipping_fee_checkpoint.json', 'r') as f:
-                    checkpoint = json.load(f)
-                    last_id = checkpoint.get('last_processed_id', 0)
-                    logging.info(f"📋 Resuming from checkpoint: last_id = {last_id}")
-                    return last_id
-        except Exception as e:
+            checkpoint = self.checkpoints.load_cursor(self.checkpoint_job, self.checkpoint_shard, start_after,
+                                                      self.shard['end_id'] if self.shard else None)
+        except sqlite3.Error as e:
             logging.warning(f"⚠️  Cannot load checkpoint: {e}")
+            return start_after
         
-        return 0
+        if not checkpoint:
+            return start_after
+        for key in CHECKPOINT_STATS:
+            self.stats[key] = checkpoint['stats'].get(key, 0)
+        logging.info(f"📋 Resuming from checkpoint: last_id = {checkpoint['last_id']} "
+                     f"({self.stats['order_items_processed']:,} items already processed)")
+        return checkpoint['last_id']
+    
+    def _begin_checkpointed_run(self):
+        """Resume run đang dở (cùng pricing config và incremental window) hoặc bắt đầu run mới"""
+        config_hash = pricing_config_hash(self.pricing_config)
+        changed_since = self.changed_since.isoformat() if self.changed_since else None
+        self.checkpoint_run = self.checkpoints.resume(self.checkpoint_job, config_hash, changed_since)
+        if self.checkpoint_run:
+            # Cùng run_id: journal/rollback phủ cả phần đã chạy trước khi resume
+            self.run_id = self.checkpoint_run['run_id']
+            if self.journal:
+                self.journal.resume(self.run_id)
+            logging.info(f"📋 Resuming run {self.run_id} (started {self.checkpoint_run['started_at']})")
+        else:
+            self.checkpoints.start(self.checkpoint_job, self.run_id, config_hash, changed_since,
+                                   self.pricing_version)
+        self.stats['last_processed_id'] = self._load_checkpoint()
+    
+    def _delivery_fee_batches(self, start_after: int):
+        """Delivery totals theo batch (id > start_after): từ single-pass totals hoặc keyset stream"""
+        batch_size = PROCESSING_CONFIG['transaction_chunk_size']
+        if self.delivery_totals_complete:
+            deliveries = [d for d in self.delivery_totals.deliveries() if d['delivery_id'] > start_after]
+            for offset in range(0, len(deliveries), batch_size):
+                yield deliveries[offset:offset + batch_size]
+        else:
+            where = changed_deliveries_where(self.changed_since) if self.changed_since else None
+            yield from iter_delivery_fee_totals(self.connection, batch_size, start_after, where)
     
     def _process_delivery_fees_safe(self) -> bool:
-        """Process delivery fees with connection recovery"""
+        """Process delivery fees with connection recovery (bounded batches, commit mỗi batch)"""
         logging.info("🚚 Processing delivery fees with recovery...")
+        if self.delivery_totals_complete:
+            # Single pass: deliveries đã ghi trong item pass, chỉ còn orders ở biên chunk/shard
+            logging.info(f"🧮 Using single-pass delivery totals ({self.stats['deliveries_processed']:,} flushed, "
+                         f"{len(self.delivery_totals):,} remaining)")
+            processed = self.stats['deliveries_processed']
+            updated = self.stats['deliveries_updated']
+            unchanged = self.stats['deliveries_unchanged']
+        else:
+            # Aggregation query tính lại mọi delivery (kể cả phần đã flush)
+            processed = updated = unchanged = 0
         
-        query = """
-        SELECT 
-            d.id as delivery_id,
-            d.order_id,
-            d.delivery_fee as current_delivery_fee,
-            SUM(oi.shipping_fee) as total_shipping_fee,
-            COUNT(oi.id) as item_count
-        FROM deliveries d
-        JOIN orders o ON d.order_id = o.id
-        JOIN order_items oi ON o.id = oi.order_id
-        WHERE oi.shipping_fee IS NOT NULL
-        GROUP BY d.id, d.order_id, d.delivery_fee
-        ORDER BY d.id
-        """
+        last_delivery_id = 0
         
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                if not self._ensure_connection():
-                    return False
+                # Resume sau delivery_id đã commit cuối cùng nếu đây là lần retry
+                for deliveries in self._delivery_fee_batches(last_delivery_id):
+                    delivery_updates, batch_unchanged = self._delivery_updates(deliveries)
+                    
+                    # Update with recovery
+                    if delivery_updates:
+                        updated_count = self._update_deliveries_safe(delivery_updates)
+                        if updated_count != len(delivery_updates):
+                            self.db.rollback()
+                            return False
+                        updated += updated_count
+                    
+                    self.db.commit()
+                    processed += len(deliveries)
+                    unchanged += batch_unchanged
+                    last_delivery_id = deliveries[-1]['delivery_id']
                 
-                self.connection.start_transaction()
-                self.cursor.execute(query)
-                deliveries = self.cursor.fetchall()
+                self.stats['deliveries_processed'] = processed
+                self.stats['deliveries_updated'] = updated
+                self.stats['deliveries_unchanged'] = unchanged
                 
-                if not deliveries:
+                if not processed:
                     logging.info("ℹ️  No deliveries to process")
                     return True
                 
-                # Process deliveries
-                delivery_updates = []
-                for delivery in deliveries:
-                    try:
-                        delivery_fee = Decimal(str(delivery['total_shipping_fee']))
-                        delivery_updates.append((delivery_fee, delivery['delivery_id']))
-                    except Exception as e:
-                        logging.error(f"❌ Error processing delivery {delivery['delivery_id']}: {e}")
-                
-                # Update with recovery
-                if delivery_updates:
-                    updated_count = self._update_deliveries_safe(delivery_updates)
-                    
-                    if updated_count > 0:
-                        self.connection.commit()
-                        self.stats['deliveries_processed'] = len(deliveries)
-                        self.stats['deliveries_updated'] = updated_count
-                        
-                        logging.info(f"✅ Delivery fees updated: {updated_count:,}/{len(deliveries):,}")
-                        return True
-                    else:
-                        self.connection.rollback()
-                        return False
-                
+                logging.info(f"✅ Delivery fees updated: {updated:,}/{processed:,} ({unchanged:,} unchanged)")
+                self.delivery_writer.log_summary()
                 return True
                 
             except mysql.connector.Error as e:
                 logging.error(f"❌ Delivery processing attempt {attempt + 1} failed: {e}")
-                try:
-                    if self.connection:
-                        self.connection.rollback()
-                except:
-                    pass
+                self.db.rollback()
                 
                 if attempt < max_retries - 1:
                     if not self._reconnect_database():
@@ -522,45 +764,49 @@ class UltraStableShippingCalculator:
         
         return False
     
-    def _update_deliveries_safe(self, updates: List[Tuple]) -> int:
-        """Update deliveries with recovery"""
-        max_retries = 3
-        for attempt in range(max_retries):
+    def _delivery_updates(self, deliveries: List[Dict]) -> Tuple[List[Tuple], int]:
+        """(fee, delivery_id) cần ghi và số deliveries có fee không đổi"""
+        updates = []
+        unchanged = 0
+        for delivery in deliveries:
             try:
-                if not self._ensure_connection():
-                    return 0
-                
-                update_query = """
-                UPDATE deliveries 
-                SET delivery_fee = %s, updated_at = NOW()
-                WHERE id = %s
-                """
-                self.cursor.executemany(update_query, updates)
-                return len(updates)
-                
-            except mysql.connector.Error as e:
-                logging.error(f"❌ Delivery update attempt {attempt + 1} failed: {e}")
-                
-                if attempt < max_retries - 1:
-                    if not self._reconnect_database():
-                        return 0
-                    time.sleep(1)
-                else:
-                    return 0
-        
-        return 0
+                delivery_fee = Decimal(str(delivery['total_shipping_fee']))
+                if not fee_changed(delivery_fee, delivery['current_delivery_fee']):
+                    unchanged += 1
+                    continue
+                updates.append((delivery_fee, delivery['delivery_id']))
+            except Exception as e:
+                logging.error(f"❌ Error processing delivery {delivery['delivery_id']}: {e}")
+        return updates, unchanged
+    
+    def _update_deliveries_safe(self, updates: List[Tuple]) -> int:
+        """Update deliveries (write đầu tiên của transaction: mất connection thì ghi lại trên connection mới)"""
+        return self.db.execute(lambda cursor: self.delivery_writer.write(cursor, updates), write=True)
+    
+    def _prepare_journal(self) -> bool:
+        """Tạo bảng fee_change_journal / mở file journal (trước transaction đầu tiên vì DDL tự commit)"""
+        try:
+            self.journal.prepare(self.cursor)
+            self.connection.commit()
+            return True
+        except (mysql.connector.Error, OSError) as e:
+            logging.error(f"❌ Fee change journal setup failed: {e}")
+            return False
     
     def _create_backup_safe(self) -> bool:
-        """Create backup with recovery"""
-        if not PROCESSING_CONFIG['enable_backup']:
+        """Create backup with recovery (BACKUP_MODE: full | journal | file | none)"""
+        backup_mode = PROCESSING_CONFIG['backup_mode']
+        if backup_mode == 'none':
+            return True
+        if backup_mode in JOURNAL_MODES:
+            if not self._prepare_journal():
+                return False
+            logging.info(f"✅ Changed-rows journal enabled, rollback: python3 fee_journal.py rollback {self.run_id}")
             return True
         
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                if not self._ensure_connection():
-                    return False
-                
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
                 
                 # Backup queries
@@ -591,21 +837,37 @@ class UltraStableShippingCalculator:
     def run(self) -> bool:
         """Run ultra-stable calculation"""
         try:
-            # Load checkpoint if exists
-            self.stats['last_processed_id'] = self._load_checkpoint()
-            
             # Connect
             if not self._connect_initial():
                 logging.error("💥 Cannot establish initial connection")
                 return False
             
+            # Pricing rules (compile một lần lúc startup)
+            if not self._load_pricing():
+                logging.error("💥 Pricing rules unavailable, aborting")
+                return False
+            
+            # Incremental mode: quyết định full/incremental, ghi nhận thời điểm bắt đầu run
+            if PROCESSING_CONFIG['incremental']:
+                self.changed_since = self.watermark.changed_since(PROCESSING_CONFIG['full_rebuild'])
+                self.watermark.begin_run(self.cursor)
+                self.connection.rollback()
+                self.order_items_query = self._build_order_items_query()
+            
+            # Checkpoint: resume run đang dở hoặc bắt đầu run mới (cần pricing config + changed_since)
+            self._begin_checkpointed_run()
+            
             # Create backup
             if not self._create_backup_safe():
                 logging.error("💥 Backup failed, aborting for safety")
                 return False
             
-            # Process shipping fees
-            if not self._process_with_recovery():
+            # Process shipping fees (parallel: mỗi shard worker tự chọn pushdown hoặc batch)
+            if PROCESSING_CONFIG['parallel_shards'] > 1:
+                processed = self._process_parallel()
+            else:
+                processed = self._process_shard_range()
+            if not processed:
                 logging.error("💥 Shipping fee processing failed")
                 return False
             
@@ -614,11 +876,15 @@ class UltraStableShippingCalculator:
                 logging.error("💥 Delivery fee processing failed")
                 return False
             
-            # Clean up checkpoint
-            try:
-                os.remove('shipping_fee_checkpoint.json')
-            except:
-                pass
+            # Advance watermark (chỉ sau khi cả shipping và delivery fees thành công)
+            if PROCESSING_CONFIG['incremental']:
+                self.watermark.commit_run()
+            
+            # Run xong: checkpoint giữ lại để tra cứu, run sau bắt đầu mới
+            self.checkpoints.complete(self.checkpoint_job)
+            
+            if self.journal:
+                self.journal.log_summary()
             
             # Generate final report
             self._generate_final_report()
@@ -630,13 +896,11 @@ class UltraStableShippingCalculator:
             logging.error(f"💥 Critical system error: {e}")
             return False
         finally:
-            try:
-                if self.cursor:
-                    self.cursor.close()
-                if self.connection:
-                    self.connection.close()
-            except:
-                pass
+            if self.journal:
+                self.journal.close()
+            self.throttle.close()
+            self.checkpoints.close()
+            self.db.close()
     
     def _generate_final_report(self):
         """Generate comprehensive final report"""
@@ -650,21 +914,33 @@ class UltraStableShippingCalculator:
 - **End:** {self.stats['end_time'].strftime('%Y-%m-%d %H:%M:%S')}
 - **Duration:** {execution_time.total_seconds():.1f} seconds
 - **Mode:** {'TEST' if self.is_test else 'PRODUCTION'}
+- **Fee Engine:** {self.fee_engine.name}
+- **Pricing:** {f"pricing_rules version {self.pricing_version}" if self.pricing_version else 'SHIPPING_CONSTANTS'}
+- **Run Mode:** {self._run_mode_description()}
+- **Checkpoint:** {f"resumed run {self.run_id}" if self.checkpoint_run else f"new run {self.run_id}"} ({self.checkpoints.path})
+- **Backup:** {self._backup_description()}
+- **Parallel Shards:** {len(self.stats.get('shards', [])) or 'serial'}
 
 ## Results
 - **Order Items Processed:** {self.stats['order_items_processed']:,}
 - **Order Items Updated:** {self.stats['order_items_updated']:,}
+- **Order Items Unchanged (write skipped):** {self.stats['order_items_unchanged']:,}
 - **Deliveries Updated:** {self.stats['deliveries_updated']:,}
+- **Deliveries Unchanged (write skipped):** {self.stats['deliveries_unchanged']:,}
+- **Delivery Totals:** {'single pass (accumulated during item pass)' if self.delivery_totals_complete else 'aggregation query'}
 - **Transactions Committed:** {self.stats['transactions_committed']:,}
 - **Connection Recoveries:** {self.stats['connection_recoveries']:,}
+- **Throttle:** {self._throttle_description()}
+- **Connection Checks:** {self._connection_description()}
 - **Errors:** {self.stats['order_items_errors']:,}
+- **Fee Memo Hit Rate:** {self.fee_memo.hit_rate():.2%} ({len(self.fee_memo.entries):,} entries, {self.fee_memo.stats['invalidations']:,} invalidations)
 
 ## Performance
 - **Records/Second:** {self.stats['order_items_processed'] / max(execution_time.total_seconds(), 1):.2f}
-- **Success Rate:** {(self.stats['order_items_updated'] / max(self.stats['order_items_processed'], 1) * 100):.2f}%
+- **Success Rate:** {((self.stats['order_items_updated'] + self.stats['order_items_unchanged']) / max(self.stats['order_items_processed'], 1) * 100):.2f}%
 
-## Reliability Features Used
-- ✅ Connection health monitoring
+{self._shard_report_section()}## Reliability Features Used
+- ✅ Failure-driven reconnection (pooled, no periodic pings)
 - ✅ Automatic reconnection
 - ✅ Progress checkpoints
 - ✅ Transaction chunking
@@ -683,6 +959,57 @@ class UltraStableShippingCalculator:
         
         logging.info(f"📄 Final report saved: {report_file}")
 
+    def _backup_description(self) -> str:
+        if not self.journal:
+            return PROCESSING_CONFIG['backup_mode']
+        entries = self.journal.stats['entries'] + sum(
+            result['journal']['entries'] for result in self.stats.get('shards', []) if result.get('journal'))
+        return (f"{self.journal.mode} journal, run {self.run_id} ({entries:,} changed rows; "
+                f"rollback: `python3 fee_journal.py rollback {self.run_id}`)")
+    
+    def _throttle_description(self) -> str:
+        summaries = [self.throttle.summary()] + [result['throttle'] for result in self.stats.get('shards', [])]
+        samples = sum(summary['samples'] for summary in summaries)
+        overloaded = sum(summary['overloaded_samples'] for summary in summaries)
+        slept = sum(summary['slept_seconds'] for summary in summaries)
+        max_delay = max(summary['max_delay'] for summary in summaries)
+        return (f"{overloaded:,}/{samples:,} samples over thresholds, slept {slept:.1f}s "
+                f"(max delay {max_delay:.2f}s)")
+    
+    def _connection_description(self) -> str:
+        summaries = [self.db.summary()] + [result['connection'] for result in self.stats.get('shards', [])]
+        pings = sum(summary['pings_avoided'] for summary in summaries)
+        seconds = sum(summary['ping_seconds_avoided'] for summary in summaries)
+        retried = sum(summary['retried_operations'] for summary in summaries)
+        return (f"{pings:,} periodic SELECT 1 pings avoided (~{seconds:.2f}s), "
+                f"{retried:,} operations retried on a fresh connection")
+    
+    def _run_mode_description(self) -> str:
+        if self.changed_since:
+            return f"incremental (changes since {self.changed_since.isoformat(sep=' ')})"
+        return "full rebuild" if PROCESSING_CONFIG['incremental'] else "full"
+    
+    def _shard_report_section(self) -> str:
+        """Bảng kết quả từng shard (parallel mode)"""
+        if not self.stats.get('shards'):
+            return ""
+        lines = ["## Shards",
+                 "| Shard | Id range | Processed | Updated | Unchanged | Errors | Recoveries | Status |",
+                 "|---|---|---|---|---|---|---|---|"]
+        for result in self.stats['shards']:
+            shard, stats = result['shard'], result['stats']
+            lines.append(f"| {shard['index']} | ({shard['start_after']:,}, {shard['end_id']:,}] "
+                         f"| {stats['order_items_processed']:,} | {stats['order_items_updated']:,} "
+                         f"| {stats['order_items_unchanged']:,} | {stats['order_items_errors']:,} | {stats['connection_recoveries']:,} "
+                         f"| {'✅' if result['success'] else '❌'} |")
+        return "\n".join(lines) + "\n\n"
+
+def _run_shard_worker(args: Tuple[bool, Dict[str, int], Optional[datetime], Optional[int], str]) -> Dict[str, Any]:
+    """Pool worker (module-level để picklable với spawn)"""
+    is_test, shard, changed_since, pricing_version, run_id = args
+    return UltraStableShippingCalculator(is_test=is_test, shard=shard, changed_since=changed_since,
+                                         pricing_version=pricing_version, run_id=run_id).run_shard()
+
 def main():
     """Main function"""
     print("🛡️  === ULTRA-STABLE SHIPPING FEE CALCULATOR ===")
@@ -694,16 +1021,13 @@ def main():
     print("   ✅ Transaction chunking")
     print()
     
-    # Check for existing checkpoint
-    if os.path.exists('shipping_fee_checkpoint.json'):
-        print("📋 Found existing checkpoint - can resume from last position")
-        resume = input("Resume from checkpoint? (y/n): ").strip().lower()
-        if resume != 'y':
-            try:
-                os.remove('shipping_fee_checkpoint.json')
-                print("🗑️  Checkpoint cleared, starting fresh")
-            except:
-                pass
+    # --incremental / --full-rebuild (tương đương INCREMENTAL=true / FULL_REBUILD=true)
+    if '--incremental' in sys.argv:
+        PROCESSING_CONFIG['incremental'] = True
+    if '--full-rebuild' in sys.argv:
+        PROCESSING_CONFIG['full_rebuild'] = True
+    if PROCESSING_CONFIG['incremental']:
+        print(f"⏩ Incremental mode ({'full rebuild' if PROCESSING_CONFIG['full_rebuild'] else 'since last watermark'})")
     
     print("Choose mode:")
     print("1. Test mode (fastroute_test)")
@@ -726,6 +1050,18 @@ def main():
         print("❌ Invalid choice")
         return
     
+    # Check for unfinished run
+    checkpoints = CheckpointStore()
+    job = checkpoint_job(get_database_config(is_test))
+    unfinished = checkpoints.active_run(job)
+    if unfinished:
+        print(f"📋 Found unfinished run {unfinished['run_id']} - can resume from last position")
+        resume = input("Resume from checkpoint? (y/n): ").strip().lower()
+        if resume != 'y':
+            checkpoints.discard(job)
+            print("🗑️  Checkpoint cleared, starting fresh")
+    checkpoints.close()
+    
     print("\n🔄 Starting ultra-stable processing...")
     
     calculator = UltraStableShippingCalculator(is_test=is_test)
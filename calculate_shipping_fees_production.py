@@ -10,11 +10,18 @@ Phiên bản: Production 1.0
 import mysql.connector
 import logging
 from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import sys
 import os
 import json
 
+from shipping_fee_db import (
+    build_order_item_delivery_query, fee_changed, fetch_delivery_fee_totals_after, fetch_order_items_after,
+    iter_keyset_batches, latest_fee_updates, make_fee_writer, ProductAttributeCache
+)
+from shipping_fee_engine import get_row_fee_engine
+from fee_memo import FeeMemo
+
 # Cấu hình logging
 def setup_logging():
     """Thiết lập logging với file riêng biệt cho production"""
@@ -71,6 +78,18 @@ FRAGILE_MULTIPLIER = Decimal('1.3')   # Hệ số hàng dễ vỡ
 NORMAL_MULTIPLIER = Decimal('1.0')    # Hệ số hàng bình thường
 VOLUME_TO_WEIGHT_FACTOR = Decimal('200')  # Volume (m³) × 200 = kg
 
+PRICING_CONSTANTS = {
+    'BASE_PRICE_PER_KG': BASE_PRICE_PER_KG,
+    'FRAGILE_MULTIPLIER': FRAGILE_MULTIPLIER,
+    'NORMAL_MULTIPLIER': NORMAL_MULTIPLIER,
+    'VOLUME_TO_WEIGHT_FACTOR': VOLUME_TO_WEIGHT_FACTOR
+}
+
+# Ghi phí về DB: staging (temp table + UPDATE JOIN) hoặc executemany (từng row)
+FEE_WRITE_STRATEGY = os.getenv('FEE_WRITE_STRATEGY', 'staging').lower()
+
+ORDER_ITEMS_QUERY = build_order_item_delivery_query()
+
 class ProductionShippingFeeCalculator:
     def __init__(self):
         self.connection = None
@@ -80,13 +99,31 @@ class ProductionShippingFeeCalculator:
             'order_items_processed': 0,
             'order_items_updated': 0,
             'order_items_errors': 0,
+            'order_items_unchanged': 0,
             'deliveries_processed': 0,
             'deliveries_updated': 0,
+            'deliveries_unchanged': 0,
             'deliveries_errors': 0,
             'start_time': datetime.now(),
             'end_time': None
         }
         
+        # Cache thuộc tính products thay cho JOIN products trong mỗi batch
+        self.product_cache = ProductAttributeCache()
+        
+        # Writer cho shipping_fee / delivery_fee
+        self.item_writer = make_fee_writer(FEE_WRITE_STRATEGY, 'order_items', 'shipping_fee')
+        self.delivery_writer = make_fee_writer(FEE_WRITE_STRATEGY, 'deliveries', 'delivery_fee')
+        
+        # Fee engine (FEE_ENGINE) với hằng số tính toán của script này
+        self.fee_engine = get_row_fee_engine(constants=PRICING_CONSTANTS, service_multipliers=SERVICE_TYPE_MULTIPLIERS)
+        
+        # Memo (product_id, service_type) -> phí, invalidate khi hằng số tính toán thay đổi
+        self.fee_memo = FeeMemo(self.calculate_shipping_fee, 'breakdown', config={
+            'constants': PRICING_CONSTANTS,
+            'service_multipliers': SERVICE_TYPE_MULTIPLIERS
+        })
+        
         logging.info("=== BẮT ĐẦU PRODUCTION DEPLOYMENT - TÍNH TOÁN PHÍ GIAO HÀNG ===")
         logging.info(f"Database: {DB_CONFIG['database']}")
         logging.info(f"Log file: {self.log_file}")
@@ -141,83 +178,22 @@ class ProductionShippingFeeCalculator:
             logging.error(f"❌ Lỗi tạo backup table: {e}")
             return False
     
-    def calculate_shipping_weight(self, actual_weight, volume):
-        """Tính trọng lượng tính phí = MAX(trọng lượng thực tế, trọng lượng quy đổi)"""
-        actual_weight = Decimal(str(actual_weight)) if actual_weight else Decimal('0')
-        volume = Decimal(str(volume)) if volume else Decimal('0')
-        
-        # Trọng lượng quy đổi = Volume (m³) × 200
-        volume_weight = volume * VOLUME_TO_WEIGHT_FACTOR
-        
-        shipping_weight = max(actual_weight, volume_weight)
-        return shipping_weight
-    
-    def calculate_base_fee(self, shipping_weight):
-        """Tính phí cơ bản = Trọng lượng tính phí × 15,000 VNĐ/kg"""
-        return shipping_weight * BASE_PRICE_PER_KG
-    
-    def get_fragile_multiplier(self, is_fragile):
-        """Lấy hệ số rủi ro dựa trên is_fragile"""
-        return FRAGILE_MULTIPLIER if is_fragile else NORMAL_MULTIPLIER
-    
-    def get_service_type_multiplier(self, service_type):
-        """Lấy hệ số service type"""
-        return SERVICE_TYPE_MULTIPLIERS.get(service_type, Decimal('1.0'))
-    
     def calculate_shipping_fee(self, weight, volume, is_fragile, service_type):
         """
         Tính phí logistics cho một order_item
         TỔNG PHÍ LOGISTICS = PHÍ CƠ BẢN × HỆ SỐ RỦI RO × HỆ SỐ SERVICE_TYPE
+        Trả về (total_fee, shipping_weight, base_fee), công thức nằm trong fee engine
         """
-        # 1. Tính trọng lượng tính phí
-        shipping_weight = self.calculate_shipping_weight(weight, volume)
-        
-        # 2. Tính phí cơ bản
-        base_fee = self.calculate_base_fee(shipping_weight)
-        
-        # 3. Áp dụng hệ số rủi ro
-        fragile_multiplier = self.get_fragile_multiplier(is_fragile)
-        
-        # 4. Áp dụng hệ số service type
-        service_multiplier = self.get_service_type_multiplier(service_type)
-        
-        # 5. Tính tổng phí
-        total_fee = base_fee * fragile_multiplier * service_multiplier
-        
-        # Làm tròn đến 2 chữ số thập phân
-        total_fee = total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        
-        return total_fee, shipping_weight, base_fee
+        return self.fee_engine.breakdown(weight, volume, is_fragile, service_type)
     
-    def get_order_items_batch(self, limit=1000, offset=0):
-        """Lấy dữ liệu order_items theo batch để xử lý"""
-        query = """
-        SELECT 
-            oi.id as order_item_id,
-            oi.order_id,
-            oi.product_id,
-            oi.quantity,
-            oi.shipping_fee as current_shipping_fee,
-            p.weight,
-            p.volume,
-            p.is_fragile,
-            p.name as product_name,
-            d.service_type,
-            o.external_id as order_external_id
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        JOIN orders o ON oi.order_id = o.id
-        JOIN deliveries d ON o.id = d.order_id
-        ORDER BY oi.id
-        LIMIT %s OFFSET %s
-        """
-        
+    def get_order_items_batch(self, limit=1000, last_id=0):
+        """Lấy dữ liệu order_items theo batch để xử lý (keyset: oi.id > last_id)"""
         try:
-            self.cursor.execute(query, (limit, offset))
-            results = self.cursor.fetchall()
-            return results
+            self.product_cache.maybe_refresh(self.cursor)
+            rows = fetch_order_items_after(self.cursor, last_id, limit, ORDER_ITEMS_QUERY)
+            return self.product_cache.attach(rows)
         except mysql.connector.Error as e:
-            logging.error(f"❌ Lỗi truy vấn order_items batch (offset={offset}): {e}")
+            logging.error(f"❌ Lỗi truy vấn order_items batch (last_id={last_id}): {e}")
             return []
     
     def update_order_item_shipping_fee_batch(self, updates):
@@ -226,13 +202,7 @@ class ProductionShippingFeeCalculator:
             return 0
         
         try:
-            update_query = """
-            UPDATE order_items 
-            SET shipping_fee = %s, updated_at = NOW()
-            WHERE id = %s
-            """
-            self.cursor.executemany(update_query, updates)
-            return len(updates)
+            return self.item_writer.write(self.cursor, updates)
         except mysql.connector.Error as e:
             logging.error(f"❌ Lỗi cập nhật batch shipping_fee: {e}")
             return 0
@@ -242,34 +212,37 @@ class ProductionShippingFeeCalculator:
         logging.info("🔄 Bắt đầu xử lý shipping_fees...")
         
         batch_size = 1000
-        offset = 0
         total_processed = 0
         total_updated = 0
         total_errors = 0
         
-        while True:
-            # Lấy batch data
-            batch_items = self.get_order_items_batch(batch_size, offset)
-            if not batch_items:
-                break
-            
+        for batch_items in iter_keyset_batches(self.get_order_items_batch, batch_size):
             batch_updates = []
             batch_processed = 0
             batch_errors = 0
             
             for item in batch_items:
+                if item['product_missing']:
+                    continue  # Product không tồn tại (JOIN products trước đây loại bỏ row này)
                 try:
                     # Tính shipping_fee
-                    shipping_fee, shipping_weight, base_fee = self.calculate_shipping_fee(
-                        weight=item['weight'],
-                        volume=item['volume'],
-                        is_fragile=bool(item['is_fragile']),
-                        service_type=item['service_type']
+                    shipping_fee, shipping_weight, base_fee = self.fee_memo.lookup(
+                        item['product_id'],
+                        item['weight'],
+                        item['volume'],
+                        bool(item['is_fragile']),
+                        item['service_type']
                     )
                     
+                    batch_processed += 1
+                    
+                    # Bỏ qua row có phí không đổi (không sinh redo log/binlog)
+                    if not fee_changed(shipping_fee, item['current_shipping_fee']):
+                        self.stats['order_items_unchanged'] += 1
+                        continue
+                    
                     # Thêm vào batch updates
                     batch_updates.append((shipping_fee, item['order_item_id']))
-                    batch_processed += 1
                     
                     # Log chi tiết cho một số item đầu tiên
                     if total_processed < 10:
@@ -284,8 +257,9 @@ class ProductionShippingFeeCalculator:
                 updated_count = self.update_order_item_shipping_fee_batch(batch_updates)
                 total_updated += updated_count
                 
-                if updated_count != len(batch_updates):
-                    logging.warning(f"⚠️  Batch update không hoàn toàn: {updated_count}/{len(batch_updates)}")
+                expected = len(latest_fee_updates(batch_updates))
+                if updated_count != expected:
+                    logging.warning(f"⚠️  Batch update không hoàn toàn: {updated_count}/{expected}")
             
             total_processed += batch_processed
             total_errors += batch_errors
@@ -293,8 +267,6 @@ class ProductionShippingFeeCalculator:
             # Log tiến trình
             if total_processed % 10000 == 0:
                 logging.info(f"📊 Đã xử lý {total_processed:,} order_items...")
-            
-            offset += batch_size
         
         self.stats['order_items_processed'] = total_processed
         self.stats['order_items_updated'] = total_updated
@@ -303,35 +275,21 @@ class ProductionShippingFeeCalculator:
         logging.info(f"✅ Hoàn thành xử lý shipping_fees:")
         logging.info(f"   - Đã xử lý: {total_processed:,} order_items")
         logging.info(f"   - Đã cập nhật: {total_updated:,} order_items")
+        logging.info(f"   - Không đổi (bỏ qua ghi): {self.stats['order_items_unchanged']:,} order_items")
         logging.info(f"   - Lỗi: {total_errors:,} order_items")
+        self.fee_memo.log_summary()
+        self.product_cache.log_summary()
+        self.item_writer.log_summary()
         
         return total_errors == 0
     
-    def get_deliveries_data(self):
-        """Lấy dữ liệu deliveries cần tính delivery_fee"""
-        query = """
-        SELECT 
-            d.id as delivery_id,
-            d.order_id,
-            d.delivery_fee as current_delivery_fee,
-            SUM(oi.shipping_fee) as total_shipping_fee,
-            COUNT(oi.id) as item_count
-        FROM deliveries d
-        JOIN orders o ON d.order_id = o.id
-        JOIN order_items oi ON o.id = oi.order_id
-        WHERE oi.shipping_fee IS NOT NULL
-        GROUP BY d.id, d.order_id, d.delivery_fee
-        ORDER BY d.id
-        """
-        
+    def get_deliveries_batch(self, limit=1000, last_id=0):
+        """Lấy tổng shipping_fee theo delivery theo batch (keyset: d.id > last_id, unbuffered cursor)"""
         try:
-            self.cursor.execute(query)
-            results = self.cursor.fetchall()
-            logging.info(f"📋 Tìm được {len(results)} deliveries cần cập nhật delivery_fee")
-            return results
+            return fetch_delivery_fee_totals_after(self.connection, last_id, limit)
         except mysql.connector.Error as e:
-            logging.error(f"❌ Lỗi truy vấn deliveries: {e}")
-            return []
+            logging.error(f"❌ Lỗi truy vấn deliveries batch (last_id={last_id}): {e}")
+            raise
     
     def update_delivery_fees_batch(self, updates):
         """Cập nhật delivery_fee cho nhiều deliveries cùng lúc"""
@@ -339,60 +297,64 @@ class ProductionShippingFeeCalculator:
             return 0
         
         try:
-            update_query = """
-            UPDATE deliveries 
-            SET delivery_fee = %s, updated_at = NOW()
-            WHERE id = %s
-            """
-            self.cursor.executemany(update_query, updates)
-            return len(updates)
+            return self.delivery_writer.write(self.cursor, updates)
         except mysql.connector.Error as e:
             logging.error(f"❌ Lỗi cập nhật batch delivery_fee: {e}")
             return 0
     
     def process_delivery_fees(self):
-        """Xử lý tính toán và cập nhật delivery_fees"""
+        """Xử lý tính toán và cập nhật delivery_fees (stream theo batch, không fetchall toàn bộ)"""
         logging.info("🔄 Bắt đầu xử lý delivery_fees...")
         
-        deliveries = self.get_deliveries_data()
-        if not deliveries:
-            logging.warning("⚠️  Không có deliveries nào để xử lý")
-            return False
-        
-        delivery_updates = []
+        batch_size = 1000
         processed = 0
+        updated_count = 0
+        unchanged = 0
         errors = 0
         
-        for delivery in deliveries:
-            try:
-                delivery_fee = Decimal(str(delivery['total_shipping_fee']))
-                delivery_updates.append((delivery_fee, delivery['delivery_id']))
-                processed += 1
+        try:
+            for deliveries in iter_keyset_batches(self.get_deliveries_batch, batch_size, key='delivery_id'):
+                delivery_updates = []
                 
-                # Log chi tiết cho một số delivery đầu tiên
-                if processed <= 10:
-                    logging.info(f"Delivery {delivery['delivery_id']}: {delivery_fee:,} VNĐ ({delivery['item_count']} items)")
-                    
-            except Exception as e:
-                logging.error(f"❌ Lỗi xử lý delivery {delivery['delivery_id']}: {e}")
-                errors += 1
+                for delivery in deliveries:
+                    try:
+                        delivery_fee = Decimal(str(delivery['total_shipping_fee']))
+                        processed += 1
+                        if not fee_changed(delivery_fee, delivery['current_delivery_fee']):
+                            unchanged += 1
+                            continue
+                        delivery_updates.append((delivery_fee, delivery['delivery_id']))
+                        
+                        # Log chi tiết cho một số delivery đầu tiên
+                        if processed <= 10:
+                            logging.info(f"Delivery {delivery['delivery_id']}: {delivery_fee:,} VNĐ ({delivery['item_count']} items)")
+                            
+                    except Exception as e:
+                        logging.error(f"❌ Lỗi xử lý delivery {delivery['delivery_id']}: {e}")
+                        errors += 1
+                
+                # Cập nhật các deliveries có phí thay đổi trong batch
+                updated_count += self.update_delivery_fees_batch(delivery_updates)
+        except mysql.connector.Error:
+            return False
         
-        # Cập nhật tất cả deliveries
-        if delivery_updates:
-            updated_count = self.update_delivery_fees_batch(delivery_updates)
-            
-            self.stats['deliveries_processed'] = processed
-            self.stats['deliveries_updated'] = updated_count
-            self.stats['deliveries_errors'] = errors
-            
-            logging.info(f"✅ Hoàn thành xử lý delivery_fees:")
-            logging.info(f"   - Đã xử lý: {processed:,} deliveries")
-            logging.info(f"   - Đã cập nhật: {updated_count:,} deliveries")
-            logging.info(f"   - Lỗi: {errors:,} deliveries")
-            
-            return errors == 0
+        if not processed:
+            logging.warning("⚠️  Không có deliveries nào để xử lý")
+            return False
         
-        return False
+        self.stats['deliveries_processed'] = processed
+        self.stats['deliveries_updated'] = updated_count
+        self.stats['deliveries_unchanged'] = unchanged
+        self.stats['deliveries_errors'] = errors
+        
+        logging.info(f"✅ Hoàn thành xử lý delivery_fees:")
+        logging.info(f"   - Đã xử lý: {processed:,} deliveries")
+        logging.info(f"   - Đã cập nhật: {updated_count:,} deliveries")
+        logging.info(f"   - Không đổi (bỏ qua ghi): {unchanged:,} deliveries")
+        logging.info(f"   - Lỗi: {errors:,} deliveries")
+        self.delivery_writer.log_summary()
+        
+        return errors == 0
     
     def save_execution_report(self):
         """Lưu báo cáo thực thi"""
@@ -411,12 +373,18 @@ class ProductionShippingFeeCalculator:
             'order_items_stats': {
                 'processed': self.stats['order_items_processed'],
                 'updated': self.stats['order_items_updated'],
-                'errors': self.stats['order_items_errors']
+                'unchanged': self.stats['order_items_unchanged'],
+                'errors': self.stats['order_items_errors'],
+                'fee_memo': self.fee_memo.summary(),
+                'product_cache': self.product_cache.summary(),
+                'write_back': self.item_writer.summary()
             },
             'deliveries_stats': {
                 'processed': self.stats['deliveries_processed'],
                 'updated': self.stats['deliveries_updated'],
-                'errors': self.stats['deliveries_errors']
+                'unchanged': self.stats['deliveries_unchanged'],
+                'errors': self.stats['deliveries_errors'],
+                'write_back': self.delivery_writer.summary()
             },
             'calculation_config': {
                 'base_price_per_kg': str(BASE_PRICE_PER_KG),
@@ -445,14 +413,16 @@ class ProductionShippingFeeCalculator:
 ### Order Items (shipping_fee)
 - **Đã xử lý:** {self.stats['order_items_processed']:,} items
 - **Đã cập nhật:** {self.stats['order_items_updated']:,} items
+- **Không đổi (bỏ qua ghi):** {self.stats['order_items_unchanged']:,} items
 - **Lỗi:** {self.stats['order_items_errors']:,} items
-- **Tỷ lệ thành công:** {(self.stats['order_items_updated']/max(self.stats['order_items_processed'], 1)*100):.2f}%
+- **Tỷ lệ thành công:** {((self.stats['order_items_updated'] + self.stats['order_items_unchanged'])/max(self.stats['order_items_processed'], 1)*100):.2f}%
 
 ### Deliveries (delivery_fee)
 - **Đã xử lý:** {self.stats['deliveries_processed']:,} deliveries
 - **Đã cập nhật:** {self.stats['deliveries_updated']:,} deliveries
+- **Không đổi (bỏ qua ghi):** {self.stats['deliveries_unchanged']:,} deliveries
 - **Lỗi:** {self.stats['deliveries_errors']:,} deliveries
-- **Tỷ lệ thành công:** {(self.stats['deliveries_updated']/max(self.stats['deliveries_processed'], 1)*100):.2f}%
+- **Tỷ lệ thành công:** {((self.stats['deliveries_updated'] + self.stats['deliveries_unchanged'])/max(self.stats['deliveries_processed'], 1)*100):.2f}%
 
 ## Cấu hình tính toán
 - **Giá cơ bản:** {BASE_PRICE_PER_KG:,} VNĐ/kg
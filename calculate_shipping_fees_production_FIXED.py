@@ -9,7 +9,7 @@ Phiên bản: Production 2.0 - SECURE & RELIABLE
 import mysql.connector
 import logging
 from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import sys
 import os
 import json
@@ -21,6 +21,17 @@ from shipping_fee_config import (
     get_database_config, SHIPPING_CONSTANTS, SERVICE_TYPE_MULTIPLIERS,
     PROCESSING_CONFIG, LOGGING_CONFIG, VALIDATION_CONFIG, SECURITY_CONFIG
 )
+from shipping_fee_db import (
+    build_order_item_delivery_query, fee_changed, fetch_order_items_after, iter_delivery_fee_totals,
+    latest_fee_updates, make_fee_writer, ProductAttributeCache
+)
+from shipping_fee_engine import get_row_fee_engine
+from fee_memo import FeeMemo
+from pricing_rules import resolve_pricing_config
+from fee_watermark import FeeWatermark, changed_deliveries_where, changed_order_items_where
+from fee_journal import FeeChangeJournal, JOURNAL_MODES, new_run_id
+
+ORDER_ITEMS_QUERY = build_order_item_delivery_query(force_primary=True)
 
 class SecureShippingFeeCalculator:
     """
@@ -38,6 +49,11 @@ class SecureShippingFeeCalculator:
         self.cursor = None
         self.db_config = get_database_config(is_test)
         
+        # Incremental mode: chỉ order_items thay đổi từ watermark (None = toàn bộ)
+        self.changed_since = None
+        self.watermark = FeeWatermark(PROCESSING_CONFIG['watermark_file'])
+        self.order_items_query = ORDER_ITEMS_QUERY
+        
         # Setup secure logging
         self.log_file, self.error_log_file = self._setup_secure_logging()
         
@@ -46,14 +62,40 @@ class SecureShippingFeeCalculator:
             'order_items_processed': 0,
             'order_items_updated': 0,
             'order_items_errors': 0,
+            'order_items_unchanged': 0,
             'deliveries_processed': 0,
             'deliveries_updated': 0,
+            'deliveries_unchanged': 0,
             'deliveries_errors': 0,
             'transactions_committed': 0,
             'start_time': datetime.now(),
             'end_time': None
         }
         
+        # Product attributes cache thay cho JOIN products trong mỗi batch
+        self.product_cache = ProductAttributeCache(PROCESSING_CONFIG['product_cache_refresh_seconds'])
+        
+        # BACKUP_MODE journal/file: chỉ ghi (id, old_fee, new_fee) của rows bị đổi, rollback theo run_id
+        self.run_id = new_run_id()
+        self.journal = (FeeChangeJournal(PROCESSING_CONFIG['backup_mode'], self.run_id)
+                        if PROCESSING_CONFIG['backup_mode'] in JOURNAL_MODES else None)
+        
+        # Write-back: staging temp table + UPDATE JOIN (2 round trips / chunk) hoặc executemany
+        self.item_writer = make_fee_writer(PROCESSING_CONFIG['fee_write_strategy'], 'order_items', 'shipping_fee',
+                                           journal=self.journal)
+        self.delivery_writer = make_fee_writer(PROCESSING_CONFIG['fee_write_strategy'], 'deliveries', 'delivery_fee',
+                                               journal=self.journal)
+        
+        # Pricing (PRICING_SOURCE), nạp lại sau khi connect
+        self.pricing_version = None
+        
+        # Fee engine (FEE_ENGINE); sql pushdown chỉ có ở ULTRA_STABLE, ở đây tính phía client
+        self.fee_engine = get_row_fee_engine()
+        
+        # Memo (product_id, service_type) -> fee
+        self.fee_memo = FeeMemo(self._calculate_shipping_fee, 'breakdown',
+                                persist_file=PROCESSING_CONFIG['fee_memo_file'] or None)
+        
         # Security: Don't log credentials
         safe_db_info = {k: v for k, v in self.db_config.items() if k != 'password'}
         
@@ -122,8 +164,27 @@ class SecureShippingFeeCalculator:
                     
         return False
     
+    def _load_pricing(self) -> bool:
+        """Compile pricing rules (PRICING_SOURCE=table), dựng lại engine/memo/watermark theo config đó"""
+        try:
+            self.pricing_version, pricing_config = resolve_pricing_config(self.cursor)
+            self.connection.rollback()
+        except (mysql.connector.Error, ValueError) as e:
+            logging.error(f"❌ Cannot load pricing rules: {e}")
+            return False
+        
+        if self.pricing_version is not None:
+            self.fee_engine = get_row_fee_engine(constants=pricing_config['constants'],
+                                             service_multipliers=pricing_config['service_multipliers'])
+            self.fee_memo = FeeMemo(self._calculate_shipping_fee, 'breakdown', config=pricing_config,
+                                    persist_file=PROCESSING_CONFIG['fee_memo_file'] or None)
+            self.watermark = FeeWatermark(PROCESSING_CONFIG['watermark_file'], config=pricing_config)
+        return True
+    
     def _disconnect_database(self):
         """Safely disconnect from database"""
+        if self.journal:
+            self.journal.close()
         try:
             if self.cursor:
                 self.cursor.close()
@@ -134,10 +195,21 @@ class SecureShippingFeeCalculator:
             logging.error(f"⚠️  Error during disconnection: {e}")
     
     def _create_secure_backup(self) -> bool:
-        """Create comprehensive backup with proper naming"""
-        if not PROCESSING_CONFIG['enable_backup']:
+        """Create comprehensive backup with proper naming (BACKUP_MODE: full | journal | file | none)"""
+        if PROCESSING_CONFIG['backup_mode'] == 'none':
             logging.info("📋 Backup disabled by configuration")
             return True
+        
+        if self.journal:
+            # Chỉ journal rows bị đổi; DDL của bảng journal tự commit nên chạy trước transaction đầu tiên
+            try:
+                self.journal.prepare(self.cursor)
+                self.connection.commit()
+                logging.info(f"✅ Changed-rows journal enabled, rollback: python3 fee_journal.py rollback {self.run_id}")
+                return True
+            except (mysql.connector.Error, OSError) as e:
+                logging.error(f"❌ Fee change journal setup failed: {e}")
+                return False
             
         try:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -199,27 +271,7 @@ class SecureShippingFeeCalculator:
         if not self._validate_input(weight, volume, service_type):
             raise ValueError("Invalid input parameters")
         
-        # Convert to Decimal for precision
-        actual_weight = Decimal(str(weight)) if weight else Decimal('0')
-        volume_val = Decimal(str(volume)) if volume else Decimal('0')
-        
-        # Calculate shipping weight
-        volume_weight = volume_val * SHIPPING_CONSTANTS['VOLUME_TO_WEIGHT_FACTOR']
-        shipping_weight = max(actual_weight, volume_weight)
-        
-        # Calculate base fee
-        base_fee = shipping_weight * SHIPPING_CONSTANTS['BASE_PRICE_PER_KG']
-        
-        # Apply fragile multiplier
-        fragile_multiplier = (SHIPPING_CONSTANTS['FRAGILE_MULTIPLIER'] 
-                            if is_fragile else SHIPPING_CONSTANTS['NORMAL_MULTIPLIER'])
-        
-        # Apply service type multiplier
-        service_multiplier = SERVICE_TYPE_MULTIPLIERS.get(service_type, Decimal('1.0'))
-        
-        # Calculate total fee
-        total_fee = base_fee * fragile_multiplier * service_multiplier
-        total_fee = total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        total_fee, shipping_weight, base_fee = self.fee_engine.breakdown(weight, volume, is_fragile, service_type)
         
         # Validate result
         if total_fee > VALIDATION_CONFIG['max_shipping_fee']:
@@ -227,37 +279,14 @@ class SecureShippingFeeCalculator:
         
         return total_fee, shipping_weight, base_fee
     
-    def _get_order_items_chunk(self, limit: int, offset: int) -> List[Dict[str, Any]]:
-        """Get order items with optimized query"""
-        query = """
-        SELECT 
-            oi.id as order_item_id,
-            oi.order_id,
-            oi.product_id,
-            oi.quantity,
-            oi.shipping_fee as current_shipping_fee,
-            p.weight,
-            p.volume,
-            p.is_fragile,
-            p.name as product_name,
-            d.service_type,
-            o.external_id as order_external_id
-        FROM order_items oi
-        FORCE INDEX (PRIMARY)
-        JOIN products p ON oi.product_id = p.id
-        JOIN orders o ON oi.order_id = o.id  
-        JOIN deliveries d ON o.id = d.order_id
-        WHERE oi.id > %s
-        ORDER BY oi.id
-        LIMIT %s
-        """
-        
+    def _get_order_items_chunk(self, limit: int, last_id: int) -> List[Dict[str, Any]]:
+        """Get order items after last_id (keyset pagination on PRIMARY)"""
         try:
-            self.cursor.execute(query, (offset, limit))
-            results = self.cursor.fetchall()
-            return results
+            self.product_cache.maybe_refresh(self.cursor)
+            rows = fetch_order_items_after(self.cursor, last_id, limit, self.order_items_query)
+            return self.product_cache.attach(rows)
         except mysql.connector.Error as e:
-            logging.error(f"❌ Query failed (offset={offset}): {e}")
+            logging.error(f"❌ Query failed (last_id={last_id}): {e}")
             return []
     
     def _update_shipping_fees_batch(self, updates: List[Tuple[Decimal, int]]) -> int:
@@ -266,13 +295,7 @@ class SecureShippingFeeCalculator:
             return 0
         
         try:
-            update_query = """
-            UPDATE order_items 
-            SET shipping_fee = %s, updated_at = NOW()
-            WHERE id = %s
-            """
-            self.cursor.executemany(update_query, updates)
-            return len(updates)
+            return self.item_writer.write(self.cursor, updates)
             
         except mysql.connector.Error as e:
             logging.error(f"❌ Batch update failed: {e}")
@@ -290,7 +313,7 @@ class SecureShippingFeeCalculator:
         total_errors = 0
         chunk_start_time = datetime.now()
         
-        # Start with offset 0, use cursor-based pagination
+        # Keyset pagination: mỗi batch bắt đầu sau order_item_id cuối cùng
         last_id = 0
         
         while True:
@@ -311,15 +334,23 @@ class SecureShippingFeeCalculator:
                     batch_updates = []
                     
                     for item in batch_items:
+                        if item['product_missing']:
+                            continue  # Product không tồn tại (JOIN products trước đây loại bỏ row này)
                         try:
                             # Calculate shipping fee
-                            shipping_fee, shipping_weight, base_fee = self._calculate_shipping_fee(
-                                weight=item['weight'],
-                                volume=item['volume'], 
-                                is_fragile=bool(item['is_fragile']),
-                                service_type=item['service_type']
+                            shipping_fee, shipping_weight, base_fee = self.fee_memo.lookup(
+                                item['product_id'],
+                                item['weight'],
+                                item['volume'],
+                                bool(item['is_fragile']),
+                                item['service_type']
                             )
                             
+                            # Không ghi lại row có fee không đổi
+                            if not fee_changed(shipping_fee, item['current_shipping_fee']):
+                                self.stats['order_items_unchanged'] += 1
+                                continue
+                            
                             batch_updates.append((shipping_fee, item['order_item_id']))
                             
                             # Log first few items for verification
@@ -336,8 +367,9 @@ class SecureShippingFeeCalculator:
                         updated_count = self._update_shipping_fees_batch(batch_updates)
                         chunk_updated += updated_count
                         
-                        if updated_count != len(batch_updates):
-                            logging.warning(f"⚠️  Partial batch update: {updated_count}/{len(batch_updates)}")
+                        expected = len(latest_fee_updates(batch_updates))
+                        if updated_count != expected:
+                            logging.warning(f"⚠️  Partial batch update: {updated_count}/{expected}")
                     
                     chunk_processed += len(batch_items)
                     last_id = batch_items[-1]['order_item_id']  # Cursor-based pagination
@@ -389,82 +421,73 @@ class SecureShippingFeeCalculator:
         logging.info(f"✅ Shipping fee processing completed:")
         logging.info(f"   📊 Processed: {total_processed:,} items")
         logging.info(f"   ✅ Updated: {total_updated:,} items")
+        logging.info(f"   ⏭️  Unchanged (write skipped): {self.stats['order_items_unchanged']:,} items")
         logging.info(f"   ❌ Errors: {total_errors:,} items")
         logging.info(f"   🔄 Transactions: {self.stats['transactions_committed']:,}")
+        self.fee_memo.log_summary()
+        self.product_cache.log_summary()
+        self.item_writer.log_summary()
+        self.fee_memo.save()
         
         return total_errors == 0
     
     def _process_delivery_fees(self) -> bool:
-        """Process delivery fees with error handling"""
+        """Process delivery fees in keyset-ranged batches (one transaction per batch)"""
         logging.info("🚚 Processing delivery fees...")
         
-        query = """
-        SELECT 
-            d.id as delivery_id,
-            d.order_id,
-            d.delivery_fee as current_delivery_fee,
-            SUM(oi.shipping_fee) as total_shipping_fee,
-            COUNT(oi.id) as item_count
-        FROM deliveries d
-        JOIN orders o ON d.order_id = o.id
-        JOIN order_items oi ON o.id = oi.order_id
-        WHERE oi.shipping_fee IS NOT NULL
-        GROUP BY d.id, d.order_id, d.delivery_fee
-        ORDER BY d.id
-        """
+        where = changed_deliveries_where(self.changed_since) if self.changed_since else None
+        batch_size = PROCESSING_CONFIG['transaction_chunk_size']
+        
+        processed = 0
+        updated_count = 0
+        unchanged = 0
+        errors = 0
         
         try:
-            self.connection.start_transaction()
-            
-            self.cursor.execute(query)
-            deliveries = self.cursor.fetchall()
+            # Unbuffered keyset stream: memory ~ batch_size thay vì toàn bộ deliveries
+            for deliveries in iter_delivery_fee_totals(self.connection, batch_size, where=where):
+                delivery_updates = []
+                
+                for delivery in deliveries:
+                    try:
+                        delivery_fee = Decimal(str(delivery['total_shipping_fee']))
+                        processed += 1
+                        if not fee_changed(delivery_fee, delivery['current_delivery_fee']):
+                            unchanged += 1
+                            continue
+                        delivery_updates.append((delivery_fee, delivery['delivery_id']))
+                        
+                        # Log first few for verification
+                        if processed <= 5:
+                            logging.info(f"Delivery {delivery['delivery_id']}: {delivery_fee:,} VNĐ "
+                                       f"({delivery['item_count']} items)")
+                            
+                    except Exception as e:
+                        logging.error(f"❌ Error processing delivery {delivery['delivery_id']}: {e}")
+                        errors += 1
+                
+                # Update deliveries có fee thay đổi
+                updated_count += self.delivery_writer.write(self.cursor, delivery_updates)
+                self.connection.commit()
+                self.stats['transactions_committed'] += 1
             
-            if not deliveries:
+            if not processed:
                 logging.warning("⚠️  No deliveries found to process")
                 return True
             
-            delivery_updates = []
-            processed = 0
-            errors = 0
-            
-            for delivery in deliveries:
-                try:
-                    delivery_fee = Decimal(str(delivery['total_shipping_fee']))
-                    delivery_updates.append((delivery_fee, delivery['delivery_id']))
-                    processed += 1
-                    
-                    # Log first few for verification
-                    if processed <= 5:
-                        logging.info(f"Delivery {delivery['delivery_id']}: {delivery_fee:,} VNĐ "
-                                   f"({delivery['item_count']} items)")
-                        
-                except Exception as e:
-                    logging.error(f"❌ Error processing delivery {delivery['delivery_id']}: {e}")
-                    errors += 1
+            logging.info(f"✅ Delivery fee processing completed:")
+            logging.info(f"   📊 Processed: {processed:,} deliveries")
+            logging.info(f"   ✅ Updated: {updated_count:,} deliveries")
+            logging.info(f"   ⏭️  Unchanged (write skipped): {unchanged:,} deliveries")
+            logging.info(f"   ❌ Errors: {errors:,} deliveries")
+            self.delivery_writer.log_summary()
             
-            # Update all deliveries
-            if delivery_updates:
-                update_query = """
-                UPDATE deliveries 
-                SET delivery_fee = %s, updated_at = NOW()
-                WHERE id = %s
-                """
-                self.cursor.executemany(update_query, delivery_updates)
-                self.connection.commit()
-                
-                updated_count = len(delivery_updates)
-                logging.info(f"✅ Delivery fee processing completed:")
-                logging.info(f"   📊 Processed: {processed:,} deliveries")
-                logging.info(f"   ✅ Updated: {updated_count:,} deliveries")
-                logging.info(f"   ❌ Errors: {errors:,} deliveries")
-                
-                self.stats['deliveries_processed'] = processed
-                self.stats['deliveries_updated'] = updated_count
-                self.stats['deliveries_errors'] = errors
-                
-                return errors == 0
+            self.stats['deliveries_processed'] = processed
+            self.stats['deliveries_updated'] = updated_count
+            self.stats['deliveries_unchanged'] = unchanged
+            self.stats['deliveries_errors'] = errors
             
-            return False
+            return errors == 0
             
         except mysql.connector.Error as e:
             logging.error(f"❌ Delivery fee processing failed: {e}")
@@ -486,16 +509,26 @@ class SecureShippingFeeCalculator:
                 'execution_time_seconds': execution_time.total_seconds(),
                 'database': self.db_config['database'],
                 'mode': 'TEST' if self.is_test else 'PRODUCTION',
+                'changed_since': self.changed_since.isoformat() if self.changed_since else None,
+                'pricing_version': self.pricing_version,
+                'backup_mode': PROCESSING_CONFIG['backup_mode'],
+                'run_id': self.run_id,
                 'version': 'Production 2.0 - SECURE & RELIABLE'
             },
             'processing_stats': {
                 'order_items_processed': self.stats['order_items_processed'],
                 'order_items_updated': self.stats['order_items_updated'],
                 'order_items_errors': self.stats['order_items_errors'],
+                'order_items_unchanged': self.stats['order_items_unchanged'],
                 'deliveries_processed': self.stats['deliveries_processed'],
                 'deliveries_updated': self.stats['deliveries_updated'],
+                'deliveries_unchanged': self.stats['deliveries_unchanged'],
                 'deliveries_errors': self.stats['deliveries_errors'],
-                'transactions_committed': self.stats['transactions_committed']
+                'transactions_committed': self.stats['transactions_committed'],
+                'fee_memo': self.fee_memo.summary(),
+                'product_cache': self.product_cache.summary(),
+                'write_back': self.item_writer.summary(),
+                'journal': self.journal.summary() if self.journal else None
             },
             'configuration': {
                 'batch_size': PROCESSING_CONFIG['batch_size'],
@@ -513,9 +546,10 @@ class SecureShippingFeeCalculator:
             json.dump(report, f, ensure_ascii=False, indent=2)
         
         # Save markdown summary
-        success_rate_items = (self.stats['order_items_updated'] / 
+        # Row không đổi (write skipped) cũng tính là thành công
+        success_rate_items = ((self.stats['order_items_updated'] + self.stats['order_items_unchanged']) / 
                             max(self.stats['order_items_processed'], 1) * 100)
-        success_rate_deliveries = (self.stats['deliveries_updated'] / 
+        success_rate_deliveries = ((self.stats['deliveries_updated'] + self.stats['deliveries_unchanged']) / 
                                  max(self.stats['deliveries_processed'], 1) * 100)
         
         markdown_content = f"""# SHIPPING FEE CALCULATION REPORT - SECURE VERSION
@@ -525,26 +559,32 @@ class SecureShippingFeeCalculator:
 - **End Time:** {self.stats['end_time'].strftime('%Y-%m-%d %H:%M:%S')}
 - **Duration:** {execution_time.total_seconds():.1f} seconds
 - **Mode:** {'TEST' if self.is_test else 'PRODUCTION'}
+- **Run:** {f"incremental (changes since {self.changed_since.isoformat(sep=' ')})" if self.changed_since else 'full'}
+- **Backup:** {f"{self.journal.mode} journal, run {self.run_id} (rollback: `python3 fee_journal.py rollback {self.run_id}`)" if self.journal else PROCESSING_CONFIG['backup_mode']}
 - **Version:** Production 2.0 - SECURE & RELIABLE
 
 ## Processing Results
 ### Order Items (shipping_fee)
 - **Processed:** {self.stats['order_items_processed']:,}
 - **Updated:** {self.stats['order_items_updated']:,}
+- **Unchanged (write skipped):** {self.stats['order_items_unchanged']:,}
 - **Errors:** {self.stats['order_items_errors']:,}
 - **Success Rate:** {success_rate_items:.2f}%
 
 ### Deliveries (delivery_fee)
 - **Processed:** {self.stats['deliveries_processed']:,}
 - **Updated:** {self.stats['deliveries_updated']:,}
+- **Unchanged (write skipped):** {self.stats['deliveries_unchanged']:,}
 - **Errors:** {self.stats['deliveries_errors']:,}
 - **Success Rate:** {success_rate_deliveries:.2f}%
 
 ## Technical Details
 - **Transactions Committed:** {self.stats['transactions_committed']:,}
+- **Fee Memo Hit Rate:** {self.fee_memo.hit_rate():.2%} ({len(self.fee_memo.entries):,} entries)
 - **Batch Size:** {PROCESSING_CONFIG['batch_size']:,}
 - **Transaction Chunk Size:** {PROCESSING_CONFIG['transaction_chunk_size']:,}
-- **Base Price:** {SHIPPING_CONSTANTS['BASE_PRICE_PER_KG']:,} VNĐ/kg
+- **Base Price:** {self.fee_engine.constants['BASE_PRICE_PER_KG']:,} VNĐ/kg
+- **Pricing:** {f"pricing_rules version {self.pricing_version}" if self.pricing_version else 'SHIPPING_CONSTANTS'}
 
 ## Security Features Applied
 - ✅ Secure credential management
@@ -573,11 +613,24 @@ class SecureShippingFeeCalculator:
                 logging.error("💥 Cannot proceed without database connection")
                 return False
             
+            if not self._load_pricing():
+                logging.error("💥 Pricing rules unavailable, aborting")
+                return False
+            
             # 2. Create backup
             if not self._create_secure_backup():
                 logging.error("💥 Backup creation failed, aborting for safety")
                 return False
             
+            # Incremental mode: quyết định full/incremental, ghi nhận thời điểm bắt đầu run
+            if PROCESSING_CONFIG['incremental']:
+                self.changed_since = self.watermark.changed_since(PROCESSING_CONFIG['full_rebuild'])
+                self.watermark.begin_run(self.cursor)
+                self.connection.rollback()
+                if self.changed_since:
+                    self.order_items_query = build_order_item_delivery_query(
+                        where=changed_order_items_where(self.changed_since), force_primary=True)
+            
             # 3. Process shipping fees with chunked transactions
             if not self._process_shipping_fees_chunked():
                 logging.error("💥 Shipping fee processing failed")
@@ -588,6 +641,12 @@ class SecureShippingFeeCalculator:
                 logging.error("💥 Delivery fee processing failed")
                 return False
             
+            if PROCESSING_CONFIG['incremental']:
+                self.watermark.commit_run()
+            
+            if self.journal:
+                self.journal.log_summary()
+            
             # 5. Generate reports
             report_file, markdown_file = self._save_execution_report()
             
@@ -616,6 +675,12 @@ def main():
     print("   🚫 No credential logging")
     print()
     
+    # --incremental / --full-rebuild (tương đương INCREMENTAL=true / FULL_REBUILD=true)
+    if '--incremental' in sys.argv:
+        PROCESSING_CONFIG['incremental'] = True
+    if '--full-rebuild' in sys.argv:
+        PROCESSING_CONFIG['full_rebuild'] = True
+    
     # Environment check
     if not os.getenv('DB_PASSWORD'):
         print("⚠️  WARNING: DB_PASSWORD environment variable not set!")
@@ -8,10 +8,12 @@ Expert solution for orphaned records + complete fee calculation
 import mysql.connector
 import logging
 from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import sys
 import os
 
+from shipping_fee_engine import get_row_fee_engine
+
 # Database config
 DB_CONFIG = {
     'host': 'server.aptech.io',
@@ -36,6 +38,13 @@ SERVICE_TYPE_MULTIPLIERS = {
     'EXPRESS': Decimal('1.8')
 }
 
+FEE_ENGINE = get_row_fee_engine(constants={
+    'BASE_PRICE_PER_KG': BASE_PRICE_PER_KG,
+    'FRAGILE_MULTIPLIER': FRAGILE_MULTIPLIER,
+    'NORMAL_MULTIPLIER': NORMAL_MULTIPLIER,
+    'VOLUME_TO_WEIGHT_FACTOR': VOLUME_TO_WEIGHT_FACTOR
+}, service_multipliers=SERVICE_TYPE_MULTIPLIERS)
+
 def setup_logging():
     """Setup logging"""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -53,23 +62,7 @@ def setup_logging():
 
 def calculate_shipping_fee(weight, volume, is_fragile, service_type):
     """Calculate shipping fee"""
-    actual_weight = Decimal(str(weight)) if weight else Decimal('0')
-    volume_val = Decimal(str(volume)) if volume else Decimal('0')
-    
-    # Shipping weight = max(actual, volume converted)
-    volume_weight = volume_val * VOLUME_TO_WEIGHT_FACTOR
-    shipping_weight = max(actual_weight, volume_weight)
-    
-    # Base fee
-    base_fee = shipping_weight * BASE_PRICE_PER_KG
-    
-    # Multipliers
-    fragile_multiplier = FRAGILE_MULTIPLIER if is_fragile else NORMAL_MULTIPLIER
-    service_multiplier = SERVICE_TYPE_MULTIPLIERS.get(service_type, Decimal('1.0'))
-    
-    # Total fee
-    total_fee = base_fee * fragile_multiplier * service_multiplier
-    return total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return FEE_ENGINE.fee(weight, volume, is_fragile, service_type)
 
 def main():
     """Main function"""
@@ -190,7 +183,7 @@ def main():
                 
                 update_query = """
                 UPDATE order_items 
-                SET shipping_fee = %s, updated_at = NOW()
+                SET shipping_fee = %s
                 WHERE id = %s
                 """
                 cursor.executemany(update_query, batch_updates)
@@ -231,7 +224,7 @@ def main():
         
         update_delivery_query = """
         UPDATE deliveries 
-        SET delivery_fee = %s, updated_at = NOW()
+        SET delivery_fee = %s
         WHERE id = %s
         """
         cursor.executemany(update_delivery_query, delivery_updates)
@@ -11,9 +11,10 @@ Created: 2025
 import pandas as pd
 import numpy as np
 import mysql.connector
+from mysql.connector import pooling
 from datetime import datetime
 import logging
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
 import os
 from pathlib import Path
 import json
@@ -29,6 +30,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Direct load configuration
+PIPELINE_CONFIG = {
+    'batch_size': int(os.getenv('PIPELINE_BATCH_SIZE', '500')),   # Rows mỗi multi-row INSERT
+    'pool_size': int(os.getenv('PIPELINE_POOL_SIZE', '2'))
+}
+
+# MySQL giới hạn 65535 placeholders cho một prepared statement
+MAX_PREPARED_PLACEHOLDERS = 65535
+
+SYSTEM_USER_SQL = """
+            INSERT IGNORE INTO users (username, email, full_name, password, role_id, status_id, created_at) VALUES
+            ('system', 'system@dataco.com', 'System User', 'hashed_password', 
+             (SELECT id FROM roles WHERE role_name = 'CUSTOMER'), 
+             (SELECT id FROM status WHERE name = 'ACTIVE'), NOW());
+            """
+
 class DataCoPipeline:
     """
     Chuyên nghiệp ETL Pipeline cho DataCo Supply Chain Dataset
@@ -46,6 +63,7 @@ class DataCoPipeline:
         self.db_config = db_config
         self.df = None
         self.connection = None
+        self.pool = None
         
         # Mapping configurations từ kinh nghiệm 20 năm
         self.shipping_mode_mapping = {
@@ -72,7 +90,8 @@ class DataCoPipeline:
             'total_rows': 0,
             'processed_rows': 0,
             'errors': 0,
-            'skipped_rows': 0
+            'skipped_rows': 0,
+            'loaded_rows': 0
         }
 
     def connect_database(self) -> bool:
@@ -87,6 +106,20 @@ class DataCoPipeline:
             logger.error(f"❌ Lỗi kết nối database: {e}")
             return False
 
+    def get_pooled_connection(self):
+        """
+        Lấy connection từ pool (pool được tạo lần đầu khi cần)
+        """
+        if self.pool is None:
+            self.pool = pooling.MySQLConnectionPool(
+                pool_name='dataco_pipeline_pool',
+                pool_size=PIPELINE_CONFIG['pool_size'],
+                pool_reset_session=True,
+                **self.db_config
+            )
+            logger.info("✅ Database connection pool initialized")
+        return self.pool.get_connection()
+
     def load_dataset(self) -> bool:
         """
         Load dataset với encoding handling và error recovery
@@ -199,9 +232,9 @@ class DataCoPipeline:
             logger.error(f"❌ Lỗi trong quá trình cleaning: {e}")
             return False
 
-    def create_master_data_sql(self) -> List[str]:
+    def create_default_data_sql(self) -> List[str]:
         """
-        Tạo SQL cho master data (categories, stores, default data)
+        SQL cho default data cố định (statuses, role, warehouse, vehicle)
         """
         sql_statements = []
         
@@ -241,6 +274,14 @@ class DataCoPipeline:
         """
         sql_statements.append(vehicle_sql)
         
+        return sql_statements
+
+    def create_master_data_sql(self) -> List[str]:
+        """
+        Tạo SQL cho master data (categories, stores, default data)
+        """
+        sql_statements = self.create_default_data_sql()
+        
         # 5. Categories từ dataset - theo mapping guide
         logger.info("📝 Tạo categories SQL...")
         categories = self.df[['Category Id', 'Category Name']].drop_duplicates()
@@ -338,13 +379,7 @@ class DataCoPipeline:
                 all_sql.append(products_sql)
             
             # 3. Users (customers) - tạo user mặc định với AUTO_INCREMENT và lookup
-            users_sql = """
-            INSERT IGNORE INTO users (username, email, full_name, password, role_id, status_id, created_at) VALUES
-            ('system', 'system@dataco.com', 'System User', 'hashed_password', 
-             (SELECT id FROM roles WHERE role_name = 'CUSTOMER'), 
-             (SELECT id FROM status WHERE name = 'ACTIVE'), NOW());
-            """
-            all_sql.append(users_sql)
+            all_sql.append(SYSTEM_USER_SQL)
             
             # 4. Orders, order_items, addresses, payments, deliveries
             # Sẽ implement trong phần tiếp theo
@@ -373,9 +408,145 @@ class DataCoPipeline:
             logger.error(f"❌ Lỗi generate SQL: {e}")
             return False
 
-    def run_pipeline(self) -> bool:
+    def category_rows(self) -> Iterator[Tuple]:
+        """Rows (external_id, name) cho categories"""
+        categories = self.df[['Category Id', 'Category Name']].drop_duplicates()
+        for external_id, name in categories.itertuples(index=False):
+            yield (int(external_id), str(name))
+
+    def store_rows(self) -> Iterator[Tuple]:
+        """Rows (external_id, store_name) cho stores"""
+        stores = self.df[['Department Id', 'Department Name']].drop_duplicates()
+        for external_id, store_name in stores.itertuples(index=False):
+            yield (int(external_id), str(store_name))
+
+    def product_rows(self, category_ids: Dict[int, int]) -> Iterator[Tuple]:
+        """
+        Rows cho products, cùng mapping với create_products_sql nhưng
+        category_id được resolve trước thay vì subquery từng row
+        """
+        products = self.df[[
+            'Product Card Id', 'Product Name', 'Product Description', 
+            'Product Price', 'Product Status', 'Product Image', 'Product Category Id'
+        ]].drop_duplicates(subset=['Product Card Id'])
+        
+        for (external_id, name, description, price, status,
+             image, category_external_id) in products.itertuples(index=False):
+            name = str(name).strip()
+            yield (
+                int(external_id),
+                name,
+                str(description) if pd.notna(description) else name,
+                float(price),
+                self.product_status_mapping.get(int(status), 'ACTIVE'),
+                str(image) if pd.notna(image) else '',
+                category_ids.get(int(category_external_id))
+            )
+
+    def insert_rows(self, connection, table: str, columns: List[str],
+                    rows: Iterable[Tuple], value_template: str = None) -> int:
+        """
+        Stream rows vào table bằng server-side prepared multi-row INSERT.
+        
+        Statement cho chunk đầy đủ chỉ được prepare một lần rồi execute lại
+        với params mới; chunk cuối (ngắn hơn) dùng statement riêng.
+        """
+        value_template = value_template or f"({', '.join(['%s'] * len(columns))})"
+        params_per_row = value_template.count('%s')
+        rows_per_statement = max(1, min(PIPELINE_CONFIG['batch_size'],
+                                        MAX_PREPARED_PLACEHOLDERS // params_per_row))
+        
+        def build_statement(row_count: int) -> str:
+            return (f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES "
+                    f"{', '.join([value_template] * row_count)}")
+        
+        full_statement = build_statement(rows_per_statement)
+        cursor = connection.cursor(prepared=True)
+        inserted = 0
+        
+        try:
+            chunk = []
+            for row in rows:
+                chunk.extend(row)
+                if len(chunk) == rows_per_statement * params_per_row:
+                    cursor.execute(full_statement, chunk)
+                    connection.commit()
+                    inserted += rows_per_statement
+                    chunk = []
+            
+            if chunk:
+                tail_rows = len(chunk) // params_per_row
+                cursor.execute(build_statement(tail_rows), chunk)
+                connection.commit()
+                inserted += tail_rows
+            
+            logger.info(f"✅ {table}: {inserted:,} rows loaded")
+            return inserted
+            
+        finally:
+            cursor.close()
+
+    def load_direct(self) -> bool:
+        """
+        Load dữ liệu đã clean thẳng vào database, không qua file SQL trung gian
+        """
+        connection = None
+        try:
+            logger.info("🚀 Bắt đầu direct load vào database...")
+            connection = self.get_pooled_connection()
+            cursor = connection.cursor()
+            cursor.execute("SET SESSION foreign_key_checks = 0")
+            
+            # 1. Default data (statements cố định, không có params)
+            for sql in self.create_default_data_sql():
+                cursor.execute(sql)
+            connection.commit()
+            
+            # 2. Categories và stores
+            self.stats['loaded_rows'] += self.insert_rows(
+                connection, 'categories', ['external_id', 'name', 'created_at'],
+                self.category_rows(), '(%s, %s, NOW())'
+            )
+            self.stats['loaded_rows'] += self.insert_rows(
+                connection, 'stores', ['external_id', 'store_name', 'created_at'],
+                self.store_rows(), '(%s, %s, NOW())'
+            )
+            
+            # 3. Products - resolve category external_id → id một lần
+            cursor.execute("SELECT external_id, id FROM categories WHERE external_id IS NOT NULL")
+            category_ids = {int(external_id): category_id for external_id, category_id in cursor.fetchall()}
+            self.stats['loaded_rows'] += self.insert_rows(
+                connection, 'products',
+                ['external_id', 'name', 'description', 'unit_price', 'product_status',
+                 'product_image', 'category_id', 'created_at'],
+                self.product_rows(category_ids), '(%s, %s, %s, %s, %s, %s, %s, NOW())'
+            )
+            
+            # 4. System user
+            cursor.execute(SYSTEM_USER_SQL)
+            cursor.execute("SET SESSION foreign_key_checks = 1")
+            connection.commit()
+            cursor.close()
+            
+            logger.info(f"✅ Direct load hoàn thành: {self.stats['loaded_rows']:,} rows")
+            return True
+            
+        except mysql.connector.Error as e:
+            if connection:
+                connection.rollback()
+            logger.error(f"❌ Lỗi direct load: {e}")
+            return False
+        finally:
+            if connection:
+                connection.close()  # Trả connection về pool
+
+    def run_pipeline(self, load_mode: str = 'sql') -> bool:
         """
         Chạy toàn bộ pipeline ETL
+        
+        Args:
+            load_mode: 'sql' - generate dataco_import.sql;
+                       'direct' - load thẳng vào database qua prepared statements
         """
         logger.info("🚀 Bắt đầu DataCo ETL Pipeline...")
         
@@ -388,14 +559,13 @@ class DataCoPipeline:
             if not self.clean_and_validate_data():
                 return False
             
-            # Step 3: Generate SQL
-            if not self.generate_all_sql():
+            # Step 3: Generate SQL hoặc load thẳng vào DB
+            if load_mode == 'direct':
+                if not self.load_direct():
+                    return False
+            elif not self.generate_all_sql():
                 return False
             
-            # Step 4: Kết nối DB và execute (optional)
-            # if self.connect_database():
-            #     self.execute_sql_statements()
-            
             # Final report
             logger.info("🎉 Pipeline hoàn thành thành công!")
             logger.info(f"📈 Thống kê:")
@@ -418,13 +588,15 @@ DB_CONFIG = {
 }
 
 if __name__ == "__main__":
-    # Chạy pipeline
+    import sys
+    
+    # Chạy pipeline (--direct: load thẳng vào DB, không tạo file SQL)
     pipeline = DataCoPipeline(
         csv_file='DataCoSupplyChainDataset.csv',
         db_config=DB_CONFIG
     )
     
-    success = pipeline.run_pipeline()
+    success = pipeline.run_pipeline(load_mode='direct' if '--direct' in sys.argv else 'sql')
     
     if success:
         print("✅ ETL Pipeline thành công!")
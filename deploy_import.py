@@ -4,27 +4,83 @@ DataCo Deployment Script
 ========================
 Script cuối cùng để deploy import vào database thực tế.
 
-Usage: python3 deploy_import.py [--dry-run] [--batch-size=1000]
+Usage: python3 deploy_import.py [--dry-run] [--batch-size=1000] [--defer-indexes]
+                                [--pipeline --csv-file=DataCoSupplyChainDataset.csv]
 """
 
 import argparse
+import multiprocessing
+import queue as queue_module
 import mysql.connector
 import logging
 import time
+from typing import Iterable, Iterator, List
 from pathlib import Path
 import sys
 import re
+from datetime import datetime
+
+from bulk_load_indexes import SecondaryIndexManager, BULK_LOAD_TABLES
+from import_metrics import ImportMetrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Số statement chunks tối đa nằm trong queue giữa generator và loader
+PIPELINE_QUEUE_SIZE = 4
+# Statements mỗi chunk (mỗi INSERT tối đa batch_size rows) => queue giữ tối đa QUEUE_SIZE x CHUNK statements
+PIPELINE_CHUNK_STATEMENTS = 20
+# Loader chờ queue tối đa bấy nhiêu giây mỗi lần rồi kiểm tra producer còn sống
+PIPELINE_GET_TIMEOUT = 5
+
+
+def split_statements(sql_content: str) -> List[str]:
+    """Tách SQL text thành các statements"""
+    return [stmt.strip() for stmt in sql_content.split(';') if stmt.strip()]
+
+
+def produce_statement_batches(csv_file: str, sort_by_key: bool, queue,
+                              chunk_statements: int = PIPELINE_CHUNK_STATEMENTS):
+    """
+    Producer process: chạy AdvancedDataCoPipeline và đẩy statements vào queue
+    theo chunks cố định chunk_statements. Luôn kết thúc bằng sentinel None.
+    """
+    try:
+        from advanced_pipeline import AdvancedDataCoPipeline
+        
+        pipeline = AdvancedDataCoPipeline(csv_file, sort_by_key=sort_by_key)
+        if not pipeline.load_and_prepare_data():
+            queue.put({'error': f"Cannot load {csv_file}"})
+            return
+        
+        chunk = []
+        for section in pipeline.iter_sql_sections():
+            for statement in split_statements(section):
+                chunk.append(statement)
+                if len(chunk) >= chunk_statements:
+                    queue.put(chunk)  # Block khi queue đầy -> back-pressure
+                    chunk = []
+        if chunk:
+            queue.put(chunk)
+                
+    except Exception as e:
+        queue.put({'error': str(e)})
+    finally:
+        queue.put(None)
+
+
 class DataCoDeployer:
     """Production deployment cho DataCo import"""
     
-    def __init__(self, db_config: dict, sql_file: str, dry_run: bool = False):
+    def __init__(self, db_config: dict, sql_file: str, dry_run: bool = False,
+                 defer_indexes: bool = False, pipeline_csv: str = None,
+                 sort_by_key: bool = False):
         self.db_config = db_config
         self.sql_file = sql_file
         self.dry_run = dry_run
+        self.defer_indexes = defer_indexes
+        self.pipeline_csv = pipeline_csv  # Set -> generate và load song song, không qua file
+        self.sort_by_key = sort_by_key
         self.connection = None
         self.cursor = None
         
@@ -104,6 +160,54 @@ class DataCoDeployer:
             logger.error(f"❌ Data check failed: {e}")
             return {}
     
+    def _execute_statements(self, statements: Iterable[str], total: int = None) -> bool:
+        """Execute INSERT statements trong một transaction"""
+        total_label = total if total is not None else '?'
+        metrics = ImportMetrics('deploy_import', self.cursor, logger)
+        try:
+            self.connection.start_transaction()
+            metrics.start()
+            
+            success_count = 0
+            i = 0
+            for i, statement in enumerate(statements, 1):
+                if statement.upper().startswith('INSERT'):
+                    statement_start = time.perf_counter()
+                    try:
+                        self.cursor.execute(statement)
+                        affected = self.cursor.rowcount
+                        success_count += 1
+                        metrics.record_statement(statement, time.perf_counter() - statement_start, affected)
+                        
+                        if i % 10 == 0:  # Progress update every 10 statements
+                            logger.info(f"✅ Executed {i}/{total_label} statements, {affected} rows affected")
+                            
+                    except mysql.connector.Error as e:
+                        metrics.record_statement(statement, time.perf_counter() - statement_start, 0, success=False)
+                        logger.warning(f"⚠️  Statement {i} failed: {e}")
+                        # Continue with next statement
+            
+            # Commit transaction
+            commit_start = time.perf_counter()
+            self.connection.commit()
+            metrics.record_commit(time.perf_counter() - commit_start)
+            logger.info(f"✅ Import completed successfully! {success_count}/{i} statements executed")
+            
+            metrics.finish()
+            # Report ghi sau commit — lỗi I/O ở đây không được coi là import failed
+            try:
+                metrics.write_report(f"production_logs/import_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            except Exception as e:
+                logger.warning(f"⚠️  Could not write import metrics report: {e}")
+            
+            return True
+            
+        except Exception as e:
+            # Rollback on error
+            self.connection.rollback()
+            logger.error(f"❌ Import failed, rolled back: {e}")
+            return False
+    
     def execute_import(self) -> bool:
         """Execute SQL import với transaction management"""
         try:
@@ -111,6 +215,9 @@ class DataCoDeployer:
                 logger.info("🧪 DRY RUN MODE - No data will be imported")
                 return self.validate_sql_file()
             
+            if self.pipeline_csv:
+                return self.execute_pipelined_import()
+            
             logger.info("🚀 Starting database import...")
             
             # Read SQL file
@@ -118,45 +225,90 @@ class DataCoDeployer:
                 sql_content = f.read()
             
             # Split into individual statements
-            statements = [stmt.strip() for stmt in sql_content.split(';') if stmt.strip()]
+            statements = split_statements(sql_content)
             
             logger.info(f"📋 Found {len(statements)} SQL statements")
             
-            # Execute in transaction
-            try:
-                self.connection.start_transaction()
-                
-                success_count = 0
-                for i, statement in enumerate(statements, 1):
-                    if statement.upper().startswith('INSERT'):
-                        try:
-                            self.cursor.execute(statement)
-                            affected = self.cursor.rowcount
-                            success_count += 1
-                            
-                            if i % 10 == 0:  # Progress update every 10 statements
-                                logger.info(f"✅ Executed {i}/{len(statements)} statements, {affected} rows affected")
-                                
-                        except mysql.connector.Error as e:
-                            logger.warning(f"⚠️  Statement {i} failed: {e}")
-                            # Continue with next statement
-                
-                # Commit transaction
-                self.connection.commit()
-                logger.info(f"✅ Import completed successfully! {success_count}/{len(statements)} statements executed")
-                
-                return True
-                
-            except Exception as e:
-                # Rollback on error
-                self.connection.rollback()
-                logger.error(f"❌ Import failed, rolled back: {e}")
-                return False
+            return self._execute_statements(statements, len(statements))
             
         except Exception as e:
             logger.error(f"❌ Import execution failed: {e}")
             return False
     
+    @staticmethod
+    def _drain_queue(queue, producer, timeout: float = PIPELINE_GET_TIMEOUT) -> Iterator[str]:
+        """
+        Consume statement chunks cho tới sentinel None. Producer chết mà không gửi
+        sentinel (OOM, kill) => RuntimeError, transaction của loader được rollback.
+        """
+        while True:
+            try:
+                chunk = queue.get(timeout=timeout)
+            except queue_module.Empty:
+                if not producer.is_alive():
+                    raise RuntimeError(f"SQL generator exited (exit code {producer.exitcode}) "
+                                       f"without finishing")
+                continue
+            if chunk is None:
+                return
+            if isinstance(chunk, dict):
+                raise RuntimeError(f"SQL generator failed: {chunk['error']}")
+            yield from chunk
+    
+    def execute_pipelined_import(self) -> bool:
+        """
+        Generate SQL trong process riêng và load song song qua bounded queue,
+        để round trips tới DB chồng lên thời gian format SQL
+        """
+        logger.info(f"🚀 Starting pipelined import from {self.pipeline_csv} "
+                    f"(queue size: {PIPELINE_QUEUE_SIZE} x {PIPELINE_CHUNK_STATEMENTS} statements)...")
+        
+        queue = multiprocessing.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        producer = multiprocessing.Process(
+            target=produce_statement_batches,
+            args=(self.pipeline_csv, self.sort_by_key, queue),
+            daemon=True
+        )
+        start_time = time.time()
+        producer.start()
+        
+        success = False
+        try:
+            success = self._execute_statements(self._drain_queue(queue, producer))
+        finally:
+            if not success:
+                # Loader dừng sớm: producer có thể đang block trên queue đầy
+                producer.terminate()
+            producer.join()
+        
+        logger.info(f"⏱️  Pipelined import took {time.time() - start_time:.2f} seconds")
+        return success and producer.exitcode == 0
+    
+    def execute_import_with_deferred_indexes(self) -> bool:
+        """Execute import, optionally dropping secondary indexes around the bulk load"""
+        if not self.defer_indexes or self.dry_run:
+            return self.execute_import()
+        
+        logger.info(f"🗂️  Deferring secondary indexes on: {', '.join(BULK_LOAD_TABLES)}")
+        index_manager = SecondaryIndexManager(self.cursor, BULK_LOAD_TABLES, logger)
+        if not index_manager.drop_secondary_indexes():
+            # drop_secondary_indexes already restored whatever it dropped before failing
+            return False
+        
+        try:
+            import_ok = self.execute_import()
+        finally:
+            # Always rebuild, even when the import failed
+            start_time = time.time()
+            rebuild_ok = index_manager.rebuild_secondary_indexes()
+            logger.info(f"🔧 Index rebuild took {time.time() - start_time:.2f} seconds")
+        
+        if not rebuild_ok or not index_manager.verify_schema():
+            logger.error("❌ Index schema differs from pre-load snapshot, check index_definitions_*.json")
+            return False
+        
+        return import_ok
+    
     def validate_sql_file(self) -> bool:
         """Validate SQL file với AUTO_INCREMENT checks"""
         try:
@@ -287,7 +439,7 @@ class DataCoDeployer:
                     return False
             
             # Step 4: Execute import
-            if not self.execute_import():
+            if not self.execute_import_with_deferred_indexes():
                 return False
             
             # Step 5: Verify results (if not dry run)
@@ -315,6 +467,14 @@ def main():
     parser.add_argument('--password', default='fastroute_password', help='Database password')
     parser.add_argument('--database', default='fasteroute', help='Database name')
     parser.add_argument('--sql-file', default='dataco_complete_import.sql', help='SQL file to import')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='Drop secondary indexes before the bulk load and rebuild them afterwards')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Generate SQL from --csv-file in a separate process and load it concurrently')
+    parser.add_argument('--csv-file', default='DataCoSupplyChainDataset.csv',
+                        help='Source CSV for --pipeline mode')
+    parser.add_argument('--sort-by-key', action='store_true',
+                        help='In --pipeline mode, emit rows in clustered key order')
     
     args = parser.parse_args()
     
@@ -336,7 +496,10 @@ def main():
     deployer = DataCoDeployer(
         db_config=db_config,
         sql_file=args.sql_file,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        defer_indexes=args.defer_indexes,
+        pipeline_csv=args.csv_file if args.pipeline else None,
+        sort_by_key=args.sort_by_key
     )
     
     # Run deployment
@@ -74,6 +74,9 @@ class GenerationConfig:
     # Rush hours for orders
     rush_hours = [(9, 11), (14, 16), (19, 21)]
     
+    # Insert rows theo thứ tự clustered key / FK cha để giảm InnoDB page splits
+    sort_by_key: bool = False
+    
     def __post_init__(self):
         """Adjust counts based on scale."""
         if self.scale == "small":
@@ -453,10 +456,12 @@ class FastRouteDataGenerator:
         cursor = connection.cursor()
         
         # Get orders với vehicle assignments
-        cursor.execute("""
+        order_by = "ORDER BY id" if self.config.sort_by_key else ""
+        cursor.execute(f"""
             SELECT id, created_at, vehicle_id, address_id, total_amount 
             FROM orders 
             WHERE vehicle_id IS NOT NULL 
+            {order_by}
             LIMIT %s
         """, (count,))
         orders = cursor.fetchall()
@@ -528,7 +533,8 @@ class FastRouteDataGenerator:
         connection = self.db.get_connection()
         cursor = connection.cursor()
         
-        cursor.execute("""
+        order_by = "ORDER BY d.id" if self.config.sort_by_key else ""
+        cursor.execute(f"""
             SELECT d.id, d.vehicle_id, d.pickup_date, d.actual_delivery_time, 
                    COALESCE(a.latitude, 10.8231), COALESCE(a.longitude, 106.6297)
             FROM deliveries d
@@ -537,6 +543,7 @@ class FastRouteDataGenerator:
             WHERE d.vehicle_id IS NOT NULL
             AND d.pickup_date IS NOT NULL 
             AND d.actual_delivery_time IS NOT NULL
+            {order_by}
             LIMIT %s
         """, (count // 5,))  # Mỗi delivery có ~5 tracking points
         
@@ -908,6 +915,10 @@ class FastRouteDataGenerator:
                 f"Nhận chuyển kho từ WH-{from_warehouse} - {product['name']}"
             ))
             
+        if self.config.sort_by_key:
+            # Gom theo (product_id, warehouse_id) để FK indexes được insert tuần tự
+            transactions.sort(key=lambda t: (t[0], t[1]))
+            
         return transactions
         
     def generate_delivery_proofs(self, count: int = 15000) -> List[Tuple]:
@@ -1150,9 +1161,12 @@ def main():
                        default='all', help='Generation phase')
     parser.add_argument('--scale', choices=['small', 'medium', 'large'], 
                        default='medium', help='Data scale')
+    parser.add_argument('--sort-by-key', action='store_true',
+                       help='Emit rows in clustered key order to reduce InnoDB page splits')
     
     args = parser.parse_args()
     config.scale = args.scale
+    config.sort_by_key = args.sort_by_key
     config.__post_init__()  # Recalculate counts
     
     try:
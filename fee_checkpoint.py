@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpoint store (SQLite) cho các fee runs dài
+Thay cho shipping_fee_checkpoint*.json: mỗi lần lưu là một SQLite transaction
+(atomic, không bao giờ để lại file ghi dở), nhiều worker processes ghi chung
+một file (WAL + busy timeout), mỗi shard một cursor row.
+
+Một run (job = tên job + database) lưu: run_id, hash pricing config,
+changed_since (incremental), shard plan và cho từng shard cursor last_id +
+partial stats. Run chỉ được resume khi hash và changed_since còn khớp, nên
+rows trước cursor không bao giờ được tính lại theo pricing khác, và stats
+cộng tiếp từ partial stats thay vì đếm lại từ 0.
+
+Cursor được lưu ngay sau khi MySQL commit chunk: crash giữa hai bước chỉ làm
+chunk cuối chạy lại (fee writes idempotent).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from shipping_fee_config import PROCESSING_CONFIG
+
+# Shard index của run serial (không chia shard)
+SERIAL = -1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fee_runs (
+    job TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    changed_since TEXT,
+    pricing_version INTEGER,
+    shard_plan TEXT,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fee_cursors (
+    job TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    start_after INTEGER NOT NULL,
+    end_id INTEGER,
+    last_id INTEGER NOT NULL,
+    stats TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (job, shard)
+);
+"""
+
+
+class CheckpointStore:
+    """Run + per-shard cursors trong một file SQLite (CHECKPOINT_DB)"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or PROCESSING_CONFIG['checkpoint_db']
+        self._connection = None
+
+    def _db(self) -> sqlite3.Connection:
+        # Mở lazily: object được tạo trong process cha nhưng dùng trong từng worker (spawn)
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _write(self, statements: List[tuple]):
+        """Các statements trong một transaction (BEGIN IMMEDIATE: chờ lock thay vì lỗi giữa chừng)"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                db.execute(sql, params)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def active_run(self, job: str) -> Optional[Dict[str, Any]]:
+        row = self._db().execute("SELECT * FROM fee_runs WHERE job = ? AND status = 'running'", (job,)).fetchone()
+        if not row:
+            return None
+        run = dict(row)
+        run['shard_plan'] = json.loads(run['shard_plan']) if run['shard_plan'] else None
+        return run
+
+    def resume(self, job: str, config_hash: str, changed_since: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Run đang dở nếu resume được với pricing config / incremental window hiện tại"""
+        run = self.active_run(job)
+        if not run:
+            return None
+        if run['config_hash'] != config_hash:
+            logging.warning(f"⚠️  Checkpoint of run {run['run_id']} used a different pricing config, starting fresh")
+            return None
+        if run['changed_since'] != changed_since:
+            logging.warning(f"⚠️  Checkpoint of run {run['run_id']} covers a different incremental window, "
+                            f"starting fresh")
+            return None
+        return run
+
+    def start(self, job: str, run_id: str, config_hash: str, changed_since: Optional[str],
+              pricing_version: Optional[int]):
+        """Run mới: thay run cũ (nếu có) và xoá cursors của nó"""
+        now = datetime.now().isoformat()
+        self._write([
+            ("DELETE FROM fee_cursors WHERE job = ?", (job,)),
+            ("INSERT OR REPLACE INTO fee_runs (job, run_id, config_hash, changed_since, pricing_version, "
+             "shard_plan, status, started_at, updated_at) VALUES (?, ?, ?, ?, ?, NULL, 'running', ?, ?)",
+             (job, run_id, config_hash, changed_since, pricing_version, now, now))
+        ])
+
+    def save_plan(self, job: str, shards: List[Dict[str, int]]):
+        self._write([("UPDATE fee_runs SET shard_plan = ?, updated_at = ? WHERE job = ?",
+                      (json.dumps(shards), datetime.now().isoformat(), job))])
+
+    def save_cursor(self, job: str, shard: int, start_after: int, end_id: Optional[int], last_id: int,
+                    stats: Dict[str, Any]):
+        now = datetime.now().isoformat()
+        self._write([
+            ("INSERT OR REPLACE INTO fee_cursors (job, shard, start_after, end_id, last_id, stats, updated_at) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?)", (job, shard, start_after, end_id, last_id, json.dumps(stats), now)),
+            ("UPDATE fee_runs SET updated_at = ? WHERE job = ?", (now, job))
+        ])
+
+    def load_cursor(self, job: str, shard: int, start_after: int,
+                    end_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """Cursor của shard nếu cùng id range (plan khác => None)"""
+        row = self._db().execute(
+            "SELECT c.* FROM fee_cursors c JOIN fee_runs r ON r.job = c.job AND r.status = 'running' "
+            "WHERE c.job = ? AND c.shard = ?", (job, shard)).fetchone()
+        if not row:
+            return None
+        if row['start_after'] != start_after or row['end_id'] != end_id:
+            logging.info("📋 Checkpoint belongs to a different range plan, ignoring")
+            return None
+        return {'last_id': row['last_id'], 'stats': json.loads(row['stats'])}
+
+    def cursors(self, job: str) -> List[Dict[str, Any]]:
+        rows = self._db().execute("SELECT * FROM fee_cursors WHERE job = ? ORDER BY shard", (job,)).fetchall()
+        return [{**dict(row), 'stats': json.loads(row['stats'])} for row in rows]
+
+    def complete(self, job: str):
+        """Run xong: giữ cursors/stats để tra cứu, run sau sẽ bắt đầu mới"""
+        self._write([("UPDATE fee_runs SET status = 'completed', updated_at = ? WHERE job = ?",
+                      (datetime.now().isoformat(), job))])
+
+    def discard(self, job: str):
+        self._write([("DELETE FROM fee_cursors WHERE job = ?", (job,)),
+                     ("DELETE FROM fee_runs WHERE job = ?", (job,))])
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
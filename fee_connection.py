@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Failure-driven connection management thay cho ping SELECT 1 định kỳ
+Không kiểm tra connection trước mỗi query: câu lệnh chạy thẳng, chỉ khi lỗi vì
+mất connection mới lấy connection mới từ pool và chạy lại. Chạy lại chỉ an
+toàn khi transaction hiện tại chưa có write nào (writes chưa commit đã mất cùng
+connection cũ) - khi đó lỗi được raise để caller làm lại từ checkpoint.
+
+Stats đếm số ping mà policy cũ (mỗi CONNECTION_CHECK_INTERVAL operations hoặc
+sau MAX_CONNECTION_IDLE giây) đã phải gửi, nhân với RTT đo lúc connect.
+"""
+
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+import mysql.connector
+from mysql.connector import errors, pooling
+
+# Lỗi cho biết connection đã chết (không phải lỗi của bản thân câu lệnh)
+CONNECTION_LOST_ERRNOS = {
+    1053,  # ER_SERVER_SHUTDOWN
+    2006,  # CR_SERVER_GONE_ERROR
+    2013,  # CR_SERVER_LOST
+    2055,  # CR_SERVER_LOST_EXTENDED
+    4031,  # ER_CLIENT_INTERACTION_TIMEOUT
+}
+
+
+class ConnectionManager:
+    """Pooled connection + cursor (dictionary, buffered) với retry khi mất connection"""
+
+    def __init__(self, db_config: Dict[str, Any], pool_name: Optional[str] = None, pool_size: int = 2,
+                 max_retries: int = 3, retry_delay: float = 1.0,
+                 check_interval: int = 100, max_idle: float = 30.0):
+        self.db_config = db_config
+        self.pool_name = pool_name or f"shipping_fee_{os.getpid()}"
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Policy ping cũ, chỉ dùng để đo overhead đã bỏ
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+
+        self.pool = None
+        self.connection = None
+        self.cursor = None
+        self.in_transaction = False
+        self.pending_writes = False
+        # Gọi sau mỗi lần reconnect thành công (stats, throttle...)
+        self.on_reconnect: Optional[Callable[[], None]] = None
+
+        self.ping_rtt = 0.0
+        self._since_check = 0
+        self._last_check = time.monotonic()
+        self.stats = {'operations': 0, 'connects': 0, 'reconnects': 0, 'retried_operations': 0,
+                      'connection_errors': 0, 'pings_avoided': 0}
+
+    def connect(self):
+        """Lấy connection từ pool (tạo pool lần đầu); raise mysql.connector.Error"""
+        if self.pool is None:
+            config = {key: value for key, value in self.db_config.items() if key not in ('pool_name', 'pool_size')}
+            self.pool = pooling.MySQLConnectionPool(pool_name=self.pool_name, pool_size=self.pool_size, **config)
+        self.connection = self.pool.get_connection()
+        self.cursor = self.connection.cursor(dictionary=True, buffered=True)
+        self.in_transaction = False
+        self.pending_writes = False
+        self.stats['connects'] += 1
+
+        # Một SELECT 1 mỗi connect: kiểm tra connection mới và đo RTT
+        start = time.perf_counter()
+        self.cursor.execute("SELECT 1")
+        self.cursor.fetchone()
+        self.ping_rtt = time.perf_counter() - start
+
+    def discard(self):
+        """Bỏ connection hiện tại (trả về pool; pool tự reconnect khi lấy ra lần sau)"""
+        for resource in (self.cursor, self.connection):
+            try:
+                if resource:
+                    resource.close()
+            except (mysql.connector.Error, AttributeError):
+                pass
+        self.connection = None
+        self.cursor = None
+        self.in_transaction = False
+        self.pending_writes = False
+
+    def close(self):
+        self.discard()
+
+    def reconnect(self) -> bool:
+        """Connection mới từ pool, progressive delay giữa các lần thử"""
+        self.discard()
+        for attempt in range(self.max_retries):
+            try:
+                time.sleep(self.retry_delay * attempt)
+                self.connect()
+                self.stats['reconnects'] += 1
+                logging.info(f"✅ Database reconnected (attempt {attempt + 1})")
+                if self.on_reconnect:
+                    self.on_reconnect()
+                return True
+            except mysql.connector.Error as e:
+                logging.error(f"❌ Reconnection attempt {attempt + 1} failed: {e}")
+                self.discard()
+        logging.error("💥 All reconnection attempts failed!")
+        return False
+
+    def is_connection_lost(self, error: Exception) -> bool:
+        if getattr(error, 'errno', None) in CONNECTION_LOST_ERRNOS:
+            return True
+        # errno không rõ (vd. "MySQL Connection not available"): chỉ lúc này mới ping để xác nhận
+        if isinstance(error, (errors.InterfaceError, errors.OperationalError)):
+            try:
+                return not (self.connection and self.connection.is_connected())
+            except Exception:
+                return True
+        return False
+
+    def begin(self):
+        """START TRANSACTION (mất connection thì reconnect và bắt đầu lại, chưa có write nào)"""
+        self.execute(lambda cursor: self.connection.start_transaction())
+        self.in_transaction = True
+        self.pending_writes = False
+
+    def commit(self):
+        self.connection.commit()
+        self.in_transaction = False
+        self.pending_writes = False
+
+    def rollback(self):
+        """Rollback, bỏ qua lỗi (connection có thể đã chết)"""
+        try:
+            if self.connection:
+                self.connection.rollback()
+        except mysql.connector.Error:
+            pass
+        self.in_transaction = False
+        self.pending_writes = False
+
+    def execute(self, operation: Callable[[Any], Any], write: bool = False) -> Any:
+        """
+        Chạy operation(cursor). Mất connection: reconnect và chạy lại nếu transaction
+        chưa có write (operation phải idempotent); ngược lại raise cho caller.
+        """
+        self.stats['operations'] += 1
+        self._count_avoided_ping()
+
+        attempt = 0
+        while True:
+            try:
+                result = operation(self.cursor)
+                if write:
+                    self.pending_writes = True
+                return result
+            except mysql.connector.Error as e:
+                if not self.is_connection_lost(e):
+                    raise
+                self.stats['connection_errors'] += 1
+                if self.pending_writes:
+                    logging.warning(f"⚠️  Connection lost with uncommitted writes: {e}")
+                    raise
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logging.warning(f"⚠️  Connection lost ({e}), retrying on a fresh connection")
+                was_in_transaction = self.in_transaction
+                if not self.reconnect():
+                    raise
+                if was_in_transaction:
+                    self.connection.start_transaction()
+                    self.in_transaction = True
+                self.stats['retried_operations'] += 1
+
+    def _count_avoided_ping(self):
+        self._since_check += 1
+        now = time.monotonic()
+        if self._since_check >= self.check_interval or now - self._last_check > self.max_idle:
+            self.stats['pings_avoided'] += 1
+            self._since_check = 0
+            self._last_check = now
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, 'ping_rtt_ms': round(self.ping_rtt * 1000, 3),
+                'ping_seconds_avoided': round(self.stats['pings_avoided'] * self.ping_rtt, 3)}
+
+    def log_summary(self):
+        logging.info(f"🔌 Connection: {self.stats['operations']:,} operations, "
+                     f"{self.stats['reconnects']:,} reconnects, {self.stats['retried_operations']:,} retried; "
+                     f"{self.stats['pings_avoided']:,} pings avoided "
+                     f"(~{self.stats['pings_avoided'] * self.ping_rtt:.2f}s at {self.ping_rtt * 1000:.2f}ms RTT)")
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fee change journal thay cho backup toàn bảng (CREATE TABLE ... AS SELECT)
+Chỉ ghi (id, old_fee, new_fee) của các rows thực sự được UPDATE, trong bảng
+fee_change_journal (cùng transaction với UPDATE) hoặc file JSONL local (ghi
+trước khi UPDATE). Rollback replay journal của một run: mỗi row về old_fee
+của entry đầu tiên, chỉ khi giá trị hiện tại vẫn là new_fee của entry cuối
+(row đã bị sửa sau run thì bỏ qua, trừ khi --force).
+
+File mode: entries được ghi (và flush) trước UPDATE, ngoài transaction của chunk
+=> chunk rollback thì entries vẫn còn trong file. Rollback vẫn đúng: row của
+entry đó vẫn giữ old_fee (khác new_fee) nên bị bỏ qua như row đã đổi sau run;
+với --force nó được ghi lại old_fee - chính giá trị đang có.
+
+BACKUP_MODE: full (copy bảng) | journal (bảng fee_change_journal) | file (JSONL) | none
+
+Usage:
+    python3 fee_journal.py list [--production]
+    python3 fee_journal.py rollback RUN_ID [--force] [--production]
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import mysql.connector
+
+from shipping_fee_config import get_database_config, PROCESSING_CONFIG
+
+JOURNAL_TABLE = "fee_change_journal"
+JOURNAL_MODES = ('journal', 'file')
+
+# Chỉ các cột phí này được journal/rollback (tên bảng/cột không bao giờ lấy từ input ngoài)
+JOURNALED_COLUMNS = {
+    'order_items': 'shipping_fee',
+    'deliveries': 'delivery_fee'
+}
+
+CREATE_JOURNAL_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {JOURNAL_TABLE} (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    run_id VARCHAR(64) NOT NULL,
+    table_name VARCHAR(64) NOT NULL,
+    row_id BIGINT NOT NULL,
+    old_fee DECIMAL(38,2) DEFAULT NULL,
+    new_fee DECIMAL(38,2) NOT NULL,
+    created_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    KEY idx_fee_change_journal_run (run_id, id)
+) ENGINE=InnoDB
+"""
+
+
+def new_run_id() -> str:
+    return datetime.now().strftime('%Y%m%d_%H%M%S')
+
+
+def journal_files(run_id: str, journal_dir: str) -> List[str]:
+    """File JSONL của run (process chính + từng shard)"""
+    return sorted(glob.glob(os.path.join(journal_dir, f"fee_journal_{run_id}*.jsonl")))
+
+
+def _fee(value) -> Optional[str]:
+    return str(Decimal(str(value))) if value is not None else None
+
+
+class FeeChangeJournal:
+    """Ghi (id, old_fee, new_fee) trước mỗi write của ExecutemanyFeeWriter/StagingFeeWriter"""
+
+    def __init__(self, mode: str, run_id: str, journal_dir: Optional[str] = None,
+                 shard_index: Optional[int] = None):
+        if mode not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode: {mode} (expected one of {JOURNAL_MODES})")
+        self.mode = mode
+        self.run_id = run_id
+        self.journal_dir = journal_dir or PROCESSING_CONFIG['journal_dir']
+        self.suffix = f"_shard_{shard_index}" if shard_index is not None else ""
+        self.file_path = os.path.join(self.journal_dir, f"fee_journal_{run_id}{self.suffix}.jsonl")
+        self._file = None
+        self.stats = {'entries': 0, 'round_trips': 0, 'seconds': 0.0}
+
+    def resume(self, run_id: str):
+        """Ghi tiếp journal của run đang được resume (gọi trước prepare)"""
+        self.run_id = run_id
+        self.file_path = os.path.join(self.journal_dir, f"fee_journal_{run_id}{self.suffix}.jsonl")
+
+    def prepare(self, cursor):
+        """Tạo bảng journal (DDL => implicit commit, gọi trước khi bắt đầu transaction) hoặc mở file"""
+        if self.mode == 'journal':
+            cursor.execute(CREATE_JOURNAL_TABLE)
+        else:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._file = open(self.file_path, 'a', encoding='utf-8')
+        logging.info(f"📒 Fee change journal ({self.mode}): run {self.run_id}"
+                     + (f" -> {self.file_path}" if self.mode == 'file' else f" -> {JOURNAL_TABLE}"))
+
+    def record(self, cursor, table: str, column: str, updates: List[tuple]) -> int:
+        """
+        updates: [(fee, id), ...] sắp được ghi. Đọc giá trị cũ bằng SELECT ... FOR UPDATE
+        (khoá rows tới hết transaction) rồi ghi journal trước UPDATE. File mode không
+        rollback theo transaction: entries của chunk bị rollback vẫn nằm trong file.
+        """
+        if not updates:
+            return 0
+        if JOURNALED_COLUMNS.get(table) != column:
+            raise ValueError(f"{table}.{column} is not a journaled fee column")
+        start = time.perf_counter()
+
+        latest = dict((row_id, fee) for fee, row_id in updates)
+        row_ids = sorted(latest)
+        cursor.execute(
+            f"SELECT id, {column} AS old_fee FROM {table} WHERE id IN ({', '.join(['%s'] * len(row_ids))}) "
+            f"FOR UPDATE",
+            row_ids
+        )
+        old_fees = {row['id']: row['old_fee'] for row in cursor.fetchall()}
+        self.stats['round_trips'] += 1
+        self.stats['seconds'] += time.perf_counter() - start
+
+        return self.record_entries(cursor, table, [(row_id, old_fees[row_id], latest[row_id])
+                                                   for row_id in row_ids if row_id in old_fees])
+
+    def record_entries(self, cursor, table: str, entries: List[Tuple[int, Any, Any]]) -> int:
+        """Ghi [(id, old_fee, new_fee), ...] đã biết (vd. SQL pushdown tự SELECT các rows sẽ đổi)"""
+        if not entries:
+            return 0
+        start = time.perf_counter()
+        if self.mode == 'journal':
+            cursor.execute(
+                f"INSERT INTO {JOURNAL_TABLE} (run_id, table_name, row_id, old_fee, new_fee) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s)"] * len(entries)),
+                [value for row_id, old_fee, new_fee in entries
+                 for value in (self.run_id, table, row_id, old_fee, new_fee)]
+            )
+            self.stats['round_trips'] += 1
+        else:
+            self._file.write("".join(
+                json.dumps({'table': table, 'id': row_id, 'old': _fee(old_fee), 'new': _fee(new_fee)}) + "\n"
+                for row_id, old_fee, new_fee in entries
+            ))
+            self._file.flush()
+
+        self.stats['entries'] += len(entries)
+        self.stats['seconds'] += time.perf_counter() - start
+        return len(entries)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, 'mode': self.mode, 'run_id': self.run_id, 'seconds': round(self.stats['seconds'], 3),
+                'file': self.file_path if self.mode == 'file' else None}
+
+    def log_summary(self):
+        logging.info(f"📒 Fee change journal: {self.stats['entries']:,} entries for run {self.run_id} "
+                     f"({self.stats['round_trips']:,} round trips, {self.stats['seconds']:.2f}s)")
+
+
+def load_journal(cursor, run_id: str, journal_dir: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
+    """(source, entries theo thứ tự ghi) của một run: file JSONL nếu có, ngược lại bảng journal"""
+    files = journal_files(run_id, journal_dir or PROCESSING_CONFIG['journal_dir'])
+    if files:
+        entries = []
+        for path in files:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries.extend(json.loads(line) for line in f if line.strip())
+        return 'file', entries
+
+    cursor.execute(
+        f"SELECT table_name, row_id, old_fee, new_fee FROM {JOURNAL_TABLE} WHERE run_id = %s ORDER BY id",
+        (run_id,)
+    )
+    return 'journal', [{'table': row['table_name'], 'id': row['row_id'],
+                        'old': _fee(row['old_fee']), 'new': _fee(row['new_fee'])} for row in cursor.fetchall()]
+
+
+def rollback_plan(entries: List[Dict[str, Any]]) -> Dict[str, Dict[int, Tuple[Optional[str], str]]]:
+    """{table: {id: (restore_to, expected_current)}}: old của entry đầu, new của entry cuối"""
+    plan: Dict[str, Dict[int, Tuple[Optional[str], str]]] = {}
+    for entry in entries:
+        rows = plan.setdefault(entry['table'], {})
+        restore_to = rows[entry['id']][0] if entry['id'] in rows else entry['old']
+        rows[entry['id']] = (restore_to, entry['new'])
+    return plan
+
+
+def rollback_run(connection, run_id: str, force: bool = False, journal_dir: Optional[str] = None,
+                 chunk_size: int = 1000) -> Dict[str, Any]:
+    """
+    Replay journal ngược: nạp plan vào TEMPORARY table (multi-row INSERT) rồi
+    một UPDATE ... JOIN cho mỗi bảng, tất cả trong một transaction. Không bump
+    updated_at (như fee writes): incremental run sau không coi rows vừa restore
+    là thay đổi và không áp lại fees vừa rollback.
+    """
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    try:
+        source, entries = load_journal(cursor, run_id, journal_dir)
+        plan = rollback_plan(entries)
+        unknown = set(plan) - set(JOURNALED_COLUMNS)
+        if unknown:
+            raise ValueError(f"Journal references unknown tables: {sorted(unknown)}")
+
+        cursor.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS fee_rollback ("
+            "table_name VARCHAR(64) NOT NULL, id BIGINT NOT NULL, restore_fee DECIMAL(38,2) NULL, "
+            "expected_fee DECIMAL(38,2) NOT NULL, PRIMARY KEY (table_name, id)) ENGINE=InnoDB"
+        )
+        cursor.execute("DELETE FROM fee_rollback")
+
+        result = {'run_id': run_id, 'source': source, 'entries': len(entries), 'tables': {}}
+        for table, rows in plan.items():
+            items = sorted(rows.items())
+            for offset in range(0, len(items), chunk_size):
+                chunk = items[offset:offset + chunk_size]
+                cursor.execute(
+                    "INSERT INTO fee_rollback (table_name, id, restore_fee, expected_fee) VALUES "
+                    + ", ".join(["(%s, %s, %s, %s)"] * len(chunk)),
+                    [value for row_id, (restore_to, expected) in chunk for value in (table, row_id, restore_to, expected)]
+                )
+
+            column = JOURNALED_COLUMNS[table]
+            guard = "" if force else f" WHERE t.{column} <=> r.expected_fee"
+            cursor.execute(
+                f"UPDATE {table} t JOIN fee_rollback r ON r.table_name = %s AND r.id = t.id "
+                f"SET t.{column} = r.restore_fee{guard}",
+                (table,)
+            )
+            restored = cursor.rowcount
+            result['tables'][table] = {'rows': len(items), 'restored': restored,
+                                       'skipped_changed_since': len(items) - restored}
+
+        connection.commit()
+        return result
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def list_runs(cursor, journal_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Runs có journal (bảng + files)"""
+    runs = []
+    try:
+        cursor.execute(
+            f"SELECT run_id, COUNT(*) AS entries, MIN(created_at) AS started_at FROM {JOURNAL_TABLE} "
+            f"GROUP BY run_id ORDER BY started_at DESC"
+        )
+        runs = [{'run_id': row['run_id'], 'source': 'journal', 'entries': row['entries']}
+                for row in cursor.fetchall()]
+    except mysql.connector.Error as e:
+        logging.warning(f"⚠️  Cannot read {JOURNAL_TABLE}: {e}")
+
+    for path in sorted(glob.glob(os.path.join(journal_dir or PROCESSING_CONFIG['journal_dir'],
+                                              "fee_journal_*.jsonl")), reverse=True):
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = sum(1 for line in f if line.strip())
+        runs.append({'run_id': os.path.basename(path)[len('fee_journal_'):-len('.jsonl')],
+                     'source': 'file', 'entries': entries})
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fee change journal: list runs / roll back a run')
+    parser.add_argument('command', choices=['list', 'rollback'])
+    parser.add_argument('run_id', nargs='?', help='Run to roll back')
+    parser.add_argument('--force', action='store_true', help='Restore rows even if changed after the run')
+    parser.add_argument('--journal-dir', default=PROCESSING_CONFIG['journal_dir'], help='JSONL journal directory')
+    parser.add_argument('--production', action='store_true', help='Use the production database')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db_config = get_database_config(is_test=not args.production)
+    try:
+        connection = mysql.connector.connect(**db_config)
+    except mysql.connector.Error as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(1)
+
+    try:
+        if args.command == 'list':
+            cursor = connection.cursor(dictionary=True, buffered=True)
+            for run in list_runs(cursor, args.journal_dir):
+                print(f"   {run['run_id']:<32} {run['source']:<8} {run['entries']:>12,} entries")
+            connection.rollback()
+            return
+
+        if not args.run_id:
+            parser.error("rollback needs a RUN_ID")
+        result = rollback_run(connection, args.run_id, args.force, args.journal_dir)
+        print(f"⏪ Rolled back run {result['run_id']} from {result['source']} ({result['entries']:,} entries)")
+        for table, stats in result['tables'].items():
+            print(f"   {table}: {stats['restored']:,}/{stats['rows']:,} restored, "
+                  f"{stats['skipped_changed_since']:,} skipped (changed after the run)")
+    except (mysql.connector.Error, ValueError) as e:
+        print(f"❌ Rollback failed: {e}")
+        sys.exit(1)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fee memo table keyed on (product_id, service_type)
+Shipping fee chỉ phụ thuộc weight, volume, is_fragile của product và
+service_type của delivery, nên với ~100 products x 4 service types hầu hết
+order_items chỉ cần một dictionary lookup.
+
+Entry bị invalidate khi attributes của product thay đổi; file persist chỉ được
+dùng lại khi hash của pricing config và kind của kết quả ('fee' hay
+'breakdown') còn khớp - các scripts dùng chung FEE_MEMO_FILE.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from shipping_fee_config import SHIPPING_CONSTANTS, SERVICE_TYPE_MULTIPLIERS
+
+DEFAULT_PRICING_CONFIG = {
+    'constants': SHIPPING_CONSTANTS,
+    'service_multipliers': SERVICE_TYPE_MULTIPLIERS
+}
+
+
+def _canonical(value: Any) -> Any:
+    """Decimal theo giá trị, không theo scale: Decimal('15000.0000') và Decimal('15000') cùng hash"""
+    if isinstance(value, dict):
+        return {key: _canonical(v) for key, v in value.items()}
+    if isinstance(value, (tuple, list)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, Decimal):
+        return format(value.normalize(), 'f')
+    return value
+
+
+def pricing_config_hash(config: Dict[str, Any] = DEFAULT_PRICING_CONFIG) -> str:
+    """Hash ổn định của pricing config (Decimal -> str đã normalize)"""
+    payload = json.dumps(_canonical(config), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, tuple):
+        return [_encode(v) for v in value]
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(_decode(v) for v in value)
+    return Decimal(value) if isinstance(value, str) else value
+
+
+RESULT_KINDS = ('fee', 'breakdown')  # fee_engine.fee -> Decimal, fee_engine.breakdown -> (fee, weight, base_fee)
+
+
+class FeeMemo:
+    """In-process memo của kết quả calculate(weight, volume, is_fragile, service_type)"""
+
+    def __init__(self, calculate: Callable[..., Any], kind: str,
+                 config: Dict[str, Any] = DEFAULT_PRICING_CONFIG,
+                 persist_file: Optional[str] = None):
+        if kind not in RESULT_KINDS:
+            raise ValueError(f"Unknown fee memo kind: {kind}")
+        self.calculate = calculate
+        self.kind = kind
+        self.config_hash = pricing_config_hash(config)
+        self.persist_file = persist_file
+        self.entries: Dict[Tuple[Any, Any], Tuple[Tuple, Any]] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+        if persist_file:
+            self.load()
+
+    @staticmethod
+    def _attributes(weight, volume, is_fragile) -> Tuple:
+        """Attributes của product ảnh hưởng tới phí (so sánh theo giá trị Decimal)"""
+        return (str(weight) if weight is not None else None,
+                str(volume) if volume is not None else None,
+                bool(is_fragile))
+
+    def lookup(self, product_id, weight, volume, is_fragile, service_type) -> Any:
+        """Kết quả calculate() cho product/service, tính lại nếu attributes đã đổi"""
+        key = (product_id, service_type)
+        attributes = self._attributes(weight, volume, is_fragile)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == attributes:
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['invalidations'] += 1
+
+        self.stats['misses'] += 1
+        result = self.calculate(weight, volume, is_fragile, service_type)
+        self.entries[key] = (attributes, result)
+        return result
+
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, 'entries': len(self.entries), 'hit_rate': round(self.hit_rate(), 4)}
+
+    def log_summary(self):
+        logging.info(f"🧠 Fee memo: {len(self.entries):,} entries, hit rate {self.hit_rate():.2%} "
+                     f"({self.stats['hits']:,} hits, {self.stats['misses']:,} misses, "
+                     f"{self.stats['invalidations']:,} invalidations)")
+
+    def load(self) -> bool:
+        """Load memo đã persist nếu cùng pricing config và cùng kind"""
+        if not self.persist_file or not os.path.exists(self.persist_file):
+            return False
+        try:
+            with open(self.persist_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('config_hash') != self.config_hash:
+                logging.info("🧠 Fee memo file built with different pricing config, ignoring")
+                return False
+            if data.get('kind') != self.kind:
+                logging.info(f"🧠 Fee memo file holds '{data.get('kind')}' results, expected '{self.kind}', ignoring")
+                return False
+            for product_id, service_type, attributes, result in data['entries']:
+                self.entries[(product_id, service_type)] = (tuple(attributes), _decode(result))
+            logging.info(f"🧠 Loaded {len(self.entries):,} fee memo entries from {self.persist_file}")
+            return True
+        except Exception as e:
+            logging.warning(f"⚠️  Cannot load fee memo: {e}")
+            return False
+
+    def save(self) -> bool:
+        """Persist memo (atomic replace)"""
+        if not self.persist_file:
+            return False
+        try:
+            data = {
+                'config_hash': self.config_hash,
+                'kind': self.kind,
+                'entries': [[product_id, service_type, list(attributes), _encode(result)]
+                            for (product_id, service_type), (attributes, result) in self.entries.items()]
+            }
+            tmp_file = f"{self.persist_file}.{os.getpid()}.tmp"  # Nhiều worker processes có thể save cùng lúc
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.persist_file)
+            return True
+        except Exception as e:
+            logging.warning(f"⚠️  Cannot save fee memo: {e}")
+            return False
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive throttle thay cho sleep cố định giữa các transaction chunks
+Mỗi THROTTLE_SAMPLE_SECONDS đọc tải server (Threads_running, InnoDB row lock
+waits, replication lag của replicas) rồi chỉnh delay giữa các chunks theo AIMD:
+vượt ngưỡng => delay tăng gấp đôi (tối đa THROTTLE_MAX_DELAY), dưới ngưỡng =>
+delay giảm một nửa về 0. Server rảnh chạy full speed, server bận được giãn ra.
+
+Chỉ pause giữa các chunks (sau commit, không giữ lock). Ngưỡng = 0 tắt signal đó.
+"""
+
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import mysql.connector
+
+STATUS_QUERY = (
+    "SELECT VARIABLE_NAME, VARIABLE_VALUE FROM performance_schema.global_status "
+    "WHERE VARIABLE_NAME IN ('Threads_running', 'Innodb_row_lock_current_waits')"
+)
+
+# Delay nhỏ nhất khi bắt đầu giãn (s); dưới mức này coi như 0
+MIN_DELAY = 0.1
+
+
+def replica_lag(cursor) -> Optional[float]:
+    """Seconds behind source của replica (None nếu replication không chạy)"""
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+        lag_column = 'Seconds_Behind_Source'
+    except mysql.connector.Error:
+        # MySQL < 8.0.22
+        cursor.execute("SHOW SLAVE STATUS")
+        lag_column = 'Seconds_Behind_Master'
+    row = cursor.fetchone()
+    if not row or row.get(lag_column) is None:
+        return None
+    return float(row[lag_column])
+
+
+class AdaptiveThrottle:
+    """Delay giữa các chunks điều chỉnh theo tải server"""
+
+    def __init__(self, config: Dict[str, Any], db_config: Optional[Dict[str, Any]] = None):
+        self.max_threads_running = config['throttle_max_threads_running']
+        self.max_lock_waits = config['throttle_max_lock_waits']
+        self.max_replica_lag = config['throttle_max_replica_lag']
+        self.sample_seconds = config['throttle_sample_seconds']
+        self.max_delay = config['throttle_max_delay']
+        # Replicas (host hoặc host:port, cùng credentials) để đọc lag; rỗng = không kiểm tra
+        self.replica_hosts = [host for host in config['throttle_replica_hosts'].split(',') if host.strip()]
+        self.db_config = db_config or {}
+        self.replica_connections: Dict[str, Any] = {}
+
+        self.delay = 0.0
+        self.last_sample = 0.0
+        self.last_signals: Dict[str, Any] = {}
+        self.stats = {'samples': 0, 'overloaded_samples': 0, 'sample_errors': 0,
+                      'pauses': 0, 'slept_seconds': 0.0, 'max_delay': 0.0}
+
+    def pause(self, connection):
+        """Gọi giữa các chunks: sample (nếu tới hạn), chỉnh delay rồi sleep"""
+        if time.monotonic() - self.last_sample >= self.sample_seconds:
+            self._adjust(self.sample(connection))
+
+        if self.delay > 0:
+            time.sleep(self.delay)
+            self.stats['pauses'] += 1
+            self.stats['slept_seconds'] += self.delay
+
+    def penalize(self):
+        """Lỗi/mất kết nối cũng là dấu hiệu quá tải: giãn chunks như khi vượt ngưỡng"""
+        self._adjust(['connection failure'])
+
+    def sample(self, connection) -> List[str]:
+        """Đọc signals, trả về các signals vượt ngưỡng"""
+        self.last_sample = time.monotonic()
+        self.stats['samples'] += 1
+        over = []
+        try:
+            cursor = connection.cursor(dictionary=True, buffered=True)
+            try:
+                cursor.execute(STATUS_QUERY)
+                status = {row['VARIABLE_NAME'].lower(): int(row['VARIABLE_VALUE']) for row in cursor.fetchall()}
+            finally:
+                cursor.close()
+                # SELECT dưới autocommit=0 mở transaction; đóng lại trước start_transaction() tiếp theo
+                connection.rollback()
+        except mysql.connector.Error as e:
+            self.stats['sample_errors'] += 1
+            logging.warning(f"⚠️  Throttle sample failed: {e}")
+            return over
+
+        threads_running = status.get('threads_running', 0)
+        lock_waits = status.get('innodb_row_lock_current_waits', 0)
+        self.last_signals = {'threads_running': threads_running, 'row_lock_waits': lock_waits}
+        if self.max_threads_running and threads_running > self.max_threads_running:
+            over.append(f"Threads_running {threads_running} > {self.max_threads_running}")
+        if self.max_lock_waits and lock_waits > self.max_lock_waits:
+            over.append(f"row lock waits {lock_waits} > {self.max_lock_waits}")
+
+        if self.max_replica_lag:
+            for host in self.replica_hosts:
+                lag = self._replica_lag(host)
+                self.last_signals[f"replica_lag[{host}]"] = lag
+                if lag is None:
+                    # Replication dừng/không đọc được: không biết lag, coi như vượt ngưỡng cho an toàn
+                    over.append(f"replica {host} lag unknown")
+                elif lag > self.max_replica_lag:
+                    over.append(f"replica {host} lag {lag:.0f}s > {self.max_replica_lag:.0f}s")
+        return over
+
+    def _replica_lag(self, host: str) -> Optional[float]:
+        try:
+            connection = self.replica_connections.get(host)
+            if connection is None or not connection.is_connected():
+                name, _, port = host.strip().partition(':')
+                config = {**self.db_config, 'host': name, 'autocommit': True}
+                if port:
+                    config['port'] = int(port)
+                connection = mysql.connector.connect(**config)
+                self.replica_connections[host] = connection
+            cursor = connection.cursor(dictionary=True, buffered=True)
+            try:
+                return replica_lag(cursor)
+            finally:
+                cursor.close()
+        except mysql.connector.Error as e:
+            self.stats['sample_errors'] += 1
+            logging.warning(f"⚠️  Cannot read replication lag from {host}: {e}")
+            self.replica_connections.pop(host, None)
+            return None
+
+    def _adjust(self, over: List[str]):
+        previous = self.delay
+        if over:
+            self.stats['overloaded_samples'] += 1
+            self.delay = min(self.max_delay, max(MIN_DELAY, self.delay * 2))
+        else:
+            self.delay = self.delay / 2 if self.delay / 2 >= MIN_DELAY else 0.0
+        self.stats['max_delay'] = max(self.stats['max_delay'], self.delay)
+
+        if over and self.delay != previous:
+            logging.info(f"🐢 Throttle: delay {previous:.2f}s -> {self.delay:.2f}s ({'; '.join(over)})")
+        elif not over and previous and not self.delay:
+            logging.info("🐇 Throttle: server under thresholds, full speed")
+
+    def close(self):
+        for connection in self.replica_connections.values():
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+        self.replica_connections = {}
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, 'slept_seconds': round(self.stats['slept_seconds'], 2), 'current_delay': self.delay}
+
+    def log_summary(self):
+        logging.info(f"🚦 Throttle: {self.stats['overloaded_samples']:,}/{self.stats['samples']:,} samples over "
+                     f"thresholds, slept {self.stats['slept_seconds']:.1f}s in {self.stats['pauses']:,} pauses "
+                     f"(max delay {self.stats['max_delay']:.2f}s)")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+High-water mark cho incremental shipping fee recalculation
+Watermark = thời điểm (theo đồng hồ của MySQL) bắt đầu lần chạy thành công
+gần nhất. Lần chạy sau chỉ tính lại order_items mới hoặc có order_item,
+product hay delivery (service_type) thay đổi từ watermark.
+
+Pricing config đổi (hash khác) hoặc FULL_REBUILD => chạy lại toàn bộ.
+
+Fee writes của calculator không bump updated_at (nếu bump, mọi row vừa ghi đều
+>= watermark và lần chạy sau chọn lại toàn bộ), nên delivery cần tính lại khi
+item đổi vì product đổi được nhận ra qua products.updated_at.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from fee_memo import DEFAULT_PRICING_CONFIG, pricing_config_hash
+
+
+def sql_datetime(value: datetime) -> str:
+    """Datetime literal cho MySQL (chỉ nhận datetime, không nhận string từ ngoài)"""
+    if not isinstance(value, datetime):
+        raise TypeError(f"Expected datetime, got {type(value).__name__}")
+    return f"'{value.strftime('%Y-%m-%d %H:%M:%S.%f')}'"
+
+
+def changed_order_items_where(since: datetime) -> str:
+    """WHERE cho build_order_item_delivery_query: order_items cần tính lại từ since"""
+    since_sql = sql_datetime(since)
+    return (f"(oi.shipping_fee IS NULL OR oi.updated_at >= {since_sql} OR d.updated_at >= {since_sql} "
+            f"OR oi.product_id IN (SELECT id FROM products WHERE updated_at >= {since_sql}))")
+
+
+def changed_deliveries_where(since: datetime) -> str:
+    """WHERE cho delivery aggregation: deliveries có order_items, products của items (hoặc chính nó) thay đổi từ since"""
+    since_sql = sql_datetime(since)
+    return (f"(d.delivery_fee IS NULL OR d.updated_at >= {since_sql} "
+            f"OR d.order_id IN (SELECT order_id FROM order_items WHERE updated_at >= {since_sql}) "
+            f"OR d.order_id IN (SELECT i.order_id FROM order_items i JOIN products p ON p.id = i.product_id "
+            f"WHERE p.updated_at >= {since_sql}))")
+
+
+class FeeWatermark:
+    """State file: watermark của lần chạy thành công + run đang dở (pending)"""
+
+    def __init__(self, state_file: str, config: Dict[str, Any] = DEFAULT_PRICING_CONFIG):
+        self.state_file = state_file
+        self.config_hash = pricing_config_hash(config)
+        self.state: Dict[str, Any] = {}
+        self.run_started_at: Optional[datetime] = None
+
+    def load(self) -> Dict[str, Any]:
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    self.state = json.load(f)
+        except Exception as e:
+            logging.warning(f"⚠️  Cannot load watermark state: {e}")
+            self.state = {}
+        return self.state
+
+    def _save_state(self) -> bool:
+        try:
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_file, self.state_file)
+            return True
+        except Exception as e:
+            logging.warning(f"⚠️  Cannot save watermark state: {e}")
+            return False
+
+    def changed_since(self, full_rebuild: bool = False) -> Optional[datetime]:
+        """Watermark để lọc incremental, None = phải tính lại toàn bộ"""
+        self.load()
+        if full_rebuild:
+            logging.info("🔁 Full rebuild requested")
+            return None
+        if not self.state.get('watermark'):
+            logging.info("🔁 No previous successful run, full rebuild")
+            return None
+        if self.state.get('config_hash') != self.config_hash:
+            logging.info("🔁 Pricing config changed since last run, full rebuild")
+            return None
+        watermark = datetime.fromisoformat(self.state['watermark'])
+        logging.info(f"⏩ Incremental run: changes since {watermark.isoformat(sep=' ')}")
+        return watermark
+
+    def begin_run(self, cursor) -> datetime:
+        """
+        Ghi nhận thời điểm bắt đầu theo NOW(6) của MySQL. Nếu run trước bị dừng
+        giữa chừng (resume), giữ thời điểm cũ hơn để không bỏ sót thay đổi.
+        """
+        cursor.execute("SELECT NOW(6) AS now")
+        now = cursor.fetchone()['now']
+        pending = self.state.get('pending_run_started_at')
+        self.run_started_at = min(now, datetime.fromisoformat(pending)) if pending else now
+        self.state['pending_run_started_at'] = self.run_started_at.isoformat()
+        self._save_state()
+        return self.run_started_at
+
+    def commit_run(self) -> bool:
+        """Run thành công: pending -> watermark"""
+        if self.run_started_at is None:
+            return False
+        self.state = {
+            'watermark': self.run_started_at.isoformat(),
+            'config_hash': self.config_hash,
+            'completed_at': datetime.now().isoformat()
+        }
+        logging.info(f"💾 Watermark advanced to {self.run_started_at.isoformat(sep=' ')}")
+        return self._save_state()
@@ -5,7 +5,8 @@ Handles ALL edge cases and completes shipping fee calculation 100%
 """
 
 import mysql.connector
-from decimal import Decimal, ROUND_HALF_UP
+
+from shipping_fee_engine import get_row_fee_engine
 
 DB_CONFIG = {
     'host': 'server.aptech.io',
@@ -16,32 +17,11 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+FEE_ENGINE = get_row_fee_engine()
+
 def calculate_fee(weight, volume, is_fragile, service_type='STANDARD'):
     """Calculate shipping fee"""
-    weight = Decimal(str(weight)) if weight else Decimal('0')
-    volume = Decimal(str(volume)) if volume else Decimal('0')
-    
-    # Shipping weight = max(actual, volume*200)
-    volume_weight = volume * Decimal('200')
-    shipping_weight = max(weight, volume_weight)
-    
-    # Base fee = weight * 15000
-    base_fee = shipping_weight * Decimal('15000')
-    
-    # Fragile multiplier
-    fragile_mult = Decimal('1.3') if is_fragile else Decimal('1.0')
-    
-    # Service multiplier
-    service_mults = {
-        'SECOND_CLASS': Decimal('0.8'),
-        'STANDARD': Decimal('1.0'),
-        'FIRST_CLASS': Decimal('1.3'), 
-        'EXPRESS': Decimal('1.8')
-    }
-    service_mult = service_mults.get(service_type, Decimal('1.0'))
-    
-    total = base_fee * fragile_mult * service_mult
-    return total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return FEE_ENGINE.fee(weight, volume, is_fragile, service_type)
 
 def main():
     print("🎯 FINAL COMPLETE SOLUTION - Expert 20 years")
@@ -128,7 +108,7 @@ def main():
         
         if updates:
             cursor.executemany("""
-            UPDATE order_items SET shipping_fee = %s, updated_at = NOW() WHERE id = %s
+            UPDATE order_items SET shipping_fee = %s WHERE id = %s
             """, updates)
             conn.commit()
             print(f"✅ Updated {len(updates):,} remaining items")
@@ -143,8 +123,7 @@ def main():
             FROM order_items oi
             JOIN orders o ON oi.order_id = o.id
             WHERE o.id = d.order_id AND oi.shipping_fee IS NOT NULL
-        ),
-        updated_at = NOW()
+        )
         WHERE EXISTS (
             SELECT 1 FROM orders o WHERE o.id = d.order_id
         )
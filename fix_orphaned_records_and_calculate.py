@@ -9,17 +9,18 @@ Expert: 20 years experience in database systems
 import mysql.connector
 import logging
 from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 import sys
 import os
 import json
 from typing import List, Dict, Any
 
 # Import configuration
-from shipping_fee_config import (
-    get_database_config, SHIPPING_CONSTANTS, SERVICE_TYPE_MULTIPLIERS,
-    PROCESSING_CONFIG
-)
+from shipping_fee_config import get_database_config, PROCESSING_CONFIG
+from shipping_fee_db import build_order_item_fee_query, fee_changed, iter_order_item_batches
+from shipping_fee_engine import get_row_fee_engine
+from fee_memo import FeeMemo
+from pricing_rules import resolve_pricing_config
 
 class ExpertDataIntegrityHandler:
     """
@@ -45,6 +46,13 @@ class ExpertDataIntegrityHandler:
             'start_time': datetime.now()
         }
         
+        # Fee engine (FEE_ENGINE), tính phía client
+        self.fee_engine = get_row_fee_engine()
+        
+        # Memo (product_id, service_type) -> fee
+        self.fee_memo = FeeMemo(self._calculate_shipping_fee, 'fee',
+                                persist_file=PROCESSING_CONFIG['fee_memo_file'] or None)
+        
         logging.info("🔧 === EXPERT DATA INTEGRITY HANDLER ===")
         logging.info(f"Database: {self.db_config['database']}")
         
@@ -73,11 +81,27 @@ class ExpertDataIntegrityHandler:
             self.connection = mysql.connector.connect(**self.db_config)
             self.cursor = self.connection.cursor(dictionary=True)
             logging.info("✅ Database connected")
-            return True
+            return self._load_pricing()
         except mysql.connector.Error as e:
             logging.error(f"❌ Connection failed: {e}")
             return False
     
+    def _load_pricing(self) -> bool:
+        """Pricing rules (PRICING_SOURCE=table) -> fee engine + memo"""
+        try:
+            pricing_version, pricing_config = resolve_pricing_config(self.cursor)
+            self.connection.rollback()
+        except (mysql.connector.Error, ValueError) as e:
+            logging.error(f"❌ Cannot load pricing rules: {e}")
+            return False
+        
+        if pricing_version is not None:
+            self.fee_engine = get_row_fee_engine(constants=pricing_config['constants'],
+                                             service_multipliers=pricing_config['service_multipliers'])
+            self.fee_memo = FeeMemo(self._calculate_shipping_fee, 'fee', config=pricing_config,
+                                    persist_file=PROCESSING_CONFIG['fee_memo_file'] or None)
+        return True
+    
     def _disconnect(self):
         """Disconnect safely"""
         try:
@@ -252,38 +276,22 @@ class ExpertDataIntegrityHandler:
         """Calculate shipping fees for ALL order_items (including previously orphaned)"""
         logging.info("💰 Calculating shipping fees for ALL order_items...")
         
-        # Updated query to handle all order_items
-        query = """
-        SELECT 
-            oi.id as order_item_id,
-            oi.order_id,
-            oi.product_id,
-            oi.quantity,
-            oi.shipping_fee as current_shipping_fee,
-            p.weight,
-            p.volume,
-            p.is_fragile,
-            p.name as product_name,
-            COALESCE(d.service_type, 'STANDARD') as service_type,
-            o.external_id as order_external_id
-        FROM order_items oi
-        JOIN products p ON oi.product_id = p.id
-        JOIN orders o ON oi.order_id = o.id
-        LEFT JOIN deliveries d ON o.id = d.order_id
-        WHERE oi.shipping_fee IS NULL
-        ORDER BY oi.id
-        LIMIT %s OFFSET %s
-        """
+        # Updated query to handle all order_items (deliveries có thể thiếu)
+        query = build_order_item_fee_query(
+            left_join_deliveries=True,
+            default_service_type='STANDARD',
+            where='oi.shipping_fee IS NULL'
+        )
         
         batch_size = 500
-        offset = 0
         total_processed = 0
         total_updated = 0
         
+        # Keyset pagination: rows vừa update rời khỏi filter IS NULL nên OFFSET sẽ bỏ sót rows
+        batches = iter_order_item_batches(self.cursor, batch_size, query=query)
         while True:
             try:
-                self.cursor.execute(query, (batch_size, offset))
-                batch_items = self.cursor.fetchall()
+                batch_items = next(batches, None)
                 
                 if not batch_items:
                     break
@@ -293,11 +301,12 @@ class ExpertDataIntegrityHandler:
                 for item in batch_items:
                     try:
                         # Calculate shipping fee
-                        shipping_fee = self._calculate_shipping_fee(
-                            weight=item['weight'],
-                            volume=item['volume'],
-                            is_fragile=bool(item['is_fragile']),
-                            service_type=item['service_type']
+                        shipping_fee = self.fee_memo.lookup(
+                            item['product_id'],
+                            item['weight'],
+                            item['volume'],
+                            bool(item['is_fragile']),
+                            item['service_type']
                         )
                         
                         batch_updates.append((shipping_fee, item['order_item_id']))
@@ -311,7 +320,7 @@ class ExpertDataIntegrityHandler:
                     
                     update_query = """
                     UPDATE order_items 
-                    SET shipping_fee = %s, updated_at = NOW()
+                    SET shipping_fee = %s
                     WHERE id = %s
                     """
                     self.cursor.executemany(update_query, batch_updates)
@@ -320,7 +329,6 @@ class ExpertDataIntegrityHandler:
                     total_updated += len(batch_updates)
                 
                 total_processed += len(batch_items)
-                offset += batch_size
                 
                 if total_processed % 5000 == 0:
                     logging.info(f"📊 Processed {total_processed:,} items...")
@@ -335,29 +343,13 @@ class ExpertDataIntegrityHandler:
         
         self.stats['shipping_fees_calculated'] = total_updated
         logging.info(f"✅ Shipping fees calculated: {total_updated:,}/{total_processed:,}")
+        self.fee_memo.log_summary()
+        self.fee_memo.save()
         return total_updated > 0
     
     def _calculate_shipping_fee(self, weight, volume, is_fragile, service_type):
-        """Calculate shipping fee"""
-        # Convert to Decimal
-        actual_weight = Decimal(str(weight)) if weight else Decimal('0')
-        volume_val = Decimal(str(volume)) if volume else Decimal('0')
-        
-        # Calculate shipping weight
-        volume_weight = volume_val * SHIPPING_CONSTANTS['VOLUME_TO_WEIGHT_FACTOR']
-        shipping_weight = max(actual_weight, volume_weight)
-        
-        # Calculate base fee
-        base_fee = shipping_weight * SHIPPING_CONSTANTS['BASE_PRICE_PER_KG']
-        
-        # Apply multipliers
-        fragile_multiplier = (SHIPPING_CONSTANTS['FRAGILE_MULTIPLIER'] 
-                            if is_fragile else SHIPPING_CONSTANTS['NORMAL_MULTIPLIER'])
-        service_multiplier = SERVICE_TYPE_MULTIPLIERS.get(service_type, Decimal('1.0'))
-        
-        # Calculate total
-        total_fee = base_fee * fragile_multiplier * service_multiplier
-        return total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        """Calculate shipping fee (fee engine)"""
+        return self.fee_engine.fee(weight, volume, is_fragile, service_type)
     
     def calculate_delivery_fees_all(self) -> bool:
         """Calculate delivery fees for all deliveries"""
@@ -367,13 +359,14 @@ class ExpertDataIntegrityHandler:
         SELECT 
             d.id as delivery_id,
             d.order_id,
+            d.delivery_fee as current_delivery_fee,
             SUM(oi.shipping_fee) as total_shipping_fee,
             COUNT(oi.id) as item_count
         FROM deliveries d
         JOIN orders o ON d.order_id = o.id
         JOIN order_items oi ON o.id = oi.order_id
         WHERE oi.shipping_fee IS NOT NULL
-        GROUP BY d.id, d.order_id
+        GROUP BY d.id, d.order_id, d.delivery_fee
         ORDER BY d.id
         """
         
@@ -390,19 +383,22 @@ class ExpertDataIntegrityHandler:
             delivery_updates = []
             for delivery in deliveries:
                 delivery_fee = Decimal(str(delivery['total_shipping_fee']))
-                delivery_updates.append((delivery_fee, delivery['delivery_id']))
+                if fee_changed(delivery_fee, delivery['current_delivery_fee']):
+                    delivery_updates.append((delivery_fee, delivery['delivery_id']))
             
-            # Update all deliveries
-            update_query = """
-            UPDATE deliveries 
-            SET delivery_fee = %s, updated_at = NOW()
-            WHERE id = %s
-            """
-            self.cursor.executemany(update_query, delivery_updates)
+            # Update deliveries có fee thay đổi
+            if delivery_updates:
+                update_query = """
+                UPDATE deliveries 
+                SET delivery_fee = %s
+                WHERE id = %s
+                """
+                self.cursor.executemany(update_query, delivery_updates)
             self.connection.commit()
             
             self.stats['delivery_fees_calculated'] = len(delivery_updates)
-            logging.info(f"✅ Delivery fees calculated: {len(delivery_updates):,}")
+            logging.info(f"✅ Delivery fees calculated: {len(delivery_updates):,} written, "
+                         f"{len(deliveries) - len(delivery_updates):,} unchanged")
             return True
             
         except mysql.connector.Error as e:
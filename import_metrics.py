@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Import Throughput Metrics
+=========================
+Structured metrics cho các đợt import SQL: rows/s và bytes/s theo từng bảng,
+latency percentiles của statements, lock wait time và commits/s.
+
+Kết quả được ghi ra JSON trong production_logs/ cạnh các markdown reports,
+để so sánh giữa các lần deploy và tìm bảng nào là bottleneck.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+TABLE_PATTERN = re.compile(r'^\s*(?:INSERT|REPLACE)\s+(?:IGNORE\s+)?(?:INTO\s+)?`?(\w+)`?', re.IGNORECASE)
+
+# Global status variables cho lock waits (toàn server, không chỉ session này)
+LOCK_STATUS_VARIABLES = ['Innodb_row_lock_time', 'Innodb_row_lock_waits']
+
+LATENCY_PERCENTILES = [50, 90, 95, 99]
+
+
+def statement_table(statement: str) -> str:
+    """Tên bảng đích của một INSERT statement ('other' nếu không nhận ra)."""
+    match = TABLE_PATTERN.match(statement)
+    return match.group(1) if match else 'other'
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Percentiles (ms) của một list latencies (seconds)."""
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 3) for p in LATENCY_PERCENTILES}
+    summary['max'] = round(float(values.max()), 3)
+    summary['mean'] = round(float(values.mean()), 3)
+    return summary
+
+
+class ImportMetrics:
+    """Thu thập metrics cho một đợt import."""
+
+    def __init__(self, label: str, cursor=None, logger: Optional[logging.Logger] = None):
+        self.label = label
+        self.cursor = cursor
+        self.logger = logger or logging.getLogger(__name__)
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.commit_latencies: List[float] = []
+        self.failed_statements = 0
+        self.lock_before: Dict[str, int] = {}
+        self.lock_after: Dict[str, int] = {}
+        self.started_at = None
+        self.elapsed = 0.0
+
+    def _lock_status(self) -> Dict[str, int]:
+        if self.cursor is None:
+            return {}
+        try:
+            placeholders = ', '.join(['%s'] * len(LOCK_STATUS_VARIABLES))
+            self.cursor.execute(
+                f"SELECT VARIABLE_NAME, VARIABLE_VALUE FROM performance_schema.global_status "
+                f"WHERE VARIABLE_NAME IN ({placeholders})",
+                tuple(LOCK_STATUS_VARIABLES)
+            )
+            return {name: int(value) for name, value in self.cursor.fetchall()}
+        except Exception as e:
+            self.logger.warning(f"⚠️  Cannot read lock wait status: {e}")
+            return {}
+
+    def start(self):
+        self.lock_before = self._lock_status()
+        self.started_at = time.time()
+
+    def record_statement(self, statement: str, elapsed: float, rowcount: int, success: bool = True):
+        table = self.tables.setdefault(statement_table(statement), {
+            'statements': 0,
+            'rows': 0,
+            'bytes': 0,
+            'seconds': 0.0,
+            'latencies': []
+        })
+        table['statements'] += 1
+        table['bytes'] += len(statement.encode('utf-8'))
+        table['seconds'] += elapsed
+        table['latencies'].append(elapsed)
+        if success:
+            table['rows'] += max(rowcount, 0)
+        else:
+            self.failed_statements += 1
+
+    def record_commit(self, elapsed: float):
+        self.commit_latencies.append(elapsed)
+
+    def finish(self):
+        self.elapsed = time.time() - self.started_at
+        self.lock_after = self._lock_status()
+
+    def summary(self) -> Dict[str, Any]:
+        tables = {}
+        for name, table in self.tables.items():
+            seconds = table['seconds']
+            tables[name] = {
+                'statements': table['statements'],
+                'rows': table['rows'],
+                'bytes': table['bytes'],
+                'seconds': round(seconds, 3),
+                'rows_per_second': round(table['rows'] / seconds, 1) if seconds > 0 else 0.0,
+                'bytes_per_second': round(table['bytes'] / seconds, 1) if seconds > 0 else 0.0,
+                'latency_ms': latency_summary(table['latencies'])
+            }
+
+        all_latencies = [lat for table in self.tables.values() for lat in table['latencies']]
+        total_rows = sum(table['rows'] for table in self.tables.values())
+        total_bytes = sum(table['bytes'] for table in self.tables.values())
+        lock_delta = {name: self.lock_after.get(name, 0) - self.lock_before.get(name, 0)
+                      for name in self.lock_before if name in self.lock_after}
+
+        return {
+            'label': self.label,
+            'generated_at': datetime.now().isoformat(),
+            'elapsed_seconds': round(self.elapsed, 3),
+            'total_rows': total_rows,
+            'total_bytes': total_bytes,
+            'rows_per_second': round(total_rows / self.elapsed, 1) if self.elapsed > 0 else 0.0,
+            'bytes_per_second': round(total_bytes / self.elapsed, 1) if self.elapsed > 0 else 0.0,
+            'failed_statements': self.failed_statements,
+            'statement_latency_ms': latency_summary(all_latencies),
+            'commits': len(self.commit_latencies),
+            'commits_per_second': round(len(self.commit_latencies) / self.elapsed, 3) if self.elapsed > 0 else 0.0,
+            'commit_latency_ms': latency_summary(self.commit_latencies),
+            'lock_wait_ms': lock_delta.get('Innodb_row_lock_time'),
+            'lock_waits': lock_delta.get('Innodb_row_lock_waits'),
+            'tables': tables,
+            'bottleneck_table': max(tables, key=lambda name: tables[name]['seconds']) if tables else None
+        }
+
+    def write_report(self, report_file: str) -> str:
+        """Ghi JSON report, trả về đường dẫn file."""
+        os.makedirs(os.path.dirname(report_file) or '.', exist_ok=True)
+        summary = self.summary()
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+        self.logger.info(f"📊 Import metrics: {summary['total_rows']:,} rows in {summary['elapsed_seconds']}s "
+                         f"({summary['rows_per_second']:,} rows/s), bottleneck: {summary['bottleneck_table']}")
+        self.logger.info(f"📊 Import metrics report: {report_file}")
+        return report_file
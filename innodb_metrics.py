@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+InnoDB Insert Metrics
+=====================
+Đo page splits, insert rate và buffer pool misses quanh một đợt bulk load.
+
+Dùng để so sánh load theo thứ tự CSV với load theo clustered key
+(AdvancedDataCoPipeline(sort_by_key=True)) trên một local test server.
+
+Usage: python3 innodb_metrics.py [--host localhost] [--database fastroute_test]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import mysql.connector
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Counters trong information_schema.INNODB_METRICS (module index, mặc định tắt)
+INNODB_COUNTERS = ['index_page_splits', 'index_page_merge_successful', 'index_page_reorg_successful']
+
+# Biến SHOW GLOBAL STATUS liên quan tới insert path
+STATUS_VARIABLES = [
+    'Innodb_rows_inserted',
+    'Innodb_buffer_pool_reads',
+    'Innodb_buffer_pool_read_requests',
+    'Innodb_pages_written',
+    'Innodb_data_written'
+]
+
+
+class InnoDBInsertMetrics:
+    """Snapshot InnoDB counters trước/sau một bulk load và tính delta."""
+
+    def __init__(self, cursor, logger: Optional[logging.Logger] = None):
+        self.cursor = cursor
+        self.logger = logger or logging.getLogger(__name__)
+        self.before = None
+        self.after = None
+        self.started_at = None
+        self.elapsed = 0.0
+        self.counters_enabled = False
+
+    def enable_counters(self) -> bool:
+        """Bật các INNODB_METRICS counters (cần SYSTEM_VARIABLES_ADMIN / SUPER)."""
+        try:
+            for counter in INNODB_COUNTERS:
+                self.cursor.execute(f"SET GLOBAL innodb_monitor_enable = '{counter}'")
+            self.counters_enabled = True
+        except mysql.connector.Error as e:
+            self.logger.warning(f"⚠️  Cannot enable InnoDB monitor counters, page splits unavailable: {e}")
+            self.counters_enabled = False
+        return self.counters_enabled
+
+    def snapshot(self) -> Dict[str, int]:
+        """Đọc giá trị hiện tại của các counters."""
+        values = {}
+
+        if self.counters_enabled:
+            placeholders = ', '.join(['%s'] * len(INNODB_COUNTERS))
+            self.cursor.execute(
+                f"SELECT NAME, COUNT FROM information_schema.INNODB_METRICS WHERE NAME IN ({placeholders})",
+                tuple(INNODB_COUNTERS)
+            )
+            for name, count in self.cursor.fetchall():
+                values[name] = int(count)
+
+        placeholders = ', '.join(['%s'] * len(STATUS_VARIABLES))
+        self.cursor.execute(
+            f"SELECT VARIABLE_NAME, VARIABLE_VALUE FROM performance_schema.global_status "
+            f"WHERE VARIABLE_NAME IN ({placeholders})",
+            tuple(STATUS_VARIABLES)
+        )
+        for name, value in self.cursor.fetchall():
+            values[name] = int(value)
+
+        return values
+
+    def start(self):
+        self.enable_counters()
+        self.before = self.snapshot()
+        self.started_at = time.time()
+
+    def stop(self):
+        self.elapsed = time.time() - self.started_at
+        self.after = self.snapshot()
+
+    def summary(self) -> Dict[str, float]:
+        """Delta giữa hai snapshot + các chỉ số dẫn xuất."""
+        delta = {name: self.after.get(name, 0) - self.before.get(name, 0)
+                 for name in set(self.before) | set(self.after)}
+
+        rows = delta.get('Innodb_rows_inserted', 0)
+        read_requests = delta.get('Innodb_buffer_pool_read_requests', 0)
+        summary = dict(delta)
+        summary['elapsed_seconds'] = round(self.elapsed, 3)
+        summary['rows_per_second'] = round(rows / self.elapsed, 1) if self.elapsed > 0 else 0.0
+        summary['buffer_pool_miss_ratio'] = (
+            round(delta.get('Innodb_buffer_pool_reads', 0) / read_requests, 6) if read_requests else 0.0
+        )
+        if self.counters_enabled:
+            summary['page_splits_per_1k_rows'] = (
+                round(delta.get('index_page_splits', 0) * 1000 / rows, 3) if rows else 0.0
+            )
+        return summary
+
+    def log_summary(self, label: str):
+        summary = self.summary()
+        self.logger.info(f"📊 [{label}] {summary.get('Innodb_rows_inserted', 0):,} rows in "
+                         f"{summary['elapsed_seconds']}s ({summary['rows_per_second']:,} rows/s)")
+        if self.counters_enabled:
+            self.logger.info(f"📊 [{label}] page splits: {summary.get('index_page_splits', 0):,} "
+                             f"({summary['page_splits_per_1k_rows']} per 1k rows)")
+        self.logger.info(f"📊 [{label}] buffer pool miss ratio: {summary['buffer_pool_miss_ratio']:.4%}, "
+                         f"pages written: {summary.get('Innodb_pages_written', 0):,}")
+
+
+# Thứ tự TRUNCATE: con trước cha
+BENCHMARK_TABLES = [
+    'delivery_tracking', 'deliveries', 'payments', 'order_items',
+    'addresses', 'orders', 'products', 'users', 'categories', 'stores'
+]
+
+
+def truncate_tables(cursor):
+    cursor.execute("SET SESSION foreign_key_checks = 0")
+    for table in BENCHMARK_TABLES:
+        cursor.execute(f"TRUNCATE TABLE `{table}`")
+    cursor.execute("SET SESSION foreign_key_checks = 1")
+
+
+def run_load(db_config: dict, sql_file: str, label: str) -> Optional[Dict[str, float]]:
+    """Load một SQL file bằng DataCoDeployer và đo InnoDB counters quanh đó."""
+    from deploy_import import DataCoDeployer
+
+    deployer = DataCoDeployer(db_config=db_config, sql_file=sql_file)
+    if not deployer.connect_database():
+        return None
+
+    try:
+        truncate_tables(deployer.cursor)
+        metrics = InnoDBInsertMetrics(deployer.cursor, logger)
+        metrics.start()
+        deployer.connection.commit()  # Đóng implicit transaction trước start_transaction()
+        if not deployer.execute_import():
+            return None
+        metrics.stop()
+        metrics.log_summary(label)
+        return metrics.summary()
+    finally:
+        deployer.cleanup_session()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CSV-order vs clustered-key-order bulk load')
+    parser.add_argument('--host', default='localhost', help='Database host')
+    parser.add_argument('--user', default='fastroute_user', help='Database user')
+    parser.add_argument('--password', default='fastroute_password', help='Database password')
+    parser.add_argument('--database', default='fastroute_test', help='Scratch database (will be truncated)')
+    parser.add_argument('--csv-file', default='DataCoSupplyChainDataset.csv', help='Source CSV')
+    args = parser.parse_args()
+
+    from advanced_pipeline import AdvancedDataCoPipeline
+
+    db_config = {
+        'host': args.host,
+        'user': args.user,
+        'password': args.password,
+        'database': args.database,
+        'charset': 'utf8mb4'
+    }
+
+    response = input(f"⚠️  Benchmark sẽ TRUNCATE các bảng trong `{args.database}`. Continue? (y/N): ")
+    if response.lower() != 'y':
+        logger.info("🛑 Benchmark cancelled by user")
+        sys.exit(1)
+
+    results = {}
+    for label, sort_by_key in (('csv_order', False), ('clustered_key_order', True)):
+        sql_file = f"dataco_benchmark_{label}.sql"
+        pipeline = AdvancedDataCoPipeline(args.csv_file, sort_by_key=sort_by_key)
+        if not pipeline.load_and_prepare_data() or not pipeline.generate_complete_sql(sql_file):
+            logger.error(f"❌ SQL generation failed for {label}")
+            sys.exit(1)
+
+        summary = run_load(db_config, sql_file, label)
+        if summary is None:
+            logger.error(f"❌ Load failed for {label}")
+            sys.exit(1)
+        results[label] = summary
+
+    os.makedirs('production_logs', exist_ok=True)
+    report_file = f"production_logs/innodb_insert_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    baseline, ordered = results['csv_order'], results['clustered_key_order']
+    for key in ('index_page_splits', 'rows_per_second', 'buffer_pool_miss_ratio'):
+        if key in baseline:
+            logger.info(f"📈 {key}: {baseline[key]} → {ordered[key]}")
+    logger.info(f"📄 Benchmark report: {report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pricing rules lưu trong DB (bảng pricing_rules, versioned)
+Mỗi version là một bộ rules đầy đủ; version đang dùng là version có activated_at
+mới nhất (<= NOW). Đổi giá = insert version mới + activate, không cần deploy.
+Schema + seed (version 1 = SHIPPING_CONSTANTS hiện tại): pricing_rules_migration.sql
+
+Rules được compile lúc startup thành config {'constants', 'service_multipliers'}
+cho fee engine; weight tiers thành 'WEIGHT_TIERS' (batch engine lookup bằng
+searchsorted, sql engine dùng CASE).
+
+Usage:
+    python3 pricing_rules.py show [--version N] [--production]
+    python3 pricing_rules.py activate N [--production]
+"""
+
+import argparse
+import logging
+import sys
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import mysql.connector
+
+from shipping_fee_config import get_database_config, PROCESSING_CONFIG
+from fee_memo import DEFAULT_PRICING_CONFIG
+
+RULE_TYPES = ('WEIGHT_TIER', 'SERVICE_MULTIPLIER', 'FRAGILE_MULTIPLIER', 'NORMAL_MULTIPLIER', 'VOLUME_FACTOR')
+
+ACTIVE_VERSION_QUERY = """
+SELECT version FROM pricing_rule_versions
+WHERE activated_at IS NOT NULL AND activated_at <= NOW(6)
+ORDER BY activated_at DESC, version DESC
+LIMIT 1
+"""
+
+PRICING_RULES_QUERY = """
+SELECT rule_type, rule_key, min_weight, value
+FROM pricing_rules
+WHERE version = %s
+ORDER BY rule_type, min_weight, rule_key
+"""
+
+
+def compile_pricing_rules(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Rows của một version -> pricing config cho fee engine (ValueError nếu thiếu/sai rule)"""
+    tiers = []
+    service_multipliers = {}
+    singles = {}
+
+    for row in rows:
+        rule_type = row['rule_type']
+        value = Decimal(str(row['value']))
+        if rule_type == 'WEIGHT_TIER':
+            tiers.append((Decimal(str(row['min_weight'] or 0)), value))
+        elif rule_type == 'SERVICE_MULTIPLIER':
+            service_multipliers[row['rule_key']] = value
+        elif rule_type in RULE_TYPES:
+            singles[rule_type] = value
+        else:
+            raise ValueError(f"Unknown rule type '{rule_type}'")
+
+    if not tiers:
+        raise ValueError("Pricing rules need at least one WEIGHT_TIER")
+    for rule_type in ('FRAGILE_MULTIPLIER', 'VOLUME_FACTOR'):
+        if rule_type not in singles:
+            raise ValueError(f"Pricing rules missing {rule_type}")
+
+    tiers.sort()
+    if tiers[0][0] != 0:
+        raise ValueError("First WEIGHT_TIER must start at min_weight 0")
+    if len({min_weight for min_weight, _ in tiers}) != len(tiers):
+        raise ValueError("Duplicate WEIGHT_TIER min_weight")
+
+    constants = {
+        'BASE_PRICE_PER_KG': tiers[0][1],
+        'FRAGILE_MULTIPLIER': singles['FRAGILE_MULTIPLIER'],
+        'NORMAL_MULTIPLIER': singles.get('NORMAL_MULTIPLIER', Decimal('1.0')),
+        'VOLUME_TO_WEIGHT_FACTOR': singles['VOLUME_FACTOR']
+    }
+    # Một tier = công thức cũ, không thêm WEIGHT_TIERS; Decimal từ DB có scale khác
+    # (15000.0000) nhưng pricing_config_hash normalize nên hash vẫn khớp SHIPPING_CONSTANTS
+    if len(tiers) > 1:
+        constants['WEIGHT_TIERS'] = tuple(tiers)
+
+    return {'constants': constants, 'service_multipliers': service_multipliers}
+
+
+def active_pricing_version(cursor) -> Optional[int]:
+    cursor.execute(ACTIVE_VERSION_QUERY)
+    row = cursor.fetchone()
+    return row['version'] if row else None
+
+
+def load_pricing_rules(cursor, version: Optional[int] = None) -> Tuple[int, Dict[str, Any]]:
+    """(version, pricing config) của version chỉ định hoặc version đang active"""
+    if not version:
+        version = active_pricing_version(cursor)
+        if version is None:
+            raise ValueError("No active pricing rules version")
+    cursor.execute(PRICING_RULES_QUERY, (version,))
+    rows = cursor.fetchall()
+    if not rows:
+        raise ValueError(f"Pricing rules version {version} has no rules")
+    return version, compile_pricing_rules(rows)
+
+
+def resolve_pricing_config(cursor, version: Optional[int] = None) -> Tuple[Optional[int], Dict[str, Any]]:
+    """
+    Pricing config cho run theo PRICING_SOURCE: 'config' = SHIPPING_CONSTANTS
+    (version None), 'table' = bảng pricing_rules (version pin theo PRICING_VERSION
+    hoặc tham số, mặc định version active).
+    """
+    if PROCESSING_CONFIG['pricing_source'] != 'table':
+        return None, DEFAULT_PRICING_CONFIG
+
+    version, config = load_pricing_rules(cursor, version or PROCESSING_CONFIG['pricing_version'])
+    tiers = config['constants'].get('WEIGHT_TIERS')
+    logging.info(f"💲 Pricing rules version {version}: {len(tiers) if tiers else 1} weight tier(s), "
+                 f"{len(config['service_multipliers'])} service multipliers")
+    return version, config
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Versioned pricing rules')
+    parser.add_argument('command', choices=['show', 'activate'])
+    parser.add_argument('version', type=int, nargs='?', help='Version to activate')
+    parser.add_argument('--version', dest='show_version', type=int, help='Version to show (default: active)')
+    parser.add_argument('--production', action='store_true', help='Use the production database')
+    args = parser.parse_args()
+
+    db_config = get_database_config(is_test=not args.production)
+    try:
+        connection = mysql.connector.connect(**db_config)
+    except mysql.connector.Error as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(1)
+
+    try:
+        cursor = connection.cursor(dictionary=True, buffered=True)
+        if args.command == 'show':
+            version, config = load_pricing_rules(cursor, args.show_version)
+            print(f"💲 Pricing rules version {version} ({db_config['database']})")
+            for name, value in config['constants'].items():
+                print(f"   {name}: {value}")
+            for name, value in config['service_multipliers'].items():
+                print(f"   {name}: {value}")
+        else:
+            if not args.version:
+                parser.error("activate needs a version")
+            # Compile trước khi activate: version lỗi không bao giờ thành active
+            load_pricing_rules(cursor, args.version)
+            cursor.execute("UPDATE pricing_rule_versions SET activated_at = NOW(6) WHERE version = %s",
+                           (args.version,))
+            if cursor.rowcount != 1:
+                connection.rollback()
+                print(f"❌ Version {args.version} not found in pricing_rule_versions")
+                sys.exit(1)
+            connection.commit()
+            print(f"✅ Pricing rules version {args.version} activated on {db_config['database']}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
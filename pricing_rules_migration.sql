@@ -0,0 +1,51 @@
+-- Versioned pricing rules for shipping fee calculation
+-- Replaces the hard-coded SHIPPING_CONSTANTS / SERVICE_TYPE_MULTIPLIERS when
+-- the calculators run with PRICING_SOURCE=table (see pricing_rules.py).
+-- A version is a complete rule set; the active version is the one with the
+-- latest activated_at. To change prices: insert a new version, then
+--   python3 pricing_rules.py activate <version>
+
+USE fastroute;
+
+CREATE TABLE IF NOT EXISTS pricing_rule_versions (
+    version INT NOT NULL PRIMARY KEY,
+    description VARCHAR(255) DEFAULT NULL,
+    created_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    activated_at DATETIME(6) DEFAULT NULL,
+    KEY idx_pricing_rule_versions_activated_at (activated_at)
+);
+
+-- rule_type:
+--   WEIGHT_TIER         price per kg (value) for shipping weight >= min_weight; first tier starts at 0
+--   SERVICE_MULTIPLIER  multiplier (value) for deliveries.service_type = rule_key
+--   FRAGILE_MULTIPLIER  multiplier for products.is_fragile = 1
+--   NORMAL_MULTIPLIER   multiplier for non-fragile products (default 1.0)
+--   VOLUME_FACTOR       volume (m³) -> weight (kg) conversion factor
+CREATE TABLE IF NOT EXISTS pricing_rules (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    version INT NOT NULL,
+    rule_type ENUM('WEIGHT_TIER', 'SERVICE_MULTIPLIER', 'FRAGILE_MULTIPLIER',
+                   'NORMAL_MULTIPLIER', 'VOLUME_FACTOR') NOT NULL,
+    rule_key VARCHAR(50) NOT NULL DEFAULT '',
+    min_weight DECIMAL(10,3) NOT NULL DEFAULT 0.000,
+    value DECIMAL(14,4) NOT NULL,
+    UNIQUE KEY uq_pricing_rules (version, rule_type, rule_key, min_weight),
+    KEY idx_pricing_rules_version (version),
+    CONSTRAINT fk_pricing_rules_version FOREIGN KEY (version) REFERENCES pricing_rule_versions (version)
+);
+
+-- Version 1 = current SHIPPING_CONSTANTS / SERVICE_TYPE_MULTIPLIERS
+INSERT IGNORE INTO pricing_rule_versions (version, description, activated_at)
+VALUES (1, 'Initial rules from shipping_fee_config.py', NOW(6));
+
+INSERT IGNORE INTO pricing_rules (version, rule_type, rule_key, min_weight, value) VALUES
+    (1, 'WEIGHT_TIER', '', 0.000, 15000.0000),
+    (1, 'FRAGILE_MULTIPLIER', '', 0.000, 1.3000),
+    (1, 'NORMAL_MULTIPLIER', '', 0.000, 1.0000),
+    (1, 'VOLUME_FACTOR', '', 0.000, 200.0000),
+    (1, 'SERVICE_MULTIPLIER', 'SECOND_CLASS', 0.000, 0.8000),
+    (1, 'SERVICE_MULTIPLIER', 'STANDARD', 0.000, 1.0000),
+    (1, 'SERVICE_MULTIPLIER', 'FIRST_CLASS', 0.000, 1.3000),
+    (1, 'SERVICE_MULTIPLIER', 'EXPRESS', 0.000, 1.8000);
+
+SELECT 'Pricing rules tables created, version 1 active' as status;
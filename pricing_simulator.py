@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+What-if pricing simulator
+Snapshot một lần các cột cần cho việc tính phí (order_items + products +
+deliveries + region của địa chỉ giao hàng) vào file columnar .npz, sau đó
+đánh giá nhiều pricing configs trên snapshot bằng batch engine (NumPy) mà
+không đụng tới DB. Kết quả: tổng doanh thu phí, phân bố phí theo region /
+service type và chênh lệch so với config hiện tại, dạng Markdown + JSON.
+
+Usage:
+    python3 pricing_simulator.py snapshot [--output shipping_fee_snapshot.npz] [--production]
+    python3 pricing_simulator.py simulate pricing_candidates.example.json [--snapshot shipping_fee_snapshot.npz]
+
+Candidates file: list các {"name", "constants", "service_multipliers"}; key
+thiếu lấy theo SHIPPING_CONSTANTS / SERVICE_TYPE_MULTIPLIERS, "WEIGHT_TIERS"
+là list [min_weight, price_per_kg] (xem pricing_rules.py).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List
+
+import mysql.connector
+import numpy as np
+
+from shipping_fee_config import get_database_config, SHIPPING_CONSTANTS, SERVICE_TYPE_MULTIPLIERS
+from shipping_fee_db import iter_keyset_batches, ProductAttributeCache
+from shipping_fee_engine import BatchFeeEngine, cents_to_decimal
+
+SNAPSHOT_FILE = "shipping_fee_snapshot.npz"
+REPORT_DIR = "production_logs"
+NO_REGION = '(none)'
+PERCENTILES = (50, 90, 99)
+
+# Region = region của địa chỉ DELIVERY đầu tiên của order.
+# Keyset trên page oi.id (chỉ items có delivery) rồi mới join deliveries: order nhiều deliveries
+# lặp item trong cùng batch thay vì bị cắt ở biên batch; d.id tăng dần => row đầu là delivery nhỏ nhất
+SNAPSHOT_QUERY = """
+SELECT
+    oi.id as order_item_id,
+    oi.product_id,
+    oi.shipping_fee as current_shipping_fee,
+    d.id as delivery_id,
+    d.service_type,
+    (SELECT a.region FROM addresses a
+     WHERE a.order_id = oi.order_id AND a.address_type = 'DELIVERY'
+     ORDER BY a.id LIMIT 1) as region
+FROM (SELECT id FROM order_items i
+      WHERE i.id > %s AND EXISTS (SELECT 1 FROM deliveries d1 WHERE d1.order_id = i.order_id)
+      ORDER BY i.id
+      LIMIT %s) page
+JOIN order_items oi ON oi.id = page.id
+JOIN deliveries d ON d.order_id = oi.order_id
+ORDER BY oi.id, d.id
+"""
+
+
+def _encode_labels(values: List[Any], vocabulary: Dict[Any, int]) -> np.ndarray:
+    return np.array([vocabulary.setdefault(value, len(vocabulary)) for value in values], dtype=np.int32)
+
+
+def take_snapshot(connection, output: str = SNAPSHOT_FILE, batch_size: int = 5000) -> Dict[str, Any]:
+    """Keyset scan order_items trong một read-only transaction, ghi các cột tính phí ra .npz"""
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    connection.start_transaction(consistent_snapshot=True, readonly=True)  # Một snapshot nhất quán cho toàn bộ scan
+    try:
+        products = ProductAttributeCache()
+        products.refresh(cursor)
+
+        columns = {name: [] for name in ('order_item_id', 'delivery_id', 'weight_milli', 'volume_milli',
+                                         'fragile', 'service_code', 'region_code',
+                                         'current_fee_cents', 'has_current_fee')}
+        service_vocabulary: Dict[Any, int] = {}
+        region_vocabulary: Dict[Any, int] = {}
+        skipped = 0
+
+        def fetch(limit: int, last_id: int) -> List[Dict[str, Any]]:
+            cursor.execute(SNAPSHOT_QUERY, (last_id, limit))
+            return cursor.fetchall()
+
+        for batch in iter_keyset_batches(fetch, batch_size):
+            rows = [row for row in batch if products.is_known(row['product_id'])]
+            skipped += len(batch) - len(rows)
+            if not rows:
+                continue
+            product_ids = np.array([row['product_id'] for row in rows], dtype=np.int64)
+            columns['order_item_id'].append(np.array([row['order_item_id'] for row in rows], dtype=np.int64))
+            columns['delivery_id'].append(np.array([row['delivery_id'] for row in rows], dtype=np.int64))
+            columns['weight_milli'].append(products.weight_milli[product_ids])
+            columns['volume_milli'].append(products.volume_milli[product_ids])
+            columns['fragile'].append(products.fragile[product_ids])
+            columns['service_code'].append(_encode_labels([row['service_type'] for row in rows], service_vocabulary))
+            columns['region_code'].append(_encode_labels([row['region'] or NO_REGION for row in rows],
+                                                         region_vocabulary))
+            columns['current_fee_cents'].append(np.array(
+                [int(Decimal(str(row['current_shipping_fee'])).scaleb(2)) if row['current_shipping_fee'] is not None
+                 else 0 for row in rows], dtype=np.int64))
+            columns['has_current_fee'].append(np.array([row['current_shipping_fee'] is not None for row in rows],
+                                                       dtype=bool))
+            print(f"   📥 {sum(len(chunk) for chunk in columns['order_item_id']):,} order_items "
+                  f"(last id {batch[-1]['order_item_id']:,})")
+    finally:
+        connection.rollback()
+        cursor.close()
+
+    arrays = {name: np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+              for name, chunks in columns.items()}
+    meta = {
+        'created_at': datetime.now().isoformat(),
+        'rows': int(len(arrays['order_item_id'])),
+        'missing_current_fee': int((~arrays['has_current_fee'].astype(bool)).sum()),
+        'skipped_missing_product': skipped
+    }
+    np.savez_compressed(
+        output, **arrays,
+        service_types=np.array(list(service_vocabulary), dtype=object),
+        regions=np.array(list(region_vocabulary), dtype=object),
+        meta=np.array(json.dumps(meta))
+    )
+    return {**meta, 'file': output, 'size_mb': round(os.path.getsize(output) / 1024 / 1024, 2)}
+
+
+def load_snapshot(path: str = SNAPSHOT_FILE) -> Dict[str, Any]:
+    with np.load(path, allow_pickle=True) as data:
+        snapshot = {name: data[name] for name in data.files}
+    snapshot['meta'] = json.loads(str(snapshot['meta']))
+    return snapshot
+
+
+def parse_candidates(items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Candidates JSON -> {name: pricing config}, giá trị dạng string/number -> Decimal"""
+    candidates = {}
+    for item in items:
+        constants = dict(SHIPPING_CONSTANTS)
+        for key, value in item.get('constants', {}).items():
+            constants[key] = (tuple((Decimal(str(m)), Decimal(str(r))) for m, r in value)
+                              if key == 'WEIGHT_TIERS' else Decimal(str(value)))
+        service_multipliers = dict(SERVICE_TYPE_MULTIPLIERS)
+        service_multipliers.update({key: Decimal(str(value))
+                                    for key, value in item.get('service_multipliers', {}).items()})
+        candidates[item['name']] = {'constants': constants, 'service_multipliers': service_multipliers}
+    return candidates
+
+
+def _distribution(cents: np.ndarray) -> Dict[str, Any]:
+    if not len(cents):
+        return {'items': 0, 'total': '0.00', 'mean': '0.00', **{f"p{p}": '0.00' for p in PERCENTILES}}
+    total = int(cents.sum())
+    percentiles = np.percentile(cents, PERCENTILES, method='lower')
+    return {
+        'items': int(len(cents)),
+        'total': str(cents_to_decimal(total)),
+        'mean': str(cents_to_decimal(round(total / len(cents)))),
+        **{f"p{p}": str(cents_to_decimal(int(value))) for p, value in zip(PERCENTILES, percentiles)}
+    }
+
+
+def _group_index(codes: np.ndarray, labels: np.ndarray) -> Dict[str, Any]:
+    """Sort theo nhóm một lần cho cả snapshot; mỗi config chỉ cần gather + slice"""
+    order = np.argsort(codes, kind='stable')
+    return {'order': order, 'bounds': np.searchsorted(codes[order], np.arange(len(labels) + 1)), 'labels': labels}
+
+
+def _grouped(cents: np.ndarray, group: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Distribution theo từng nhóm"""
+    sorted_cents, bounds = cents[group['order']], group['bounds']
+    return {str(group['labels'][code]): _distribution(sorted_cents[bounds[code]:bounds[code + 1]])
+            for code in range(len(group['labels'])) if bounds[code + 1] > bounds[code]}
+
+
+def simulate(snapshot: Dict[str, Any], candidates: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Tính fee (cents) cho mọi row của snapshot với từng candidate config"""
+    results = {}
+    groups = {'by_region': _group_index(snapshot['region_code'], snapshot['regions']),
+              'by_service_type': _group_index(snapshot['service_code'], snapshot['service_types'])}
+    current = snapshot['current_fee_cents']
+    # Phí đang lưu trong DB (NULL tính là 0)
+    results['current'] = {
+        'seconds': 0.0,
+        'overall': _distribution(current),
+        **{section: _grouped(current, group) for section, group in groups.items()}
+    }
+
+    for name, config in candidates.items():
+        start = time.perf_counter()
+        engine = BatchFeeEngine(config['constants'], config['service_multipliers'])
+        # Service codes của snapshot -> index multiplier của engine (service type lạ -> mặc định)
+        service_index = engine.encode_service_types(snapshot['service_types'])[snapshot['service_code']]
+        cents = engine.fee_cents(snapshot['weight_milli'], snapshot['volume_milli'],
+                                 snapshot['fragile'], service_index)
+        results[name] = {
+            'seconds': round(time.perf_counter() - start, 3),
+            'overall': _distribution(cents),
+            **{section: _grouped(cents, group) for section, group in groups.items()}
+        }
+    return results
+
+
+def _delta(total: str, baseline: str) -> str:
+    baseline_value = Decimal(baseline)
+    if not baseline_value:
+        return "n/a"
+    return f"{(Decimal(total) - baseline_value) / baseline_value * 100:+.2f}%"
+
+
+def write_reports(snapshot: Dict[str, Any], candidates: Dict[str, Dict[str, Any]],
+                  results: Dict[str, Any], report_dir: str = REPORT_DIR) -> List[str]:
+    """Markdown + JSON so sánh các candidates với phí đang lưu (current)"""
+    os.makedirs(report_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    baseline = results['current']
+
+    json_file = os.path.join(report_dir, f"pricing_simulation_{timestamp}.json")
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump({'generated_at': datetime.now().isoformat(), 'snapshot': snapshot['meta'],
+                   'candidates': candidates, 'results': results}, f, indent=2, default=str)
+
+    lines = [
+        "# PRICING SIMULATION REPORT",
+        "",
+        f"- **Snapshot:** {snapshot['meta']['rows']:,} order_items (taken {snapshot['meta']['created_at']})",
+        f"- **Current fee:** phí đang lưu, {snapshot['meta']['missing_current_fee']:,} rows NULL tính là 0",
+        f"- **Candidates:** {', '.join(candidates)}",
+        "",
+        "## Total Shipping Fee Revenue",
+        "| Config | Total (VNĐ) | vs current | Mean | P50 | P90 | P99 | Seconds |",
+        "|---|---|---|---|---|---|---|---|"
+    ]
+    for name, result in results.items():
+        overall = result['overall']
+        lines.append(f"| {name} | {Decimal(overall['total']):,} | {_delta(overall['total'], baseline['overall']['total'])} "
+                     f"| {Decimal(overall['mean']):,} | {Decimal(overall['p50']):,} | {Decimal(overall['p90']):,} "
+                     f"| {Decimal(overall['p99']):,} | {result['seconds']} |")
+
+    for section, title in (('by_region', 'Region'), ('by_service_type', 'Service Type')):
+        lines += ["", f"## By {title}",
+                  f"| {title} | Items | " + " | ".join(results) + " |",
+                  "|---|---|" + "---|" * len(results)]
+        for group, stats in baseline[section].items():
+            cells = []
+            for name, result in results.items():
+                total = result[section].get(group, {}).get('total', '0.00')
+                cells.append(f"{Decimal(total):,}" if name == 'current'
+                             else f"{Decimal(total):,} ({_delta(total, stats['total'])})")
+            lines.append(f"| {group} | {stats['items']:,} | " + " | ".join(cells) + " |")
+
+    markdown_file = os.path.join(report_dir, f"pricing_simulation_{timestamp}.md")
+    with open(markdown_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return [markdown_file, json_file]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='What-if pricing simulator')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    snapshot_parser = subparsers.add_parser('snapshot', help='Snapshot fee inputs from the database')
+    snapshot_parser.add_argument('--output', default=SNAPSHOT_FILE, help='Snapshot file (.npz)')
+    snapshot_parser.add_argument('--batch-size', type=int, default=5000, help='order_items per keyset batch')
+    snapshot_parser.add_argument('--production', action='store_true', help='Snapshot the production database')
+
+    simulate_parser = subparsers.add_parser('simulate', help='Evaluate candidate pricing configs')
+    simulate_parser.add_argument('candidates', help='Candidates JSON file')
+    simulate_parser.add_argument('--snapshot', default=SNAPSHOT_FILE, help='Snapshot file (.npz)')
+    args = parser.parse_args()
+
+    if args.command == 'snapshot':
+        db_config = get_database_config(is_test=not args.production)
+        print(f"📸 Snapshot of {db_config['database']} -> {args.output}")
+        try:
+            connection = mysql.connector.connect(**db_config)
+        except mysql.connector.Error as e:
+            print(f"❌ Connection failed: {e}")
+            sys.exit(1)
+        try:
+            result = take_snapshot(connection, args.output, args.batch_size)
+        finally:
+            connection.close()
+        print(f"✅ {result['rows']:,} order_items, {result['size_mb']} MB "
+              f"({result['skipped_missing_product']:,} skipped: missing product)")
+        return
+
+    snapshot = load_snapshot(args.snapshot)
+    with open(args.candidates, 'r', encoding='utf-8') as f:
+        candidates = parse_candidates(json.load(f))
+    print(f"🧮 Simulating {len(candidates)} pricing configs on {snapshot['meta']['rows']:,} order_items")
+
+    results = simulate(snapshot, candidates)
+    for name, result in results.items():
+        print(f"   {name:<24} {Decimal(result['overall']['total']):>22,} VNĐ "
+              f"({_delta(result['overall']['total'], results['current']['overall']['total'])}) "
+              f"{result['seconds']:.3f}s")
+    for path in write_reports(snapshot, candidates, results):
+        print(f"📄 Report saved: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,8 @@ from prod_config import (
     PRODUCTION_SECURITY,
     PRODUCTION_PATHS
 )
+from bulk_load_indexes import SecondaryIndexManager, BULK_LOAD_TABLES
+from import_metrics import ImportMetrics
 
 class ProductionDeployment:
     """Production deployment với full safety measures."""
@@ -318,8 +320,11 @@ class ProductionDeployment:
             with open(sql_file, 'r', encoding='utf-8') as f:
                 sql_content = f.read()
                 
+            metrics = ImportMetrics(f"production_{self.deployment_id}", self.cursor, self.logger)
+            
             # Start transaction
             self.connection.start_transaction()
+            metrics.start()
             
             try:
                 # Disable foreign key checks for import
@@ -338,17 +343,29 @@ class ProductionDeployment:
                             progress = (i / total_statements) * 100
                             self.logger.info(f"   Progress: {progress:.1f}% ({i}/{total_statements})")
                             
+                        statement_start = time.perf_counter()
                         self.cursor.execute(statement)
+                        metrics.record_statement(statement, time.perf_counter() - statement_start,
+                                                 self.cursor.rowcount)
                         
                 # Re-enable foreign key checks
                 self.cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
                 
                 # Commit transaction
+                commit_start = time.perf_counter()
                 self.connection.commit()
+                metrics.record_commit(time.perf_counter() - commit_start)
                 
                 end_time = time.time()
                 duration = end_time - start_time
                 
+                metrics.finish()
+                # Report ghi sau commit — lỗi I/O ở đây không được coi là import failed
+                try:
+                    metrics.write_report(f"production_logs/IMPORT_METRICS_{self.deployment_id}.json")
+                except Exception as e:
+                    self.logger.warning(f"⚠️  Could not write import metrics report: {e}")
+                
                 self.logger.info(f"✅ Production import completed successfully in {duration:.2f} seconds")
                 return True
                 
@@ -361,6 +378,28 @@ class ProductionDeployment:
             self.logger.error(f"❌ Import process failed: {e}")
             return False
             
+    def import_data_with_deferred_indexes(self, sql_file: str) -> bool:
+        """Import data với secondary indexes được drop trước và rebuild sau bulk load."""
+        self.logger.info(f"🗂️  Deferring secondary indexes on: {', '.join(BULK_LOAD_TABLES)}")
+        index_manager = SecondaryIndexManager(self.cursor, BULK_LOAD_TABLES, self.logger)
+        if not index_manager.drop_secondary_indexes():
+            index_manager.rebuild_secondary_indexes()
+            return False
+            
+        try:
+            import_ok = self.import_data(sql_file)
+        finally:
+            # Rebuild luôn được chạy, kể cả khi import thất bại
+            start_time = time.time()
+            rebuild_ok = index_manager.rebuild_secondary_indexes()
+            self.logger.info(f"🔧 Index rebuild took {time.time() - start_time:.2f} seconds")
+            
+        if not rebuild_ok or not index_manager.verify_schema():
+            self.logger.error("❌ Index schema differs from pre-load snapshot")
+            return False
+            
+        return import_ok
+            
     def verify_import_results(self) -> bool:
         """Verify kết quả import với comprehensive checks."""
         try:
@@ -485,6 +524,7 @@ class ProductionDeployment:
 ## Deployment Log Files
 - Main Log: production_logs/deploy_{self.deployment_id}.log
 - Error Log: production_logs/errors_{self.deployment_id}.log
+- Import Metrics: production_logs/IMPORT_METRICS_{self.deployment_id}.json
 - Backup: production_backups/backup_{self.config['database']}_{self.deployment_id}.sql
 
 ## Next Steps
@@ -516,7 +556,8 @@ class ProductionDeployment:
             self.connection.close()
         self.logger.info("🧹 Database connections closed")
         
-    def deploy(self, sql_file: str = 'dataco_complete_import.sql', dry_run: bool = False) -> bool:
+    def deploy(self, sql_file: str = 'dataco_complete_import.sql', dry_run: bool = False,
+               defer_indexes: bool = False) -> bool:
         """Main deployment method."""
         try:
             self.logger.info("🎯 Starting PRODUCTION deployment process...")
@@ -549,7 +590,11 @@ class ProductionDeployment:
                 return True
                 
             # Step 7: Actual import
-            if not self.import_data(sql_file):
+            if defer_indexes:
+                imported = self.import_data_with_deferred_indexes(sql_file)
+            else:
+                imported = self.import_data(sql_file)
+            if not imported:
                 return False
                 
             # Step 8: Verify results
@@ -577,11 +622,13 @@ def main():
                        help='SQL file to import')
     parser.add_argument('--dry-run', action='store_true', 
                        help='Perform dry-run only')
+    parser.add_argument('--defer-indexes', action='store_true',
+                       help='Drop secondary indexes before bulk load, rebuild afterwards')
     
     args = parser.parse_args()
     
     deployment = ProductionDeployment()
-    success = deployment.deploy(args.sql_file, args.dry_run)
+    success = deployment.deploy(args.sql_file, args.dry_run, args.defer_indexes)
     
     sys.exit(0 if success else 1)
 
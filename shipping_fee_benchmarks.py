@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks cho các shipping fee scripts
+Chạy trên TEST database (fastroute_test) trừ khi truyền --production.
+
+Usage:
+    python3 shipping_fee_benchmarks.py pagination [--batch-size 1000] [--repeats 3]
+    python3 shipping_fee_benchmarks.py write_back [--rows 10000] [--batch-size 1000]
+    python3 shipping_fee_benchmarks.py delivery_memory [--deliveries 1000000] [--batch-size 1000]
+    python3 shipping_fee_benchmarks.py engines [--samples 200000] [--repeats 3]
+    python3 shipping_fee_benchmarks.py engines_db [--rows 10000] [--repeats 3]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+
+import mysql.connector
+
+from shipping_fee_config import get_database_config
+from shipping_fee_db import (
+    build_order_item_fee_query, fee_changed, iter_delivery_fee_totals, FEE_WRITE_STRATEGIES
+)
+from shipping_fee_engine import get_fee_engine, random_inputs
+
+BENCHMARK_LOG_DIR = "production_logs"
+
+# Vị trí trong bảng order_items (tỉ lệ theo số rows) để đo latency
+SCAN_POSITIONS = [0.0, 0.25, 0.5, 0.75, 0.99]
+
+
+def time_query(cursor, query: str, params: tuple, repeats: int) -> float:
+    """Median latency (ms) của một query, đã fetch hết rows"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 2)
+
+
+def benchmark_pagination(cursor, batch_size: int, repeats: int) -> Dict[str, Any]:
+    """So sánh LIMIT/OFFSET với keyset (oi.id > last_id) tại các vị trí khác nhau trong bảng"""
+    keyset_query = build_order_item_fee_query()
+    offset_query = (keyset_query
+                    .replace("WHERE oi.id > %s", "WHERE 1 = 1")
+                    .replace("LIMIT %s", "LIMIT %s OFFSET %s"))
+
+    cursor.execute("SELECT COUNT(*) AS total FROM order_items")
+    total_rows = cursor.fetchone()['total']
+    print(f"📊 order_items: {total_rows:,} rows, batch size {batch_size:,}")
+
+    results = []
+    for position in SCAN_POSITIONS:
+        offset = min(int(total_rows * position), max(total_rows - 1, 0))
+
+        # Setup (không tính giờ): id đứng ngay trước vị trí offset
+        cursor.execute("SELECT id FROM order_items ORDER BY id LIMIT 1 OFFSET %s", (offset,))
+        row = cursor.fetchone()
+        anchor_id = row['id'] - 1 if row else 0
+
+        offset_ms = time_query(cursor, offset_query, (batch_size, offset), repeats)
+        keyset_ms = time_query(cursor, keyset_query, (anchor_id, batch_size), repeats)
+        results.append({
+            'position': position,
+            'offset': offset,
+            'offset_ms': offset_ms,
+            'keyset_ms': keyset_ms
+        })
+        print(f"   {position:>5.0%} (offset {offset:>10,}): LIMIT/OFFSET {offset_ms:>9.2f} ms | "
+              f"keyset {keyset_ms:>8.2f} ms")
+
+    return {'total_rows': total_rows, 'batch_size': batch_size, 'repeats': repeats, 'positions': results}
+
+
+def benchmark_write_back(cursor, rows: int, batch_size: int, repeats: int) -> Dict[str, Any]:
+    """
+    executemany (1 round trip / row) so với staging temp table + UPDATE JOIN
+    (2 round trips / chunk). Ghi lại shipping_fee hiện tại rồi rollback.
+    """
+    cursor.execute("SELECT id, COALESCE(shipping_fee, 0) AS fee FROM order_items ORDER BY id LIMIT %s", (rows,))
+    updates = [(row['fee'], row['id']) for row in cursor.fetchall()]
+    print(f"📊 Write-back of {len(updates):,} order_items, {batch_size:,} rows per batch")
+
+    results = []
+    for strategy, writer_class in FEE_WRITE_STRATEGIES.items():
+        samples = []
+        for _ in range(repeats):
+            writer = writer_class('order_items', 'shipping_fee', batch_size)
+            start = time.perf_counter()
+            for offset in range(0, len(updates), batch_size):
+                writer.write(cursor, updates[offset:offset + batch_size])
+            samples.append(time.perf_counter() - start)
+            cursor.execute("ROLLBACK")  # không giữ thay đổi, không tính vào thời gian
+
+        seconds = statistics.median(samples)
+        rows_per_second = round(len(updates) / seconds, 1) if seconds else None
+        round_trips_per_1000 = round(writer.stats['round_trips'] * 1000 / len(updates), 1) if updates else 0
+        results.append({
+            'strategy': strategy,
+            'seconds': round(seconds, 3),
+            'rows_per_second': rows_per_second,
+            'round_trips': writer.stats['round_trips'],
+            'round_trips_per_1000_rows': round_trips_per_1000
+        })
+        print(f"   {strategy:<12} {seconds:>8.3f} s | {rows_per_second or 0:>10,.0f} rows/s | "
+              f"{round_trips_per_1000:>7.1f} round trips / 1000 rows")
+
+    return {'rows': len(updates), 'batch_size': batch_size, 'repeats': repeats, 'strategies': results}
+
+
+class SyntheticDeliveryCursor:
+    """Cursor giả lập delivery totals query (không cần DB): params (last_id, limit) hoặc toàn bộ"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.rows = []
+
+    def execute(self, query: str, params: tuple = None):
+        last_id, limit = params if params else (0, self.total)
+        self.rows = [{
+            'delivery_id': delivery_id,
+            'order_id': delivery_id,
+            'current_delivery_fee': Decimal(delivery_id % 997 * 1500).quantize(Decimal('0.01')),
+            'total_shipping_fee': Decimal(delivery_id % 991 * 1500).quantize(Decimal('0.01')),
+            'item_count': delivery_id % 5 + 1
+        } for delivery_id in range(last_id + 1, min(last_id + limit, self.total) + 1)]
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class SyntheticConnection:
+    def __init__(self, total: int):
+        self.total = total
+
+    def cursor(self, **kwargs) -> SyntheticDeliveryCursor:
+        return SyntheticDeliveryCursor(self.total)
+
+
+def _delivery_updates(deliveries: List[Dict[str, Any]]) -> List[tuple]:
+    return [(Decimal(str(d['total_shipping_fee'])), d['delivery_id']) for d in deliveries
+            if fee_changed(d['total_shipping_fee'], d['current_delivery_fee'])]
+
+
+def benchmark_delivery_memory(deliveries: int, batch_size: int) -> Dict[str, Any]:
+    """
+    Peak memory (tracemalloc) của delivery aggregation: fetchall() toàn bộ
+    result + một list updates, so với keyset stream theo batch. Dùng cursor giả
+    lập nên đo phần client-side, không cần DB.
+    """
+    def fetchall_path():
+        cursor = SyntheticConnection(deliveries).cursor(dictionary=True, buffered=True)
+        cursor.execute("SELECT ... GROUP BY d.id")
+        rows = cursor.fetchall()
+        return len(rows), len(_delivery_updates(rows))
+
+    def stream_path():
+        processed = written = 0
+        for batch in iter_delivery_fee_totals(SyntheticConnection(deliveries), batch_size):
+            processed += len(batch)
+            written += len(_delivery_updates(batch))
+        return processed, written
+
+    print(f"📊 Delivery aggregation memory, {deliveries:,} deliveries, batch size {batch_size:,}")
+    results = []
+    for name, path in (('fetchall', fetchall_path), ('keyset_stream', stream_path)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        processed, written = path()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({'path': name, 'processed': processed, 'written': written,
+                        'peak_mb': round(peak / 1024 / 1024, 2), 'seconds': round(seconds, 3)})
+        print(f"   {name:<14} peak {peak / 1024 / 1024:>9.2f} MB | {seconds:>7.2f} s | "
+              f"{processed:,} processed, {written:,} to write")
+
+    return {'deliveries': deliveries, 'batch_size': batch_size, 'paths': results}
+
+
+def benchmark_engines(samples: int, repeats: int) -> Dict[str, Any]:
+    """Client-side backends (python, batch) trên cùng random inputs, kiểm tra kết quả khớp nhau"""
+    inputs = random_inputs(samples)
+    columns = (inputs['weights'], inputs['volumes'], inputs['fragile'], inputs['service_types'])
+    print(f"📊 Fee engines, {samples:,} random inputs")
+
+    results = []
+    expected = None
+    for name in ('python', 'batch'):
+        engine = get_fee_engine(name)
+        samples_seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fees = engine.fees(*columns)
+            samples_seconds.append(time.perf_counter() - start)
+        if expected is None:
+            expected = fees
+        mismatches = sum(1 for exp, got in zip(expected, fees) if exp != got)
+
+        seconds = statistics.median(samples_seconds)
+        rows_per_second = round(samples / seconds, 1) if seconds else None
+        results.append({'engine': name, 'seconds': round(seconds, 3),
+                        'rows_per_second': rows_per_second, 'mismatches': mismatches})
+        print(f"   {name:<8} {seconds:>8.3f} s | {rows_per_second or 0:>12,.0f} rows/s | {mismatches:,} mismatches")
+
+    return {'samples': samples, 'repeats': repeats, 'engines': results}
+
+
+def benchmark_engines_db(cursor, rows: int, repeats: int) -> Dict[str, Any]:
+    """
+    Tính phí cho `rows` order_items đầu tiên: fetch inputs + python/batch engine
+    so với SQL pushdown (biểu thức tính ngay trong MySQL). Chỉ SELECT, không ghi.
+    """
+    sql_engine = get_fee_engine('sql')
+    query = sql_engine.preview_statement()
+    print(f"📊 Fee engines on {rows:,} order_items")
+
+    def client_side(name: str) -> Callable[[], List]:
+        engine = get_fee_engine(name)
+
+        def run():
+            cursor.execute(query, (0, rows))
+            fetched = cursor.fetchall()
+            return engine.fees([r['weight'] for r in fetched], [r['volume'] for r in fetched],
+                               [r['is_fragile'] for r in fetched], [r['service_type'] for r in fetched])
+        return run
+
+    def pushdown():
+        cursor.execute(query, (0, rows))
+        return [Decimal(r['sql_fee']) for r in cursor.fetchall()]
+
+    results = []
+    expected = None
+    for name, run in (('python', client_side('python')), ('batch', client_side('batch')), ('sql', pushdown)):
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fees = run()
+            samples.append(time.perf_counter() - start)
+        if expected is None:
+            expected = fees
+        mismatches = sum(1 for exp, got in zip(expected, fees) if exp != got)
+
+        seconds = statistics.median(samples)
+        results.append({'engine': name, 'seconds': round(seconds, 3), 'rows': len(fees), 'mismatches': mismatches})
+        print(f"   {name:<8} {seconds:>8.3f} s | {len(fees):,} rows | {mismatches:,} mismatches")
+
+    return {'rows': rows, 'repeats': repeats, 'engines': results}
+
+
+BENCHMARKS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    'pagination': lambda cursor, args: benchmark_pagination(cursor, args.batch_size, args.repeats),
+    'write_back': lambda cursor, args: benchmark_write_back(cursor, args.rows, args.batch_size, args.repeats),
+    'delivery_memory': lambda cursor, args: benchmark_delivery_memory(args.deliveries, args.batch_size),
+    'engines': lambda cursor, args: benchmark_engines(args.samples, args.repeats),
+    'engines_db': lambda cursor, args: benchmark_engines_db(cursor, args.rows, args.repeats),
+}
+
+# Benchmarks chạy hoàn toàn client-side, không mở connection
+OFFLINE_BENCHMARKS = {'delivery_memory', 'engines'}
+
+
+def save_results(name: str, results: Dict[str, Any]) -> str:
+    os.makedirs(BENCHMARK_LOG_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(BENCHMARK_LOG_DIR, f"benchmark_{name}_{timestamp}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'benchmark': name, 'generated_at': datetime.now().isoformat(), **results}, f, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shipping fee benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS), help='Benchmark to run')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows per batch')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows to write (write_back) / price (engines_db)')
+    parser.add_argument('--samples', type=int, default=200_000, help='Random inputs (engines)')
+    parser.add_argument('--deliveries', type=int, default=1_000_000, help='Synthetic deliveries (delivery_memory)')
+    parser.add_argument('--repeats', type=int, default=3, help='Repetitions per measurement (median)')
+    parser.add_argument('--production', action='store_true', help='Run against the production database')
+    args = parser.parse_args()
+
+    if args.benchmark in OFFLINE_BENCHMARKS:
+        print(f"🔬 Benchmark '{args.benchmark}' (offline)")
+        results = BENCHMARKS[args.benchmark](None, args)
+        print(f"📄 Results saved: {save_results(args.benchmark, results)}")
+        return
+
+    db_config = get_database_config(is_test=not args.production)
+    print(f"🔬 Benchmark '{args.benchmark}' on database {db_config['database']}")
+
+    try:
+        connection = mysql.connector.connect(**db_config)
+    except mysql.connector.Error as e:
+        print(f"❌ Connection failed: {e}")
+        sys.exit(1)
+
+    try:
+        cursor = connection.cursor(dictionary=True, buffered=True)
+        results = BENCHMARKS[args.benchmark](cursor, args)
+        connection.rollback()
+        print(f"📄 Results saved: {save_results(args.benchmark, results)}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
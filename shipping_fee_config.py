@@ -53,9 +53,34 @@ PROCESSING_CONFIG = {
     'transaction_chunk_size': int(os.getenv('TRANSACTION_CHUNK_SIZE', 1000)),  # Smaller chunks
     'max_transaction_time': int(os.getenv('MAX_TRANSACTION_TIME', 60)),  # Shorter timeout
     'enable_backup': os.getenv('ENABLE_BACKUP', 'true').lower() == 'true',
+    # full (CREATE TABLE ... AS SELECT toàn bảng) | journal (bảng fee_change_journal) | file (JSONL) | none
+    'backup_mode': os.getenv('BACKUP_MODE', 'full' if os.getenv('ENABLE_BACKUP', 'true').lower() == 'true'
+                             else 'none').lower(),
+    'journal_dir': os.getenv('JOURNAL_DIR', 'fee_journal'),  # Thư mục file journal (BACKUP_MODE=file)
     'backup_chunk_size': int(os.getenv('BACKUP_CHUNK_SIZE', 5000)),
+    # Policy ping cũ (SELECT 1 mỗi N operations / sau N giây idle); Ultra không ping nữa, chỉ dùng để đo overhead đã bỏ
     'connection_check_interval': int(os.getenv('CONNECTION_CHECK_INTERVAL', 100)),  # Check every 100 records
-    'max_connection_idle': int(os.getenv('MAX_CONNECTION_IDLE', 30))  # Reconnect after 30s idle
+    'max_connection_idle': int(os.getenv('MAX_CONNECTION_IDLE', 30)),  # Reconnect after 30s idle
+    # Adaptive throttle giữa các chunks (fee_throttle.py); ngưỡng 0 = bỏ qua signal đó
+    'throttle_max_threads_running': int(os.getenv('THROTTLE_MAX_THREADS_RUNNING', 32)),
+    'throttle_max_lock_waits': int(os.getenv('THROTTLE_MAX_LOCK_WAITS', 10)),  # Innodb_row_lock_current_waits
+    'throttle_max_replica_lag': float(os.getenv('THROTTLE_MAX_REPLICA_LAG', 5)),  # seconds
+    'throttle_replica_hosts': os.getenv('THROTTLE_REPLICA_HOSTS', ''),  # host[:port],... (cùng credentials)
+    'throttle_sample_seconds': float(os.getenv('THROTTLE_SAMPLE_SECONDS', 5)),
+    'throttle_max_delay': float(os.getenv('THROTTLE_MAX_DELAY', 10)),  # Delay tối đa giữa chunks (s)
+    'fee_engine': os.getenv('FEE_ENGINE', 'python').lower(),  # python (Decimal) | batch (NumPy fees(); per-row calculators -> python) | sql (set-based UPDATE in MySQL)
+    'sql_range_size': int(os.getenv('SQL_RANGE_SIZE', 50000)),  # order_items ids per set-based UPDATE
+    'fee_memo_file': os.getenv('FEE_MEMO_FILE', ''),  # Persist (product_id, service_type) fee memo; empty = in-process only
+    'product_cache_refresh_seconds': float(os.getenv('PRODUCT_CACHE_REFRESH_SECONDS', 60)),
+    'fee_write_strategy': os.getenv('FEE_WRITE_STRATEGY', 'staging').lower(),  # staging (temp table + UPDATE JOIN) | executemany
+    'parallel_shards': int(os.getenv('PARALLEL_SHARDS', 0)),  # order_items id ranges, mỗi range một worker process; 0/1 = serial
+    'max_workers': int(os.getenv('MAX_WORKERS', 4)),  # Concurrency cap: số worker processes (connections) chạy cùng lúc
+    'incremental': os.getenv('INCREMENTAL', 'false').lower() == 'true',  # Chỉ tính lại rows thay đổi từ watermark
+    'full_rebuild': os.getenv('FULL_REBUILD', 'false').lower() == 'true',  # Bỏ qua watermark (vd. sau khi đổi SHIPPING_CONSTANTS)
+    'watermark_file': os.getenv('WATERMARK_FILE', 'shipping_fee_watermark.json'),
+    'checkpoint_db': os.getenv('CHECKPOINT_DB', 'shipping_fee_checkpoints.sqlite'),  # SQLite: run + cursor từng shard
+    'pricing_source': os.getenv('PRICING_SOURCE', 'config').lower(),  # config (SHIPPING_CONSTANTS) | table (pricing_rules)
+    'pricing_version': int(os.getenv('PRICING_VERSION', 0))  # Pin pricing_rules version; 0 = version đang active
 }
 
 # Logging Configuration
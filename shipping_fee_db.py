@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared database helpers for the shipping fee scripts
+Keyset pagination (WHERE oi.id > last_id ORDER BY oi.id LIMIT n) thay cho
+LIMIT/OFFSET: mỗi batch seek thẳng vào PRIMARY KEY nên latency không tăng
+theo vị trí trong bảng. Batch luôn chứa trọn các rows của một oi.id (order
+nhiều deliveries), xem fetch_order_items_after().
+"""
+
+import logging
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from decimal import Decimal
+
+ORDER_ITEM_FEE_QUERY = """
+SELECT
+    oi.id as order_item_id,
+    oi.order_id,
+    oi.product_id,
+    oi.quantity,
+    oi.shipping_fee as current_shipping_fee,
+    p.weight,
+    p.volume,
+    p.is_fragile,
+    p.name as product_name,
+    {service_type} as service_type,
+    o.external_id as order_external_id
+FROM order_items oi{index_hint}
+JOIN products p ON oi.product_id = p.id
+JOIN orders o ON oi.order_id = o.id
+{delivery_join} deliveries d ON o.id = d.order_id
+WHERE oi.id > %s{extra_where}
+ORDER BY oi.id
+LIMIT %s
+"""
+
+
+def build_order_item_fee_query(left_join_deliveries: bool = False,
+                               default_service_type: Optional[str] = None,
+                               where: Optional[str] = None,
+                               force_primary: bool = False) -> str:
+    """
+    Query lấy order_items + thông tin tính phí, phân trang theo oi.id.
+    Params khi execute: (last_id, limit).
+    """
+    service_type = f"COALESCE(d.service_type, '{default_service_type}')" if default_service_type else "d.service_type"
+    return ORDER_ITEM_FEE_QUERY.format(
+        service_type=service_type,
+        index_hint=" FORCE INDEX (PRIMARY)" if force_primary else "",
+        delivery_join="LEFT JOIN" if left_join_deliveries else "JOIN",
+        extra_where=f" AND {where}" if where else ""
+    )
+
+
+def fee_changed(fee, current_fee) -> bool:
+    """
+    True nếu fee mới khác giá trị đang lưu (so sánh theo giá trị Decimal:
+    12.3 == 12.30). Dùng để bỏ qua UPDATE không đổi gì (redo log, binlog, replication).
+    """
+    if current_fee is None:
+        return True
+    return Decimal(str(fee)) != Decimal(str(current_fee))
+
+
+def boundary_order_item_query(query: str) -> str:
+    """Cùng query (cùng filters) nhưng cho đúng một oi.id, không LIMIT. Params: (order_item_id,)"""
+    return query.replace("WHERE oi.id > %s", "WHERE oi.id = %s", 1).replace("\nLIMIT %s", "", 1)
+
+
+def fetch_order_items_after(cursor, last_id: int, limit: int, query: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Một batch order_items có id > last_id. JOIN deliveries theo order_id (không unique)
+    nên một oi.id có thể lặp nhiều rows: batch luôn kết thúc trọn một oi.id, nếu không
+    keyset (oi.id > id cuối) sẽ bỏ sót các rows còn lại của oi.id ở biên batch.
+    Lấy thêm một row để biết batch có cắt ngang oi.id cuối không; chỉ khi có mới
+    đọc lại toàn bộ rows của oi.id đó (round trip thêm chỉ ở order nhiều deliveries).
+    """
+    query = query or build_order_item_fee_query()
+    cursor.execute(query, (last_id, limit + 1))
+    rows = cursor.fetchall()
+    if len(rows) <= limit:
+        return rows
+
+    boundary_id = rows[limit - 1]['order_item_id']
+    if rows[limit]['order_item_id'] != boundary_id:
+        return rows[:limit]
+    cursor.execute(boundary_order_item_query(query), (boundary_id,))
+    return [row for row in rows if row['order_item_id'] != boundary_id] + cursor.fetchall()
+
+
+def iter_keyset_batches(fetch: Callable[[int, int], List[Dict[str, Any]]], batch_size: int,
+                        start_after: int = 0, key: str = 'order_item_id') -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield batches cho tới khi fetch(limit, last_id) trả về rỗng.
+    last_id lấy từ row cuối của batch trước (rows phải được ORDER BY key).
+    """
+    last_id = start_after
+    while True:
+        batch = fetch(batch_size, last_id)
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][key]
+
+
+def iter_order_item_batches(cursor, batch_size: int, start_after: int = 0,
+                            query: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Keyset scan toàn bộ order_items theo batch trên một dictionary cursor"""
+    query = query or build_order_item_fee_query()
+    return iter_keyset_batches(
+        lambda limit, last_id: fetch_order_items_after(cursor, last_id, limit, query),
+        batch_size, start_after
+    )
+
+
+ORDER_ITEM_DELIVERY_QUERY = """
+SELECT
+    oi.id as order_item_id,
+    oi.order_id,
+    oi.product_id,
+    oi.quantity,
+    oi.shipping_fee as current_shipping_fee,
+    {service_type} as service_type,
+    d.id as delivery_id,
+    d.delivery_fee as current_delivery_fee
+FROM order_items oi{index_hint}
+{delivery_join} deliveries d ON d.order_id = oi.order_id
+WHERE oi.id > %s{extra_where}
+ORDER BY oi.id
+LIMIT %s
+"""
+
+
+def build_order_item_delivery_query(left_join_deliveries: bool = False,
+                                    default_service_type: Optional[str] = None,
+                                    where: Optional[str] = None,
+                                    force_primary: bool = False) -> str:
+    """
+    Như build_order_item_fee_query nhưng chỉ scan order_items/deliveries;
+    attributes của product lấy từ ProductAttributeCache.attach().
+    """
+    service_type = f"COALESCE(d.service_type, '{default_service_type}')" if default_service_type else "d.service_type"
+    return ORDER_ITEM_DELIVERY_QUERY.format(
+        service_type=service_type,
+        index_hint=" FORCE INDEX (PRIMARY)" if force_primary else "",
+        delivery_join="LEFT JOIN" if left_join_deliveries else "JOIN",
+        extra_where=f" AND {where}" if where else ""
+    )
+
+
+class ProductAttributeCache:
+    """
+    Weight/volume/is_fragile/name của products trong arrays đánh index theo
+    product_id (AUTO_INCREMENT nên dày đặc). Refresh theo watermark updated_at.
+    """
+
+    PRODUCT_QUERY = """
+    SELECT id, weight, volume, is_fragile, name, updated_at
+    FROM products
+    {where}
+    """
+
+    def __init__(self, refresh_interval: float = 60.0):
+        self.refresh_interval = refresh_interval
+        self.known = np.zeros(0, dtype=bool)
+        self.weight_milli = np.zeros(0, dtype=np.int64)
+        self.volume_milli = np.zeros(0, dtype=np.int64)
+        self.fragile = np.zeros(0, dtype=np.int8)
+        # Decimal gốc từ DB (giữ nguyên để Decimal engine/memo cho kết quả y hệt)
+        self.weight = np.empty(0, dtype=object)
+        self.volume = np.empty(0, dtype=object)
+        self.name = np.empty(0, dtype=object)
+        self.watermark = None
+        self.last_refresh = None
+        self.stats = {'loads': 0, 'rows_loaded': 0, 'missing_lookups': 0}
+
+    def _grow(self, max_id: int):
+        size = max_id + 1
+        if size <= len(self.known):
+            return
+        extra = size - len(self.known)
+        self.known = np.concatenate([self.known, np.zeros(extra, dtype=bool)])
+        self.weight_milli = np.concatenate([self.weight_milli, np.zeros(extra, dtype=np.int64)])
+        self.volume_milli = np.concatenate([self.volume_milli, np.zeros(extra, dtype=np.int64)])
+        self.fragile = np.concatenate([self.fragile, np.zeros(extra, dtype=np.int8)])
+        self.weight = np.concatenate([self.weight, np.full(extra, None, dtype=object)])
+        self.volume = np.concatenate([self.volume, np.full(extra, None, dtype=object)])
+        self.name = np.concatenate([self.name, np.full(extra, None, dtype=object)])
+
+    def refresh(self, cursor) -> int:
+        """Load products thay đổi từ watermark (lần đầu: toàn bộ), trả về số rows"""
+        if self.watermark is None:
+            cursor.execute(self.PRODUCT_QUERY.format(where=""))
+        else:
+            # >= để không bỏ sót rows cập nhật cùng thời điểm với watermark
+            cursor.execute(self.PRODUCT_QUERY.format(where="WHERE updated_at >= %s"), (self.watermark,))
+        rows = cursor.fetchall()
+        self.last_refresh = time.monotonic()
+        if not rows:
+            return 0
+
+        self._grow(max(row['id'] for row in rows))
+        for row in rows:
+            product_id = row['id']
+            self.known[product_id] = True
+            self.weight[product_id] = row['weight']
+            self.volume[product_id] = row['volume']
+            self.weight_milli[product_id] = int(row['weight'] * 1000) if row['weight'] is not None else 0
+            self.volume_milli[product_id] = int(row['volume'] * 1000) if row['volume'] is not None else 0
+            self.fragile[product_id] = 1 if row['is_fragile'] else 0
+            self.name[product_id] = row['name']
+            if row['updated_at'] is not None and (self.watermark is None or row['updated_at'] > self.watermark):
+                self.watermark = row['updated_at']
+
+        self.stats['loads'] += 1
+        self.stats['rows_loaded'] += len(rows)
+        return len(rows)
+
+    def maybe_refresh(self, cursor) -> int:
+        """Refresh nếu chưa load hoặc đã quá refresh_interval giây"""
+        if self.last_refresh is None or time.monotonic() - self.last_refresh >= self.refresh_interval:
+            return self.refresh(cursor)
+        return 0
+
+    def is_known(self, product_id: int) -> bool:
+        return product_id is not None and 0 <= product_id < len(self.known) and bool(self.known[product_id])
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, 'products': int(self.known.sum()),
+                'watermark': self.watermark.isoformat() if self.watermark else None}
+
+    def log_summary(self):
+        logging.info(f"📦 Product cache: {int(self.known.sum()):,} products, {self.stats['loads']:,} loads "
+                     f"({self.stats['rows_loaded']:,} rows), {self.stats['missing_lookups']:,} missing lookups")
+
+    def attach(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Gắn weight/volume/is_fragile/product_name vào từng row.
+        Row có product không tồn tại được đánh dấu product_missing (JOIN cũ sẽ loại bỏ nó).
+        """
+        for row in rows:
+            product_id = row['product_id']
+            if self.is_known(product_id):
+                row['weight'] = self.weight[product_id]
+                row['volume'] = self.volume[product_id]
+                row['is_fragile'] = int(self.fragile[product_id])
+                row['product_name'] = self.name[product_id]
+                row['product_missing'] = False
+            else:
+                row['product_missing'] = True
+                self.stats['missing_lookups'] += 1
+        return rows
+
+
+def latest_fee_updates(updates: List[tuple]) -> List[tuple]:
+    """[(fee, id), ...] không trùng id, sort theo id; id trùng (order nhiều deliveries): giá trị cuối thắng"""
+    latest = dict((row_id, fee) for fee, row_id in updates)
+    return [(fee, row_id) for row_id, fee in sorted(latest.items())]
+
+
+class ExecutemanyFeeWriter:
+    """
+    UPDATE ... WHERE id = %s qua executemany (mysql-connector gửi từng row một).
+    Chỉ ghi cột fee, không bump updated_at: updated_at là input của incremental
+    watermark (fee_watermark.py), fee write của chính calculator không phải thay đổi.
+    """
+
+    def __init__(self, table: str, column: str, chunk_size: int = 1000, journal=None):
+        self.table = table
+        self.column = column
+        self.chunk_size = chunk_size
+        # FeeChangeJournal (fee_journal.py): ghi (id, old_fee, new_fee) trước mỗi write
+        self.journal = journal
+        self.stats = {'rows': 0, 'round_trips': 0, 'seconds': 0.0}
+
+    def write(self, cursor, updates: List[tuple]) -> int:
+        """
+        updates: [(fee, id), ...]; trả về số rows UPDATE thực sự đổi (rowcount), caller so
+        với len(latest_fee_updates(updates)) để phát hiện row bị thiếu
+        """
+        if not updates:
+            return 0
+        if self.journal:
+            self.journal.record(cursor, self.table, self.column, updates)
+        start = time.perf_counter()
+        rows = latest_fee_updates(updates)
+        cursor.executemany(
+            f"UPDATE {self.table} SET {self.column} = %s WHERE id = %s",
+            rows
+        )
+        self.stats['rows'] += len(rows)
+        self.stats['round_trips'] += len(rows)
+        self.stats['seconds'] += time.perf_counter() - start
+        return cursor.rowcount
+
+    def summary(self) -> Dict[str, Any]:
+        seconds = self.stats['seconds']
+        return {**self.stats, 'seconds': round(seconds, 3),
+                'rows_per_second': round(self.stats['rows'] / seconds, 1) if seconds else None}
+
+    def log_summary(self):
+        summary = self.summary()
+        logging.info(f"✍️  {self.table}.{self.column} writes ({type(self).__name__}): {summary['rows']:,} rows, "
+                     f"{summary['round_trips']:,} round trips, {summary['rows_per_second'] or 0:,.0f} rows/s")
+
+
+class StagingFeeWriter(ExecutemanyFeeWriter):
+    """
+    Bulk write-back: multi-row INSERT (id, fee) vào session TEMPORARY table rồi
+    một UPDATE ... JOIN cho mỗi chunk => 2 round trips / chunk thay vì 1 / row.
+    Rows của chunk trước không bị xoá mỗi lần (tránh thêm round trip) mà được
+    phân biệt bằng cột chunk_no; bảng staging được dọn sau mỗi clear_every chunks.
+    """
+
+    def __init__(self, table: str, column: str, chunk_size: int = 1000, journal=None, clear_every: int = 50):
+        super().__init__(table, column, chunk_size, journal)
+        self.staging_table = f"fee_staging_{table}"
+        self.clear_every = clear_every
+        self.chunk_no = 0
+        self._cursor = None
+
+    def _ensure_staging(self, cursor):
+        """TEMPORARY table sống theo session: tạo lại sau khi reconnect (không gây implicit commit)"""
+        if cursor is self._cursor:
+            return
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {self.staging_table} ("
+            f"chunk_no INT NOT NULL, id BIGINT NOT NULL, fee DECIMAL(38,2) NOT NULL, "
+            f"PRIMARY KEY (chunk_no, id)) ENGINE=InnoDB"
+        )
+        self.stats['round_trips'] += 1
+        self._cursor = cursor
+
+    def _write_chunk(self, cursor, chunk: List[tuple]) -> int:
+        self.chunk_no += 1
+        if self.chunk_no % self.clear_every == 0:
+            cursor.execute(f"DELETE FROM {self.staging_table}")
+            self.stats['round_trips'] += 1
+
+        cursor.execute(
+            f"INSERT INTO {self.staging_table} (chunk_no, id, fee) VALUES "
+            + ", ".join(["(%s, %s, %s)"] * len(chunk)),
+            [value for fee, row_id in chunk for value in (self.chunk_no, row_id, fee)]
+        )
+        cursor.execute(
+            f"UPDATE {self.table} t JOIN {self.staging_table} s ON s.id = t.id AND s.chunk_no = %s "
+            f"SET t.{self.column} = s.fee",
+            (self.chunk_no,)
+        )
+        self.stats['round_trips'] += 2
+        return cursor.rowcount
+
+    def write(self, cursor, updates: List[tuple]) -> int:
+        if not updates:
+            return 0
+        if self.journal:
+            self.journal.record(cursor, self.table, self.column, updates)
+        start = time.perf_counter()
+        self._ensure_staging(cursor)
+        # id trùng bị gộp (PRIMARY KEY của staging); sort theo id để JOIN đi theo PRIMARY KEY
+        rows = latest_fee_updates(updates)
+        updated = 0
+        for offset in range(0, len(rows), self.chunk_size):
+            updated += self._write_chunk(cursor, rows[offset:offset + self.chunk_size])
+        self.stats['rows'] += len(rows)
+        self.stats['seconds'] += time.perf_counter() - start
+        return updated
+
+
+FEE_WRITE_STRATEGIES = {
+    'executemany': ExecutemanyFeeWriter,
+    'staging': StagingFeeWriter
+}
+
+
+def make_fee_writer(strategy: str, table: str, column: str, chunk_size: int = 1000,
+                    journal=None) -> ExecutemanyFeeWriter:
+    """Writer cho table.column theo strategy ('staging' | 'executemany')"""
+    if strategy not in FEE_WRITE_STRATEGIES:
+        raise ValueError(f"Unknown fee write strategy: {strategy} (expected one of {sorted(FEE_WRITE_STRATEGIES)})")
+    return FEE_WRITE_STRATEGIES[strategy](table, column, chunk_size, journal)
+
+
+class DeliveryFeeAccumulator:
+    """
+    Tổng shipping_fee theo delivery, cộng dồn ngay trong item pass để không cần
+    scan SUM(oi.shipping_fee) ... GROUP BY d.id lần hai. Giá trị được cộng vào
+    pending và chỉ vào totals khi transaction chunk commit (rollback => bỏ pending).
+
+    Items được scan theo oi.id nên items của một order nằm liền nhau: khi scan sang
+    order khác, deliveries của order trước đã đủ và pop_completed() trả chúng ra để
+    ghi ngay => memory chỉ giữ order đang mở ở biên chunk (và order đầu của shard,
+    có thể bắt đầu ở shard trước). Order quay lại sau khi đã flush => contiguous = False,
+    caller phải tính lại bằng aggregation query.
+    """
+
+    def __init__(self, hold_first_order: bool = False):
+        # delivery_id -> [total_shipping_fee, current_delivery_fee, item_count, order_id]
+        self.totals: Dict[int, list] = {}
+        self.pending: Dict[int, list] = {}
+        self.hold_first_order = hold_first_order
+        self.held_order = None
+        self.current_order = None
+        self.committed_order = None
+        self.max_flushed_order = None
+        self.contiguous = True
+        self.discarded = False
+
+    @staticmethod
+    def _merge_into(target: Dict[int, list], source: Dict[int, list]):
+        for delivery_id, (total, current_fee, item_count, order_id) in source.items():
+            entry = target.get(delivery_id)
+            if entry is None:
+                target[delivery_id] = [total, current_fee, item_count, order_id]
+            else:
+                entry[0] += total
+                entry[2] += item_count
+
+    def _enter_order(self, order_id):
+        if self.current_order is None and self.hold_first_order:
+            self.held_order = order_id
+        # order_id tăng theo oi.id trong dữ liệu bình thường; <= order đã flush có thể là order quay lại
+        if self.max_flushed_order is not None and order_id <= self.max_flushed_order:
+            self.contiguous = False
+        self.current_order = order_id
+
+    def add(self, row: Dict[str, Any], shipping_fee):
+        """Cộng fee của một order_item (None = item chưa có fee, bị bỏ qua như trong SUM)"""
+        if self.discarded:
+            return
+        if row['order_id'] != self.current_order:
+            self._enter_order(row['order_id'])
+        delivery_id = row.get('delivery_id')
+        if delivery_id is None or shipping_fee is None:
+            return
+        entry = self.pending.get(delivery_id)
+        if entry is None:
+            self.pending[delivery_id] = [Decimal(str(shipping_fee)), row['current_delivery_fee'], 1, row['order_id']]
+        else:
+            entry[0] += Decimal(str(shipping_fee))
+            entry[2] += 1
+
+    def commit(self):
+        self._merge_into(self.totals, self.pending)
+        self.pending = {}
+        self.committed_order = self.current_order
+
+    def rollback(self):
+        self.pending = {}
+        self.current_order = self.committed_order
+
+    def pop_completed(self) -> List[Dict[str, Any]]:
+        """Deliveries (đã commit) của orders đã scan xong, bỏ khỏi totals; giữ order đang mở và order đầu của shard"""
+        open_orders = (self.current_order, self.held_order)
+        completed = {delivery_id: entry for delivery_id, entry in self.totals.items()
+                     if entry[3] not in open_orders}
+        for delivery_id, entry in completed.items():
+            del self.totals[delivery_id]
+            if self.max_flushed_order is None or entry[3] > self.max_flushed_order:
+                self.max_flushed_order = entry[3]
+        return self._rows(completed)
+
+    def discard(self):
+        """Totals không còn dùng được (resume, reconnect, order không liền nhau): bỏ và ngừng cộng dồn"""
+        self.discarded = True
+        self.totals = {}
+        self.pending = {}
+
+    def merge(self, totals: Dict[int, list]):
+        """Gộp totals còn mở của một shard khác (order ở biên có thể nằm ở hai shards)"""
+        self._merge_into(self.totals, totals)
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+    @staticmethod
+    def _rows(totals: Dict[int, list]) -> List[Dict[str, Any]]:
+        return [{'delivery_id': delivery_id, 'current_delivery_fee': current_fee,
+                 'total_shipping_fee': total, 'item_count': item_count}
+                for delivery_id, (total, current_fee, item_count, _) in sorted(totals.items())]
+
+    def deliveries(self) -> List[Dict[str, Any]]:
+        """Cùng dạng rows với delivery aggregation query, ORDER BY delivery_id"""
+        return self._rows(self.totals)
+
+
+DELIVERY_FEE_TOTALS_QUERY = """
+SELECT
+    d.id as delivery_id,
+    d.order_id,
+    d.delivery_fee as current_delivery_fee,
+    SUM(oi.shipping_fee) as total_shipping_fee,
+    COUNT(oi.id) as item_count
+FROM deliveries d
+JOIN order_items oi ON oi.order_id = d.order_id
+WHERE d.id > %s AND oi.shipping_fee IS NOT NULL{extra_where}
+GROUP BY d.id, d.order_id, d.delivery_fee
+ORDER BY d.id
+LIMIT %s
+"""
+
+
+def build_delivery_fee_totals_query(where: Optional[str] = None) -> str:
+    """
+    SUM(shipping_fee) theo delivery, keyset theo d.id (GROUP BY đi theo PRIMARY
+    KEY nên mỗi range chỉ đọc LIMIT deliveries). Params: (last_id, limit).
+    """
+    return DELIVERY_FEE_TOTALS_QUERY.format(extra_where=f" AND {where}" if where else "")
+
+
+def fetch_delivery_fee_totals_after(connection, last_id: int, limit: int,
+                                    query: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Một range delivery totals qua unbuffered cursor: rows được đọc dần từ socket
+    thay vì buffer cả result; cursor đọc hết và đóng trước khi UPDATE.
+    """
+    cursor = connection.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(query or build_delivery_fee_totals_query(), (last_id, limit))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def iter_delivery_fee_totals(connection, batch_size: int, start_after: int = 0,
+                             where: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Stream delivery totals theo batch (memory ~ batch_size, không phụ thuộc số deliveries)"""
+    query = build_delivery_fee_totals_query(where)
+    return iter_keyset_batches(
+        lambda limit, last_id: fetch_delivery_fee_totals_after(connection, last_id, limit, query),
+        batch_size, start_after, key='delivery_id'
+    )
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shipping Fee Engine - nơi duy nhất chứa công thức tính shipping_fee
+Ba backends cùng một interface (breakdown / fee / fees), chọn theo run bằng
+FEE_ENGINE (xem get_fee_engine):
+    python - Decimal, từng row một (reference)
+    batch  - NumPy fixed-point (int64), giống hệt Decimal quantize(Decimal('0.01'), ROUND_HALF_UP)
+    sql    - đẩy công thức xuống MySQL (UPDATE ... JOIN theo id range)
+Batch chỉ vectorize fees(); scripts tính từng row qua FeeMemo dùng
+get_row_fee_engine, nơi batch được thay bằng python (kèm warning).
+
+Công thức (xem SHIPPING_FEE_IMPLEMENTATION_SUMMARY.md):
+    shipping_weight = max(weight, volume * VOLUME_TO_WEIGHT_FACTOR)
+    fee = shipping_weight * BASE_PRICE_PER_KG * fragile_multiplier * service_multiplier
+
+Weight/volume là decimal(10,3) trong DB nên được biểu diễn bằng milli-units
+(int64). Mỗi tổ hợp (weight tier, fragile, service_type) được quy về một phân
+số chính xác P/Q (cents trên mỗi milli-kg), nên fee tính bằng cents là
+round_half_up(sw * P / Q).
+
+constants có thể kèm 'WEIGHT_TIERS' = ((min_weight, price_per_kg), ...) tăng dần
+(xem pricing_rules.py); không có thì một tier duy nhất BASE_PRICE_PER_KG.
+
+Usage: python3 shipping_fee_engine.py [--samples 2000000] [--seed 42]
+"""
+
+import argparse
+import logging
+import math
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from fractions import Fraction
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from shipping_fee_config import SHIPPING_CONSTANTS, SERVICE_TYPE_MULTIPLIERS, PROCESSING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Weight/volume trong DB là decimal(10,3)
+WEIGHT_SCALE = 1000
+INT64_MAX = np.iinfo(np.int64).max
+
+DEFAULT_SERVICE_MULTIPLIER = Decimal('1.0')
+
+
+def weight_tiers(constants: Dict[str, Decimal]) -> Tuple[Tuple[Decimal, Decimal], ...]:
+    """((min_weight, price_per_kg), ...) tăng dần theo min_weight"""
+    return tuple(constants.get('WEIGHT_TIERS') or ((Decimal('0'), constants['BASE_PRICE_PER_KG']),))
+
+
+def price_per_kg(shipping_weight: Decimal, constants: Dict[str, Decimal]) -> Decimal:
+    """Giá/kg của tier cao nhất có min_weight <= shipping_weight (dưới tier đầu thì dùng tier đầu)"""
+    tiers = weight_tiers(constants)
+    rate = tiers[0][1]
+    for min_weight, tier_rate in tiers:
+        if shipping_weight >= min_weight:
+            rate = tier_rate
+    return rate
+
+
+def fee_breakdown(weight, volume, is_fragile, service_type,
+                  constants: Dict[str, Decimal] = SHIPPING_CONSTANTS,
+                  service_multipliers: Dict[str, Decimal] = SERVICE_TYPE_MULTIPLIERS) -> Tuple[Decimal, Decimal, Decimal]:
+    """Decimal reference: (total_fee, shipping_weight, base_fee)"""
+    actual_weight = Decimal(str(weight)) if weight else Decimal('0')
+    volume_val = Decimal(str(volume)) if volume else Decimal('0')
+
+    volume_weight = volume_val * constants['VOLUME_TO_WEIGHT_FACTOR']
+    shipping_weight = max(actual_weight, volume_weight)
+
+    base_fee = shipping_weight * price_per_kg(shipping_weight, constants)
+    fragile_multiplier = constants['FRAGILE_MULTIPLIER'] if is_fragile else constants['NORMAL_MULTIPLIER']
+    service_multiplier = service_multipliers.get(service_type, DEFAULT_SERVICE_MULTIPLIER)
+
+    total_fee = base_fee * fragile_multiplier * service_multiplier
+    return total_fee.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), shipping_weight, base_fee
+
+
+def reference_fee(weight, volume, is_fragile, service_type,
+                  constants: Dict[str, Decimal] = SHIPPING_CONSTANTS,
+                  service_multipliers: Dict[str, Decimal] = SERVICE_TYPE_MULTIPLIERS) -> Decimal:
+    """Decimal reference fee (quantize 0.01, ROUND_HALF_UP)"""
+    return fee_breakdown(weight, volume, is_fragile, service_type, constants, service_multipliers)[0]
+
+
+def to_milli(values: Iterable[Any]) -> np.ndarray:
+    """
+    Chuyển weight/volume (Decimal, float, int, None) sang milli-units int64.
+    None/0 -> 0, giống `Decimal(str(x)) if x else 0` của reference.
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+        return np.rint(np.nan_to_num(values) * WEIGHT_SCALE).astype(np.int64)
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+        return values.astype(np.int64) * WEIGHT_SCALE
+
+    milli = [
+        int((Decimal(str(value)) * WEIGHT_SCALE).to_integral_value(rounding=ROUND_HALF_UP)) if value else 0
+        for value in values
+    ]
+    return np.array(milli, dtype=np.int64)
+
+
+def cents_to_decimal(cents: int) -> Decimal:
+    """Cents (int) -> Decimal với 2 chữ số thập phân, như cột decimal(38,2)"""
+    return Decimal(int(cents)).scaleb(-2)
+
+
+class FeeEngine:
+    """
+    Interface chung của các backends. Mặc định tính bằng Decimal reference;
+    backends override fees() (batch) hoặc bật supports_pushdown (sql).
+    """
+
+    name = 'python'
+    supports_pushdown = False
+
+    def __init__(self, constants: Dict[str, Decimal] = SHIPPING_CONSTANTS,
+                 service_multipliers: Dict[str, Decimal] = SERVICE_TYPE_MULTIPLIERS):
+        self.constants = constants
+        self.service_multipliers = service_multipliers
+
+    def breakdown(self, weight, volume, is_fragile, service_type) -> Tuple[Decimal, Decimal, Decimal]:
+        """(total_fee, shipping_weight, base_fee) cho một row"""
+        return fee_breakdown(weight, volume, is_fragile, service_type, self.constants, self.service_multipliers)
+
+    def fee(self, weight, volume, is_fragile, service_type) -> Decimal:
+        """shipping_fee cho một row"""
+        return self.breakdown(weight, volume, is_fragile, service_type)[0]
+
+    def fees(self, weights: Iterable[Any], volumes: Iterable[Any],
+             fragile: Iterable[Any], service_types: Iterable[Optional[str]]) -> List[Decimal]:
+        """shipping_fee cho nhiều rows (các cột song song như fetch từ DB)"""
+        return [self.fee(w, v, f, s) for w, v, f, s in zip(weights, volumes, fragile, service_types)]
+
+
+class ScalarFeeEngine(FeeEngine):
+    """Decimal, từng row một"""
+
+    name = 'python'
+
+
+class BatchFeeEngine(FeeEngine):
+    """Tính shipping_fee theo batch với NumPy int64 fixed-point"""
+
+    name = 'batch'
+
+    def __init__(self, constants: Dict[str, Decimal] = SHIPPING_CONSTANTS,
+                 service_multipliers: Dict[str, Decimal] = SERVICE_TYPE_MULTIPLIERS):
+        super().__init__(constants, service_multipliers)
+        self.service_types = list(service_multipliers)
+        # Index cuối cùng = service type không có trong config (multiplier mặc định)
+        self.service_index = {name: i for i, name in enumerate(self.service_types)}
+        self.default_service_index = len(self.service_types)
+
+        multipliers = [service_multipliers[name] for name in self.service_types]
+        multipliers.append(DEFAULT_SERVICE_MULTIPLIER)
+        fragile = [constants['NORMAL_MULTIPLIER'], constants['FRAGILE_MULTIPLIER']]
+
+        # Weight tiers -> bounds (milli-kg) cho searchsorted
+        tiers = weight_tiers(constants)
+        self.tier_bounds = np.array([int(Fraction(min_weight) * WEIGHT_SCALE) for min_weight, _ in tiers],
+                                    dtype=np.int64)
+
+        # Cents trên mỗi milli-kg cho từng tổ hợp (tier, fragile, service)
+        fractions = [[[Fraction(rate) * 100 / WEIGHT_SCALE * Fraction(f) * Fraction(s) for s in multipliers]
+                      for f in fragile] for _, rate in tiers]
+        flat = [fr for tier in fractions for row in tier for fr in row]
+
+        self.denominator = math.lcm(*[fr.denominator for fr in flat])
+        self.numerators = np.array(
+            [[[fr.numerator * (self.denominator // fr.denominator) for fr in row] for row in tier]
+             for tier in fractions],
+            dtype=object
+        )
+        self.max_numerator = max(abs(int(fr.numerator * (self.denominator // fr.denominator))) for fr in flat)
+        self.volume_factor = Fraction(constants['VOLUME_TO_WEIGHT_FACTOR'])
+        if self.volume_factor.denominator != 1:
+            raise ValueError("VOLUME_TO_WEIGHT_FACTOR phải là số nguyên cho fixed-point engine")
+        self.volume_factor = int(self.volume_factor)
+
+    def encode_service_types(self, service_types: Iterable[Optional[str]]) -> np.ndarray:
+        """Service type names -> index vào bảng multiplier"""
+        return np.array([self.service_index.get(name, self.default_service_index) for name in service_types],
+                        dtype=np.int64)
+
+    def shipping_weight_milli(self, weight_milli: np.ndarray, volume_milli: np.ndarray) -> np.ndarray:
+        return np.maximum(weight_milli, volume_milli * self.volume_factor)
+
+    def tier_index(self, shipping_weight_milli: np.ndarray) -> np.ndarray:
+        """Index tier cho từng shipping weight (lookup, không branch theo từng item)"""
+        index = np.searchsorted(self.tier_bounds, shipping_weight_milli, side='right') - 1
+        return np.maximum(index, 0)
+
+    def fee_cents(self, weight_milli: np.ndarray, volume_milli: np.ndarray,
+                  fragile: np.ndarray, service_index: np.ndarray) -> np.ndarray:
+        """
+        Fee (cents, int64) từ arrays đã encode.
+        Dùng int64 khi chắc chắn không overflow, ngược lại fallback sang Python int.
+        """
+        shipping_weight = self.shipping_weight_milli(np.asarray(weight_milli, dtype=np.int64),
+                                                     np.asarray(volume_milli, dtype=np.int64))
+        fragile_index = (np.asarray(fragile) != 0).astype(np.int64)
+        service_index = np.asarray(service_index, dtype=np.int64)
+
+        max_weight = int(np.abs(shipping_weight).max()) if shipping_weight.size else 0
+        fits_int64 = 2 * max_weight * self.max_numerator + self.denominator <= INT64_MAX
+        dtype = np.int64 if fits_int64 else object
+
+        numerators = self.numerators.astype(dtype)[self.tier_index(shipping_weight), fragile_index, service_index]
+        num = shipping_weight.astype(dtype) * numerators
+        # ROUND_HALF_UP (away from zero): floor((2|num| + Q) / 2Q), giữ dấu
+        magnitude = (2 * np.abs(num) + self.denominator) // (2 * self.denominator)
+        cents = np.where(num < 0, -magnitude, magnitude)
+        return cents.astype(np.int64)
+
+    def calculate(self, weights: Iterable[Any], volumes: Iterable[Any],
+                  fragile: Iterable[Any], service_types: Iterable[Optional[str]]) -> np.ndarray:
+        """Fee (cents, int64) từ raw values như fetch từ DB"""
+        fragile_flags = np.array([1 if flag else 0 for flag in fragile], dtype=np.int64)
+        return self.fee_cents(to_milli(weights), to_milli(volumes), fragile_flags,
+                              self.encode_service_types(service_types))
+
+    def fees(self, weights: Iterable[Any], volumes: Iterable[Any],
+             fragile: Iterable[Any], service_types: Iterable[Optional[str]]) -> List[Decimal]:
+        return [cents_to_decimal(cents) for cents in self.calculate(weights, volumes, fragile, service_types)]
+
+
+def sql_decimal(value: Decimal) -> str:
+    """Decimal -> exact DECIMAL literal (không bao giờ dạng số mũ)"""
+    return format(Decimal(value), 'f')
+
+
+class SqlPushdownFeeEngine(FeeEngine):
+    """
+    Đẩy công thức tính phí xuống MySQL: một UPDATE ... JOIN cho mỗi id range.
+    
+    DECIMAL arithmetic của MySQL là exact và ROUND(x, 2) làm tròn half away
+    from zero, giống Decimal ROUND_HALF_UP, nên kết quả trùng với Python engine.
+    Rows tính phía client (fee/fees) dùng Decimal reference.
+    """
+
+    name = 'sql'
+    supports_pushdown = True
+
+    def multiplier_table(self) -> str:
+        """SERVICE_TYPE_MULTIPLIERS dưới dạng derived lookup table"""
+        rows = [f"SELECT '{name}' AS service_type, {sql_decimal(multiplier)} AS multiplier"
+                for name, multiplier in self.service_multipliers.items()]
+        return f"({' UNION ALL '.join(rows)})"
+
+    def price_expression(self, shipping_weight: str) -> str:
+        """Giá/kg theo weight tier (CASE từ tier cao xuống)"""
+        tiers = weight_tiers(self.constants)
+        if len(tiers) == 1:
+            return sql_decimal(tiers[0][1])
+        cases = " ".join(f"WHEN {shipping_weight} >= {sql_decimal(min_weight)} THEN {sql_decimal(rate)}"
+                         for min_weight, rate in reversed(tiers[1:]))
+        return f"(CASE {cases} ELSE {sql_decimal(tiers[0][1])} END)"
+
+    def fee_expression(self) -> str:
+        """Biểu thức SQL tương đương reference_fee()"""
+        c = self.constants
+        shipping_weight = (f"GREATEST(COALESCE(p.weight, 0), "
+                           f"COALESCE(p.volume, 0) * {sql_decimal(c['VOLUME_TO_WEIGHT_FACTOR'])})")
+        return (
+            f"ROUND({shipping_weight}"
+            f" * {self.price_expression(shipping_weight)}"
+            f" * CASE WHEN p.is_fragile THEN {sql_decimal(c['FRAGILE_MULTIPLIER'])}"
+            f" ELSE {sql_decimal(c['NORMAL_MULTIPLIER'])} END"
+            f" * COALESCE(sm.multiplier, {sql_decimal(DEFAULT_SERVICE_MULTIPLIER)}), 2)"
+        )
+
+    def joins(self) -> str:
+        return (
+            "JOIN products p ON oi.product_id = p.id\n"
+            "JOIN orders o ON oi.order_id = o.id\n"
+            "JOIN deliveries d ON o.id = d.order_id\n"
+            f"LEFT JOIN {self.multiplier_table()} sm ON sm.service_type = d.service_type"
+        )
+
+    @staticmethod
+    def _extra_where(where: Optional[str]) -> str:
+        return f" AND {where}" if where else ""
+
+    def update_statement(self, where: Optional[str] = None) -> str:
+        """
+        UPDATE cho một id range, params: (start_after, end_id); bỏ qua rows có fee không đổi.
+        Không đổi oi.updated_at: fee là dữ liệu dẫn xuất, bump sẽ làm incremental run sau chọn lại mọi row.
+        where: điều kiện thêm trên oi/p/d (vd. changed_order_items_where cho incremental)
+        """
+        fee = self.fee_expression()
+        return (
+            f"UPDATE order_items oi\n{self.joins()}\n"
+            f"SET oi.shipping_fee = {fee}\n"
+            f"WHERE oi.id > %s AND oi.id <= %s AND NOT (oi.shipping_fee <=> {fee}){self._extra_where(where)}"
+        )
+
+    def changes_statement(self, where: Optional[str] = None) -> str:
+        """Rows mà update_statement() sẽ đổi (id, old_fee, new_fee), khoá FOR UPDATE; params như update_statement"""
+        fee = self.fee_expression()
+        return (
+            f"SELECT oi.id AS order_item_id, oi.shipping_fee AS old_fee, {fee} AS new_fee\n"
+            f"FROM order_items oi\n{self.joins()}\n"
+            f"WHERE oi.id > %s AND oi.id <= %s AND NOT (oi.shipping_fee <=> {fee}){self._extra_where(where)}\n"
+            f"FOR UPDATE"
+        )
+
+    def preview_statement(self) -> str:
+        """SELECT cùng biểu thức kèm inputs, để so sánh với Python engine"""
+        return (
+            f"SELECT oi.id AS order_item_id, p.weight, p.volume, p.is_fragile, d.service_type,\n"
+            f"       {self.fee_expression()} AS sql_fee\n"
+            f"FROM order_items oi\n{self.joins()}\n"
+            f"WHERE oi.id > %s ORDER BY oi.id LIMIT %s"
+        )
+
+    def update_range(self, cursor, start_after: int, end_id: int, journal=None,
+                     where: Optional[str] = None) -> int:
+        """Tính lại shipping_fee cho start_after < oi.id <= end_id (và where), trả về số rows thay đổi"""
+        if journal is not None:
+            # Cursor dictionary; rows bị khoá tới commit nên journal khớp đúng UPDATE bên dưới
+            cursor.execute(self.changes_statement(where), (start_after, end_id))
+            journal.record_entries(cursor, 'order_items', [(row['order_item_id'], row['old_fee'], row['new_fee'])
+                                                           for row in cursor.fetchall()])
+        cursor.execute(self.update_statement(where), (start_after, end_id))
+        return cursor.rowcount
+
+    def verify_sample(self, cursor, limit: int = 1000, start_after: int = 0) -> List[Dict[str, Any]]:
+        """So sánh biểu thức SQL với reference_fee() trên một mẫu rows, trả về các mismatches"""
+        cursor.execute(self.preview_statement(), (start_after, limit))
+        mismatches = []
+        for row in cursor.fetchall():
+            expected = reference_fee(row['weight'], row['volume'], bool(row['is_fragile']),
+                                     row['service_type'], self.constants, self.service_multipliers)
+            if Decimal(row['sql_fee']) != expected:
+                mismatches.append({'order_item_id': row['order_item_id'],
+                                   'expected': str(expected), 'sql_fee': str(row['sql_fee'])})
+        return mismatches
+
+
+FEE_ENGINES = {
+    'python': ScalarFeeEngine,
+    'batch': BatchFeeEngine,
+    'sql': SqlPushdownFeeEngine,
+}
+
+
+def get_fee_engine(name: Optional[str] = None,
+                   constants: Dict[str, Decimal] = SHIPPING_CONSTANTS,
+                   service_multipliers: Dict[str, Decimal] = SERVICE_TYPE_MULTIPLIERS) -> FeeEngine:
+    """Backend theo tên, mặc định PROCESSING_CONFIG['fee_engine'] (FEE_ENGINE)"""
+    name = name or PROCESSING_CONFIG['fee_engine']
+    if name not in FEE_ENGINES:
+        raise ValueError(f"Unknown fee engine '{name}', expected one of: {', '.join(FEE_ENGINES)}")
+    return FEE_ENGINES[name](constants, service_multipliers)
+
+
+def get_row_fee_engine(name: Optional[str] = None,
+                       constants: Dict[str, Decimal] = SHIPPING_CONSTANTS,
+                       service_multipliers: Dict[str, Decimal] = SERVICE_TYPE_MULTIPLIERS) -> FeeEngine:
+    """
+    Backend cho scripts gọi breakdown()/fee() từng row (qua FeeMemo). Batch engine
+    chỉ nhanh hơn ở fees() theo cột, nên FEE_ENGINE=batch ở đây chạy Decimal reference
+    (cùng kết quả) và báo warning thay vì âm thầm không có tác dụng.
+    """
+    name = name or PROCESSING_CONFIG['fee_engine']
+    if name == BatchFeeEngine.name:
+        logger.warning("⚠️  FEE_ENGINE=batch only vectorizes fees(); per-row calculation "
+                       "uses the python (Decimal) engine")
+        name = ScalarFeeEngine.name
+    return get_fee_engine(name, constants, service_multipliers)
+
+
+def random_inputs(samples: int, seed: int = 42) -> Dict[str, Any]:
+    """Random inputs trong miền decimal(10,3), gồm cả None/0 và service type lạ"""
+    rng = np.random.default_rng(seed)
+
+    # Trộn giá trị nhỏ (phần lẻ .xx5 quan trọng cho rounding) và lớn tới giới hạn decimal(10,3)
+    small = rng.integers(0, 100_000, samples)
+    large = rng.integers(0, 10_000_000_000, samples)
+    weight_milli = np.where(rng.random(samples) < 0.7, small, large)
+    volume_milli = np.where(rng.random(samples) < 0.8, rng.integers(0, 5_000, samples),
+                            rng.integers(0, 10_000_000_000, samples))
+
+    weights = [None if w == 0 and i % 2 else Decimal(int(w)).scaleb(-3) for i, w in enumerate(weight_milli)]
+    volumes = [None if v == 0 and i % 2 else Decimal(int(v)).scaleb(-3) for i, v in enumerate(volume_milli)]
+
+    fragile_choices = np.array([0, 1, None], dtype=object)
+    fragile = list(fragile_choices[rng.integers(0, 3, samples)])
+
+    service_choices = np.array(list(SERVICE_TYPE_MULTIPLIERS) + [None, 'UNKNOWN'], dtype=object)
+    service_types = list(service_choices[rng.integers(0, len(service_choices), samples)])
+
+    return {'weights': weights, 'volumes': volumes, 'fragile': fragile, 'service_types': service_types}
+
+
+# Config có multipliers lẻ để rounding half-up thực sự xảy ra (config mặc định luôn ra cents chẵn)
+ROUNDING_STRESS_CONSTANTS = {
+    'BASE_PRICE_PER_KG': Decimal('12345.67'),
+    'FRAGILE_MULTIPLIER': Decimal('1.35'),
+    'NORMAL_MULTIPLIER': Decimal('1.0'),
+    'VOLUME_TO_WEIGHT_FACTOR': Decimal('200')
+}
+ROUNDING_STRESS_SERVICE_MULTIPLIERS = {
+    'SECOND_CLASS': Decimal('0.85'),
+    'STANDARD': Decimal('1.0'),
+    'FIRST_CLASS': Decimal('1.333'),
+    'EXPRESS': Decimal('1.875')
+}
+
+# Weight tiers (giá/kg giảm theo shipping weight), bounds rơi vào miền của random_inputs
+TIERED_STRESS_CONSTANTS = {
+    **ROUNDING_STRESS_CONSTANTS,
+    'WEIGHT_TIERS': (
+        (Decimal('0'), Decimal('12345.67')),
+        (Decimal('1.5'), Decimal('11999.99')),
+        (Decimal('20'), Decimal('10500.5')),
+        (Decimal('500.001'), Decimal('9000'))
+    )
+}
+
+def verify_against_reference(samples: int, seed: int = 42,
+                             constants: Dict[str, Decimal] = SHIPPING_CONSTANTS,
+                             service_multipliers: Dict[str, Decimal] = SERVICE_TYPE_MULTIPLIERS) -> Dict[str, Any]:
+    """So sánh batch engine với Decimal reference trên random inputs"""
+    engine = BatchFeeEngine(constants, service_multipliers)
+    inputs = random_inputs(samples, seed)
+
+    start_time = time.time()
+    expected = [reference_fee(w, v, f, s, constants, service_multipliers) for w, v, f, s in
+                zip(inputs['weights'], inputs['volumes'], inputs['fragile'], inputs['service_types'])]
+    reference_seconds = time.time() - start_time
+
+    # Encode (Decimal -> milli) tách riêng khỏi phần tính vectorized
+    start_time = time.time()
+    weight_milli = to_milli(inputs['weights'])
+    volume_milli = to_milli(inputs['volumes'])
+    fragile = np.array([1 if flag else 0 for flag in inputs['fragile']], dtype=np.int64)
+    service_index = engine.encode_service_types(inputs['service_types'])
+    encode_seconds = time.time() - start_time
+
+    start_time = time.time()
+    cents = engine.fee_cents(weight_milli, volume_milli, fragile, service_index)
+    batch_seconds = time.time() - start_time
+
+    mismatches = [i for i, (exp, got) in enumerate(zip(expected, cents)) if exp != cents_to_decimal(got)]
+
+    return {
+        'samples': samples,
+        'seed': seed,
+        'mismatches': len(mismatches),
+        'first_mismatches': [
+            {'weight': str(inputs['weights'][i]), 'volume': str(inputs['volumes'][i]),
+             'fragile': inputs['fragile'][i], 'service_type': inputs['service_types'][i],
+             'expected': str(expected[i]), 'got': str(cents_to_decimal(cents[i]))}
+            for i in mismatches[:10]
+        ],
+        'reference_seconds': round(reference_seconds, 3),
+        'encode_seconds': round(encode_seconds, 3),
+        'batch_seconds': round(batch_seconds, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify the batch fee engine against the Decimal reference')
+    parser.add_argument('--samples', type=int, default=2_000_000, help='Number of random inputs')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    args = parser.parse_args()
+
+    failed = False
+    for label, constants, service_multipliers in (
+        ('default config', SHIPPING_CONSTANTS, SERVICE_TYPE_MULTIPLIERS),
+        ('rounding stress config', ROUNDING_STRESS_CONSTANTS, ROUNDING_STRESS_SERVICE_MULTIPLIERS),
+        ('weight tiers config', TIERED_STRESS_CONSTANTS, ROUNDING_STRESS_SERVICE_MULTIPLIERS)
+    ):
+        print(f"🧮 Verifying batch engine ({label}) on {args.samples:,} random inputs (seed={args.seed})...")
+        result = verify_against_reference(args.samples, args.seed, constants, service_multipliers)
+
+        print(f"   Decimal reference: {result['reference_seconds']}s")
+        print(f"   Encode to milli:   {result['encode_seconds']}s")
+        print(f"   NumPy batch:       {result['batch_seconds']}s")
+        if result['mismatches']:
+            failed = True
+            print(f"❌ {result['mismatches']:,} mismatches")
+            for mismatch in result['first_mismatches']:
+                print(f"   {mismatch}")
+        else:
+            print("✅ Batch engine matches Decimal reference bit-for-bit")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,8 @@ Expert 20-year solution - No transaction conflicts
 """
 
 import mysql.connector
-from decimal import Decimal, ROUND_HALF_UP
+
+from shipping_fee_engine import get_row_fee_engine
 
 # Config
 DB_CONFIG = {
@@ -17,31 +18,11 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+FEE_ENGINE = get_row_fee_engine()
+
 def calculate_fee(weight, volume, is_fragile, service_type):
     """Calculate shipping fee"""
-    weight = Decimal(str(weight)) if weight else Decimal('0')
-    volume = Decimal(str(volume)) if volume else Decimal('0')
-    
-    # Shipping weight
-    volume_weight = volume * Decimal('200')
-    shipping_weight = max(weight, volume_weight)
-    
-    # Base fee
-    base_fee = shipping_weight * Decimal('15000')
-    
-    # Multipliers
-    fragile_mult = Decimal('1.3') if is_fragile else Decimal('1.0')
-    
-    service_mults = {
-        'SECOND_CLASS': Decimal('0.8'),
-        'STANDARD': Decimal('1.0'), 
-        'FIRST_CLASS': Decimal('1.3'),
-        'EXPRESS': Decimal('1.8')
-    }
-    service_mult = service_mults.get(service_type, Decimal('1.0'))
-    
-    total = base_fee * fragile_mult * service_mult
-    return total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return FEE_ENGINE.fee(weight, volume, is_fragile, service_type)
 
 def main():
     print("🔧 SIMPLE COMPLETE FIX - Expert 20-year solution")
@@ -110,7 +91,7 @@ def main():
                 updates.append((fee, item['id']))
             
             cursor.executemany("""
-            UPDATE order_items SET shipping_fee = %s, updated_at = NOW() WHERE id = %s
+            UPDATE order_items SET shipping_fee = %s WHERE id = %s
             """, updates)
             conn.commit()
             
@@ -135,7 +116,7 @@ def main():
         delivery_updates = [(d['total_fee'], d['id']) for d in deliveries]
         
         cursor.executemany("""
-        UPDATE deliveries SET delivery_fee = %s, updated_at = NOW() WHERE id = %s
+        UPDATE deliveries SET delivery_fee = %s WHERE id = %s
         """, delivery_updates)
         conn.commit()
         
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test SecondaryIndexManager (plan, drop, rebuild, lỗi giữa chừng) trên fake cursor
+"""
+
+import copy
+import re
+import tempfile
+
+from bulk_load_indexes import SecondaryIndexManager
+
+# table -> indexes (name, non_unique, columns) và foreign keys (name, columns, referenced table, columns)
+SCHEMA = {
+    'order_items': {
+        'indexes': [
+            ('PRIMARY', 0, ['id']),
+            ('uq_external_id', 0, ['external_id']),
+            ('uq_product_variant', 0, ['product_id', 'variant']),
+            ('idx_order_id', 1, ['order_id']),
+            ('idx_created_at', 1, ['created_at']),
+        ],
+        'foreign_keys': [
+            ('fk_order_items_order', ['order_id'], 'orders', ['id']),
+            ('fk_order_items_product', ['product_id'], 'products', ['id']),
+        ]
+    },
+    'payments': {
+        'indexes': [
+            ('PRIMARY', 0, ['id']),
+            ('idx_order_id', 1, ['order_id']),
+        ],
+        'foreign_keys': [
+            ('fk_payments_order', ['order_id'], 'orders', ['id']),
+        ]
+    }
+}
+
+
+class FakeCursor:
+    """information_schema từ state trong bộ nhớ; ALTER TABLE áp dụng atomic như InnoDB,
+    ADD FOREIGN KEY với ALGORITHM=INPLACE lỗi khi foreign_key_checks=1 như MySQL"""
+
+    def __init__(self, schema):
+        self.original = schema
+        self.state = {table: {'indexes': {idx[0]: idx for idx in definition['indexes']},
+                              'foreign_keys': {fk[0]: fk for fk in definition['foreign_keys']}}
+                      for table, definition in schema.items()}
+        self.statements = []
+        self.fail_on = None
+        self.rows = []
+        self.variables = {'@@foreign_key_checks': 1}
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        if 'information_schema.STATISTICS' in sql:
+            self.rows = [(table, name, non_unique, seq, column, None, 'A', 'BTREE', None)
+                         for table in params for name, non_unique, columns in self.state[table]['indexes'].values()
+                         for seq, column in enumerate(columns, 1)]
+        elif 'information_schema.KEY_COLUMN_USAGE' in sql:
+            self.rows = [(table, name, column, position, ref_table, ref_columns[position - 1], 'RESTRICT', 'CASCADE')
+                         for table in params for name, columns, ref_table, ref_columns in self.state[table]['foreign_keys'].values()
+                         for position, column in enumerate(columns, 1)]
+        elif sql.startswith('SET '):
+            name, value = re.match(r"SET (\S+) = (\S+)$", sql).groups()
+            name = '@@foreign_key_checks' if name == 'foreign_key_checks' else name
+            self.variables[name] = self.variables[value] if value.startswith('@') else int(value)
+        elif sql.startswith('ALTER TABLE'):
+            self._alter(sql)
+
+    def _alter(self, sql):
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError(f"injected failure: {self.fail_on}")
+        if 'FOREIGN KEY' in sql and 'ADD' in sql and 'ALGORITHM=INPLACE' in sql \
+                and self.variables['@@foreign_key_checks']:
+            raise RuntimeError("ALGORITHM=INPLACE is not supported. Reason: Adding foreign keys "
+                               "needs foreign_key_checks=OFF")
+        table = re.match(r"ALTER TABLE `(\w+)`", sql).group(1)
+        state = copy.deepcopy(self.state[table])
+        definitions = {kind: {item[0]: item for item in self.original[table][kind]}
+                       for kind in ('indexes', 'foreign_keys')}
+        for action, kind, name in re.findall(r"(DROP|ADD) (FOREIGN KEY|INDEX|CONSTRAINT) `(\w+)`", sql):
+            kind = 'indexes' if kind == 'INDEX' else 'foreign_keys'
+            if action == 'DROP':
+                del state[kind][name]
+            elif name in state[kind]:
+                raise RuntimeError(f"Duplicate key name '{name}'")
+            else:
+                state[kind][name] = definitions[kind][name]
+        self.state[table] = state
+
+    def fetchall(self):
+        return self.rows
+
+
+def _manager(cursor, log_dir):
+    return SecondaryIndexManager(cursor, list(SCHEMA), log_dir=log_dir)
+
+
+def test_plan_keeps_unique_and_covered_foreign_keys():
+    """Chỉ drop non-unique indexes; FK được index giữ lại che (leading columns) thì không drop"""
+    manager = _manager(FakeCursor(SCHEMA), None)
+    schema = manager.capture_schema()
+
+    drop_indexes, drop_fks = manager._plan_table(schema['order_items'])
+    assert sorted(idx['name'] for idx in drop_indexes) == ['idx_created_at', 'idx_order_id']
+    assert [fk['name'] for fk in drop_fks] == ['fk_order_items_order']
+
+
+def test_drop_and_rebuild_restores_schema():
+    cursor = FakeCursor(SCHEMA)
+    with tempfile.TemporaryDirectory() as log_dir:
+        manager = _manager(cursor, log_dir)
+        assert manager.drop_secondary_indexes()
+
+        assert set(cursor.state['order_items']['indexes']) == {'PRIMARY', 'uq_external_id', 'uq_product_variant'}
+        assert set(cursor.state['order_items']['foreign_keys']) == {'fk_order_items_product'}
+        assert set(manager.dropped) == {'order_items', 'payments'}
+
+        cursor.statements = []
+        assert manager.rebuild_secondary_indexes()
+        # Mỗi bảng: ALTER indexes rồi ALTER FKs riêng, cả hai INPLACE (FKs với foreign_key_checks=0)
+        alters = [sql for sql in cursor.statements if sql.startswith('ALTER TABLE')]
+        assert len(alters) == 4
+        assert all(sql.endswith('ALGORITHM=INPLACE') for sql in alters)
+        assert not any('ADD INDEX' in sql and 'ADD CONSTRAINT' in sql for sql in alters)
+        assert cursor.statements.index('SET foreign_key_checks = 0') < min(
+            i for i, sql in enumerate(cursor.statements) if 'ADD CONSTRAINT' in sql)
+        assert cursor.variables['@@foreign_key_checks'] == 1
+        assert manager.dropped == {}
+        assert manager.verify_schema()
+
+
+def test_failed_index_drop_restores_foreign_keys():
+    """DROP INDEX lỗi sau khi FK đã drop: FK vẫn được ghi nhận và add lại, index còn nguyên không add trùng"""
+    cursor = FakeCursor(SCHEMA)
+    cursor.fail_on = 'DROP INDEX'
+    with tempfile.TemporaryDirectory() as log_dir:
+        manager = _manager(cursor, log_dir)
+        assert not manager.drop_secondary_indexes()
+
+        assert set(cursor.state['order_items']['foreign_keys']) == {'fk_order_items_order', 'fk_order_items_product'}
+        assert manager.dropped == {}
+        assert manager.verify_schema()
+
+
+def test_failed_rebuild_is_kept_for_retry():
+    cursor = FakeCursor(SCHEMA)
+    with tempfile.TemporaryDirectory() as log_dir:
+        manager = _manager(cursor, log_dir)
+        assert manager.drop_secondary_indexes()
+
+        cursor.fail_on = 'ADD'
+        assert not manager.rebuild_secondary_indexes()
+        assert set(manager.dropped) == {'order_items', 'payments'}
+
+        # Indexes rebuild xong, FKs lỗi: lần sau chỉ add FKs, checks vẫn được restore
+        cursor.fail_on = 'ADD CONSTRAINT'
+        assert not manager.rebuild_secondary_indexes()
+        assert cursor.variables['@@foreign_key_checks'] == 1
+        assert 'idx_order_id' in cursor.state['order_items']['indexes']
+        assert set(manager.dropped) == {'order_items', 'payments'}
+
+        cursor.fail_on = None
+        cursor.statements = []
+        assert manager.rebuild_secondary_indexes()
+        assert not any('ADD INDEX' in sql for sql in cursor.statements)
+        assert manager.verify_schema()
+
+
+def test_rebuild_keeps_session_foreign_key_checks():
+    """Import đang tắt foreign_key_checks: rebuild không bật lại"""
+    cursor = FakeCursor(SCHEMA)
+    with tempfile.TemporaryDirectory() as log_dir:
+        manager = _manager(cursor, log_dir)
+        assert manager.drop_secondary_indexes()
+
+        cursor.execute("SET foreign_key_checks = 0")
+        assert manager.rebuild_secondary_indexes()
+        assert cursor.variables['@@foreign_key_checks'] == 0
+        assert manager.verify_schema()
+
+
+if __name__ == "__main__":
+    test_plan_keeps_unique_and_covered_foreign_keys()
+    test_drop_and_rebuild_restores_schema()
+    test_failed_index_drop_restores_foreign_keys()
+    test_failed_rebuild_is_kept_for_retry()
+    test_rebuild_keeps_session_foreign_key_checks()
+    print("✅ All bulk load index tests passed")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test CheckpointStore trên file SQLite tạm: commit atomic, resume cursor theo shard, hoàn tất run
+"""
+
+import os
+import tempfile
+
+from fee_checkpoint import CheckpointStore, SERIAL
+
+JOB = 'shipping_fees:dataco_test'
+
+
+def _store(tmp_dir):
+    return CheckpointStore(os.path.join(tmp_dir, 'checkpoints', 'fee_checkpoints.db'))
+
+
+def test_per_shard_cursor_resume():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = _store(tmp_dir)
+        store.start(JOB, 'run1', 'hash1', None, None)
+        store.save_plan(JOB, [{'index': 0, 'start_after': 0, 'end_id': 100},
+                              {'index': 1, 'start_after': 100, 'end_id': 200}])
+        store.save_cursor(JOB, 0, 0, 100, 40, {'order_items_processed': 40})
+        store.save_cursor(JOB, 1, 100, 200, 150, {'order_items_processed': 50})
+        store.save_cursor(JOB, 0, 0, 100, 60, {'order_items_processed': 60})
+        store.close()
+
+        # Process mới (vd. worker sau crash) đọc lại cùng file
+        reopened = _store(tmp_dir)
+        run = reopened.resume(JOB, 'hash1', None)
+        assert run['run_id'] == 'run1' and [shard['end_id'] for shard in run['shard_plan']] == [100, 200]
+        assert reopened.load_cursor(JOB, 0, 0, 100) == {'last_id': 60, 'stats': {'order_items_processed': 60}}
+        assert reopened.load_cursor(JOB, 1, 100, 200)['last_id'] == 150
+        assert reopened.load_cursor(JOB, 1, 100, 250) is None  # Plan khác
+        assert reopened.load_cursor(JOB, SERIAL, 0, None) is None
+
+        # Pricing config / incremental window khác: không resume
+        assert reopened.resume(JOB, 'hash2', None) is None
+        assert reopened.resume(JOB, 'hash1', '2025-08-21T00:00:00') is None
+        reopened.close()
+
+
+def test_failed_write_is_atomic():
+    """Lỗi giữa các statements của một lần lưu: không có gì được ghi"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = _store(tmp_dir)
+        store.start(JOB, 'run1', 'hash1', None, None)
+        store.save_cursor(JOB, SERIAL, 0, None, 10, {'order_items_processed': 10})
+        try:
+            store._write([
+                ("INSERT OR REPLACE INTO fee_cursors (job, shard, start_after, end_id, last_id, stats, updated_at) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?)", (JOB, SERIAL, 0, None, 20, '{}', 'now')),
+                ("UPDATE missing_table SET x = 1", ())
+            ])
+            assert False, "write should fail"
+        except Exception:
+            pass
+        assert store.load_cursor(JOB, SERIAL, 0, None)['last_id'] == 10
+        store.close()
+
+
+def test_complete_and_new_run():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = _store(tmp_dir)
+        store.start(JOB, 'run1', 'hash1', None, 3)
+        store.save_cursor(JOB, SERIAL, 0, None, 99, {'order_items_processed': 99})
+        store.complete(JOB)
+
+        # Run xong: cursors giữ để tra cứu nhưng không còn resume
+        assert store.resume(JOB, 'hash1', None) is None
+        assert store.load_cursor(JOB, SERIAL, 0, None) is None
+        assert [cursor['last_id'] for cursor in store.cursors(JOB)] == [99]
+
+        # Run mới xoá cursors của run cũ
+        store.start(JOB, 'run2', 'hash1', None, 3)
+        assert store.active_run(JOB)['run_id'] == 'run2'
+        assert store.cursors(JOB) == []
+
+        store.discard(JOB)
+        assert store.active_run(JOB) is None
+        store.close()
+
+
+if __name__ == "__main__":
+    test_per_shard_cursor_resume()
+    test_failed_write_is_atomic()
+    test_complete_and_new_run()
+    print("✅ All fee checkpoint tests passed")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test FeeChangeJournal.record / rollback_plan / rollback_run trên fake connection
+"""
+
+import tempfile
+from decimal import Decimal
+
+from fee_journal import FeeChangeJournal, journal_files, rollback_plan, rollback_run
+
+
+def _decimal(value):
+    return Decimal(str(value)) if value is not None else None
+
+
+class FakeCursor:
+    """order_items/deliveries trong bộ nhớ + TEMPORARY table fee_rollback"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.staging = {}
+        self.rows = []
+        self.rowcount = 0
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        if sql.startswith('SELECT id,'):
+            table = sql.split(' FROM ')[1].split()[0]
+            self.rows = [{'id': row_id, 'old_fee': self.tables[table][row_id]}
+                         for row_id in params if row_id in self.tables[table]]
+        elif sql.startswith('INSERT INTO fee_rollback'):
+            for table, row_id, restore_to, expected in zip(*[iter(params)] * 4):
+                self.staging[(table, row_id)] = (_decimal(restore_to), _decimal(expected))
+        elif sql.startswith('DELETE FROM fee_rollback'):
+            self.staging.clear()
+        elif sql.startswith('UPDATE'):
+            table = sql.split()[1]
+            self.rowcount = 0
+            for (staged_table, row_id), (restore_to, expected) in self.staging.items():
+                if staged_table != params[0] or row_id not in self.tables[table]:
+                    continue
+                if '<=>' in sql and self.tables[table][row_id] != expected:
+                    continue
+                self.tables[table][row_id] = restore_to
+                self.rowcount += 1
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, tables):
+        self.fake_cursor = FakeCursor(tables)
+        self.commits = 0
+
+    def cursor(self, dictionary=False, buffered=False):
+        return self.fake_cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def test_rollback_plan_first_old_and_last_new():
+    entries = [
+        {'table': 'order_items', 'id': 1, 'old': None, 'new': '10.00'},
+        {'table': 'order_items', 'id': 2, 'old': '5.00', 'new': '6.00'},
+        {'table': 'order_items', 'id': 1, 'old': '10.00', 'new': '12.00'},  # Resume ghi lại row 1
+        {'table': 'deliveries', 'id': 1, 'old': '1.00', 'new': '2.00'}
+    ]
+    assert rollback_plan(entries) == {
+        'order_items': {1: (None, '12.00'), 2: ('5.00', '6.00')},
+        'deliveries': {1: ('1.00', '2.00')}
+    }
+
+
+def test_jsonl_journal_round_trip_and_guarded_rollback():
+    tables = {'order_items': {1: None, 2: Decimal('5.00'), 3: Decimal('7.00')}, 'deliveries': {}}
+    with tempfile.TemporaryDirectory() as journal_dir:
+        journal = FeeChangeJournal('file', 'run1', journal_dir=journal_dir, shard_index=0)
+        cursor = FakeCursor(tables)
+        journal.prepare(cursor)
+        # id 1 trùng trong cùng write: new của update cuối; id 99 không tồn tại => không có entry
+        assert journal.record(cursor, 'order_items', 'shipping_fee',
+                              [(Decimal('9.00'), 1), (Decimal('10.00'), 1), (Decimal('6.00'), 2),
+                               (Decimal('8.00'), 3), (Decimal('1.00'), 99)]) == 3
+        journal.close()
+        assert [path.endswith('fee_journal_run1_shard_0.jsonl') for path in journal_files('run1', journal_dir)] == [True]
+
+        tables['order_items'].update({1: Decimal('10.00'), 2: Decimal('6.00'), 3: Decimal('8.00')})
+        tables['order_items'][3] = Decimal('8.50')  # Sửa sau run: rollback bỏ qua
+
+        connection = FakeConnection(tables)
+        result = rollback_run(connection, 'run1', journal_dir=journal_dir)
+        assert result['source'] == 'file' and result['entries'] == 3
+        assert result['tables']['order_items'] == {'rows': 3, 'restored': 2, 'skipped_changed_since': 1}
+        assert tables['order_items'] == {1: None, 2: Decimal('5.00'), 3: Decimal('8.50')}
+        assert connection.commits == 1
+        assert not [sql for sql in connection.fake_cursor.statements if 'updated_at' in sql]
+
+        result = rollback_run(FakeConnection(tables), 'run1', force=True, journal_dir=journal_dir)
+        assert result['tables']['order_items']['restored'] == 3
+        assert tables['order_items'][3] == Decimal('7.00')
+
+
+def test_rolled_back_chunk_entries_are_skipped():
+    """File mode ghi trước UPDATE: entry của chunk đã rollback còn trong file, row vẫn giữ old nên bị bỏ qua"""
+    tables = {'order_items': {1: Decimal('5.00')}}
+    with tempfile.TemporaryDirectory() as journal_dir:
+        journal = FeeChangeJournal('file', 'run2', journal_dir=journal_dir)
+        cursor = FakeCursor(tables)
+        journal.prepare(cursor)
+        journal.record(cursor, 'order_items', 'shipping_fee', [(Decimal('6.00'), 1)])
+        journal.close()
+
+        result = rollback_run(FakeConnection(tables), 'run2', journal_dir=journal_dir)
+        assert result['tables']['order_items']['restored'] == 0
+        assert tables['order_items'][1] == Decimal('5.00')
+
+
+def test_table_journal_mode_inserts_entries():
+    cursor = FakeCursor({'deliveries': {4: Decimal('1.00')}})
+    journal = FeeChangeJournal('journal', 'run3')
+    assert journal.record(cursor, 'deliveries', 'delivery_fee', [(Decimal('2.00'), 4)]) == 1
+    assert cursor.statements[-1].startswith('INSERT INTO fee_change_journal')
+
+    try:
+        journal.record(cursor, 'deliveries', 'shipping_fee', [(Decimal('2.00'), 4)])
+        assert False, "non-journaled column accepted"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_rollback_plan_first_old_and_last_new()
+    test_jsonl_journal_round_trip_and_guarded_rollback()
+    test_rolled_back_chunk_entries_are_skipped()
+    test_table_journal_mode_inserts_entries()
+    print("✅ All fee journal tests passed")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test AdaptiveThrottle: AIMD delay (_adjust) và ngưỡng = 0 tắt signal, với status sampler giả lập
+"""
+
+import fee_throttle
+from fee_throttle import AdaptiveThrottle, MIN_DELAY
+
+CONFIG = {
+    'throttle_max_threads_running': 20,
+    'throttle_max_lock_waits': 5,
+    'throttle_max_replica_lag': 10,
+    'throttle_sample_seconds': 0,
+    'throttle_max_delay': 1.0,
+    'throttle_replica_hosts': ''
+}
+
+
+class StatusConnection:
+    """performance_schema.global_status giả lập"""
+
+    def __init__(self, threads_running, lock_waits):
+        self.status = {'Threads_running': threads_running, 'Innodb_row_lock_current_waits': lock_waits}
+        self.rollbacks = 0
+
+    def cursor(self, dictionary=False, buffered=False):
+        return self
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return [{'VARIABLE_NAME': name, 'VARIABLE_VALUE': str(value)} for name, value in self.status.items()]
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_adjust_aimd_table():
+    # (delay trước, có signal vượt ngưỡng, delay sau)
+    cases = [
+        (0.0, True, MIN_DELAY),    # bắt đầu giãn từ MIN_DELAY
+        (0.1, True, 0.2),          # vượt ngưỡng: gấp đôi
+        (0.8, True, 1.0),          # không quá max_delay
+        (1.0, True, 1.0),
+        (1.0, False, 0.5),         # dưới ngưỡng: giảm một nửa
+        (0.15, False, 0.0),        # dưới MIN_DELAY => full speed
+        (0.0, False, 0.0)
+    ]
+    for before, overloaded, after in cases:
+        throttle = AdaptiveThrottle(CONFIG)
+        throttle.delay = before
+        throttle._adjust(['signal'] if overloaded else [])
+        assert abs(throttle.delay - after) < 1e-9, (before, overloaded, throttle.delay)
+        assert throttle.stats['overloaded_samples'] == int(overloaded)
+
+
+def test_sample_signals_and_zero_threshold_disables():
+    # (ngưỡng threads, ngưỡng lock waits, Threads_running, lock waits, số signals vượt ngưỡng)
+    cases = [
+        (20, 5, 10, 0, 0),
+        (20, 5, 21, 0, 1),
+        (20, 5, 21, 6, 2),
+        (0, 5, 500, 0, 0),   # ngưỡng 0: Threads_running không được kiểm tra
+        (20, 0, 0, 500, 0),  # ngưỡng 0: row lock waits không được kiểm tra
+        (0, 0, 500, 500, 0)
+    ]
+    for max_threads, max_waits, threads_running, lock_waits, expected in cases:
+        throttle = AdaptiveThrottle({**CONFIG, 'throttle_max_threads_running': max_threads,
+                                     'throttle_max_lock_waits': max_waits})
+        connection = StatusConnection(threads_running, lock_waits)
+        over = throttle.sample(connection)
+        assert len(over) == expected, (max_threads, max_waits, over)
+        assert throttle.last_signals == {'threads_running': threads_running, 'row_lock_waits': lock_waits}
+        assert connection.rollbacks == 1
+
+
+def test_replica_lag_signal():
+    throttle = AdaptiveThrottle({**CONFIG, 'throttle_replica_hosts': 'replica1,replica2:3307'})
+    lags = {'replica1': 3.0, 'replica2:3307': None}  # None = replication dừng => coi như vượt ngưỡng
+    throttle._replica_lag = lambda host: lags[host]
+    assert throttle.sample(StatusConnection(0, 0)) == ['replica replica2:3307 lag unknown']
+
+    lags['replica1'] = 30.0
+    lags['replica2:3307'] = 1.0
+    assert throttle.sample(StatusConnection(0, 0)) == ['replica replica1 lag 30s > 10s']
+
+    disabled = AdaptiveThrottle({**CONFIG, 'throttle_max_replica_lag': 0, 'throttle_replica_hosts': 'replica1'})
+    disabled._replica_lag = lambda host: None
+    assert disabled.sample(StatusConnection(0, 0)) == []
+
+
+def test_pause_backs_off_then_recovers():
+    throttle = AdaptiveThrottle(CONFIG)
+    sleeps = []
+    original_sleep = fee_throttle.time.sleep
+    fee_throttle.time.sleep = sleeps.append
+    try:
+        for threads_running in (50, 50, 1, 1, 1):
+            throttle.pause(StatusConnection(threads_running, 0))
+    finally:
+        fee_throttle.time.sleep = original_sleep
+    assert sleeps == [0.1, 0.2, 0.1]
+    assert throttle.delay == 0.0
+
+
+if __name__ == "__main__":
+    test_adjust_aimd_table()
+    test_sample_signals_and_zero_threshold_disables()
+    test_replica_lag_signal()
+    test_pause_backs_off_then_recovers()
+    print("✅ All fee throttle tests passed")
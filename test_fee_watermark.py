@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test FeeWatermark (đọc / commit / FULL_REBUILD / resume) và fee writes không bump updated_at
+"""
+
+import glob
+import os
+import re
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+from fee_memo import DEFAULT_PRICING_CONFIG
+from fee_watermark import FeeWatermark
+from shipping_fee_db import ExecutemanyFeeWriter, StagingFeeWriter
+from shipping_fee_engine import get_fee_engine
+
+
+class ClockCursor:
+    """SELECT NOW(6) trả về thời điểm cố định của fake MySQL"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def execute(self, sql, params=None):
+        assert 'NOW(6)' in sql
+
+    def fetchone(self):
+        return {'now': self.now}
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.statements = []
+        self.rowcount = 1
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    def executemany(self, sql, params):
+        self.statements.append(sql)
+
+
+def test_watermark_commit_and_read():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, 'watermark.json')
+        watermark = FeeWatermark(state_file)
+        assert watermark.changed_since() is None  # Chưa có run thành công => toàn bộ
+        assert not watermark.commit_run()
+
+        started = datetime(2025, 8, 21, 13, 52, 17, 123456)
+        watermark.begin_run(ClockCursor(started))
+        # Run chưa commit: lần chạy sau vẫn là full rebuild
+        assert FeeWatermark(state_file).changed_since() is None
+        assert watermark.commit_run()
+
+        assert FeeWatermark(state_file).changed_since() == started
+        assert FeeWatermark(state_file).changed_since(full_rebuild=True) is None
+
+        other_config = {**DEFAULT_PRICING_CONFIG, 'service_multipliers': {'STANDARD': Decimal('2.0')}}
+        assert FeeWatermark(state_file, config=other_config).changed_since() is None
+
+
+def test_interrupted_run_keeps_earliest_start():
+    """Resume sau run bị dừng: watermark là thời điểm bắt đầu cũ hơn, không bỏ sót thay đổi giữa hai lần"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_file = os.path.join(tmp_dir, 'watermark.json')
+        first = datetime(2025, 8, 21, 10, 0)
+        FeeWatermark(state_file).begin_run(ClockCursor(first))
+
+        resumed = FeeWatermark(state_file)
+        resumed.load()
+        assert resumed.begin_run(ClockCursor(datetime(2025, 8, 21, 11, 0))) == first
+        assert resumed.commit_run()
+        assert FeeWatermark(state_file).changed_since() == first
+
+
+def test_fee_writes_do_not_bump_updated_at():
+    """updated_at >= watermark chỉ do thay đổi thật, không do fee vừa ghi (nếu không incremental chọn lại mọi row)"""
+    cursor = RecordingCursor()
+    ExecutemanyFeeWriter('order_items', 'shipping_fee').write(cursor, [(Decimal('1.00'), 1)])
+    StagingFeeWriter('deliveries', 'delivery_fee').write(cursor, [(Decimal('2.00'), 7)])
+    cursor.statements.append(get_fee_engine('sql').update_statement())
+    assert cursor.statements
+    assert not [sql for sql in cursor.statements if 'updated_at' in sql]
+
+
+# SET ... của một UPDATE tới hết string literal (gồm cả subquery trong SET)
+UPDATE_SET = re.compile(r"UPDATE\s+[\w{}.]+\s.{0,300}?\bSET\s(.*?)(?:\"\"\"|\"\s*[,)])", re.S)
+
+
+def test_no_script_bumps_updated_at_on_fee_writes():
+    """Mọi script ghi shipping_fee/delivery_fee (kể cả scripts cũ và journal rollback) chỉ ghi cột fee"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    offenders = []
+    for path in glob.glob(os.path.join(root, '*.py')):
+        if os.path.basename(path).startswith('test_'):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            # Nối các string literals liền nhau (f"..." f"...") thành một statement
+            source = re.sub(r'"\s*\n\s*f?"', ' ', f.read())
+        for match in UPDATE_SET.finditer(source):
+            assignments = match.group(1)
+            if re.search(r"(shipping_fee|delivery_fee|\{(?:self\.)?column\})\s*=", assignments) \
+                    and re.search(r"updated_at\s*=", assignments):
+                offenders.append(f"{os.path.basename(path)}: {' '.join(match.group(0).split())[:80]}")
+    assert not offenders, offenders
+
+
+if __name__ == "__main__":
+    test_watermark_commit_and_read()
+    test_interrupted_run_keeps_earliest_start()
+    test_fee_writes_do_not_bump_updated_at()
+    test_no_script_bumps_updated_at_on_fee_writes()
+    print("✅ All fee watermark tests passed")
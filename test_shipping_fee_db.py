@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test StagingFeeWriter (trên fake MySQL session) và DeliveryFeeAccumulator (single-pass delivery totals)
+"""
+
+import re
+from decimal import Decimal
+
+from shipping_fee_db import (
+    build_order_item_delivery_query, build_order_item_fee_query, DeliveryFeeAccumulator,
+    iter_order_item_batches, latest_fee_updates, StagingFeeWriter
+)
+
+
+class JoinCursor:
+    """order_items JOIN deliveries ON order_id, ORDER BY oi.id (thứ tự deliveries trong một oi.id không cố định)"""
+
+    def __init__(self, items, deliveries):
+        # items: {oi.id: order_id}; deliveries: {d.id: order_id}
+        self.joined = [{'order_item_id': item_id, 'delivery_id': delivery_id}
+                       for item_id, order_id in sorted(items.items())
+                       for delivery_id, delivery_order in sorted(deliveries.items(), reverse=True)
+                       if delivery_order == order_id]
+        self.queries = 0
+        self.rows = []
+
+    def execute(self, sql, params):
+        self.queries += 1
+        if 'WHERE oi.id = %s' in sql:
+            assert 'LIMIT' not in sql
+            self.rows = [row for row in self.joined if row['order_item_id'] == params[0]]
+        else:
+            last_id, limit = params
+            self.rows = [row for row in self.joined if row['order_item_id'] > last_id][:limit]
+
+    def fetchall(self):
+        return [dict(row) for row in self.rows]
+
+
+class FakeSessionCursor:
+    """Một MySQL session: TEMPORARY tables theo session, bảng đích dùng chung (server dict)"""
+
+    def __init__(self, server):
+        self.server = server
+        self.temporary = {}
+        self.statements = []
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        if sql.startswith('CREATE TEMPORARY TABLE IF NOT EXISTS'):
+            self.temporary.setdefault(sql.split()[6], {})
+        elif sql.startswith('DELETE FROM'):
+            self._staging(sql.split()[2]).clear()
+        elif sql.startswith('INSERT INTO'):
+            staging = self._staging(sql.split()[2])
+            for chunk_no, row_id, fee in zip(params[0::3], params[1::3], params[2::3]):
+                if (chunk_no, row_id) in staging:
+                    raise RuntimeError(f"Duplicate entry '{chunk_no}-{row_id}' for key 'PRIMARY'")
+                staging[(chunk_no, row_id)] = fee
+        elif sql.startswith('UPDATE'):
+            # rowcount như MySQL: chỉ rows có giá trị thay đổi, id không tồn tại không được tính
+            table, staging_name = re.match(r"UPDATE (\w+) t JOIN (\w+) s", sql).groups()
+            self.rowcount = 0
+            for (chunk_no, row_id), fee in self._staging(staging_name).items():
+                if chunk_no == params[0] and row_id in self.server[table] and self.server[table][row_id] != fee:
+                    self.server[table][row_id] = fee
+                    self.rowcount += 1
+
+    def _staging(self, name):
+        if name not in self.temporary:
+            raise RuntimeError(f"Table '{name}' doesn't exist")
+        return self.temporary[name]
+
+
+def test_staging_writer_last_value_wins_and_chunks_are_isolated():
+    server = {'order_items': {1: None, 2: None, 3: None, 4: None}}
+    cursor = FakeSessionCursor(server)
+    writer = StagingFeeWriter('order_items', 'shipping_fee', chunk_size=2)
+
+    # id 1 trùng: giá trị cuối cùng thắng như executemany (và không vi phạm PRIMARY KEY của staging)
+    updates = [(Decimal('1.00'), 1), (Decimal('2.00'), 2), (Decimal('9.00'), 1), (Decimal('3.00'), 3)]
+    assert writer.write(cursor, updates) == len(latest_fee_updates(updates)) == 3
+    assert server['order_items'] == {1: Decimal('9.00'), 2: Decimal('2.00'), 3: Decimal('3.00'), 4: None}
+
+    # Rows staging của chunk trước còn đó nhưng UPDATE chỉ JOIN chunk_no hiện tại
+    server['order_items'][1] = Decimal('1.50')
+    assert writer.write(cursor, [(Decimal('4.00'), 4)]) == 1
+    assert server['order_items'][1] == Decimal('1.50')
+    assert server['order_items'][4] == Decimal('4.00')
+    assert len([sql for sql in cursor.statements if sql.startswith('CREATE')]) == 1
+
+
+def test_staging_writer_reports_missing_rows():
+    """Trả về rowcount của UPDATE JOIN: caller phát hiện được row không tồn tại / không đổi"""
+    server = {'deliveries': {1: None, 2: Decimal('5.00')}}
+    writer = StagingFeeWriter('deliveries', 'delivery_fee', chunk_size=2)
+    assert writer.write(FakeSessionCursor(server), [(Decimal('1.00'), 1), (Decimal('6.00'), 2),
+                                                    (Decimal('7.00'), 99)]) == 2
+    assert writer.stats['rows'] == 3
+
+    # DECIMAL(38,2) như cột đích: delivery totals lớn không bị cắt trong staging
+    cursor = FakeSessionCursor({})
+    writer._ensure_staging(cursor)
+    assert 'fee DECIMAL(38,2)' in cursor.statements[0]
+
+
+def test_staging_writer_clears_every_n_chunks():
+    cursor = FakeSessionCursor({'deliveries': dict.fromkeys(range(1, 6))})
+    writer = StagingFeeWriter('deliveries', 'delivery_fee', chunk_size=1, clear_every=3)
+    for delivery_id in range(1, 6):
+        writer.write(cursor, [(Decimal(delivery_id), delivery_id)])
+
+    assert len([sql for sql in cursor.statements if sql.startswith('DELETE')]) == 1
+    # Chunk 3 dọn bảng trước khi insert: còn chunks 3, 4, 5
+    assert sorted(cursor.temporary['fee_staging_deliveries']) == [(3, 3), (4, 4), (5, 5)]
+    assert cursor.server['deliveries'] == {i: Decimal(i) for i in range(1, 6)}
+
+
+def test_staging_writer_recreates_table_after_reconnect():
+    """TEMPORARY table mất theo session cũ: cursor mới (sau reconnect) phải tạo lại trước khi insert"""
+    server = {'order_items': {1: None, 2: None}}
+    writer = StagingFeeWriter('order_items', 'shipping_fee')
+    writer.write(FakeSessionCursor(server), [(Decimal('1.00'), 1)])
+
+    reconnected = FakeSessionCursor(server)
+    writer.write(reconnected, [(Decimal('2.00'), 2)])
+    assert reconnected.statements[0].startswith('CREATE TEMPORARY TABLE')
+    assert server['order_items'] == {1: Decimal('1.00'), 2: Decimal('2.00')}
+
+
+def test_keyset_batches_keep_multi_delivery_items_whole():
+    """Batch cắt ngang order nhiều deliveries: rows còn lại của oi.id ở biên không bị bỏ sót"""
+    items = {1: 10, 2: 10, 3: 20, 4: 30, 5: 30, 6: 40}
+    deliveries = {100: 10, 101: 10, 102: 10, 200: 20, 300: 30, 301: 30, 400: 40}
+    for query in (build_order_item_fee_query(), build_order_item_delivery_query(force_primary=True)):
+        for batch_size in (1, 2, 3, 4, 5):
+            cursor = JoinCursor(items, deliveries)
+            batches = list(iter_order_item_batches(cursor, batch_size, query=query))
+            rows = sorted((row['order_item_id'], row['delivery_id']) for batch in batches for row in batch)
+            assert rows == sorted((row['order_item_id'], row['delivery_id']) for row in cursor.joined), batch_size
+            # Mỗi oi.id nằm trọn trong một batch
+            seen = [{row['order_item_id'] for row in batch} for batch in batches]
+            assert sum(len(ids) for ids in seen) == len(items)
+
+    # Không có order nhiều deliveries ở biên: không có round trip thêm
+    cursor = JoinCursor({1: 10, 2: 20, 3: 30}, {100: 10, 200: 20, 300: 30})
+    assert [len(batch) for batch in iter_order_item_batches(cursor, 2)] == [2, 1]
+    assert cursor.queries == 3
+
+
+def _item(order_id, delivery_id, current_delivery_fee=None):
+    return {'order_id': order_id, 'delivery_id': delivery_id, 'current_delivery_fee': current_delivery_fee}
+
+
+def _totals(rows):
+    return {row['delivery_id']: (row['total_shipping_fee'], row['item_count']) for row in rows}
+
+
+def test_totals_merge_across_batches_and_rollback():
+    accumulator = DeliveryFeeAccumulator()
+    accumulator.add(_item(1, 10), Decimal('1.10'))
+    accumulator.add(_item(1, 10), None)  # Item chưa có fee: bỏ qua như SUM()
+    accumulator.commit()
+    accumulator.add(_item(1, 10), '2.20')
+    accumulator.add(_item(2, 20), Decimal('5.00'))
+    accumulator.rollback()  # Chunk rollback: bỏ pending, totals đã commit giữ nguyên
+    assert _totals(accumulator.deliveries()) == {10: (Decimal('1.10'), 1)}
+
+    accumulator.add(_item(1, 10), '2.20')
+    accumulator.commit()
+    assert _totals(accumulator.deliveries()) == {10: (Decimal('3.30'), 2)}
+
+
+def test_completed_orders_are_flushed_at_chunk_boundary():
+    """Chỉ order đang mở ở biên chunk còn lại trong memory"""
+    accumulator = DeliveryFeeAccumulator()
+    for order_id, delivery_id, fee in [(1, 10, '1.00'), (1, 11, '1.00'), (2, 20, '2.00'), (3, 30, '3.00')]:
+        accumulator.add(_item(order_id, delivery_id), Decimal(fee))
+    accumulator.commit()
+
+    assert _totals(accumulator.pop_completed()) == {10: (Decimal('1.00'), 1), 11: (Decimal('1.00'), 1),
+                                                    20: (Decimal('2.00'), 1)}
+    assert list(accumulator.totals) == [30]
+
+    # Order 3 tiếp tục ở chunk sau
+    accumulator.add(_item(3, 30), Decimal('3.00'))
+    accumulator.add(_item(4, 40), Decimal('4.00'))
+    accumulator.commit()
+    assert _totals(accumulator.pop_completed()) == {30: (Decimal('6.00'), 2)}
+    assert accumulator.contiguous
+
+
+def test_shard_boundary_orders_are_held_and_merged():
+    """Order đầu của shard có thể bắt đầu ở shard trước: giữ lại, process cha gộp với shard trước"""
+    first, second = DeliveryFeeAccumulator(), DeliveryFeeAccumulator(hold_first_order=True)
+    first.add(_item(1, 10), Decimal('1.00'))
+    first.add(_item(2, 20), Decimal('2.00'))
+    first.commit()
+    second.add(_item(2, 20), Decimal('2.00'))
+    second.add(_item(3, 30), Decimal('3.00'))
+    second.add(_item(4, 40), Decimal('4.00'))
+    second.commit()
+
+    assert _totals(first.pop_completed()) == {10: (Decimal('1.00'), 1)}
+    assert _totals(second.pop_completed()) == {30: (Decimal('3.00'), 1)}
+
+    parent = DeliveryFeeAccumulator()
+    parent.merge(first.totals)
+    parent.merge(second.totals)
+    assert _totals(parent.deliveries()) == {20: (Decimal('4.00'), 2), 40: (Decimal('4.00'), 1)}
+
+
+def test_returning_order_marks_totals_unusable():
+    accumulator = DeliveryFeeAccumulator()
+    accumulator.add(_item(1, 10), Decimal('1.00'))
+    accumulator.add(_item(2, 20), Decimal('2.00'))
+    accumulator.commit()
+    accumulator.pop_completed()
+
+    accumulator.add(_item(1, 10), Decimal('1.00'))  # Order 1 đã flush lại xuất hiện
+    assert not accumulator.contiguous
+
+    accumulator.discard()
+    accumulator.add(_item(5, 50), Decimal('1.00'))
+    accumulator.commit()
+    assert len(accumulator) == 0
+
+
+if __name__ == "__main__":
+    test_keyset_batches_keep_multi_delivery_items_whole()
+    test_staging_writer_last_value_wins_and_chunks_are_isolated()
+    test_staging_writer_reports_missing_rows()
+    test_staging_writer_clears_every_n_chunks()
+    test_staging_writer_recreates_table_after_reconnect()
+    test_totals_merge_across_batches_and_rollback()
+    test_completed_orders_are_flushed_at_chunk_boundary()
+    test_shard_boundary_orders_are_held_and_merged()
+    test_returning_order_marks_totals_unusable()
+    print("✅ All shipping fee db tests passed")
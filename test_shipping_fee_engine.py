@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test batch engine (NumPy fixed-point) so với Decimal reference
+Chạy full verification: python3 shipping_fee_engine.py --samples 2000000
+"""
+
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+from fee_memo import DEFAULT_PRICING_CONFIG, FeeMemo, pricing_config_hash
+from fee_watermark import changed_order_items_where
+from pricing_rules import compile_pricing_rules
+from shipping_fee_engine import (
+    BatchFeeEngine, cents_to_decimal, get_fee_engine, get_row_fee_engine, random_inputs, reference_fee,
+    verify_against_reference,
+    FEE_ENGINES, ROUNDING_STRESS_CONSTANTS, ROUNDING_STRESS_SERVICE_MULTIPLIERS, TIERED_STRESS_CONSTANTS
+)
+
+
+def test_known_cases():
+    """Các case trong test_calculation_logic.py"""
+    engine = BatchFeeEngine()
+    cases = [
+        (10, 0.5, False, 'STANDARD'),
+        (150, 0.1, False, 'STANDARD'),
+        (50, 0.2, True, 'EXPRESS'),
+        (None, None, None, None),
+        (Decimal('0.001'), Decimal('0.000'), True, 'SECOND_CLASS'),
+    ]
+    cents = engine.calculate(*zip(*cases))
+    for case, got in zip(cases, cents):
+        assert cents_to_decimal(got) == reference_fee(*case), case
+
+
+def test_random_default_config():
+    result = verify_against_reference(20_000, seed=7)
+    assert result['mismatches'] == 0, result['first_mismatches']
+
+
+def test_random_rounding_stress_config():
+    result = verify_against_reference(20_000, seed=11, constants=ROUNDING_STRESS_CONSTANTS,
+                                      service_multipliers=ROUNDING_STRESS_SERVICE_MULTIPLIERS)
+    assert result['mismatches'] == 0, result['first_mismatches']
+
+
+def test_random_weight_tiers_config():
+    result = verify_against_reference(20_000, seed=13, constants=TIERED_STRESS_CONSTANTS,
+                                      service_multipliers=ROUNDING_STRESS_SERVICE_MULTIPLIERS)
+    assert result['mismatches'] == 0, result['first_mismatches']
+
+
+def test_backends_agree():
+    """Mọi backend trả về cùng fees()/fee() trên cùng inputs"""
+    inputs = random_inputs(2_000, seed=3)
+    columns = (inputs['weights'], inputs['volumes'], inputs['fragile'], inputs['service_types'])
+    expected = [reference_fee(*row, ROUNDING_STRESS_CONSTANTS, ROUNDING_STRESS_SERVICE_MULTIPLIERS)
+                for row in zip(*columns)]
+    for name in FEE_ENGINES:
+        engine = get_fee_engine(name, ROUNDING_STRESS_CONSTANTS, ROUNDING_STRESS_SERVICE_MULTIPLIERS)
+        assert engine.fees(*columns) == expected, name
+        assert engine.fee(*[column[0] for column in columns]) == expected[0], name
+
+
+def test_compiled_pricing_rules():
+    """Rules từ bảng pricing_rules: một tier = config cũ, nhiều tiers = lookup theo shipping weight"""
+    rows = [
+        {'rule_type': 'WEIGHT_TIER', 'rule_key': '', 'min_weight': Decimal('0.000'), 'value': Decimal('15000')},
+        {'rule_type': 'FRAGILE_MULTIPLIER', 'rule_key': '', 'min_weight': Decimal('0.000'), 'value': Decimal('1.3')},
+        {'rule_type': 'VOLUME_FACTOR', 'rule_key': '', 'min_weight': Decimal('0.000'), 'value': Decimal('200')},
+        {'rule_type': 'SERVICE_MULTIPLIER', 'rule_key': 'EXPRESS', 'min_weight': Decimal('0.000'), 'value': Decimal('1.8')},
+    ]
+    config = compile_pricing_rules(rows)
+    assert 'WEIGHT_TIERS' not in config['constants']
+    engine = get_fee_engine('batch', config['constants'], config['service_multipliers'])
+    assert engine.fee(50, 0.2, True, 'EXPRESS') == Decimal('1755000.00')
+
+    rows.append({'rule_type': 'WEIGHT_TIER', 'rule_key': '', 'min_weight': Decimal('100.000'), 'value': Decimal('12000')})
+    config = compile_pricing_rules(rows)
+    weights = [Decimal('99.999'), Decimal('100.000'), Decimal('150')]
+    fees = get_fee_engine('batch', config['constants'], config['service_multipliers']).fees(
+        weights, [None] * 3, [False] * 3, ['STANDARD'] * 3)
+    assert fees == [Decimal('1499985.00'), Decimal('1200000.00'), Decimal('1800000.00')]
+
+
+
+def test_migration_seed_matches_config_hash():
+    """Seed version 1 trong pricing_rules_migration.sql (DECIMAL scale 4) cùng hash với SHIPPING_CONSTANTS"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pricing_rules_migration.sql'),
+              encoding='utf-8') as f:
+        sql = f.read()
+    seed = sql.split('INSERT IGNORE INTO pricing_rules ', 1)[1].split(';', 1)[0]
+    rows = [{'rule_type': rule_type, 'rule_key': rule_key, 'min_weight': Decimal(min_weight), 'value': Decimal(value)}
+            for rule_type, rule_key, min_weight, value
+            in re.findall(r"\(1, '(\w+)', '(\w*)', ([\d.]+), ([\d.]+)\)", seed)]
+    assert len(rows) == 8
+
+    config = compile_pricing_rules(rows)
+    assert config['constants']['BASE_PRICE_PER_KG'] == Decimal('15000.0000')
+    assert pricing_config_hash(config) == pricing_config_hash(DEFAULT_PRICING_CONFIG)
+
+    rows[0] = dict(rows[0], value=Decimal('15000.0001'))
+    assert pricing_config_hash(compile_pricing_rules(rows)) != pricing_config_hash(DEFAULT_PRICING_CONFIG)
+
+
+
+def test_row_fee_engine_replaces_batch():
+    """Calculators từng row: FEE_ENGINE=batch không âm thầm vô tác dụng - chạy python và warning"""
+    warnings = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            warnings.append(record.getMessage())
+
+    handler = Handler(logging.WARNING)
+    engine_logger = logging.getLogger('shipping_fee_engine')
+    engine_logger.addHandler(handler)
+    try:
+        engine = get_row_fee_engine('batch')
+        assert engine.name == 'python' and len(warnings) == 1
+        assert get_row_fee_engine('sql').supports_pushdown
+        assert len(warnings) == 1
+    finally:
+        engine_logger.removeHandler(handler)
+
+
+def test_sql_pushdown_incremental_where():
+    """Incremental pushdown: UPDATE và journal SELECT cùng lọc theo watermark, cùng params"""
+    engine = get_fee_engine('sql')
+    where = changed_order_items_where(datetime(2025, 1, 1))
+
+    class Cursor:
+        def __init__(self):
+            self.executed = []
+            self.rowcount = 3
+
+        def execute(self, sql, params):
+            self.executed.append((sql, params))
+
+        def fetchall(self):
+            return [{'order_item_id': 5, 'old_fee': None, 'new_fee': Decimal('1.00')}]
+
+    class Journal:
+        def record_entries(self, cursor, table, entries):
+            self.entries = entries
+
+    cursor, journal = Cursor(), Journal()
+    assert engine.update_range(cursor, 0, 100, journal=journal, where=where) == 3
+    assert journal.entries == [(5, None, Decimal('1.00'))]
+    for sql, params in cursor.executed:
+        assert sql.count(where) == 1 and params == (0, 100)
+    assert where not in engine.update_statement()
+
+
+def test_fee_memo_file_is_kind_specific():
+    """FEE_MEMO_FILE dùng chung: 'fee' memo không load entries 'breakdown' (và ngược lại)"""
+    engine = get_fee_engine('python')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        persist_file = os.path.join(tmp_dir, 'fee_memo.json')
+        breakdown_memo = FeeMemo(engine.breakdown, 'breakdown', persist_file=persist_file)
+        expected = breakdown_memo.lookup(1, Decimal('2.5'), Decimal('0.01'), True, 'EXPRESS')
+        assert breakdown_memo.save()
+
+        fee_memo = FeeMemo(engine.fee, 'fee', persist_file=persist_file)
+        assert fee_memo.entries == {}
+        assert fee_memo.lookup(1, Decimal('2.5'), Decimal('0.01'), True, 'EXPRESS') == expected[0]
+
+        reloaded = FeeMemo(engine.breakdown, 'breakdown', persist_file=persist_file)
+        assert reloaded.lookup(1, Decimal('2.5'), Decimal('0.01'), True, 'EXPRESS') == expected
+        assert reloaded.stats['hits'] == 1
+
+
+if __name__ == "__main__":
+    test_known_cases()
+    test_random_default_config()
+    test_random_rounding_stress_config()
+    test_random_weight_tiers_config()
+    test_backends_agree()
+    test_compiled_pricing_rules()
+    test_migration_seed_matches_config_hash()
+    test_row_fee_engine_replaces_batch()
+    test_sql_pushdown_incremental_where()
+    test_fee_memo_file_is_kind_specific()
+    print("✅ Batch engine tests passed")
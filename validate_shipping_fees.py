@@ -10,8 +10,55 @@ import mysql.connector
 import logging
 from datetime import datetime
 from decimal import Decimal
+import json
 import sys
 import os
+import time
+import zlib
+
+import numpy as np
+
+from shipping_fee_db import iter_delivery_fee_totals, iter_keyset_batches, ProductAttributeCache
+from shipping_fee_engine import BatchFeeEngine, cents_to_decimal, get_fee_engine
+from pricing_rules import resolve_pricing_config
+from pricing_simulator import load_snapshot, SNAPSHOT_FILE
+
+# Full mode (--full): keyset scan toàn bảng, batch lớn, fee lấy dạng cents ngay trong SQL
+FULL_BATCH_SIZE = 50000
+FULL_TOP_N = 20
+FEE_TOLERANCE_CENTS = 1  # như kiểm tra mẫu: lệch <= 0.01 coi là đúng
+MISMATCH_BUCKETS_CENTS = (100, 10000, 1000000)
+MISMATCH_BUCKET_LABELS = ('<= 1 VND', '<= 100 VND', '<= 10,000 VND', '> 10,000 VND')
+
+FULL_ORDER_ITEMS_QUERY = """
+SELECT
+    oi.id,
+    COALESCE(oi.product_id, 0),
+    oi.shipping_fee IS NULL,
+    COALESCE(CAST(oi.shipping_fee * 100 AS SIGNED), 0),
+    d.service_type
+FROM order_items oi
+JOIN deliveries d ON d.id = (SELECT MIN(d1.id) FROM deliveries d1 WHERE d1.order_id = oi.order_id)
+WHERE oi.id > %s AND oi.id <= %s
+ORDER BY oi.id
+LIMIT %s
+"""
+MAX_ORDER_ITEM_ID = 2 ** 63 - 1
+
+# Checksum mode (--checksum): mỗi id range chỉ trả về một row (số rows, số fee khác NULL, checksum);
+# cùng phạm vi rows với snapshot (có delivery và product)
+CHECKSUM_RANGE_SIZE = 10000
+RANGE_CHECKSUM_QUERY = """
+SELECT
+    oi.id DIV %s AS id_range,
+    COUNT(*),
+    COUNT(oi.shipping_fee),
+    BIT_XOR(CRC32(CONCAT(oi.id, oi.shipping_fee)))
+FROM order_items oi
+WHERE EXISTS (SELECT 1 FROM deliveries d WHERE d.order_id = oi.order_id)
+  AND EXISTS (SELECT 1 FROM products p WHERE p.id = oi.product_id)
+GROUP BY id_range
+"""
 
 # Cấu hình logging
 def setup_logging():
@@ -43,15 +90,116 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+class MismatchSummary:
+    """Cộng dồn mismatches qua các batch: số lượng, phân bố theo |diff| và theo nhóm, N rows lệch đầu tiên"""
+    
+    def __init__(self, top_n: int = FULL_TOP_N):
+        self.top_n = top_n
+        self.checked = 0
+        self.mismatched = 0
+        self.within_tolerance = 0
+        self.overcharged = 0
+        self.net_diff_cents = 0
+        self.buckets = np.zeros(len(MISMATCH_BUCKET_LABELS), dtype=np.int64)
+        self.by_group = {}
+        self.offenders = []
+    
+    def add(self, ids, actual_cents, expected_cents, groups=None):
+        """ids/actual/expected: arrays song song; groups: nhãn từng row (vd. service_type) hoặc None"""
+        diff = actual_cents - expected_cents
+        abs_diff = np.abs(diff)
+        bad = abs_diff > FEE_TOLERANCE_CENTS
+        self.checked += len(ids)
+        self.within_tolerance += int(((abs_diff > 0) & ~bad).sum())
+        
+        bad_count = int(bad.sum())
+        if not bad_count:
+            return
+        self.mismatched += bad_count
+        self.overcharged += int((diff[bad] > 0).sum())
+        self.net_diff_cents += int(diff[bad].sum())
+        self.buckets += np.bincount(np.searchsorted(MISMATCH_BUCKETS_CENTS, abs_diff[bad]),
+                                    minlength=len(MISMATCH_BUCKET_LABELS))
+        if groups is not None:
+            names, counts = np.unique(np.asarray(groups, dtype=object)[bad].astype(str), return_counts=True)
+            for name, count in zip(names, counts):
+                self.by_group[name] = self.by_group.get(name, 0) + int(count)
+        
+        for i in np.flatnonzero(bad)[:max(self.top_n - len(self.offenders), 0)]:
+            self.offenders.append({
+                'id': int(ids[i]),
+                'actual': str(cents_to_decimal(actual_cents[i])),
+                'expected': str(cents_to_decimal(expected_cents[i])),
+                'diff': str(cents_to_decimal(diff[i])),
+                'group': None if groups is None else groups[i]
+            })
+    
+    def summary(self):
+        return {
+            'checked': self.checked,
+            'mismatched': self.mismatched,
+            'mismatch_rate': round(self.mismatched / self.checked, 6) if self.checked else 0.0,
+            'within_tolerance': self.within_tolerance,
+            'overcharged': self.overcharged,
+            'undercharged': self.mismatched - self.overcharged,
+            'net_diff': str(cents_to_decimal(self.net_diff_cents)),
+            'abs_diff_distribution': dict(zip(MISMATCH_BUCKET_LABELS, (int(count) for count in self.buckets))),
+            'by_group': dict(sorted(self.by_group.items(), key=lambda item: -item[1])),
+            'first_offenders': self.offenders
+        }
+    
+    def log(self, name):
+        logging.info(f"📊 {name}: {self.checked - self.mismatched:,}/{self.checked:,} đúng, "
+                     f"{self.mismatched:,} lệch ({self.overcharged:,} cao hơn, "
+                     f"{self.mismatched - self.overcharged:,} thấp hơn, net {cents_to_decimal(self.net_diff_cents):,} VNĐ)")
+        if not self.mismatched:
+            return
+        for label, count in zip(MISMATCH_BUCKET_LABELS, self.buckets):
+            logging.info(f"   |diff| {label}: {int(count):,}")
+        for group, count in sorted(self.by_group.items(), key=lambda item: -item[1]):
+            logging.info(f"   {group}: {count:,}")
+        for offender in self.offenders:
+            logging.error(f"❌ {offender['id']}: Expected {offender['expected']}, Got {offender['actual']} "
+                          f"(diff {offender['diff']}{', ' + offender['group'] if offender['group'] else ''})")
+
+def checksum_text(order_item_id, cents):
+    """Giống CONCAT(oi.id, oi.shipping_fee) của MySQL với decimal(38,2)"""
+    sign = '-' if cents < 0 else ''
+    cents = abs(cents)
+    return f"{order_item_id}{sign}{cents // 100}.{cents % 100:02d}"
+
+def local_range_checksums(snapshot, engine, range_size=CHECKSUM_RANGE_SIZE):
+    """{id range: (rows, rows có fee, BIT_XOR CRC32)} từ snapshot inputs với fee tính lại bằng engine"""
+    # Order nhiều deliveries => item lặp trong snapshot; server đếm mỗi item một lần
+    ids, first = np.unique(snapshot['order_item_id'], return_index=True)
+    service_index = engine.encode_service_types(snapshot['service_types'])[snapshot['service_code'][first]]
+    cents = engine.fee_cents(snapshot['weight_milli'][first], snapshot['volume_milli'][first],
+                             snapshot['fragile'][first], service_index)
+    crcs = np.fromiter((zlib.crc32(checksum_text(item_id, fee).encode())
+                        for item_id, fee in zip(ids.tolist(), cents.tolist())), dtype=np.int64, count=len(ids))
+    ranges, starts, counts = np.unique(ids // range_size, return_index=True, return_counts=True)
+    checksums = np.bitwise_xor.reduceat(crcs, starts) if len(ids) else []
+    return {int(id_range): (int(count), int(count), int(checksum))
+            for id_range, count, checksum in zip(ranges, counts, checksums)}
+
 class ShippingFeeValidator:
-    def __init__(self, database='fastroute'):
+    def __init__(self, database='fastroute', full=False, checksum=False, snapshot=SNAPSHOT_FILE):
         DB_CONFIG['database'] = database
         self.connection = None
         self.cursor = None
         self.log_file = setup_logging()
+        self.fee_engine = get_fee_engine()
+        # full=True: kiểm tra mọi order_item / delivery thay vì mẫu LIMIT 20
+        self.full = full
+        # checksum=True: so sánh checksum từng id range với snapshot, chỉ đọc rows của ranges lệch
+        self.checksum = checksum
+        self.snapshot = snapshot
+        self.full_report = {}
         
         logging.info("=== BẮT ĐẦU VALIDATION PHÍ GIAO HÀNG ===")
         logging.info(f"Database: {database}")
+        mode = 'CHECKSUM (range checksums)' if checksum else 'FULL (toàn bảng)' if full else 'SAMPLE (LIMIT 20)'
+        logging.info(f"Mode: {mode}")
         
     def connect_database(self):
         """Kết nối đến database"""
@@ -59,8 +207,14 @@ class ShippingFeeValidator:
             self.connection = mysql.connector.connect(**DB_CONFIG)
             self.cursor = self.connection.cursor(dictionary=True)
             logging.info(f"✅ Kết nối thành công đến database: {DB_CONFIG['database']}")
+            
+            # Validate theo cùng pricing rules với calculator (PRICING_SOURCE)
+            pricing_version, pricing_config = resolve_pricing_config(self.cursor)
+            if pricing_version is not None:
+                self.fee_engine = get_fee_engine(constants=pricing_config['constants'],
+                                                 service_multipliers=pricing_config['service_multipliers'])
             return True
-        except mysql.connector.Error as e:
+        except (mysql.connector.Error, ValueError) as e:
             logging.error(f"❌ Lỗi kết nối database: {e}")
             return False
     
@@ -97,35 +251,16 @@ class ShippingFeeValidator:
             self.cursor.execute(query)
             results = self.cursor.fetchall()
             
+            # Tính lại shipping_fee cho cả batch bằng fee engine
+            expected_fees = self.fee_engine.fees(
+                [item['weight'] for item in results],
+                [item['volume'] for item in results],
+                [item['is_fragile'] for item in results],
+                [item['service_type'] for item in results]
+            )
+            
             errors = 0
-            for item in results:
-                # Tính lại shipping_fee
-                weight = Decimal(str(item['weight'])) if item['weight'] else Decimal('0')
-                volume = Decimal(str(item['volume'])) if item['volume'] else Decimal('0')
-                
-                # Trọng lượng tính phí
-                volume_weight = volume * Decimal('200')
-                shipping_weight = max(weight, volume_weight)
-                
-                # Phí cơ bản
-                base_fee = shipping_weight * Decimal('15000')
-                
-                # Hệ số rủi ro
-                fragile_multiplier = Decimal('1.3') if item['is_fragile'] else Decimal('1.0')
-                
-                # Hệ số service type
-                service_multipliers = {
-                    'SECOND_CLASS': Decimal('0.8'),
-                    'STANDARD': Decimal('1.0'),
-                    'FIRST_CLASS': Decimal('1.3'),
-                    'EXPRESS': Decimal('1.8')
-                }
-                service_multiplier = service_multipliers.get(item['service_type'], Decimal('1.0'))
-                
-                # Tổng phí
-                expected_fee = base_fee * fragile_multiplier * service_multiplier
-                expected_fee = expected_fee.quantize(Decimal('0.01'))
-                
+            for item, expected_fee in zip(results, expected_fees):
                 actual_fee = Decimal(str(item['shipping_fee']))
                 
                 if abs(expected_fee - actual_fee) > Decimal('0.01'):
@@ -181,6 +316,193 @@ class ShippingFeeValidator:
             logging.error(f"❌ Lỗi kiểm tra delivery_fee: {e}")
             return False
     
+    def _fee_recompute_inputs(self):
+        """Batch engine (cùng pricing config như engine đang dùng) + products cache; None nếu products rỗng"""
+        engine = BatchFeeEngine(self.fee_engine.constants, self.fee_engine.service_multipliers)
+        products = ProductAttributeCache()
+        if not products.refresh(self.connection.cursor(dictionary=True, buffered=True)):
+            logging.error("❌ Bảng products rỗng, không thể tính lại shipping_fee")
+            return None
+        return engine, products
+    
+    def _recompute_order_items(self, engine, products, summary, start_after=0, end_id=MAX_ORDER_ITEM_ID,
+                               batch_size=FULL_BATCH_SIZE):
+        """Keyset scan start_after < oi.id <= end_id vào summary, trả về (NULL fees, products không tồn tại)"""
+        cursor = self.connection.cursor(buffered=True)
+        missing_fee = 0
+        missing_product = 0
+        start = time.perf_counter()
+        
+        def fetch(limit, last_id):
+            cursor.execute(FULL_ORDER_ITEMS_QUERY, (last_id, end_id, limit))
+            return cursor.fetchall()
+        
+        try:
+            for batch_number, batch in enumerate(iter_keyset_batches(fetch, batch_size, start_after, key=0), 1):
+                ids, product_ids, fee_missing, actual_cents = (np.array(column, dtype=np.int64)
+                                                               for column in list(zip(*batch))[:4])
+                service_types = np.array([row[4] for row in batch], dtype=object)
+                # products.known tra theo index (product_id AUTO_INCREMENT), id ngoài range = không tồn tại
+                in_range = product_ids < len(products.known)
+                known = in_range & products.known[np.where(in_range, product_ids, 0)]
+                missing_product += int((~known).sum())
+                missing_fee += int((known & (fee_missing != 0)).sum())
+                checked = known & (fee_missing == 0)
+                
+                product_ids = product_ids[checked]
+                expected_cents = engine.fee_cents(products.weight_milli[product_ids], products.volume_milli[product_ids],
+                                                  products.fragile[product_ids],
+                                                  engine.encode_service_types(service_types[checked]))
+                summary.add(ids[checked], actual_cents[checked], expected_cents, service_types[checked])
+                
+                if batch_number % 10 == 0:
+                    logging.info(f"   {summary.checked:,} order_items, {summary.mismatched:,} lệch "
+                                 f"({summary.checked / (time.perf_counter() - start):,.0f} rows/s)")
+        finally:
+            cursor.close()
+        return missing_fee, missing_product
+    
+    def validate_shipping_fee_full(self, batch_size=FULL_BATCH_SIZE):
+        """Tính lại shipping_fee cho mọi order_item (keyset batches + batch engine)"""
+        logging.info("🔍 Kiểm tra shipping_fee toàn bảng...")
+        summary = MismatchSummary()
+        start = time.perf_counter()
+        try:
+            inputs = self._fee_recompute_inputs()
+            if inputs is None:
+                return False
+            missing_fee, missing_product = self._recompute_order_items(*inputs, summary, batch_size=batch_size)
+        except mysql.connector.Error as e:
+            logging.error(f"❌ Lỗi kiểm tra shipping_fee: {e}")
+            return False
+        
+        elapsed = time.perf_counter() - start
+        summary.log("Shipping fee (toàn bảng)")
+        logging.info(f"   NULL shipping_fee: {missing_fee:,}, product không tồn tại: {missing_product:,}, "
+                     f"{elapsed:.1f}s ({summary.checked / max(elapsed, 1e-9):,.0f} rows/s)")
+        self.full_report['shipping_fee'] = {**summary.summary(), 'missing_fee': missing_fee,
+                                            'missing_product': missing_product, 'seconds': round(elapsed, 2)}
+        return summary.mismatched == 0 and missing_fee == 0
+    
+    def validate_shipping_fee_checksum(self, range_size=CHECKSUM_RANGE_SIZE):
+        """
+        So sánh BIT_XOR(CRC32(CONCAT(id, shipping_fee))) từng id range trên server với
+        checksum tính local từ snapshot (pricing_simulator.py snapshot) + batch engine.
+        Chỉ ranges lệch mới được đọc từng row và tính lại như full mode.
+        """
+        logging.info("🔍 Kiểm tra shipping_fee bằng range checksums...")
+        if not os.path.exists(self.snapshot):
+            logging.error(f"❌ Không tìm thấy snapshot {self.snapshot} (tạo bằng: python3 pricing_simulator.py snapshot)")
+            return False
+        snapshot = load_snapshot(self.snapshot)
+        logging.info(f"   Snapshot {self.snapshot}: {snapshot['meta']['rows']:,} rows, "
+                     f"tạo lúc {snapshot['meta']['created_at']}")
+        
+        start = time.perf_counter()
+        engine = BatchFeeEngine(self.fee_engine.constants, self.fee_engine.service_multipliers)
+        expected = local_range_checksums(snapshot, engine, range_size)
+        local_seconds = time.perf_counter() - start
+        
+        summary = MismatchSummary()
+        missing_fee = 0
+        missing_product = 0
+        stale_ranges = []
+        try:
+            start = time.perf_counter()
+            cursor = self.connection.cursor(buffered=True)
+            try:
+                cursor.execute(RANGE_CHECKSUM_QUERY, (range_size,))
+                actual = {int(id_range): (int(rows), int(with_fee), int(checksum or 0))
+                          for id_range, rows, with_fee, checksum in cursor.fetchall()}
+            finally:
+                cursor.close()
+            server_seconds = time.perf_counter() - start
+            
+            mismatched = sorted(id_range for id_range in set(expected) | set(actual)
+                                if expected.get(id_range) != actual.get(id_range))
+            logging.info(f"   {len(actual):,} ranges x {range_size:,} ids: {len(mismatched):,} lệch checksum "
+                         f"(local {local_seconds:.1f}s, server {server_seconds:.1f}s)")
+            
+            start = time.perf_counter()
+            if mismatched:
+                inputs = self._fee_recompute_inputs()
+                if inputs is None:
+                    return False
+                for id_range in mismatched:
+                    problems = summary.mismatched + missing_fee
+                    range_missing_fee, range_missing_product = self._recompute_order_items(
+                        *inputs, summary, start_after=id_range * range_size - 1, end_id=(id_range + 1) * range_size - 1)
+                    missing_fee += range_missing_fee
+                    missing_product += range_missing_product
+                    if summary.mismatched + missing_fee == problems:
+                        # Fee đúng theo dữ liệu hiện tại: snapshot cũ (inputs đã đổi / rows mới) ở range này
+                        stale_ranges.append(id_range)
+            drill_seconds = time.perf_counter() - start
+        except mysql.connector.Error as e:
+            logging.error(f"❌ Lỗi kiểm tra shipping_fee checksum: {e}")
+            return False
+        
+        summary.log("Shipping fee (ranges lệch checksum)")
+        logging.info(f"   {len(actual) - len(mismatched):,} ranges khớp checksum, {len(mismatched):,} ranges đọc lại "
+                     f"({summary.checked:,} rows, {drill_seconds:.1f}s), {len(stale_ranges):,} do snapshot cũ; "
+                     f"NULL shipping_fee: {missing_fee:,}")
+        self.full_report['shipping_fee_checksum'] = {
+            'snapshot': self.snapshot,
+            'snapshot_created_at': snapshot['meta']['created_at'],
+            'range_size': range_size,
+            'ranges': len(actual),
+            'mismatched_ranges': len(mismatched),
+            'stale_ranges': len(stale_ranges),
+            'drilled_ranges': [[id_range * range_size, (id_range + 1) * range_size - 1] for id_range in mismatched[:100]],
+            'local_seconds': round(local_seconds, 2),
+            'server_seconds': round(server_seconds, 2),
+            'drill_seconds': round(drill_seconds, 2),
+            **summary.summary(),
+            'missing_fee': missing_fee,
+            'missing_product': missing_product
+        }
+        return summary.mismatched == 0 and missing_fee == 0
+    
+    def validate_delivery_fee_full(self, batch_size=FULL_BATCH_SIZE):
+        """So sánh delivery_fee với SUM(shipping_fee) cho mọi delivery (keyset theo d.id)"""
+        logging.info("🔍 Kiểm tra delivery_fee toàn bảng...")
+        summary = MismatchSummary()
+        missing_fee = 0
+        start = time.perf_counter()
+        
+        try:
+            for batch in iter_delivery_fee_totals(self.connection, batch_size):
+                rows = [row for row in batch if row['current_delivery_fee'] is not None]
+                missing_fee += len(batch) - len(rows)
+                if not rows:
+                    continue
+                summary.add(
+                    np.array([row['delivery_id'] for row in rows], dtype=np.int64),
+                    np.array([int(Decimal(str(row['current_delivery_fee'])).scaleb(2)) for row in rows], dtype=np.int64),
+                    np.array([int(Decimal(str(row['total_shipping_fee'])).scaleb(2)) for row in rows], dtype=np.int64)
+                )
+        except mysql.connector.Error as e:
+            logging.error(f"❌ Lỗi kiểm tra delivery_fee: {e}")
+            return False
+        
+        elapsed = time.perf_counter() - start
+        summary.log("Delivery fee (toàn bảng)")
+        logging.info(f"   NULL delivery_fee: {missing_fee:,}, {elapsed:.1f}s")
+        self.full_report['delivery_fee'] = {**summary.summary(), 'missing_fee': missing_fee,
+                                            'seconds': round(elapsed, 2)}
+        return summary.mismatched == 0 and missing_fee == 0
+    
+    def save_full_report(self):
+        """Ghi kết quả full/checksum validation ra JSON cạnh log file"""
+        report_file = os.path.join(os.path.dirname(self.log_file),
+                                   f"{'checksum' if self.checksum else 'full'}_validation_"
+                                   f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump({'database': DB_CONFIG['database'], 'created_at': datetime.now().isoformat(),
+                       'tolerance_cents': FEE_TOLERANCE_CENTS, **self.full_report}, f, ensure_ascii=False, indent=2)
+        logging.info(f"📄 Validation report: {report_file}")
+        return report_file
+    
     def get_statistics(self):
         """Lấy thống kê tổng quan"""
         logging.info("📊 Lấy thống kê tổng quan...")
@@ -333,9 +655,27 @@ class ShippingFeeValidator:
             if not self.connect_database():
                 return False
             
+            # resolve_pricing_config đã mở implicit transaction, đóng trước start_transaction()
+            self.connection.rollback()
+            
             # Các kiểm tra
-            shipping_fee_ok = self.validate_shipping_fee_calculations()
-            delivery_fee_ok = self.validate_delivery_fee_calculations()
+            if self.checksum:
+                # Checksums trên một snapshot nhất quán; delivery_fee kiểm tra mẫu như bình thường
+                self.connection.start_transaction(consistent_snapshot=True, readonly=True)
+                shipping_fee_ok = self.validate_shipping_fee_checksum()
+                self.connection.rollback()
+                delivery_fee_ok = self.validate_delivery_fee_calculations()
+                self.save_full_report()
+            elif self.full:
+                # Một snapshot nhất quán cho cả hai lần scan (không báo lệch giả khi calculator đang chạy)
+                self.connection.start_transaction(consistent_snapshot=True, readonly=True)
+                shipping_fee_ok = self.validate_shipping_fee_full()
+                delivery_fee_ok = self.validate_delivery_fee_full()
+                self.connection.rollback()
+                self.save_full_report()
+            else:
+                shipping_fee_ok = self.validate_shipping_fee_calculations()
+                delivery_fee_ok = self.validate_delivery_fee_calculations()
             integrity_ok = self.check_data_integrity()
             
             # Thống kê
@@ -360,6 +700,11 @@ class ShippingFeeValidator:
 def main():
     """Hàm main"""
     print("🔍 === VALIDATION PHÍ GIAO HÀNG ===")
+    # --full: kiểm tra toàn bộ order_items / deliveries thay vì mẫu 20 rows
+    full = '--full' in sys.argv
+    # --checksum [--snapshot file.npz]: so sánh checksum từng id range, chỉ đọc rows của ranges lệch
+    checksum = '--checksum' in sys.argv
+    snapshot = sys.argv[sys.argv.index('--snapshot') + 1] if '--snapshot' in sys.argv else SNAPSHOT_FILE
     print("1. Validate trên database TEST (fastroute_test)")
     print("2. Validate trên database PRODUCTION (fastroute)")
     
@@ -374,7 +719,7 @@ def main():
         return
     
     # Chạy validation
-    validator = ShippingFeeValidator(database)
+    validator = ShippingFeeValidator(database, full=full, checksum=checksum, snapshot=snapshot)
     success = validator.run_validation()
     
     if success: